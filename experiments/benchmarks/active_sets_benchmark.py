@@ -0,0 +1,62 @@
+# Benchmark of active sets (Simulator(active_sets=True)), where the send and receive kernels only run over the lists
+# of infectious and susceptible people built on the device each step, instead of over the whole population. Times the
+# send and receive halves of a step with and without active sets, for a range of infectious fractions (with everyone
+# else susceptible, or everyone else recovered to mimic the end of an epidemic).
+#
+# Run from the root of the repository:
+#     PYTHONPATH=. python experiments/benchmarks/active_sets_benchmark.py --npeople 1000000
+import time
+
+import click
+import numpy as np
+import pyopencl as cl
+
+from microsim.opencl.ramp.disease_statuses import DiseaseStatus
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot
+
+
+def time_hazards(simulator, statuses, steps):
+    """Mean time to send and receive hazards with the given statuses, without updating the statuses."""
+    simulator.upload("people_statuses", statuses)
+    simulator.enqueue_send_hazards().wait()  # warm up
+    start = time.perf_counter()
+    for _ in range(steps):
+        event = simulator.enqueue_send_hazards()
+        enqueue_recv_hazards(simulator, event).wait()
+    return (time.perf_counter() - start) / steps
+
+
+def enqueue_recv_hazards(simulator, wait_event):
+    """Enqueue only the receive kernel (not the status update, so the statuses stay the same between steps)."""
+    kernel, size = ((simulator.kernels.people_recv_hazards_active, simulator.active_global_size)
+                    if simulator.active_sets else (simulator.kernels.people_recv_hazards, simulator.npeople))
+    return cl.enqueue_nd_range_kernel(simulator.queue, kernel, (size, simulator.nreplicates), None,
+                                      wait_for=[wait_event])
+
+
+@click.command()
+@click.option('--npeople', default=1000000, help='Number of people in the synthetic population')
+@click.option('--nplaces', default=300000, help='Number of places in the synthetic population')
+@click.option('--nslots', default=8, help='Number of slots per person')
+@click.option('--steps', default=10, help='Number of timesteps to time')
+@click.option('--gpu/--cpu', default=False, help='Run on the GPU (defaults to the CPU OpenCL device)')
+def main(npeople, nplaces, nslots, steps, gpu):
+    snapshot = Snapshot.random(nplaces, npeople, nslots)
+    simulators = {active_sets: Simulator(snapshot, gpu=gpu, num_seed_days=0, hazard_mode="scatter",
+                                         active_sets=active_sets) for active_sets in [False, True]}
+    for simulator in simulators.values():
+        simulator.upload_all(snapshot.buffers)
+
+    print(f"People: {npeople}, places: {nplaces}, slots: {nslots}\n")
+    print(f"{'Infectious':>10s} {'Others':>12s} {'All people ms':>14s} {'Active sets ms':>15s}")
+    for infectious in [0.0005, 0.01, 0.1, 0.3]:
+        for others in [DiseaseStatus.Susceptible, DiseaseStatus.Recovered]:
+            statuses = np.where(np.random.rand(npeople) < infectious, DiseaseStatus.Symptomatic.value,
+                                others.value).astype(np.uint32)
+            times = [time_hazards(simulators[active_sets], statuses, steps) for active_sets in [False, True]]
+            print(f"{infectious:10.4f} {others.name:>12s} {times[0] * 1000:14.2f} {times[1] * 1000:15.2f}")
+
+
+if __name__ == "__main__":
+    main()
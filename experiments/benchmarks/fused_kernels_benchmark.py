@@ -0,0 +1,68 @@
+# Benchmark of the fused step kernels (Simulator(fused=True)), which compute flows on the fly from the baseline flows
+# instead of storing them in people_flows, and receive hazards and update statuses in a single pass. Reports the time
+# per step and the size of the flow buffers on the device for the unfused and fused kernels, on a synthetic
+# population or on a snapshot file or directory if one is given.
+#
+# Run from the root of the repository:
+#     PYTHONPATH=. python experiments/benchmarks/fused_kernels_benchmark.py --npeople 1000000
+import time
+
+import click
+import numpy as np
+
+from microsim.opencl.ramp.activity import Activity
+from microsim.opencl.ramp.disease_statuses import DiseaseStatus
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot
+
+
+def synthetic_snapshot(nplaces, npeople, nslots, infectious):
+    """A snapshot where each person has a home and nslots - 1 other places."""
+    snapshot = Snapshot.random(nplaces, npeople, nslots)
+    snapshot.buffers.place_activities[:] = np.where(np.arange(nplaces) % 3 == 0, Activity.Home.value,
+                                                    np.random.randint(1, len(Activity), size=nplaces))
+    homes = np.flatnonzero(snapshot.buffers.place_activities == Activity.Home.value)
+    others = np.flatnonzero(snapshot.buffers.place_activities != Activity.Home.value)
+    place_ids = np.column_stack([np.random.choice(homes, size=npeople),
+                                 np.random.choice(others, size=(npeople, nslots - 1))])
+    snapshot.buffers.people_place_ids[:] = place_ids.flatten()
+    snapshot.buffers.people_flows[:] = snapshot.buffers.people_baseline_flows
+    snapshot.buffers.people_statuses[:] = np.where(np.random.rand(npeople) < infectious,
+                                                   DiseaseStatus.Symptomatic.value, DiseaseStatus.Susceptible.value)
+    return snapshot
+
+
+def time_steps(snapshot, steps, fused, gpu):
+    simulator = Simulator(snapshot, gpu=gpu, num_seed_days=0, hazard_mode="scatter", fused=fused)
+    simulator.upload_all(snapshot.buffers)
+    simulator.step()  # warm up
+    start = time.perf_counter()
+    for _ in range(steps):
+        simulator.step()
+    step_time = (time.perf_counter() - start) / steps
+    flow_bytes = simulator.buffers.people_flows.size + simulator.buffers.people_baseline_flows.size
+    return step_time, flow_bytes
+
+
+@click.command()
+@click.option('--snapshot', 'snapshot_path', default=None, help='Snapshot to benchmark, instead of a synthetic one')
+@click.option('--npeople', default=1000000, help='Number of people in the synthetic population')
+@click.option('--nplaces', default=300000, help='Number of places in the synthetic population')
+@click.option('--nslots', default=16, help='Number of slots per person in the synthetic population')
+@click.option('--infectious', default=0.05, help='Fraction of people infectious in the synthetic population')
+@click.option('--steps', default=10, help='Number of timesteps to time')
+@click.option('--gpu/--cpu', default=False, help='Run on the GPU (defaults to the CPU OpenCL device)')
+def main(snapshot_path, npeople, nplaces, nslots, infectious, steps, gpu):
+    if snapshot_path is not None:
+        snapshot = Snapshot.load_full_snapshot(snapshot_path)
+    else:
+        snapshot = synthetic_snapshot(nplaces, npeople, nslots, infectious)
+
+    print(f"People: {snapshot.npeople}, places: {snapshot.nplaces}, slots: {snapshot.nvisits}")
+    for name, fused in [("Unfused", False), ("Fused", True)]:
+        step_time, flow_bytes = time_steps(snapshot, steps, fused, gpu)
+        print(f"{name:8s} flow buffers {flow_bytes / 1024 ** 2:8.1f} MiB, {step_time * 1000:8.2f} ms per step")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# Benchmark of the scatter (people_send_hazards, with atomics) and gather (places_gather_hazards, without atomics)
+# ways of accumulating place hazards, across a range of prevalence levels. Place popularity follows a power law, so a
+# few large places (like big workplaces and schools) receive many visits and become atomic hot spots.
+# Prints the time per hazard accumulation for each mode, to show the infectious fraction above which gather wins and
+# so guide the choice of Simulator(gather_threshold=...).
+#
+# Run from the root of the repository:
+#     PYTHONPATH=. python experiments/benchmarks/hazard_mode_benchmark.py --npeople 1000000 --nplaces 100000
+import time
+
+import click
+import numpy as np
+import pyopencl as cl
+
+from microsim.opencl.ramp.disease_statuses import DiseaseStatus
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot
+
+
+def skewed_snapshot(nplaces, npeople, nslots, exponent):
+    """A snapshot where the probability of visiting each place falls off as a power law of its rank."""
+    snapshot = Snapshot.random(nplaces, npeople, nslots)
+    popularity = 1.0 / np.arange(1, nplaces + 1) ** exponent
+    snapshot.buffers.people_place_ids[:] = np.random.choice(
+        nplaces, size=npeople * nslots, p=popularity / popularity.sum()).astype(np.uint32)
+    return snapshot
+
+
+def time_kernels(simulator, kernel_names, dims, repeats):
+    """Mean time to run the given kernels in order, after updating the flows and running them once to warm up."""
+    simulator.step_kernel("people_update_flows")
+    for name in kernel_names:
+        cl.enqueue_nd_range_kernel(simulator.queue, getattr(simulator.kernels, name), dims, None)
+    simulator.queue.finish()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for name in kernel_names:
+            cl.enqueue_nd_range_kernel(simulator.queue, getattr(simulator.kernels, name), dims, None)
+    simulator.queue.finish()
+    return (time.perf_counter() - start) / repeats
+
+
+@click.command()
+@click.option('--npeople', default=1000000, help='Number of people in the synthetic population')
+@click.option('--nplaces', default=100000, help='Number of places')
+@click.option('--nslots', default=16, help='Number of places each person visits')
+@click.option('--exponent', default=1.0, help='Power law exponent of place popularity, higher gives bigger hot spots')
+@click.option('--repeats', default=10, help='Number of times to time each mode')
+@click.option('--gpu/--cpu', default=False, help='Run on the GPU (defaults to the CPU OpenCL device)')
+def main(npeople, nplaces, nslots, exponent, repeats, gpu):
+    snapshot = skewed_snapshot(nplaces, npeople, nslots, exponent)
+    simulator = Simulator(snapshot, gpu=gpu)
+    simulator.upload_all(snapshot.buffers)
+
+    print(f"People: {npeople}, places: {nplaces}, slots: {nslots}, popularity exponent: {exponent}")
+    print(f"{'Infectious':>10s} {'Scatter (ms)':>13s} {'Gather (ms)':>12s}  Faster")
+    for prevalence in [0.0, 0.001, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5]:
+        statuses = np.where(np.random.rand(npeople) < prevalence, DiseaseStatus.Symptomatic.value,
+                            DiseaseStatus.Susceptible.value).astype(np.uint32)
+        simulator.upload("people_statuses", statuses)
+
+        scatter = time_kernels(simulator, ["places_reset", "people_send_hazards"], (npeople, 1), repeats)
+        scatter_hazards = np.zeros(nplaces, dtype=np.uint32)
+        simulator.download("place_hazards", scatter_hazards)
+
+        gather = time_kernels(simulator, ["places_gather_hazards"], (nplaces, 1), repeats)
+        gather_hazards = np.zeros(nplaces, dtype=np.uint32)
+        simulator.download("place_hazards", gather_hazards)
+        assert np.array_equal(scatter_hazards, gather_hazards)
+
+        print(f"{prevalence * 100:9.1f}% {scatter * 1000:13.2f} {gather * 1000:12.2f}  "
+              f"{'gather' if gather < scatter else 'scatter'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# Benchmark of the effect of Snapshot.reorder_for_locality on memory locality and step time.
+# A synthetic population is generated where people visit places near their home, then the people and places are
+# shuffled to mimic the arbitrary order of the input data. The shuffled snapshot is compared with the same snapshot
+# after reordering, by estimating the cache hit rate of the place hazard accesses and timing simulator steps.
+#
+# Run from the root of the repository:
+#     PYTHONPATH=. python experiments/benchmarks/locality_benchmark.py --npeople 1000000 --nplaces 300000
+import copy
+import time
+
+import click
+import numpy as np
+
+from microsim.opencl.ramp.activity import Activity
+from microsim.opencl.ramp.buffers import sentinel_value
+from microsim.opencl.ramp.disease_statuses import DiseaseStatus
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot
+
+
+def spatial_snapshot(nplaces, npeople, nslots, neighbourhood):
+    """A snapshot where each person visits their home and nslots - 1 other places near to it, in random order."""
+    snapshot = Snapshot.random(nplaces, npeople, nslots)
+
+    # places along a space filling path, so places with close ids are close in space
+    side = int(np.ceil(np.sqrt(nplaces)))
+    rows, cols = np.divmod(np.arange(nplaces), side)
+    cols = np.where(rows % 2 == 0, cols, side - 1 - cols)
+    snapshot.buffers.place_coords[0::2] = 50.0 + rows / side
+    snapshot.buffers.place_coords[1::2] = -4.0 + cols / side
+    snapshot.buffers.place_activities[:] = np.where(np.arange(nplaces) % 3 == 0, Activity.Home.value,
+                                                    np.random.randint(1, len(Activity), size=nplaces))
+
+    homes = np.flatnonzero(snapshot.buffers.place_activities == Activity.Home.value)
+    people_homes = np.random.choice(homes, size=npeople)
+    offsets = np.random.randint(-neighbourhood, neighbourhood + 1, size=(npeople, nslots - 1))
+    others = np.clip(people_homes[:, None] + offsets, 0, nplaces - 1)
+    # make sure people only have one home
+    others = np.where(snapshot.buffers.place_activities[others] == Activity.Home.value,
+                      np.minimum(others + 1, nplaces - 1), others)
+    snapshot.buffers.people_place_ids[:] = np.column_stack([people_homes, others]).flatten()
+    snapshot.area_codes = np.array([f"E0200{i:04d}" for i in people_homes * 100 // nplaces])
+
+    # shuffle people and places, as in the order of the input data
+    snapshot.reorder(place_order=np.random.permutation(nplaces), people_order=np.random.permutation(npeople))
+    snapshot.people_order = snapshot.place_order = None
+    return snapshot
+
+
+def estimated_hit_rate(snapshot, cache_lines, line_bytes=64):
+    """
+    Estimate the cache hit rate of the place hazard accesses made when people loop over their places, by counting
+    an access as a hit if the same cache line was accessed within the previous cache_lines accesses.
+    """
+    place_ids = snapshot.buffers.people_place_ids
+    lines = place_ids[place_ids != sentinel_value].astype(np.int64) * 4 // line_bytes
+
+    # sort accesses by cache line, keeping them in access order within each line
+    order = np.argsort(lines, kind="stable")
+    same_line = lines[order][1:] == lines[order][:-1]
+    reuse_distance = np.diff(order)
+    hits = np.count_nonzero(same_line & (reuse_distance <= cache_lines))
+    return hits / lines.shape[0]
+
+
+def time_steps(snapshot, steps, gpu):
+    simulator = Simulator(snapshot, gpu=gpu)
+    simulator.upload_all(snapshot.buffers)
+    simulator.step()  # warm up
+    simulator.queue.finish()
+    start = time.perf_counter()
+    for _ in range(steps):
+        simulator.step()
+    simulator.queue.finish()
+    return (time.perf_counter() - start) / steps
+
+
+@click.command()
+@click.option('--npeople', default=1000000, help='Number of people in the synthetic population')
+@click.option('--nplaces', default=300000, help='Number of places')
+@click.option('--nslots', default=16, help='Number of places each person visits')
+@click.option('--neighbourhood', default=2000, help='How far (in place ids) from home people travel')
+@click.option('--steps', default=10, help='Number of timesteps to time')
+@click.option('--cache-lines', default=8192, help='Capacity in cache lines of the modelled cache (8192 = 512KB)')
+@click.option('--gpu/--cpu', default=False, help='Run on the GPU (defaults to the CPU OpenCL device)')
+def main(npeople, nplaces, nslots, neighbourhood, steps, cache_lines, gpu):
+    shuffled = spatial_snapshot(nplaces, npeople, nslots, neighbourhood)
+    # make a fraction of people infectious so that hazards are sent to places
+    shuffled.buffers.people_statuses[:] = np.where(np.random.rand(npeople) < 0.05,
+                                                   DiseaseStatus.Symptomatic.value, DiseaseStatus.Susceptible.value)
+
+    start = time.perf_counter()
+    reordered = copy.deepcopy(shuffled)
+    reordered.reorder_for_locality()
+    reorder_time = time.perf_counter() - start
+
+    print(f"People: {npeople}, places: {nplaces}, slots: {nslots}, reordering took {reorder_time:.2f} s")
+    for name, snapshot in [("Shuffled", shuffled), ("Reordered", reordered)]:
+        hit_rate = estimated_hit_rate(snapshot, cache_lines)
+        step_time = time_steps(snapshot, steps, gpu)
+        print(f"{name:10s} estimated place hazard cache hit rate {hit_rate * 100:5.1f}%, "
+              f"{step_time * 1000:8.2f} ms per step")
+
+
+if __name__ == "__main__":
+    main()
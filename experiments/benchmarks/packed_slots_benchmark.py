@@ -0,0 +1,72 @@
+# Benchmark of the memory and step time saved by packing the slots of a snapshot (Snapshot.pack_slots), which drops
+# the empty slots that pad the fixed layout so that every person has nslots slots.
+# Runs on a snapshot file or directory (eg. the Devon snapshot in microsim/opencl/snapshots/cache) if one is given,
+# otherwise on a synthetic population where each person has a home and a random number of other venues.
+#
+# Run from the root of the repository:
+#     PYTHONPATH=. python experiments/benchmarks/packed_slots_benchmark.py --snapshot microsim/opencl/snapshots/cache
+import copy
+import time
+
+import click
+import numpy as np
+
+from microsim.opencl.ramp.disease_statuses import DiseaseStatus
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot
+
+sentinel_value = (1 << 31) - 1
+
+
+def synthetic_snapshot(nplaces, npeople, nslots, mean_venues):
+    """A snapshot where each person visits their home and a Poisson distributed number of other places."""
+    snapshot = Snapshot.random(nplaces, npeople, nslots)
+    place_ids = np.random.randint(nplaces, size=(npeople, nslots)).astype(np.uint32)
+    nvenues = np.minimum(1 + np.random.poisson(mean_venues, size=(npeople, 1)), nslots)
+    place_ids[np.arange(nslots) >= nvenues] = sentinel_value
+    snapshot.buffers.people_place_ids[:] = place_ids.flatten()
+    snapshot.buffers.people_statuses[:] = np.where(np.random.rand(npeople) < 0.05, DiseaseStatus.Symptomatic.value,
+                                                   DiseaseStatus.Susceptible.value)
+    return snapshot
+
+
+def time_steps(snapshot, steps, gpu):
+    simulator = Simulator(snapshot, gpu=gpu, num_seed_days=0, hazard_mode="scatter")
+    simulator.upload_all(snapshot.buffers)
+    simulator.step()  # warm up
+    start = time.perf_counter()
+    for _ in range(steps):
+        simulator.step()
+    simulator.queue.finish()
+    return (time.perf_counter() - start) / steps
+
+
+@click.command()
+@click.option('--snapshot', 'snapshot_path', default=None, help='Snapshot to benchmark, instead of a synthetic one')
+@click.option('--npeople', default=1000000, help='Number of people in the synthetic population')
+@click.option('--nplaces', default=300000, help='Number of places in the synthetic population')
+@click.option('--nslots', default=16, help='Number of slots per person in the synthetic population')
+@click.option('--mean-venues', default=4.0, help='Mean number of non-home venues per person in the synthetic population')
+@click.option('--steps', default=10, help='Number of timesteps to time')
+@click.option('--gpu/--cpu', default=False, help='Run on the GPU (defaults to the CPU OpenCL device)')
+def main(snapshot_path, npeople, nplaces, nslots, mean_venues, steps, gpu):
+    if snapshot_path is not None:
+        fixed = Snapshot.load_full_snapshot(snapshot_path)
+    else:
+        fixed = synthetic_snapshot(nplaces, npeople, nslots, mean_venues)
+
+    start = time.perf_counter()
+    packed = copy.deepcopy(fixed)
+    packed.pack_slots()
+    pack_time = time.perf_counter() - start
+
+    print(f"People: {fixed.npeople}, places: {fixed.nplaces}, slots: {fixed.nslots}, "
+          f"packing took {pack_time:.2f} s")
+    for name, snapshot in [("Fixed", fixed), ("Packed", packed)]:
+        step_time = time_steps(snapshot, steps, gpu)
+        print(f"{name:7s} {snapshot.nvisits:10d} slots, snapshot {snapshot.num_bytes() / 1024 ** 2:8.1f} MiB, "
+              f"{step_time * 1000:8.2f} ms per step")
+
+
+if __name__ == "__main__":
+    main()
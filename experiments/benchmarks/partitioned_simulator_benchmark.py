@@ -0,0 +1,83 @@
+# Strong scaling benchmark of the PartitionedSimulator, which splits the people of a snapshot between several OpenCL
+# devices or sub-devices. Times a step of the same synthetic population with an increasing number of partitions and
+# reports the speedup over a single partition. By default each partition is a sub-device of the CPU created with
+# device fission, so this shows how well the simulator uses the NUMA nodes or cores of one host; with --all-devices
+# the partitions are the devices of the first platform instead (eg. several GPUs).
+# Devices that can not be split into enough sub-devices are shared between partitions, which shows only the overhead
+# of partitioning.
+#
+# Run from the root of the repository:
+#     PYTHONPATH=. python experiments/benchmarks/partitioned_simulator_benchmark.py --partitions 1,2,4,8
+import time
+
+import click
+import numpy as np
+import pyopencl as cl
+
+from microsim.opencl.ramp.disease_statuses import DiseaseStatus
+from microsim.opencl.ramp.partitioned_simulator import PartitionedSimulator, partition_devices
+from microsim.opencl.ramp.snapshot import Snapshot
+
+sentinel_value = (1 << 31) - 1
+
+
+def synthetic_snapshot(nplaces, npeople, nslots, mean_venues):
+    """A packed snapshot where each person visits their home and a Poisson distributed number of other places."""
+    snapshot = Snapshot.random(nplaces, npeople, nslots)
+    place_ids = np.random.randint(nplaces, size=(npeople, nslots)).astype(np.uint32)
+    nvenues = np.minimum(1 + np.random.poisson(mean_venues, size=(npeople, 1)), nslots)
+    place_ids[np.arange(nslots) >= nvenues] = sentinel_value
+    snapshot.buffers.people_place_ids[:] = place_ids.flatten()
+    snapshot.buffers.people_statuses[:] = np.where(np.random.rand(npeople) < 0.05, DiseaseStatus.Symptomatic.value,
+                                                   DiseaseStatus.Susceptible.value)
+    snapshot.pack_slots()
+    return snapshot
+
+
+def time_steps(simulator, snapshot, steps):
+    simulator.upload_all(snapshot.buffers)
+    simulator.step()  # warm up
+    start = time.perf_counter()
+    for _ in range(steps):
+        simulator.step()
+    return (time.perf_counter() - start) / steps
+
+
+@click.command()
+@click.option('--npeople', default=1000000, help='Number of people in the synthetic population')
+@click.option('--nplaces', default=300000, help='Number of places in the synthetic population')
+@click.option('--nslots', default=16, help='Number of slots per person in the synthetic population')
+@click.option('--mean-venues', default=4.0, help='Mean number of non-home venues per person')
+@click.option('--partitions', default='1,2,4', help='Comma separated numbers of partitions to time')
+@click.option('--nreplicates', default=1, help='Number of replicates to run in each partition')
+@click.option('--steps', default=10, help='Number of timesteps to time')
+@click.option('--gpu/--cpu', default=False, help='Split a GPU instead of the CPU OpenCL device')
+@click.option('--all-devices', is_flag=True, help='Use each device of the first platform as a partition')
+def main(npeople, nplaces, nslots, mean_venues, partitions, nreplicates, steps, gpu, all_devices):
+    snapshot = synthetic_snapshot(nplaces, npeople, nslots, mean_venues)
+    dev_type = cl.device_type.GPU if gpu else cl.device_type.CPU
+    platform = [plat for plat in cl.get_platforms() if len(plat.get_devices(dev_type)) > 0][0]
+    platform_devices = platform.get_devices(dev_type)
+    device = platform_devices[0]
+
+    print(f"People: {npeople}, places: {nplaces}, slots: {snapshot.nvisits}, replicates: {nreplicates}")
+    print(f"Device: {device.name}, {device.max_compute_units} compute units, "
+          f"up to {device.partition_max_sub_devices} sub-devices\n")
+    print(f"{'Partitions':>10s} {'Devices':>8s} {'ms per step':>12s} {'Speedup':>8s} {'Efficiency':>10s}")
+
+    npartitions_list = [len(platform_devices)] if all_devices else [int(n) for n in partitions.split(",")]
+    base_time = None
+    for npartitions in npartitions_list:
+        devices = list(platform_devices) if all_devices else partition_devices(device, npartitions)
+        simulator = PartitionedSimulator(snapshot, devices=devices, num_seed_days=0, nreplicates=nreplicates,
+                                         hazard_mode="scatter")
+        step_time = time_steps(simulator, snapshot, steps)
+        base_time = step_time if base_time is None else base_time
+        speedup = base_time / step_time
+        ndevices = len(set(d.int_ptr for d in devices))
+        print(f"{npartitions:10d} {ndevices:8d} {step_time * 1000:12.2f} {speedup:8.2f} "
+              f"{speedup / npartitions:10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# Benchmark of the pipelined headless runner (run_pipelined in microsim/opencl/ramp/run.py). Times a headless run of a
+# synthetic population with a pipeline depth of 1, which waits for the counts of each day before enqueuing the next
+# step like the original synchronous loop, against deeper pipelines and less frequent observations.
+#
+# Run from the root of the repository:
+#     PYTHONPATH=. python experiments/benchmarks/pipelined_run_benchmark.py --npeople 1000000 --iterations 100
+import time
+
+import click
+import numpy as np
+
+from microsim.opencl.ramp.disease_statuses import DiseaseStatus
+from microsim.opencl.ramp.run import run_headless
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot
+
+
+def synthetic_snapshot(nplaces, npeople, nslots):
+    snapshot = Snapshot.random(nplaces, npeople, nslots)
+    snapshot.buffers.people_place_ids[:] = np.random.randint(nplaces, size=npeople * nslots)
+    snapshot.buffers.people_statuses[:] = np.where(np.random.rand(npeople) < 0.01, DiseaseStatus.Symptomatic.value,
+                                                   DiseaseStatus.Susceptible.value)
+    snapshot.area_codes = np.random.choice(["E02004129", "E02004130", "E02004131"], npeople)
+    snapshot.lockdown_multipliers = np.ones(1, dtype=np.float32)
+    return snapshot
+
+
+@click.command()
+@click.option('--npeople', default=1000000, help='Number of people in the synthetic population')
+@click.option('--nplaces', default=300000, help='Number of places in the synthetic population')
+@click.option('--nslots', default=8, help='Number of slots per person')
+@click.option('--iterations', default=100, help='Number of days to run for')
+@click.option('--detailed/--totals', default=True, help='Whether to store the age and area counts')
+@click.option('--gpu/--cpu', default=False, help='Run on the GPU (defaults to the CPU OpenCL device)')
+def main(npeople, nplaces, nslots, iterations, detailed, gpu):
+    snapshot = synthetic_snapshot(nplaces, npeople, nslots)
+    simulator = Simulator(snapshot, gpu=gpu, num_seed_days=0)
+    simulator.upload_all(snapshot.buffers)
+
+    print(f"People: {npeople}, places: {nplaces}, days: {iterations}, detailed counts: {detailed}\n")
+    print(f"{'Observe every':>13s} {'Depth':>6s} {'ms per day':>11s}")
+    for observe_every, pipeline_depth in [(1, 1), (1, 2), (1, 4), (7, 2), (iterations, 1)]:
+        simulator.reset(seed=0)
+        start = time.perf_counter()
+        run_headless(simulator, snapshot, iterations, quiet=True, store_detailed_counts=detailed,
+                     observe_every=observe_every, pipeline_depth=pipeline_depth)
+        run_time = time.perf_counter() - start
+        print(f"{observe_every:13d} {pipeline_depth:6d} {run_time / iterations * 1000:11.2f}")
+
+
+if __name__ == "__main__":
+    main()
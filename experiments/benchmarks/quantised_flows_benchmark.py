@@ -0,0 +1,102 @@
+# Accuracy report and benchmark for quantised (16 bit fixed point) flows, see Snapshot.quantise_flows.
+# Runs the same synthetic epidemic with float32 and quantised flows for several seeds, then compares the epidemic
+# curves (number of people ever infected and currently infectious each day). The difference between the mean curves
+# of the two paths is reported relative to the seed to seed spread, which is the natural scale for judging whether the
+# quantisation changes the model. Also reports the size of the flow buffers and the time per step.
+#
+# Run from the root of the repository:
+#     PYTHONPATH=. python experiments/benchmarks/quantised_flows_benchmark.py --npeople 200000 --seeds 5
+import copy
+import time
+
+import click
+import numpy as np
+
+from microsim.opencl.ramp.activity import Activity
+from microsim.opencl.ramp.disease_statuses import DiseaseStatus
+from microsim.opencl.ramp.params import Params
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot
+
+sentinel_value = (1 << 31) - 1
+
+
+def synthetic_snapshot(nplaces, npeople, nslots, initial_infectious):
+    """A snapshot where each person has a home and nslots - 1 other places, with flows summing to 1."""
+    snapshot = Snapshot.random(nplaces, npeople, nslots)
+    snapshot.buffers.place_activities[:] = np.where(np.arange(nplaces) % 3 == 0, Activity.Home.value,
+                                                    np.random.randint(1, len(Activity), size=nplaces))
+    homes = np.flatnonzero(snapshot.buffers.place_activities == Activity.Home.value)
+    others = np.flatnonzero(snapshot.buffers.place_activities != Activity.Home.value)
+    place_ids = np.column_stack([np.random.choice(homes, size=npeople),
+                                 np.random.choice(others, size=(npeople, nslots - 1))])
+    snapshot.buffers.people_place_ids[:] = place_ids.flatten()
+
+    flows = np.random.rand(npeople, nslots) ** 3
+    flows[:, 0] += 2.0  # most time is spent at home
+    snapshot.buffers.people_baseline_flows[:] = (flows / flows.sum(axis=1, keepdims=True)).flatten()
+    snapshot.buffers.people_flows[:] = snapshot.buffers.people_baseline_flows
+    snapshot.buffers.people_statuses[:] = np.where(np.random.rand(npeople) < initial_infectious,
+                                                   DiseaseStatus.Symptomatic.value, DiseaseStatus.Susceptible.value)
+    snapshot.buffers.people_transition_times[:] = 5
+
+    params = Params()
+    params.place_hazard_multipliers = np.array([0.2, 0.1, 0.1, 0.1, 0.1], dtype=np.float32)
+    snapshot.update_params(params)
+    return snapshot
+
+
+def epidemic_curves(snapshot, seeds, days, gpu):
+    """Cumulative infections and current infectious people on each day for each seed, and the mean time per step."""
+    infectious = [DiseaseStatus.Presymptomatic.value, DiseaseStatus.Asymptomatic.value,
+                  DiseaseStatus.Symptomatic.value]
+    simulator = Simulator(snapshot, gpu=gpu, num_seed_days=0)
+    simulator.upload_all(snapshot.buffers)
+    ever_infected = np.zeros((len(seeds), days))
+    currently_infectious = np.zeros((len(seeds), days))
+    step_time = 0.0
+    for i, seed in enumerate(seeds):
+        simulator.reset(seed=seed)
+        for day in range(days):
+            start = time.perf_counter()
+            simulator.step()
+            step_time += time.perf_counter() - start
+            counts = simulator.count_statuses()[0][0]
+            ever_infected[i, day] = snapshot.npeople - counts[DiseaseStatus.Susceptible.value]
+            currently_infectious[i, day] = counts[infectious].sum()
+    return ever_infected, currently_infectious, step_time / (len(seeds) * days)
+
+
+@click.command()
+@click.option('--npeople', default=200000, help='Number of people in the synthetic population')
+@click.option('--nplaces', default=40000, help='Number of places')
+@click.option('--nslots', default=16, help='Number of places each person visits')
+@click.option('--days', default=60, help='Number of days to simulate')
+@click.option('--seeds', default=5, help='Number of random seeds to run each path with')
+@click.option('--initial-infectious', default=0.002, help='Fraction of people infectious at the start')
+@click.option('--gpu/--cpu', default=False, help='Run on the GPU (defaults to the CPU OpenCL device)')
+def main(npeople, nplaces, nslots, days, seeds, initial_infectious, gpu):
+    float_snapshot = synthetic_snapshot(nplaces, npeople, nslots, initial_infectious)
+    quantised_snapshot = copy.deepcopy(float_snapshot)
+    quantised_snapshot.quantise_flows()
+
+    print(f"People: {npeople}, places: {nplaces}, slots: {nslots}, days: {days}, seeds: {seeds}, "
+          f"flow scale: {quantised_snapshot.flow_scale:.3g}")
+    results = {}
+    for name, snapshot in [("float32", float_snapshot), ("quantised", quantised_snapshot)]:
+        flow_bytes = snapshot.buffers.people_baseline_flows.nbytes + snapshot.buffers.people_flows.nbytes
+        results[name] = epidemic_curves(snapshot, list(range(seeds)), days, gpu)
+        print(f"{name:10s} flow buffers {flow_bytes / 1024 ** 2:8.1f} MiB, {results[name][2] * 1000:8.2f} ms per step")
+
+    print(f"\n{'Curve':22s} {'Final (float32)':>16s} {'Max |mean diff|':>16s} {'Seed std':>10s} {'Ratio':>6s}")
+    for index, curve in enumerate(["Ever infected", "Currently infectious"]):
+        float_curves, quantised_curves = results["float32"][index], results["quantised"][index]
+        mean_difference = np.abs(float_curves.mean(axis=0) - quantised_curves.mean(axis=0))
+        seed_std = np.maximum(float_curves.std(axis=0), 1.0)
+        day = np.argmax(mean_difference)
+        print(f"{curve:22s} {float_curves[:, -1].mean():16.1f} {mean_difference[day]:16.1f} {seed_std[day]:10.1f} "
+              f"{mean_difference[day] / seed_std[day]:6.2f}")
+
+
+if __name__ == "__main__":
+    main()
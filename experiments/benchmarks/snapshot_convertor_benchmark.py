@@ -0,0 +1,103 @@
+# Benchmark of the runtime and peak memory of SnapshotConvertor.get_people_place_data on a synthetic population.
+# Also runs the previous per-person loop implementation on the same population for comparison (this is slow, use
+# --skip-legacy for large populations).
+#
+# Run from the root of the repository:
+#     PYTHONPATH=. python experiments/benchmarks/snapshot_convertor_benchmark.py --npeople 100000
+import time
+import tracemalloc
+
+import click
+import numpy as np
+import pandas as pd
+
+from microsim.opencl.ramp.snapshot_convertor import SnapshotConvertor, sentinel_value
+
+
+class BenchmarkActivityLocation:
+    def __init__(self, locations):
+        self._locations = locations
+
+
+def random_population(npeople, nplaces, max_venues):
+    """Random individuals with ragged venue and flow lists for a Home activity and a few non-home activities."""
+    activity_names = ["Home", "Retail", "PrimarySchool", "SecondarySchool", "Work"]
+    individuals = pd.DataFrame({"ID": np.arange(npeople)})
+    activity_locations = {}
+    for activity_name in activity_names:
+        num_venues = np.ones(npeople, dtype=int) if activity_name == "Home" \
+            else np.random.randint(1, max_venues + 1, size=npeople)
+        venues = np.random.randint(nplaces, size=num_venues.sum())
+        flows = np.random.rand(num_venues.sum())
+        splits = np.cumsum(num_venues)[:-1]
+        individuals[activity_name + "_Venues"] = [list(v) for v in np.split(venues, splits)]
+        individuals[activity_name + "_Flows"] = [list(f) for f in np.split(flows, splits)]
+        individuals[activity_name + "_Duration"] = np.random.rand(npeople)
+        activity_locations[activity_name] = BenchmarkActivityLocation(pd.DataFrame({"ID": np.arange(nplaces)}))
+    return individuals, activity_locations
+
+
+def legacy_get_people_place_data(convertor, max_places_per_person=100, places_to_keep_per_person=16):
+    """The per-person loop implementation of get_people_place_data, before it was vectorised."""
+    people_place_ids = np.full((convertor.num_people, max_places_per_person), sentinel_value, dtype=np.uint32)
+    people_place_flows = np.zeros((convertor.num_people, max_places_per_person), dtype=np.float32)
+    num_places_added = np.zeros(convertor.num_people, dtype=np.uint32)
+
+    for activity_name in convertor.activity_names:
+        activity_venues = convertor.individuals.loc[:, activity_name + "_Venues"]
+        activity_flows = convertor.individuals.loc[:, activity_name + "_Flows"]
+        activity_durations = convertor.individuals.loc[:, activity_name + "_Duration"]
+
+        for people_id, (local_place_ids, flows, duration) in enumerate(
+                zip(activity_venues, activity_flows, activity_durations)):
+            flows = np.array(flows) * duration
+            start_idx = num_places_added[people_id]
+            end_idx = start_idx + len(local_place_ids)
+            people_place_ids[people_id, start_idx:end_idx] = np.array(
+                [convertor.get_global_place_id(activity_name, local_place_id) for local_place_id in local_place_ids])
+            people_place_flows[people_id, start_idx:end_idx] = flows
+            num_places_added[people_id] += len(local_place_ids)
+
+    sorted_indices = people_place_flows.argsort()[:, ::-1]
+    people_place_ids = np.take_along_axis(people_place_ids, sorted_indices, axis=1)
+    people_place_flows = np.take_along_axis(people_place_flows, sorted_indices, axis=1)
+    return people_place_ids[:, 0:places_to_keep_per_person], people_place_flows[:, 0:places_to_keep_per_person]
+
+
+def measure(function):
+    """Run function, returning its result, the runtime in seconds and the peak traced memory in bytes. The function is
+    run twice since tracing allocations slows down the Python parts of the function considerably."""
+    start = time.perf_counter()
+    result = function()
+    runtime = time.perf_counter() - start
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, runtime, peak
+
+
+@click.command()
+@click.option('--npeople', default=100000, help='Number of people in the synthetic population')
+@click.option('--nplaces', default=10000, help='Number of places per activity')
+@click.option('--max-venues', default=10, help='Maximum number of venues per person for each non-home activity')
+@click.option('--skip-legacy', is_flag=True, help='Do not run the previous loop implementation')
+def main(npeople, nplaces, max_venues, skip_legacy):
+    individuals, activity_locations = random_population(npeople, nplaces, max_venues)
+    convertor = SnapshotConvertor(individuals, activity_locations, time_activity_multiplier=None, data_dir=None)
+
+    print(f"People: {npeople}, places per activity: {nplaces}, max venues per activity: {max_venues}")
+    (place_ids, flows), runtime, peak = measure(convertor.get_people_place_data)
+    print(f"Vectorised: {runtime:8.2f} s, peak memory {peak / 1024 ** 2:8.1f} MiB")
+
+    if not skip_legacy:
+        (legacy_place_ids, legacy_flows), runtime, peak = measure(
+            lambda: legacy_get_people_place_data(convertor))
+        print(f"Legacy:     {runtime:8.2f} s, peak memory {peak / 1024 ** 2:8.1f} MiB")
+        # place ids can differ where flows tie, so only the flows are compared exactly
+        assert np.array_equal(flows, legacy_flows)
+
+
+if __name__ == "__main__":
+    main()
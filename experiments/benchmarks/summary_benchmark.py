@@ -0,0 +1,65 @@
+# Benchmark of the cost of Summary.update with and without detailed (age and area) counts.
+# Also times the previous pandas groupby implementation of the detailed counts for comparison.
+#
+# Run from the root of the repository:
+#     PYTHONPATH=. python experiments/benchmarks/summary_benchmark.py --npeople 1000000 --steps 20
+import time
+
+import click
+import numpy as np
+import pandas as pd
+
+from microsim.opencl.ramp.disease_statuses import DiseaseStatus
+from microsim.opencl.ramp.snapshot import Snapshot
+from microsim.opencl.ramp.summary import Summary
+
+
+def groupby_detailed_update(summary, individuals_df, time, statuses):
+    """The per-step detailed counts as they were computed before the bincount implementation."""
+    individuals_df['status'] = statuses
+    for (age_bin, status), count in individuals_df.groupby(["age_bin", "status"]).size().items():
+        summary.age_counts[DiseaseStatus(status).name.lower()][age_bin][time] = np.float32(count)
+    for (area_id, status), count in individuals_df.groupby(["area_id", "status"]).size().items():
+        summary.area_counts[DiseaseStatus(status).name.lower()][area_id][time] = np.float32(count)
+
+
+def time_updates(update, steps, all_statuses):
+    start = time.perf_counter()
+    for step in range(steps):
+        update(step, all_statuses[step])
+    return (time.perf_counter() - start) / steps
+
+
+@click.command()
+@click.option('--npeople', default=1000000, help='Number of people in the random population')
+@click.option('--nareas', default=100, help='Number of distinct area codes')
+@click.option('--steps', default=20, help='Number of timesteps to time')
+def main(npeople, nareas, steps):
+    snapshot = Snapshot.zeros(nplaces=1, npeople=npeople, nslots=1)
+    snapshot.buffers.people_ages[:] = np.random.randint(100, size=npeople)
+    snapshot.area_codes = np.random.choice([f"E0200{i:04d}" for i in range(nareas)], npeople)
+    all_statuses = np.random.randint(len(DiseaseStatus), size=(steps, npeople)).astype(np.uint32)
+
+    total_summary = Summary(snapshot, store_detailed_counts=False, max_time=steps)
+    detailed_summary = Summary(snapshot, store_detailed_counts=True, max_time=steps)
+    groupby_summary = Summary(snapshot, store_detailed_counts=True, max_time=steps)
+    individuals_df = pd.DataFrame({'status': np.zeros(npeople),
+                                   'age_bin': groupby_summary.age_bins,
+                                   'area_id': groupby_summary.area_ids})
+
+    total = time_updates(total_summary.update, steps, all_statuses)
+    detailed = time_updates(detailed_summary.update, steps, all_statuses)
+    groupby = time_updates(lambda t, s: groupby_detailed_update(groupby_summary, individuals_df, t, s),
+                           steps, all_statuses)
+
+    assert np.array_equal(detailed_summary.age_status_counts, groupby_summary.age_status_counts)
+    assert np.array_equal(detailed_summary.area_status_counts, groupby_summary.area_status_counts)
+
+    print(f"People: {npeople}, areas: {nareas}, steps: {steps}")
+    print(f"Total counts only:           {total * 1000:8.2f} ms per step")
+    print(f"Detailed counts (bincount):  {detailed * 1000:8.2f} ms per step")
+    print(f"Detailed counts (groupby):   {groupby * 1000:8.2f} ms per step")
+
+
+if __name__ == "__main__":
+    main()
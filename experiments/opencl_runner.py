@@ -1,6 +1,7 @@
 # Generic functions that are used in the experiments notebooks
 # Useful to put them in here so that they can be shared across notebooks
 # and can be tested (see tests/experiements/opencl_runner_tests.py)
+import copy
 import os
 import numpy as np
 import multiprocessing
@@ -14,7 +15,7 @@ import random
 from typing import List
 from microsim.opencl.ramp.snapshot import Snapshot
 from microsim.opencl.ramp.simulator import Simulator
-from microsim.opencl.ramp.run import run_headless
+from microsim.opencl.ramp.run import run_headless, run_headless_replicates, run_headless_scenarios
 from microsim.opencl.ramp.params import Params, IndividualHazardMultipliers, LocationHazardMultipliers
 from microsim.opencl.ramp.disease_statuses import DiseaseStatus
 
@@ -26,6 +27,14 @@ class OpenCLRunner:
     # be passed through one of the run model functions.
     constants = {}
 
+    # Long-lived (snapshot, simulator) pairs for this process, keyed by (snapshot_filepath, opencl_dir, use_gpu,
+    # profile) and the version of the snapshot file, so repeated runs reset an existing simulator rather than creating
+    # a new context, program and buffers. The snapshots hold the start of the runs and are never changed.
+    simulators = {}
+
+    # Profilers of the simulators created in this process with profile=True, in the order they were created
+    profilers = []
+
     @classmethod
     def init(cls, iterations: int, repetitions: int, observations: pd.DataFrame, use_gpu: bool,
              store_detailed_counts: bool, parameters_file: str, opencl_dir: str, snapshot_filepath: str):
@@ -92,6 +101,60 @@ class OpenCLRunner:
     def clear_constants(cls):
         cls.constants = {}
 
+    @classmethod
+    def clear_simulators(cls):
+        """Release the simulators kept between runs (e.g. after the snapshot file has been regenerated)"""
+        cls.simulators = {}
+        cls.profilers = []
+
+    @classmethod
+    def get_simulator(cls, snapshot_filepath: str, opencl_dir: str, use_gpu: bool, profile: bool = False):
+        """Get the (snapshot, simulator) pair used for runs with these arguments in this process, creating
+        and uploading it the first time it is requested, or when the snapshot file has changed since."""
+        key = (snapshot_filepath, opencl_dir, use_gpu, profile)
+        version = OpenCLRunner._snapshot_version(snapshot_filepath)
+        if key in cls.simulators and cls.simulators[key][0] != version:
+            del cls.simulators[key]
+        if key not in cls.simulators:
+            snapshot = Snapshot.load_full_snapshot(path=snapshot_filepath)
+            simulator = Simulator(snapshot, opencl_dir=opencl_dir, gpu=use_gpu, profile=profile)
+            simulator.upload_all(snapshot.buffers)
+            if profile:
+                cls.profilers.append(simulator.profiler)
+            cls.simulators[key] = (version, snapshot, simulator)
+        return cls.simulators[key][1:]
+
+    @staticmethod
+    def _snapshot_version(snapshot_filepath: str):
+        """The modification time and size of a snapshot file, or of each file of a snapshot directory, which change
+        when the snapshot is regenerated."""
+        path = snapshot_filepath
+        if path.endswith(".npz") and not os.path.exists(path) and os.path.isdir(path[:-len(".npz")]):
+            path = path[:-len(".npz")]
+        if os.path.isdir(path):
+            paths = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+        else:
+            paths = [path]
+        return tuple((name, os.stat(name).st_mtime_ns, os.stat(name).st_size) for name in paths)
+
+    @staticmethod
+    def _with_params(snapshot: Snapshot, params: Params):
+        """A shallow copy of the snapshot with its own copy of the params, leaving the cached snapshot unchanged."""
+        run_snapshot = copy.copy(snapshot)
+        run_snapshot.buffers = snapshot.buffers._replace(params=snapshot.buffers.params.copy())
+        run_snapshot.update_params(params)
+        return run_snapshot
+
+    @classmethod
+    def write_profiles(cls, output_dir: str, quiet=False):
+        """Write the records of each profiled simulator in this process to output_dir, as profile_<n>.json,
+        profile_<n>.csv and profile_<n>_trace.json, printing their summaries unless quiet. Simulators run in
+        multiprocess mode are profiled in the worker processes, so are not included."""
+        for n, profiler in enumerate(cls.profilers):
+            if not quiet:
+                profiler.print_summary()
+            profiler.write(output_dir, name=f"profile_{n}")
+
     @staticmethod
     def fit_l2(obs: np.ndarray, sim: np.ndarray):
         """Calculate the fitness of a model.
@@ -249,12 +312,13 @@ class OpenCLRunner:
     @staticmethod
     def run_opencl_model(i: int, iterations: int, snapshot_filepath: str, params,
                          opencl_dir: str, use_gpu: bool,
-                         store_detailed_counts: bool = True, quiet=False) -> (np.ndarray, np.ndarray):
+                         store_detailed_counts: bool = True, quiet=False,
+                         profile=False) -> (np.ndarray, np.ndarray):
         """
         Run the OpenCL model.
 
         :param i: Simulation number (i.e. if run as part of an ensemble)
-        :param iterations: Number of iterations to ru the model for
+        :param iterations: Number of iterations to run the model for
         :param snapshot_filepath: Location of the snapshot (the model must have already been initialised)
         :param params: a Params object containing the parameters used to define how the model behaves
         :param opencl_dir: Location of the OpenCL code
@@ -262,22 +326,22 @@ class OpenCLRunner:
         :param store_detailed_counts: Whether to store the age distributions for diseases (default True, if
           false then the model runs much more quickly).
         :param quiet: Whether to print a message when the model starts
+        :param profile: Whether to record the time of each kernel and transfer (see OpenCLRunner.write_profiles)
         :return: A summary python array that contains the results for each iteration and a final state
 
         """
 
-        # load snapshot
-        snapshot = Snapshot.load_full_snapshot(path=snapshot_filepath)
+        # get the simulator for this snapshot, it is only created and uploaded on the first run in each process
+        snapshot, simulator = OpenCLRunner.get_simulator(snapshot_filepath, opencl_dir, use_gpu, profile)
 
         # set params
-        snapshot.update_params(params)
-
-        # set the random seed of the model for each repetition, otherwise it is completely deterministic
-        snapshot.seed_prngs(i)
+        snapshot = OpenCLRunner._with_params(snapshot, params)
+        simulator.rebind(params)
 
-        # Create a simulator and upload the snapshot data to the OpenCL device
-        simulator = Simulator(snapshot, opencl_dir=opencl_dir, gpu=use_gpu)
-        simulator.upload_all(snapshot.buffers)
+        # return to the start of the run, with the random seed of the model set for each repetition,
+        # otherwise it is completely deterministic. This seeds in the same way as run_opencl_model_batched.
+        simulator.reset()
+        simulator.seed_prngs([i])
 
         if not quiet:
             print(f"Running simulation {i + 1}.")
@@ -285,6 +349,78 @@ class OpenCLRunner:
                                             store_detailed_counts=store_detailed_counts)
         return summary, final_state
 
+    @staticmethod
+    def run_opencl_model_batched(seeds: List[int], iterations: int, snapshot_filepath: str, params,
+                                 opencl_dir: str, use_gpu: bool, store_detailed_counts: bool = True,
+                                 profile: bool = False):
+        """
+        Run several repetitions of the OpenCL model as replicates of a single batched simulator, so the snapshot
+        is loaded, the kernels compiled and the static buffers uploaded only once for all of them. Each replicate has
+        its own random states and chooses its initial cases with its own numpy RandomState, so it gives the same
+        results as a single simulation given the same seed with Simulator.seed_prngs, as run_opencl_model does.
+
+        :param seeds: The random seed for each repetition (one replicate is created per seed)
+        :param iterations: Number of iterations to run the model for
+        :param snapshot_filepath: Location of the snapshot (the model must have already been initialised)
+        :param params: a Params object containing the parameters used to define how the model behaves
+        :param opencl_dir: Location of the OpenCL code
+        :param use_gpu: Whether to use the GPU to process it or not
+        :param store_detailed_counts: Whether to store the age distributions for diseases
+        :param profile: Whether to record the time of each kernel and transfer (see OpenCLRunner.write_profiles)
+        :return: A list of (summary, final state) tuples, one per repetition. No final state is downloaded for
+            batched replicates so it is always None.
+        """
+        snapshot = Snapshot.load_full_snapshot(path=snapshot_filepath)
+        snapshot.update_params(params)
+
+        simulator = Simulator(snapshot, opencl_dir=opencl_dir, gpu=use_gpu, nreplicates=len(seeds), profile=profile)
+        simulator.upload_all(snapshot.buffers)
+        if profile:
+            OpenCLRunner.profilers.append(simulator.profiler)
+        simulator.seed_prngs(seeds)
+
+        summaries = run_headless_replicates(simulator, snapshot, iterations, quiet=True,
+                                            store_detailed_counts=store_detailed_counts)
+        return [(summary, None) for summary in summaries]
+
+    @staticmethod
+    def run_opencl_model_scenarios(scenarios: dict, warmup_days: int, iterations: int, snapshot_filepath: str, params,
+                                   opencl_dir: str, use_gpu: bool, store_detailed_counts: bool = True, seed: int = 0,
+                                   scenario_seeds: dict = None, quiet=False, profile=False) -> dict:
+        """
+        Run several scenarios of the OpenCL model which share their first days, simulating the shared days only
+        once and forking each scenario from the state at the end of them (see run.run_headless_scenarios).
+
+        :param scenarios: A dict of scenario names to a run.Scenario, which changes a copy of the snapshot in place
+            and lists the static buffers it changes, e.g.
+            `Scenario(lambda snapshot: snapshot.switch_to_healthier_population(), ["people_obesity"])`, or None for
+            the unchanged model
+        :param warmup_days: Number of days shared by all of the scenarios
+        :param iterations: Number of iterations to run the model for, including the warm-up
+        :param snapshot_filepath: Location of the snapshot (the model must have already been initialised)
+        :param params: a Params object containing the parameters used during the warm-up (and by any scenario that
+            doesn't change them)
+        :param opencl_dir: Location of the OpenCL code
+        :param use_gpu: Whether to use the GPU to process it or not
+        :param store_detailed_counts: Whether to store the age distributions for diseases
+        :param seed: The random seed of the warm-up
+        :param scenario_seeds: Optional dict of scenario names to random seeds, for scenarios which should have random
+            numbers independent of the others after the warm-up
+        :param quiet: Whether to print a message when the model starts
+        :param profile: Whether to record the time of each kernel and transfer (see OpenCLRunner.write_profiles)
+        :return: A dict of scenario names to the summary of each scenario
+        """
+        snapshot, simulator = OpenCLRunner.get_simulator(snapshot_filepath, opencl_dir, use_gpu, profile)
+
+        snapshot = OpenCLRunner._with_params(snapshot, params)
+        simulator.rebind(params)
+        simulator.reset(seed=seed)
+
+        if not quiet:
+            print(f"Running {len(scenarios)} scenarios after a warm-up of {warmup_days} days.")
+        return run_headless_scenarios(simulator, snapshot, scenarios, warmup_days, iterations, quiet=True,
+                                      store_detailed_counts=store_detailed_counts, seeds=scenario_seeds)
+
     #
     # Functions to run the model in multiprocess mode.
     # Don't wory currently on OS X, something to do with calling multiprocessing from a notebook
@@ -299,10 +435,16 @@ class OpenCLRunner:
             opencl_dir=os.path.join(".", "microsim", "opencl"),
             snapshot_filepath=os.path.join(".", "microsim", "opencl", "snapshots", "cache.npz"),
             multiprocess=False,
-            random_ids=False):
+            random_ids=False,
+            batched=False,
+            profile=False):
         """Run a number of models and return a list of summaries.
 
         :param multiprocess: Whether to run in mutliprocess mode (default False)
+        :param batched: Whether to run all the repetitions as replicates of a single batched simulator, rather than
+            creating a new simulator for each one (default False). Takes precedence over multiprocess.
+        :param profile: Whether to record the time of each kernel and transfer (default False), see
+            OpenCLRunner.write_profiles
         """
         # Prepare the function arguments. We need one set of arguments per repetition
         l_i = [i for i in range(repetitions)] if not random_ids else \
@@ -314,12 +456,17 @@ class OpenCLRunner:
         l_use_gpu = [use_gpu] * repetitions
         l_store_detailed_counts = [store_detailed_counts] * repetitions
         l_quiet = [True] * repetitions  # Don't print info
+        l_profile = [profile] * repetitions
 
         args = zip(l_i, l_iterations, l_snapshot_filepath, l_params, l_opencl_dir, l_use_gpu,
-                   l_store_detailed_counts, l_quiet)
+                   l_store_detailed_counts, l_quiet, l_profile)
         to_return = None
         start_time = time.time()
-        if multiprocess:
+        if batched:
+            print("Running multiple models as a batch of replicates ... ", end="", flush=True)
+            to_return = OpenCLRunner.run_opencl_model_batched(
+                l_i, iterations, snapshot_filepath, params, opencl_dir, use_gpu, store_detailed_counts, profile)
+        elif multiprocess:
             try:
                 print("Running multiple models in multiprocess mode ... ", end="", flush=True)
                 with multiprocessing.Pool(processes=int(os.cpu_count())) as pool:
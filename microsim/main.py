@@ -63,8 +63,17 @@ from microsim.utilities import data_setup, unpack_data
               help="Run the OpenCL model with GUI visualisation for OpenCL model")
 @click.option('-gpu', '--opencl-gpu/--no-opencl-gpu', default=False,
               help="Run OpenCL model on the GPU (if false then run using CPU")
+@click.option('--profile/--no-profile', default=False,
+              help="Record the time of each OpenCL kernel and transfer and write them to the OpenCL output directory "
+                   "as profile.json, profile.csv and a Chrome trace (default no)")
+@click.option('--checkpoint-every', default=0,
+              help="Save a checkpoint of a headless OpenCL run every this many days, in the checkpoints directory of "
+                   "the OpenCL output directory (default 0, never)")
+@click.option('--resume/--no-resume', default=False,
+              help="Continue a headless OpenCL run from its latest checkpoint, if there is one (default no)")
 def main(parameters_file, no_parameters_file, initialise, iterations, scenario, data_dir, output, output_every_iteration,
-               debug, repetitions, lockdown_file, use_cache, opencl, opencl_gui, opencl_gpu):
+               debug, repetitions, lockdown_file, use_cache, opencl, opencl_gui, opencl_gpu, profile, checkpoint_every,
+               resume):
     """
     Main function which runs the population initialisation, then chooses which model to run, either the Python/R
     model or the OpenCL model
@@ -205,7 +214,8 @@ def main(parameters_file, no_parameters_file, initialise, iterations, scenario,
     # Select which model implementation to run
     if opencl:
         run_opencl_model(individuals, activity_locations, time_activity_multiplier, iterations, data_dir, base_dir,
-                         opencl_gui, opencl_gpu, use_cache, initialise, calibration_params, disease_params)
+                         opencl_gui, opencl_gpu, use_cache, initialise, calibration_params, disease_params, profile,
+                         checkpoint_every, resume)
     else:
         # If -init flag set the don't run the model. Note for the opencl model this check needs to happen
         # after the snapshots have been created in run_opencl_model
@@ -217,10 +227,17 @@ def main(parameters_file, no_parameters_file, initialise, iterations, scenario,
 
 
 def run_opencl_model(individuals_df, activity_locations, time_activity_multiplier, iterations, data_dir, base_dir,
-                     use_gui, use_gpu, use_cache, initialise, calibration_params, disease_params):
-    snapshot_cache_filepath = base_dir + "/microsim/opencl/snapshots/cache.npz"
+                     use_gui, use_gpu, use_cache, initialise, calibration_params, disease_params, profile=False,
+                     checkpoint_every=0, resume=False):
+    snapshot_cache_filepath = base_dir + "/microsim/opencl/snapshots/cache"
+    legacy_snapshot_cache_filepath = snapshot_cache_filepath + ".npz"
 
     # Choose whether to load snapshot file from cache, or create a snapshot from population data
+    if use_cache and not os.path.exists(snapshot_cache_filepath) and os.path.exists(legacy_snapshot_cache_filepath):
+        # convert a cached .npz snapshot to the memory-mapped snapshot directory format
+        print("\nConverting cached .npz snapshot to a snapshot directory")
+        Snapshot.load_full_snapshot(path=legacy_snapshot_cache_filepath).save(snapshot_cache_filepath)
+
     if not use_cache or not os.path.exists(snapshot_cache_filepath):
         print("\nGenerating Snapshot for OpenCL model")
         snapshot_converter = SnapshotConvertor(individuals_df, activity_locations, time_activity_multiplier, data_dir)
@@ -245,7 +262,8 @@ def run_opencl_model(individuals_df, activity_locations, time_activity_multiplie
 
     run_mode = "GUI" if use_gui else "headless"
     print(f"\nRunning OpenCL model in {run_mode} mode")
-    run_opencl(snapshot, iterations, data_dir, use_gui, use_gpu, num_seed_days=disease_params["seed_days"], quiet=False)
+    run_opencl(snapshot, iterations, data_dir, use_gui, use_gpu, num_seed_days=disease_params["seed_days"], quiet=False,
+               profile=profile, checkpoint_every=checkpoint_every, resume=resume)
 
 
 def run_python_model(individuals_df, activity_locations_df, time_activity_multiplier, msim_args, iterations,
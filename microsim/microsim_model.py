@@ -4,6 +4,7 @@ sys.path.append("microsim")  # This is only needed when testing. I'm so confused
 from microsim.r_interface import RInterface
 from microsim.column_names import ColumnNames
 from microsim.utilities import check_durations_sum_to_1
+import numpy as np
 import pandas as pd
 pd.set_option('display.expand_frame_repr', False)  # Don't wrap lines when displaying DataFrames
 # pd.set_option('display.width', 0)  # Automatically find the best width
@@ -11,15 +12,26 @@ pd.set_option('display.expand_frame_repr', False)  # Don't wrap lines when displ
 import os
 import time
 from typing import List, Dict
+from collections import namedtuple
+import itertools
 import pickle
 import copy
 import random
 
+# Compressed sparse row (CSR) representation of the venues that each individual visits for an activity, and the flows
+# to them. The venues and flows of individual i are venues[indptr[i]:indptr[i+1]] and flows[indptr[i]:indptr[i+1]],
+# and people holds the individual that each venue/flow entry belongs to.
+VenueFlows = namedtuple("VenueFlows", ["indptr", "people", "venues", "flows"])
+
 
 class Microsim:
     """
     Class containing code for running timesteps of the Python/ R microsim model.
     This operates on two main dataframes: individuals and activity_locations.
+
+    The venues and flows of each activity (the `*_Venues` and `*_Flows` columns of individuals) are indexed when the
+    model is created and are assumed not to change afterwards. If they are edited, `update_venue_flows()` must be
+    called before the next step, otherwise dangers and risks are calculated from the old venues and flows.
     """
     def __init__(self,
                  individuals,
@@ -100,6 +112,11 @@ class Microsim:
 
         self.repnr = -1  # This is a unique ID for the model used if this model is run as part of an ensemble
 
+        # The venues and flows of each activity, used to update dangers and risks. These don't change during a
+        # model run so are built once here (update_venue_flows() must be called again if they are changed)
+        self.venue_flows = None
+        self.update_venue_flows()
+
     def run(self, iterations: int, repnr: int) -> None:
         """
         Run the model (call the step() function) for the given number of iterations.
@@ -251,22 +268,62 @@ class Microsim:
         else:
             print("\tNot applying a lockdown multiplier")
 
+    def update_venue_flows(self) -> None:
+        """
+        Build the CSR representation (see VenueFlows) of the venues and flows of every activity from the
+        individuals dataframe. This needs to be called again if the venues or flows of any individuals change.
+        """
+        self.venue_flows = dict()
+        for activty_name in self.activity_locations:
+            venues = self.individuals.loc[:, f"{activty_name}{ColumnNames.ACTIVITY_VENUES}"]
+            flows = self.individuals.loc[:, f"{activty_name}{ColumnNames.ACTIVITY_FLOWS}"]
+
+            num_venues = venues.map(len).to_numpy(dtype=np.int64)
+            assert np.array_equal(num_venues, flows.map(len).to_numpy(dtype=np.int64))
+
+            indptr = np.zeros(len(num_venues) + 1, dtype=np.int64)
+            np.cumsum(num_venues, out=indptr[1:])
+            self.venue_flows[activty_name] = VenueFlows(
+                indptr=indptr,
+                people=np.repeat(np.arange(len(num_venues), dtype=np.int64), num_venues),
+                venues=np.fromiter(itertools.chain.from_iterable(venues), dtype=np.int64, count=indptr[-1]),
+                flows=np.fromiter(itertools.chain.from_iterable(flows), dtype=np.float64, count=indptr[-1]))
+
     def update_venue_danger_and_risks(self, decimals=8):
         """
         Update the danger score for each location, based on where the individuals who have the infection visit.
         Then look through the individuals again, assigning some of that danger back to them as 'current risk'.
 
+        The dangers and risks are accumulated over the venue/flow entries of each activity in the same order (and
+        so with the same floating point rounding) as looping over each individual and each of their venues in turn.
+        The entries are those indexed by the last call to update_venue_flows(), see the class documentation.
+
         :param risk_multiplier: Risk is calcuated as duration * flow * risk_multiplier.
         :param decimals: Number of decimals to round the indivdiual risks and dangers to (defult 10). If 'None'
                         then do no rounding
         """
         print("\tUpdating danger associated with visiting each venue")
 
-        # Make a new list to keep the new risk for each individual (better than repeatedly accessing the dataframe)
+        # Make a new array to keep the new risk for each individual (better than repeatedly accessing the dataframe)
         # Make this 0 initialy as the risk is not cumulative; it gets reset each day
-        current_risk = [0] * len(self.individuals)
+        current_risk = np.zeros(len(self.individuals))
+
+        # Only people with the disease who are infectious will add danger to a place. The hazard multiplier depends
+        # on the type of disease status that this person has. There may be different multipliers passed in a
+        # dictionary as calibration parameters, if not then assume the multiplier is 1.0
+        statuses = self.individuals[ColumnNames.DISEASE_STATUS].to_numpy()
+        infectious = np.zeros(len(self.individuals), dtype=bool)
+        individual_hazard_multipliers = np.zeros(len(self.individuals))
+        for status, status_name in [(ColumnNames.DiseaseStatuses.PRESYMPTOMATIC, 'presymptomatic'),
+                                    (ColumnNames.DiseaseStatuses.SYMPTOMATIC, 'symptomatic'),
+                                    (ColumnNames.DiseaseStatuses.ASYMPTOMATIC, 'asymptomatic')]:
+            has_status = statuses == status
+            infectious |= has_status
+            if not self.hazard_individual_multipliers:  # The dictionary is empty
+                individual_hazard_multipliers[has_status] = 1.0
+            else:  # A dict was passed, so find out what the values of the multiplier are by disease status
+                individual_hazard_multipliers[has_status] = self.hazard_individual_multipliers[status_name]
 
-        # for name in tqdm(self.activity_locations, desc=f"Updating dangers and risks for activity locations"):
         for activty_name in self.activity_locations:
 
             #
@@ -276,112 +333,71 @@ class Microsim:
             print(f"\t\t{activty_name} activity")
             # Get the details of the location activity
             activity_location = self.activity_locations[activty_name]  # Pointer to the ActivityLocation object
-            # Create a list to store the dangers associated with each location for this activity.
-            # Assume 0 initially, it should be reset each day
-            loc_dangers = [0] * len(activity_location.get_dangers())
-            # loc_dangers = activity_location.get_dangers()  # List of the current dangers associated with each place
-
-            # Now look up those venues in the table of individuals
-            venues_col = f"{activty_name}{ColumnNames.ACTIVITY_VENUES}"  # The names of the venues and
-            flows_col = f"{activty_name}{ColumnNames.ACTIVITY_FLOWS}"  # flows in the individuals DataFrame
-            durations_col = f"{activty_name}{ColumnNames.ACTIVITY_DURATION}"  # flows in the individuals DataFrame
-
-            # 2D lists, for each individual: the venues they visit, the flows to the venue (i.e. how much they visit it)
-            # and the durations (how long they spend doing it)
-            statuses = self.individuals[ColumnNames.DISEASE_STATUS]
-            venues = self.individuals.loc[:, venues_col]
-            flows = self.individuals.loc[:, flows_col]
-            durations = self.individuals.loc[:, durations_col]
-            assert len(venues) == len(flows) and len(venues) == len(statuses)
-            for i, (v, f, s, duration) in enumerate(zip(venues, flows, statuses, durations)):  # For each individual
-                # Only people with the disease who are infectious will add danger to a place
-                if s == ColumnNames.DiseaseStatuses.PRESYMPTOMATIC \
-                        or s == ColumnNames.DiseaseStatuses.SYMPTOMATIC \
-                        or s == ColumnNames.DiseaseStatuses.ASYMPTOMATIC:
-                    # The hazard multiplier depends on the type of disease status that this person has
-                    # There may be different multipliers passed in a dictionary as calibration parameters, if not
-                    # then assume the multiplier is 1.0
-                    individual_hazard_multiplier: float = None
-                    if not self.hazard_individual_multipliers:  # The dictionary is empty
-                        individual_hazard_multiplier = 1.0
-                    else:  # A dict was passed, so find out what the values of the multiplier are by disease status
-                        if s == ColumnNames.DiseaseStatuses.PRESYMPTOMATIC:
-                            individual_hazard_multiplier = self.hazard_individual_multipliers['presymptomatic']
-                        elif s == ColumnNames.DiseaseStatuses.SYMPTOMATIC:
-                            individual_hazard_multiplier = self.hazard_individual_multipliers['symptomatic']
-                        elif s == ColumnNames.DiseaseStatuses.ASYMPTOMATIC:
-                            individual_hazard_multiplier = self.hazard_individual_multipliers['asymptomatic']
-                    assert individual_hazard_multiplier is not None
-                    # There may also be a hazard multiplier for locations (i.e. some locations become more hazardous
-                    # than others
-                    location_hazard_multiplier = None
-                    if not self.hazard_location_multipliers:  # The dictionary is empty
-                        location_hazard_multiplier = 1.0
-                    else:
-                        location_hazard_multiplier = self.hazard_location_multipliers[activty_name]
-                    assert location_hazard_multiplier is not None
-
-                    # v and f are lists of flows and venues for the individual. Go through each one
-                    for venue_idx, flow in zip(v, f):
-                        # print(i, venue_idx, flow, duration)
-                        # Increase the danger by the flow multiplied by some disease risk
-                        danger_increase = (flow * duration * individual_hazard_multiplier * location_hazard_multiplier)
-                        # if activty_name == ColumnNames.Activities.WORK:
-                        #    warnings.warn("Temporarily reduce danger for work while we have virtual work locations")
-                        #    work_danger = float(danger_increase / 20)
-                        #    loc_dangers[venue_idx] += work_danger
-                        # else:
-                        loc_dangers[venue_idx] += danger_increase
+            venue_flows = self.venue_flows[activty_name]
+            assert len(venue_flows.indptr) == len(self.individuals) + 1
+
+            # The durations (how long each individual spends doing the activity)
+            durations_col = f"{activty_name}{ColumnNames.ACTIVITY_DURATION}"
+            durations = self.individuals.loc[:, durations_col].to_numpy(dtype=np.float64)
+
+            # There may also be a hazard multiplier for locations (i.e. some locations become more hazardous
+            # than others
+            if not self.hazard_location_multipliers:  # The dictionary is empty
+                location_hazard_multiplier = 1.0
+            else:
+                location_hazard_multiplier = self.hazard_location_multipliers[activty_name]
+
+            # Increase the danger of each venue visited by an infectious person by the flow multiplied by some
+            # disease risk. The dangers are reset each day
+            infectious_entries = infectious[venue_flows.people]
+            infectious_people = venue_flows.people[infectious_entries]
+            danger_increase = venue_flows.flows[infectious_entries] * durations[infectious_people] * \
+                individual_hazard_multipliers[infectious_people] * location_hazard_multiplier
+            loc_dangers = np.bincount(venue_flows.venues[infectious_entries], weights=danger_increase,
+                                      minlength=len(activity_location.get_dangers()))
 
             #
             # ***** 2 - risks for individuals who visit dangerous venues
             #
 
+            # Gather the danger of each venue visited (using the updated dangers from above)
+            risk_increase = venue_flows.flows * loc_dangers[venue_flows.venues] * durations[venue_flows.people] * \
+                self.risk_multiplier
+            np.add.at(current_risk, venue_flows.people, risk_increase)
             # It's useful to report the specific risks associated with *this* activity for each individual
-            activity_specific_risk = [0] * len(self.individuals)
-
-            for i, (v, f, s, duration) in enumerate(zip(venues, flows, statuses, durations)):  # For each individual
-                # v and f are lists of flows and venues for the individual. Go through each one
-                for venue_idx, flow in zip(v, f):
-                    #  Danger associated with the location (we just created these updated dangers in the previous loop)
-                    danger = loc_dangers[venue_idx]
-                    risk_increase = flow * danger * duration * self.risk_multiplier
-                    current_risk[i] += risk_increase
-                    activity_specific_risk[i] += risk_increase
+            activity_specific_risk = np.bincount(venue_flows.people, weights=risk_increase,
+                                                 minlength=len(self.individuals))
 
             # Remember the (rounded) risk for this activity
-            if decimals is not None:
-                activity_specific_risk = [round(x, decimals) for x in activity_specific_risk]
-            self.individuals[f"{activty_name}{ColumnNames.ACTIVITY_RISK}"] = activity_specific_risk
+            self.individuals[f"{activty_name}{ColumnNames.ACTIVITY_RISK}"] = \
+                Microsim._round_values(activity_specific_risk, decimals)
 
             # Now we have the dangers associated with each location, apply these back to the main dataframe
-            if decimals is not None:  # Round the dangers?
-                loc_dangers = [round(x, decimals) for x in loc_dangers]
-            activity_location.update_dangers(loc_dangers)
+            activity_location.update_dangers(Microsim._round_values(loc_dangers, decimals))
 
         # Round the current risk
-        if decimals is not None:
-            current_risk = [round(x, decimals) for x in current_risk]
+        current_risk = Microsim._round_values(current_risk, decimals)
 
         # Sanity check
         assert len(current_risk) == len(self.individuals)
         assert min(current_risk) >= 0  # Should not be risk less than 0
-        # Santity check - do the risks of each activity add up to the total?
-        # (I can't get this to work, there are some really minor differences, but on the whole it looks fine)
-        # (I can't get this to work, there are some really minor differences, but on the whole it looks fine)
-        # if PopulationInitialisation.debug:  # replace with .debug
-        #    total_risk = [0.0] * len(self.individuals)
-        #    for activty_name in self.activity_locations:
-        #        total_risk = [i + j for (i, j) in zip(total_risk, list(self.individuals[f"{activty_name}{ColumnNames.ACTIVITY_RISK}"]))]
-        #    # Round both
-        #    total_risk = [round(x, 5) for x in total_risk]
-        #    current_risk_temp = [round(x, 5) for x in current_risk]
-        #    assert current_risk_temp == total_risk
 
         self.individuals[ColumnNames.CURRENT_RISK] = current_risk
 
         return
 
+    @staticmethod
+    def _round_values(values: np.ndarray, decimals) -> List[float]:
+        """Round an array of values to a list of floats. Uses python's round() rather than np.round() because
+        np.round() can differ from it in the last decimal place. If decimals is None then do no rounding"""
+        if decimals is None:
+            return values.tolist()
+        # Most risks and dangers are zero, which rounding doesn't change, so only round the non-zero values
+        nonzero = np.flatnonzero(values)
+        rounded = values.copy()
+        rounded[nonzero] = [round(x, decimals) for x in values[nonzero].tolist()]
+        return rounded.tolist()
+
     # No longer update disease counts per MSOA etc. Not needed
     # def update_disease_counts(self):
     #    """Update some disease counters -- counts of diseases in MSOAs & households -- which are useful
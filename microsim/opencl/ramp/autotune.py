@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import time
+
+import click
+import numpy as np
+import pyopencl as cl
+
+from microsim.opencl.ramp.program_cache import ProgramCache
+
+# Kernels launched over every person or place, whose local (work-group) size can be tuned. The kernels which count
+# statuses and build the active sets choose their own local size, since they aggregate within work-groups, and the
+# kernels over the active sets are launched with a fixed number of work items.
+tunable_kernels = (
+    "places_reset",
+    "people_update_flows",
+    "people_send_hazards",
+    "places_gather_hazards",
+    "people_send_hazards_fused",
+    "people_recv_hazards",
+    "people_update_statuses",
+    "people_recv_hazards_update_statuses",
+)
+
+
+def padded_size(size, local_size):
+    """The smallest multiple of local_size which is at least size."""
+    return local_size * ((size + local_size - 1) // local_size)
+
+
+def candidate_local_sizes(kernel, device):
+    """The local sizes to try for a kernel on a device: None (the driver's choice) and every power of two from the
+    device's preferred work-group size multiple up to the largest work-group the kernel can be launched with."""
+    max_size = kernel.get_work_group_info(cl.kernel_work_group_info.WORK_GROUP_SIZE, device)
+    size = kernel.get_work_group_info(cl.kernel_work_group_info.PREFERRED_WORK_GROUP_SIZE_MULTIPLE, device)
+    candidates = [None]
+    while size <= max_size:
+        candidates.append(int(size))
+        size *= 2
+    return candidates
+
+
+def usable_local_sizes(local_sizes, kernels, device):
+    """The local sizes which the kernels can be launched with on a device, without any which are the driver's choice
+    (None) or larger than the largest work-group of the kernel, which can happen if the cached sizes were tuned for
+    a driver which compiled the kernels differently."""
+    return {name: size for name, size in local_sizes.items() if size is not None and
+            size <= getattr(kernels, name).get_work_group_info(cl.kernel_work_group_info.WORK_GROUP_SIZE, device)}
+
+
+class LocalSizeCache:
+    """
+    On-disk cache of tuned local sizes, stored in one JSON file per device next to the compiled program binaries.
+
+    Files are keyed by a hash of the kernel source, the platform and device, the driver version and the build options
+    (see ProgramCache.key), so local sizes tuned for an older version of the kernels, or for a build with other
+    options (which may use a different number of registers), are never used. Each file holds the local sizes tuned
+    for each population size the device has been tuned for, and the sizes tuned for the population closest to the one
+    being simulated are used.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def load(self, device, source_hash, build_options, npeople):
+        """The tuned local size of each kernel for the population closest in size to npeople, or an empty dict if the
+        device has not been tuned for this build of the kernels."""
+        entries = self._load_entries(self._path(device, source_hash, build_options))
+        if len(entries) == 0:
+            return {}
+        closest = min(entries, key=lambda entry: abs(np.log(entry["npeople"]) - np.log(max(npeople, 1))))
+        return closest["local_sizes"]
+
+    def store(self, device, source_hash, build_options, npeople, nplaces, local_sizes):
+        """Store the tuned local sizes for a population, replacing any tuned for the same number of people."""
+        path = self._path(device, source_hash, build_options)
+        entries = [entry for entry in self._load_entries(path) if entry["npeople"] != npeople]
+        entries.append({"npeople": int(npeople), "nplaces": int(nplaces), "local_sizes": local_sizes})
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # write to a temporary file first so concurrent processes never read a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"device": device.name, "entries": entries}, f, indent=1)
+        os.replace(tmp_path, path)
+
+    def _path(self, device, source_hash, build_options):
+        key = hashlib.sha256(ProgramCache.key(source_hash, device, build_options).encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"local_sizes_{key}.json")
+
+    @staticmethod
+    def _load_entries(path):
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return json.load(f)["entries"]
+
+
+def time_kernel(simulator, name, local_size, repeats):
+    """The shortest time in seconds of repeats launches of a kernel with the given local size."""
+    simulator.local_sizes = {} if local_size is None else {name: local_size}
+    dims = (simulator.nplaces if name.startswith("places_") else simulator.npeople, simulator.nreplicates)
+    kernel = getattr(simulator.kernels, name)
+    simulator._enqueue_kernel(kernel, dims, None).wait()  # warm up
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        simulator._enqueue_kernel(kernel, dims, None).wait()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def autotune(simulator, repeats=5, cache_dir=None, quiet=True):
+    """Find the fastest local size of each tunable kernel for the device and population of a simulator.
+
+    The kernels are run on the simulator's current state, which is modified (eg. statuses are updated), so the
+    simulator should be reset or discarded afterwards. Launches with a local size pad the global size up to a multiple
+    of it, the kernels ignore the extra work items.
+
+    Args:
+        simulator (Simulator): simulator with the snapshot uploaded, to tune on.
+        repeats (int): number of launches to time for each candidate, the shortest is used.
+        cache_dir (str): directory of the LocalSizeCache to store the result in, so later simulators on the same
+            device use it. If None the result is not stored.
+        quiet (bool): whether to skip printing the time of each candidate.
+
+    Returns:
+        A dict of the best local size of each kernel, None where the driver's choice was fastest.
+    """
+    best_local_sizes = {}
+    for name in tunable_kernels:
+        kernel = getattr(simulator.kernels, name)
+        times = {local_size: time_kernel(simulator, name, local_size, repeats)
+                 for local_size in candidate_local_sizes(kernel, simulator.device)}
+        best_local_sizes[name] = min(times, key=times.get)
+        if not quiet:
+            print(name)
+            for local_size, seconds in times.items():
+                best = " *" if local_size == best_local_sizes[name] else ""
+                print(f"    {str(local_size):>6s} {seconds * 1000:10.3f} ms{best}")
+
+    simulator.local_sizes = {name: size for name, size in best_local_sizes.items() if size is not None}
+    if cache_dir is not None:
+        LocalSizeCache(cache_dir).store(simulator.device, simulator.source_hash, simulator.build_options,
+                                        simulator.npeople, simulator.nplaces, best_local_sizes)
+    return best_local_sizes
+
+
+@click.command()
+@click.option('--snapshot', 'snapshot_path', default="microsim/opencl/snapshots/cache",
+              help='Snapshot to tune for, defaults to the cached snapshot of the model')
+@click.option('--opencl-dir', default="microsim/opencl/", help='Directory of the OpenCL code, results are stored in '
+                                                                'its kernel_cache directory')
+@click.option('--gpu/--cpu', default=True, help='Tune for the GPU or the CPU OpenCL device')
+@click.option('--nreplicates', default=1, help='Number of replicates to tune for')
+@click.option('--repeats', default=5, help='Number of launches of each kernel to time for each local size')
+def main(snapshot_path, opencl_dir, gpu, nreplicates, repeats):
+    """Tune the local sizes of the kernels for a device and snapshot ahead of time. Simulators created later on the
+    same device use the tuned sizes. Run from the root of the repository:
+
+        PYTHONPATH=. python microsim/opencl/ramp/autotune.py --snapshot microsim/opencl/snapshots/cache
+    """
+    from microsim.opencl.ramp.simulator import Simulator
+    from microsim.opencl.ramp.snapshot import Snapshot
+
+    snapshot = Snapshot.load_full_snapshot(snapshot_path)
+    simulator = Simulator(snapshot, gpu=gpu, opencl_dir=opencl_dir, nreplicates=nreplicates, local_sizes={})
+    simulator.upload_all(snapshot.buffers)
+    print(f"Device: {simulator.device_name()}, people: {snapshot.npeople}, places: {snapshot.nplaces}\n")
+    local_sizes = autotune(simulator, repeats, cache_dir=os.path.join(opencl_dir, "kernel_cache"), quiet=False)
+    print("\nTuned local sizes:")
+    for name, local_size in local_sizes.items():
+        print(f"    {name:40s} {'driver' if local_size is None else local_size}")
+
+
+if __name__ == "__main__":
+    main()
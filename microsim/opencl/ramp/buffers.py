@@ -17,6 +17,7 @@ Buffers = namedtuple(
         "people_blood_pressure",
         "people_statuses",
         "people_transition_times",
+        "people_slot_offsets",
         "people_place_ids",
         "people_baseline_flows",
         "people_flows",
@@ -26,3 +27,28 @@ Buffers = namedtuple(
         "params",
     ]
 )
+
+# Value of the unused entries of people_place_ids, eg. the empty slots of people who visit fewer than nslots places.
+sentinel_value = (1 << 31) - 1
+
+# Names of the buffers which hold state that evolves independently in each replicate of a batched simulation. These
+# are allocated once per replicate on the device, while all the remaining buffers are shared between replicates.
+replicated_buffers = frozenset([
+    "place_hazards",
+    "place_counts",
+
+    "people_statuses",
+    "people_transition_times",
+    "people_flows",
+    "people_hazards",
+    "people_prngs",
+])
+
+# Names of the buffers with one entry per slot, ie. per place visited by each person. The slots of person i are
+# entries people_slot_offsets[i] to people_slot_offsets[i + 1]. In the fixed layout every person has nslots slots,
+# with unused slots padded with sentinel_value, while in the packed (CSR) layout only the used slots are stored.
+slot_buffers = frozenset([
+    "people_place_ids",
+    "people_baseline_flows",
+    "people_flows",
+])
@@ -0,0 +1,234 @@
+import copy
+import hashlib
+import json
+import os
+import pickle
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pyopencl as cl
+
+from microsim.opencl.ramp.snapshot import load_array, save_array, snapshot_format_version, snapshot_manifest_filename
+
+# Name of the file in each checkpoint directory holding the time, summaries and host state of the run
+checkpoint_state_filename = "state.pkl"
+
+
+def checkpoint_name(time):
+    """The name of the directory of the checkpoint taken at the end of a day, which sorts in order of time."""
+    return f"day_{int(time):05d}"
+
+
+def replicate_dirname(replicate):
+    return f"replicate_{replicate}"
+
+
+def snapshot_fingerprint(snapshot):
+    """A hash of the contents of the buffers, params and lockdown multipliers of a snapshot, identifying the snapshot a
+    run started from whatever its name or file format."""
+    fingerprint = hashlib.blake2b(digest_size=16)
+    for array in [*snapshot.buffers, snapshot.lockdown_multipliers]:
+        fingerprint.update(np.ascontiguousarray(array).data)
+    return fingerprint.hexdigest()
+
+
+def run_options(simulator):
+    """The options of a simulator which a run resumed from a checkpoint must share with the run that saved it."""
+    partitions = getattr(simulator, "partitions", [simulator])
+    return {
+        "simulator": type(simulator).__name__,
+        "npartitions": len(partitions),
+        "nreplicates": simulator.nreplicates,
+        "num_seed_days": simulator.num_seed_days,
+        "counter_prngs": partitions[0].counter_prngs,
+        "fused": partitions[0].fused,
+    }
+
+
+class Checkpointer:
+    """
+    Saves checkpoints of a running simulation, so that a long run can be resumed from the last checkpoint after a
+    crash (see load_checkpoint and run.resume_headless).
+
+    The state of every replicate is downloaded with non-blocking copies into pinned host memory, and written to disk on
+    a background thread, so the device keeps stepping while a checkpoint is written. Each checkpoint is a directory
+    named after the day (see checkpoint_name) holding a directory for each replicate, and a pickle of the summaries and
+    the rest of the host state needed to continue the run. The replicate directories are in the snapshot directory
+    format, but only hold the per-replicate buffers, as the static buffers are never changed by the simulation. Their
+    manifest refers to the snapshot the run started from, which provides the static buffers when resuming.
+    Checkpoints are written to a temporary directory which is only renamed once it is complete, and only the latest
+    `keep` checkpoints are kept. Checkpoints of an earlier run in the same directory must be removed with
+    clear_checkpoints before a new run starts, since they would be taken as later checkpoints of the new one. The
+    snapshot and options of the run are saved with each checkpoint, so that a checkpoint can't be resumed by a
+    different run.
+    """
+
+    def __init__(self, simulator, snapshot, checkpoint_dir, every, keep=2):
+        """
+        Args:
+            simulator: the Simulator (or PartitionedSimulator) being run.
+            snapshot: the snapshot the run started from, which is referred to for the static buffers.
+            checkpoint_dir: directory to write the checkpoints into.
+            every: number of days between checkpoints.
+            keep: number of the most recent checkpoints to keep, older ones are deleted.
+        """
+        if every < 1:
+            raise ValueError("Checkpoints must be at least one day apart")
+        self.simulator = simulator
+        self.snapshot = snapshot
+        self.checkpoint_dir = checkpoint_dir
+        self.every = every
+        self.keep = keep
+        self.state = simulator.allocate_state()
+        self.snapshot_fingerprint = snapshot_fingerprint(snapshot)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+
+    def due(self, time):
+        """Whether a checkpoint should be taken after the step of day `time`."""
+        return (time + 1) % self.every == 0
+
+    def save(self, summaries):
+        """Enqueue downloading the current state of the simulator and write it to disk in the background, together
+        with copies of the summaries, which must hold the counts of every day up to now. Waits for the previous
+        checkpoint to be written first, since its host arrays are reused."""
+        self.wait()
+        events = self.simulator.enqueue_download_state(self.state)
+        host_state = {
+            "time": int(self.simulator.time),
+            "nreplicates": self.simulator.nreplicates,
+            "snapshot": {"name": self.snapshot.name, "fingerprint": self.snapshot_fingerprint},
+            "run_options": run_options(self.simulator),
+            "summaries": copy.deepcopy(summaries),
+            # the order initial cases are chosen in, and how many have been, so seeding continues where it stopped
+            "initial_cases": [(initial_cases.shuffled_ids, initial_cases.num_chosen)
+                              for initial_cases in self.simulator.initial_cases],
+        }
+        self.pending = self.executor.submit(self._write, events, host_state)
+
+    def wait(self):
+        """Wait for the last checkpoint to be written, raising any error from writing it."""
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            pending.result()
+
+    def close(self):
+        """Wait for the last checkpoint to be written and stop the background thread."""
+        self.wait()
+        self.executor.shutdown()
+
+    def _write(self, events, host_state):
+        if len(events) > 0:
+            cl.wait_for_events(events)
+        time = host_state["time"]
+        path = os.path.join(self.checkpoint_dir, checkpoint_name(time))
+        tmp_path = path + ".tmp"
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+
+        for replicate in range(host_state["nreplicates"]):
+            replicate_path = os.path.join(tmp_path, replicate_dirname(replicate))
+            os.makedirs(replicate_path)
+            manifest = {
+                "version": snapshot_format_version,
+                "snapshot": self.snapshot.name,
+                "nplaces": int(self.snapshot.nplaces),
+                "npeople": int(self.snapshot.npeople),
+                "nslots": int(self.snapshot.nslots),
+                "time": time,
+                "arrays": {},
+            }
+            for name, array in self.state.items():
+                if name != "prng_keys":
+                    manifest["arrays"][name] = save_array(replicate_path, name, array[replicate])
+            with open(os.path.join(replicate_path, snapshot_manifest_filename), "w") as f:
+                json.dump(manifest, f, indent=2)
+        if "prng_keys" in self.state:
+            host_state["prng_keys"] = np.array(self.state["prng_keys"])
+        with open(os.path.join(tmp_path, checkpoint_state_filename), "wb") as f:
+            pickle.dump(host_state, f)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+        for old_path in list_checkpoints(self.checkpoint_dir)[:-self.keep]:
+            shutil.rmtree(old_path)
+
+
+def list_checkpoints(checkpoint_dir):
+    """The paths of the complete checkpoints in a directory, oldest first."""
+    if not os.path.isdir(checkpoint_dir):
+        return []
+    names = sorted(name for name in os.listdir(checkpoint_dir)
+                   if name.startswith("day_") and not name.endswith(".tmp"))
+    return [os.path.join(checkpoint_dir, name) for name in names]
+
+
+def clear_checkpoints(checkpoint_dir):
+    """Delete the checkpoints in a directory, including incomplete ones, eg. before starting a new run."""
+    if not os.path.isdir(checkpoint_dir):
+        return
+    for name in os.listdir(checkpoint_dir):
+        if name.startswith("day_"):
+            shutil.rmtree(os.path.join(checkpoint_dir, name))
+
+
+def latest_checkpoint(checkpoint_dir):
+    """The path of the most recent complete checkpoint in a directory, or None if there are none."""
+    checkpoints = list_checkpoints(checkpoint_dir)
+    return checkpoints[-1] if len(checkpoints) > 0 else None
+
+
+def load_checkpoint(simulator, path):
+    """
+    Restore a simulator to the state saved in a checkpoint written by Checkpointer, so that continuing the run gives
+    results identical to those of the run which was checkpointed. The checkpoint only holds the per-replicate buffers,
+    so the simulator must have been created from the snapshot the checkpointed run started from and with the same
+    options, and have its static buffers uploaded. Raises a ValueError if the snapshot (compared by its contents) or
+    the options differ.
+
+    Returns:
+        A tuple of the time of the checkpoint and the list of summaries saved with it.
+    """
+    with open(os.path.join(path, checkpoint_state_filename), "rb") as f:
+        host_state = pickle.load(f)
+    if host_state["nreplicates"] != simulator.nreplicates:
+        raise ValueError(f"Checkpoint '{path}' has {host_state['nreplicates']} replicates, but the simulator has "
+                         f"{simulator.nreplicates}")
+    if host_state["run_options"] != run_options(simulator):
+        raise ValueError(f"Checkpoint '{path}' was saved by a run with options {host_state['run_options']}, but the "
+                         f"simulator has options {run_options(simulator)}")
+    snapshot = simulator.start_snapshot
+    if host_state["snapshot"]["fingerprint"] != snapshot_fingerprint(snapshot):
+        raise ValueError(f"Checkpoint '{path}' was saved by a run of snapshot '{host_state['snapshot']['name']}', "
+                         f"which has different contents to the simulator's snapshot '{snapshot.name}'")
+
+    state = simulator.allocate_state()
+    if ("prng_keys" in state) != ("prng_keys" in host_state):
+        raise ValueError(f"Checkpoint '{path}' does not match whether the simulator uses counter-based random numbers")
+    for replicate in range(simulator.nreplicates):
+        replicate_path = os.path.join(path, replicate_dirname(replicate))
+        with open(os.path.join(replicate_path, snapshot_manifest_filename)) as f:
+            manifest = json.load(f)
+        if (manifest["nplaces"], manifest["npeople"], manifest["nslots"]) != \
+                (snapshot.nplaces, snapshot.npeople, snapshot.nslots):
+            raise ValueError(f"Checkpoint '{path}' was saved from snapshot '{manifest['snapshot']}' with "
+                             f"{manifest['nplaces']} places, {manifest['npeople']} people and {manifest['nslots']} "
+                             f"slots, which does not match the simulator's snapshot '{snapshot.name}'")
+        names = [name for name in state if name != "prng_keys"]
+        if sorted(manifest["arrays"]) != sorted(names):
+            raise ValueError(f"Checkpoint '{path}' has buffers {sorted(manifest['arrays'])}, but the simulator needs "
+                             f"{sorted(names)}")
+        for name in names:
+            state[name][replicate] = load_array(replicate_path, name, manifest["arrays"][name])
+    if "prng_keys" in state:
+        state["prng_keys"][:] = host_state["prng_keys"]
+    simulator.upload_state(state)
+
+    simulator.time = np.uint32(host_state["time"])
+    for initial_cases, (shuffled_ids, num_chosen) in zip(simulator.initial_cases, host_state["initial_cases"]):
+        initial_cases.shuffled_ids = shuffled_ids
+        initial_cases.num_chosen = num_chosen
+    return host_state["time"], host_state["summaries"]
@@ -1,14 +1,17 @@
+import copy
 import pandas as pd
 import numpy as np
 import os
 
 
 class InitialCases:
-    def __init__(self, area_codes, not_home_probs, data_dir="microsim/opencl/data/"):
+    def __init__(self, area_codes, not_home_probs, data_dir="microsim/opencl/data/", people_order=None):
         """
         This class loads the initial cases data for seeding infections in the model.
         Once the data is loaded it selects the people from higher risk area codes who
         spend more time outside of their home.
+        If the people have been reordered, people_order is the original id of each person (see Snapshot.reorder), and
+        the high risk people are kept in their original order, so the same people are chosen whatever their order.
         """
 
         # load initial case data
@@ -20,21 +23,47 @@ class InitialCases:
         # not home probabilities
         people_df = pd.DataFrame({"area_code": area_codes,
                                   "not_home_prob": not_home_probs})
-        people_df = people_df.merge(msoa_risks_df, on="area_code")
+        # a left merge keeps the people in order, so the row numbers below are the people's ids
+        people_df = people_df.merge(msoa_risks_df, on="area_code", how="left")
 
         # get people_ids for people in high risk MSOAs and high not home probability
         self.high_risk_ids = np.where((people_df["risk"] == "High") & (people_df["not_home_prob"] > 0.3))[0]
+        if people_order is not None:
+            self.high_risk_ids = self.high_risk_ids[np.argsort(people_order[self.high_risk_ids])]
 
-    def get_seed_people_ids_for_day(self, day):
-        """Randomly choose a given number of people ids from the high risk people"""
-        
-        num_cases = self.initial_cases.loc[day, "num_cases"]
-        if num_cases > self.high_risk_ids.shape[0]:  # if there aren't enough high risk individuals then return all of them
-            return self.high_risk_ids
+        # the order in which the high risk people are chosen, drawn on the first seeding day, see
+        # get_seed_people_ids_for_day()
+        self.shuffled_ids = None
+        self.num_chosen = 0
+        # the numpy RandomState the high risk people are shuffled with, numpy's global random state if None
+        self.random_state = None
+
+    def __copy__(self):
+        """Copies share the loaded data, but each has its own random state and progress through the shuffled ids."""
+        copied = InitialCases.__new__(InitialCases)
+        copied.__dict__.update(self.__dict__)
+        copied.random_state = copy.deepcopy(self.random_state)
+        return copied
 
-        selected_ids = np.random.choice(self.high_risk_ids, num_cases, replace=False)
+    def reseed(self, random_state):
+        """Choose the people who have not been chosen yet with a new numpy RandomState, reshuffling them if the high
+        risk people have already been shuffled, eg. for a fork of a run which should continue independently."""
+        self.random_state = random_state
+        if self.shuffled_ids is not None:
+            self.shuffled_ids = np.concatenate([self.shuffled_ids[:self.num_chosen],
+                                                random_state.permutation(self.shuffled_ids[self.num_chosen:])])
+
+    def get_seed_people_ids_for_day(self, day):
+        """Randomly choose a given number of people ids from the high risk people. The high risk people are shuffled
+        once, on the first call, and each day takes the next people in that order, so no one is chosen twice. If there
+        aren't enough high risk people left then all of the remaining ones are returned."""
+        if self.shuffled_ids is None:
+            random_state = np.random if self.random_state is None else self.random_state
+            self.shuffled_ids = random_state.permutation(self.high_risk_ids)
+            self.num_chosen = 0
 
-        # remove people from high_risk_ids so they are not chosen again
-        self.high_risk_ids = np.setdiff1d(self.high_risk_ids, selected_ids)
+        num_cases = min(self.initial_cases.loc[day, "num_cases"], self.shuffled_ids.shape[0] - self.num_chosen)
+        selected_ids = self.shuffled_ids[self.num_chosen:self.num_chosen + num_cases]
+        self.num_chosen += num_cases
 
         return selected_ids
@@ -8,10 +8,10 @@ from imgui.integrations.glfw import GlfwRenderer
 from OpenGL.GL import *
 
 from microsim.opencl.ramp.activity import Activity
-from microsim.opencl.ramp.params import Params
+from microsim.opencl.ramp.params import Params, params_schedule
 from microsim.opencl.ramp.projections import latlon_to_km
 from microsim.opencl.ramp.shader import load_shader
-from microsim.opencl.ramp.snapshot import Snapshot
+from microsim.opencl.ramp.snapshot import Snapshot, list_snapshots, snapshot_index
 from microsim.opencl.ramp.style import set_styles
 from microsim.opencl.ramp.summary import Summary
 
@@ -156,6 +156,8 @@ class Inspector:
 
         self.simulation_active = False
         self.do_lockdown = False
+        # whether the parameters (or lockdown) have changed since the params schedule was last uploaded
+        self.params_changed = True
         self.point_size = 2.0
         self.show_grid = True
         self.show_points = True
@@ -167,8 +169,8 @@ class Inspector:
         self.zoom_multiplier = 1.01
         self.position = position
         self.snapshot_dir = "microsim/opencl/snapshots"
-        self.snapshots = [f for f in os.listdir(self.snapshot_dir) if f.endswith(".npz")]
-        self.current_snapshot = self.snapshots.index(f"{snapshot.name}.npz")
+        self.snapshots = list_snapshots(self.snapshot_dir)
+        self.current_snapshot = snapshot_index(self.snapshots, snapshot.name)
         self.selected_snapshot = self.current_snapshot
         self.saveas_file = self.snapshots[self.current_snapshot]
         self.summary = Summary(snapshot, store_detailed_counts=False)
@@ -185,7 +187,7 @@ class Inspector:
 
         self.upload_hazards(self.snapshot.buffers.place_hazards)
         self.upload_locations(self.snapshot.buffers.place_coords)
-        self.upload_links(self.snapshot.buffers.people_place_ids)
+        self.upload_links(self.snapshot.to_padded_slots(self.snapshot.buffers.people_place_ids))
 
     def resize_callback(self, window, width, height):
         """Framebuffer resize callback."""
@@ -264,7 +266,7 @@ class Inspector:
         """Transforms the 1D place_ids buffer into a 1d element buffer and uploads it.
 
         Args:
-            place_ids: A numpy array of npeople*nslots uint32 place IDs.
+            place_ids: A numpy array of npeople*nslots uint32 place IDs, in the fixed slot layout.
         """
         place_mat = np.reshape(place_ids, (self.npeople, int(place_ids.size / self.npeople)))
         place_mat = place_mat[:, 0:self.nlines]
@@ -355,7 +357,10 @@ class Inspector:
             self.snapshot = copy.deepcopy(self.initial_state_snapshot)
             self.simulator.upload_all(self.snapshot.buffers)
             self.simulator.time = self.snapshot.time
-        _, self.do_lockdown = imgui.checkbox("Lockdown", self.do_lockdown)
+            self.params_changed = True
+        clicked, self.do_lockdown = imgui.checkbox("Lockdown", self.do_lockdown)
+        if clicked:
+            self.params_changed = True
         if imgui.button("Hide Parameters" if self.show_parameters else "Show Parameters"):
             self.show_parameters = not self.show_parameters
         imgui.end()
@@ -379,17 +384,19 @@ class Inspector:
         imgui.begin("Snapshots", flags=default_flags)
         clicked, self.selected_snapshot = imgui.listbox("", self.selected_snapshot, self.snapshots)
         if imgui.button("Load Selected"):
-            self.snapshot = Snapshot.load_full_snapshot(f"snapshots/{self.snapshots[self.selected_snapshot]}")
+            self.snapshot = Snapshot.load_full_snapshot(
+                os.path.join(self.snapshot_dir, self.snapshots[self.selected_snapshot]))
             self.simulator.upload_all(self.snapshot.buffers)
             self.simulator.time = self.snapshot.time
+            self.params_changed = True
             self.upload_hazards(self.snapshot.buffers.place_hazards)
             self.upload_locations(self.snapshot.buffers.place_coords)
-            self.upload_links(self.snapshot.buffers.people_place_ids)
+            self.upload_links(self.snapshot.to_padded_slots(self.snapshot.buffers.people_place_ids))
             self.current_snapshot = self.selected_snapshot
         if imgui.button("Save"):
             self.simulator.download_all(self.snapshot.buffers)
             self.snapshot.time = self.simulator.time
-            self.snapshot.save(f"snapshots/{self.snapshots[self.current_snapshot]}")
+            self.snapshot.save(os.path.join(self.snapshot_dir, self.snapshots[self.current_snapshot]))
         if imgui.button("Save As..."):
             self.show_saveas = True
         imgui.end()
@@ -409,86 +416,95 @@ class Inspector:
         if imgui.button("Save"):
             self.simulator.download_all(self.snapshot.buffers)
             self.snapshot.time = self.simulator.time
-            self.snapshot.save(f"snapshots/{self.saveas_file}")
-            self.snapshots = [f for f in os.listdir("snapshots") if f.endswith(".npz")]
+            # names ending in .npz are saved as .npz files, any other name as a snapshot directory
+            self.snapshot.save(os.path.join(self.snapshot_dir, self.saveas_file))
+            self.snapshots = list_snapshots(self.snapshot_dir)
             self.current_snapshot = self.snapshots.index(self.saveas_file)
             self.selected_snapshot = self.current_snapshot
             self.show_saveas = False
         imgui.end()
 
+    def param_slider(self, label, value, min_value, max_value, display_format="%.3f"):
+        """Slider for a parameter value, which marks the params as changed only when the value is edited."""
+        changed, value = imgui.slider_float(label, value, min_value, max_value, display_format)
+        if changed:
+            self.params_changed = True
+        return value
+
     def draw_parameters_window(self):
         """UI window with sliders for changing parameter values."""
         imgui.begin("Parameter Editor")
 
         imgui.text("Behaviour Change")
 
-        _, self.params.symptomatic_multiplier = imgui.slider_float(
+        self.params.symptomatic_multiplier = self.param_slider(
             "Symptomatic Multiplier", self.params.symptomatic_multiplier, 0.0, 1.0)
 
         imgui.text("Duration Distributions")
 
-        _, self.params.exposed_scale = imgui.slider_float(
+        self.params.exposed_scale = self.param_slider(
             "Exposed Weibull Scale", self.params.exposed_scale, 1.0, 10.0)
-        _, self.params.exposed_shape = imgui.slider_float(
+        self.params.exposed_shape = self.param_slider(
             "Exposed Weibull Shape", self.params.exposed_shape, 0.0, 10.0)
-        _, self.params.presymptomatic_scale = imgui.slider_float(
+        self.params.presymptomatic_scale = self.param_slider(
             "Presymptomatic Weibull Scale", self.params.presymptomatic_scale, 0.0, 10.0)
-        _, self.params.presymptomatic_shape = imgui.slider_float(
+        self.params.presymptomatic_shape = self.param_slider(
             "Presymptomatic Weibull Shape", self.params.presymptomatic_shape, 0.0, 10.0)
-        _, self.params.infection_log_scale = imgui.slider_float(
+        self.params.infection_log_scale = self.param_slider(
             "Infection Log-normal Scale", self.params.infection_log_scale, 0.0, 5.0)
-        _, self.params.infection_mode = imgui.slider_float(
+        self.params.infection_mode = self.param_slider(
             "Infection Log-normal Mode", self.params.infection_mode, 0.0, 20.0)
 
         imgui.text("Activity Hazard Multipliers")
 
         for i, activity in enumerate(list(Activity)):
-            _, self.params.place_hazard_multipliers[i] = imgui.slider_float(
+            self.params.place_hazard_multipliers[i] = self.param_slider(
                 activity.name, self.params.place_hazard_multipliers[i], 0.0, 1.0, "%.4f")
 
         imgui.text("Mortality Probabilities by Age")
 
-        _, self.params.mortality_probs[0] = imgui.slider_float(
+        self.params.mortality_probs[0] = self.param_slider(
             "0 to 4", self.params.mortality_probs[0], 0.0, 1.0, "%.7f")
-        _, self.params.mortality_probs[1] = imgui.slider_float(
+        self.params.mortality_probs[1] = self.param_slider(
             "5 to 9", self.params.mortality_probs[1], 0.0, 1.0, "%.7f")
-        _, self.params.mortality_probs[2] = imgui.slider_float(
+        self.params.mortality_probs[2] = self.param_slider(
             "10 to 14", self.params.mortality_probs[2], 0.0, 1.0, "%.7f")
-        _, self.params.mortality_probs[3] = imgui.slider_float(
+        self.params.mortality_probs[3] = self.param_slider(
             "15 to 19", self.params.mortality_probs[3], 0.0, 1.0, "%.7f")
-        _, self.params.mortality_probs[4] = imgui.slider_float(
+        self.params.mortality_probs[4] = self.param_slider(
             "20 to 24", self.params.mortality_probs[4], 0.0, 1.0, "%.7f")
-        _, self.params.mortality_probs[5] = imgui.slider_float(
+        self.params.mortality_probs[5] = self.param_slider(
             "25 to 29", self.params.mortality_probs[5], 0.0, 1.0, "%.7f")
-        _, self.params.mortality_probs[6] = imgui.slider_float(
+        self.params.mortality_probs[6] = self.param_slider(
             "30 to 34", self.params.mortality_probs[6], 0.0, 1.0, "%.7f")
-        _, self.params.mortality_probs[7] = imgui.slider_float(
+        self.params.mortality_probs[7] = self.param_slider(
             "35 to 39", self.params.mortality_probs[7], 0.0, 1.0, "%.7f")
-        _, self.params.mortality_probs[8] = imgui.slider_float(
+        self.params.mortality_probs[8] = self.param_slider(
             "40 to 44", self.params.mortality_probs[8], 0.0, 1.0, "%.7f")
-        _, self.params.mortality_probs[9] = imgui.slider_float(
+        self.params.mortality_probs[9] = self.param_slider(
             "45 to 49", self.params.mortality_probs[9], 0.0, 1.0, "%.7f")
-        _, self.params.mortality_probs[10] = imgui.slider_float(
+        self.params.mortality_probs[10] = self.param_slider(
             "50 to 54", self.params.mortality_probs[10], 0.0, 1.0, "%.7f")
-        _, self.params.mortality_probs[11] = imgui.slider_float(
+        self.params.mortality_probs[11] = self.param_slider(
             "55 to 59", self.params.mortality_probs[11], 0.0, 1.0, "%.7f")
-        _, self.params.mortality_probs[12] = imgui.slider_float(
+        self.params.mortality_probs[12] = self.param_slider(
             "60 to 64", self.params.mortality_probs[12], 0.0, 1.0, "%.7f")
-        _, self.params.mortality_probs[13] = imgui.slider_float(
+        self.params.mortality_probs[13] = self.param_slider(
             "65 to 69", self.params.mortality_probs[13], 0.0, 1.0, "%.7f")
-        _, self.params.mortality_probs[14] = imgui.slider_float(
+        self.params.mortality_probs[14] = self.param_slider(
             "70 to 74", self.params.mortality_probs[14], 0.0, 1.0, "%.7f")
-        _, self.params.mortality_probs[15] = imgui.slider_float(
+        self.params.mortality_probs[15] = self.param_slider(
             "75 to 79", self.params.mortality_probs[15], 0.0, 1.0, "%.7f")
-        _, self.params.mortality_probs[16] = imgui.slider_float(
+        self.params.mortality_probs[16] = self.param_slider(
             "80 to 84", self.params.mortality_probs[16], 0.0, 1.0, "%.7f")
-        _, self.params.mortality_probs[17] = imgui.slider_float(
+        self.params.mortality_probs[17] = self.param_slider(
             "85 to 89", self.params.mortality_probs[17], 0.0, 1.0, "%.7f")
-        _, self.params.mortality_probs[18] = imgui.slider_float(
+        self.params.mortality_probs[18] = self.param_slider(
             "90 and above", self.params.mortality_probs[18], 0.0, 1.0, "%.7f")
     
         if imgui.button("Reset to Defaults"):
             self.params = Params()
+            self.params_changed = True
 
         imgui.end()
 
@@ -550,12 +566,12 @@ class Inspector:
     def update_sim(self):
         """Run a step of the simulation."""
 
-        # Update the lockdown and upload params
-        if self.do_lockdown:
-            self.params.set_lockdown_multiplier(self.snapshot.lockdown_multipliers, self.simulator.time)
-        else:
-            self.params.lockdown_multiplier = 1.0  # NB: Multiplier of 1.0 has no effect
-        self.simulator.upload("params", self.params.asarray())
+        # Upload the params of every day, with the lockdown schedule, only when they have changed
+        if self.params_changed:
+            # NB: Multiplier of 1.0 has no effect
+            lockdown_multipliers = self.snapshot.lockdown_multipliers if self.do_lockdown else np.ones(1)
+            self.simulator.upload_params_schedule(params_schedule(self.params, lockdown_multipliers))
+            self.params_changed = False
 
         # Run one timestep of the model
         self.simulator.step()
@@ -566,11 +582,9 @@ class Inspector:
         # Upload hazard data from the host to OpenGL
         self.upload_hazards(self.snapshot.buffers.place_hazards)
 
-        # Download status data from OpenCL to the host
-        self.simulator.download("people_statuses", self.snapshot.buffers.people_statuses)
-
-        # Compute summary statistics for hazards
-        self.summary.update(self.simulator.time-1, self.snapshot.buffers.people_statuses)
+        # Compute summary statistics on the device and download only the counts
+        total_counts, _, _ = self.simulator.count_statuses()
+        self.summary.update_from_counts(self.simulator.time-1, total_counts[0])
 
     def update(self):
         """Update loop for running the simulation and updating/rendering the UI."""
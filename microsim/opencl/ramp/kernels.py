@@ -7,7 +7,17 @@ Kernels = namedtuple(
         "places_reset",
         "people_update_flows",
         "people_send_hazards",
+        "people_send_hazards_active",
+        "places_gather_hazards",
+        "places_add_hazards",
+        "people_send_hazards_fused",
         "people_recv_hazards",
-        "people_update_statuses"
+        "people_recv_hazards_active",
+        "people_update_statuses",
+        "people_recv_hazards_update_statuses",
+        "people_seed_prngs",
+        "people_seed_cases",
+        "people_count_statuses",
+        "people_compact_active",
     ]
 )
@@ -28,31 +28,116 @@ uint xoshiro128pp_next(global uint4* s) {
   return result;
 }
 
+// SplitMix64 generator, used only to expand a single seed into the many xoshiro128++ states used by the
+// simulation. Advances the 64 bit state x and returns a well mixed 64 bit value.
+ulong splitmix64_next(ulong* x) {
+  ulong z = (*x += 0x9e3779b97f4a7c15UL);
+  z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9UL;
+  z = (z ^ (z >> 27)) * 0x94d049bb133111ebUL;
+  return z ^ (z >> 31);
+}
+
+// Derive an independent xoshiro128++ state for the stream with the given index from a single seed.
+uint4 seed_xoshiro128pp(uint seed, ulong stream) {
+  // mix the seed first, so that nearby seeds start at unrelated points of the SplitMix64 sequence
+  ulong x = seed;
+  x = splitmix64_next(&x) + 2 * stream * 0x9e3779b97f4a7c15UL;
+  ulong a = splitmix64_next(&x);
+  ulong b = splitmix64_next(&x);
+  return (uint4)((uint)a, (uint)(a >> 32), (uint)b, (uint)(b >> 32));
+}
+
+// Philox4x32-10 counter-based random number generator (Salmon et al., "Parallel random numbers: as easy as 1, 2, 3").
+// Returns 128 random bits which are a bijective function of the counter for each key, so any draw of any person at
+// any step can be computed directly without storing a state.
+uint4 philox4x32_10(uint4 counter, uint2 key) {
+  uint c0 = counter.x, c1 = counter.y, c2 = counter.z, c3 = counter.w;
+  uint k0 = key.x, k1 = key.y;
+  // the high words of the products come from 64 bit multiplies rather than mul_hi, which some CPU drivers
+  // implement without vector instructions
+  #pragma unroll
+  for (int round = 0; round < 10; round++) {
+    const ulong p0 = (ulong)0xD2511F53u * c0;
+    const ulong p1 = (ulong)0xCD9E8D57u * c2;
+    const uint n0 = (uint)(p1 >> 32) ^ c1 ^ k0;
+    const uint n2 = (uint)(p0 >> 32) ^ c3 ^ k1;
+    c1 = (uint)p1;
+    c3 = (uint)p0;
+    c0 = n0;
+    c2 = n2;
+    k0 += 0x9E3779B9u;
+    k1 += 0xBB67AE85u;
+  }
+  return (uint4)(c0, c1, c2, c3);
+}
+
+#ifdef COUNTER_PRNG
+// With counter-based random numbers, each person's draws during a step come from the Philox blocks with counters
+// (person, time, 0, 0), (person, time, 1, 0), ..., under the key of their replicate. The generator only lives in
+// private memory for the duration of a kernel, so no per-person state is stored on the device.
+typedef struct CounterRng {
+  uint4 counter;
+  uint2 key;
+  uint4 block;
+  uint remaining;
+} CounterRng;
+
+typedef CounterRng* rng_t;
+
+CounterRng counter_rng(uint2 key, uint person, uint time) {
+  CounterRng rng;
+  rng.counter = (uint4)(person, time, 0, 0);
+  rng.key = key;
+  rng.remaining = 0;
+  return rng;
+}
+
+uint rng_next(rng_t rng) {
+  if (rng->remaining == 0) {
+    rng->block = philox4x32_10(rng->counter, rng->key);
+    rng->counter.z++;
+    rng->remaining = 4;
+  }
+  // rotate the block rather than indexing it, so it can stay in registers
+  const uint result = rng->block.x;
+  rng->block = rng->block.yzwx;
+  rng->remaining--;
+  return result;
+}
+#else
+// By default each person has a xoshiro128++ state in global memory, which is advanced by every draw
+typedef global uint4* rng_t;
+
+uint rng_next(rng_t rng) {
+  return xoshiro128pp_next(rng);
+}
+#endif
+
 // Generate a random float in the interval [0, 1]
-float rand(global uint4* rng) {
+float rand(rng_t rng) {
   // Get the 23 upper bits (i.e number of bits in fp mantissa)
-  const uint u = xoshiro128pp_next(rng) >> 9;
+  const uint u = rng_next(rng) >> 9;
   // Cast to a float and divide by the largest 23 bit unsigned integer.
   return (float)u / (float)((1 << 23) - 1);
 }
 
 // Generate a sample from the standard normal distribution, calculated using the Box-Muller transform
-float randn(global uint4* rng) {
+float randn(rng_t rng) {
   float u = rand(rng);
   float v = rand(rng);
   return sqrt(-2 * log(u)) * cos(2 * PI * v);
 }
 
 // Generate a random draw from an exponential distribution with rate 1.0 using inversion transform method.
-float rand_exp(global uint4* rng) {
+float rand_exp(rng_t rng) {
   return -log((float)1.0 - rand(rng));
 }
 
 // Generate a random draw from a weibull distribution with provided shape and scale
-float rand_weibull(global uint4* rng, float scale, float shape) {
+float rand_weibull(rng_t rng, float scale, float shape) {
   return scale * pow(rand_exp(rng), ((float)1.0 / shape));
 }
 
-float lognormal(global uint4* rng, float meanlog, float sdlog){
+float lognormal(rng_t rng, float meanlog, float sdlog){
   return exp(meanlog + sdlog * randn(rng));
 }
@@ -19,6 +19,33 @@ constant uint sentinel_value = ((uint)1<<31) - 1;
 // representable by a floating point number with a fixed exponent and 23 bit significand.
 constant float fixed_factor = 8388608.0;
 
+// Flows are either stored as floats, or if the program is built with QUANTISED_FLOWS defined, as 16 bit fixed point
+// numbers where the flow is the stored value multiplied by FLOW_SCALE (the per-snapshot scale factor, also defined
+// at build time). This halves the memory traffic of reading flows, which are the largest buffers on the device.
+#ifdef QUANTISED_FLOWS
+typedef ushort flow_t;
+
+float decode_flow(flow_t flow) {
+  return (float)flow * FLOW_SCALE;
+}
+
+flow_t encode_flow(float flow) {
+  // round to the nearest representable flow, saturating out of range flows. Converting through uint is much faster
+  // than convert_ushort_sat_rte on CPU devices.
+  return (flow_t)(uint)clamp(flow * (1.0f / FLOW_SCALE) + 0.5f, 0.0f, 65535.0f);
+}
+#else
+typedef float flow_t;
+
+float decode_flow(flow_t flow) {
+  return flow;
+}
+
+flow_t encode_flow(float flow) {
+  return flow;
+}
+#endif
+
 /*
   Disease Status Enum
 */
@@ -32,6 +59,9 @@ typedef enum DiseaseStatus {
   Dead = 6,
 } DiseaseStatus;
 
+// number of values in the DiseaseStatus enum
+#define NUM_DISEASE_STATUSES 7
+
 bool is_infectious(DiseaseStatus status) {
   return status == Presymptomatic || status == Asymptomatic || status == Symptomatic;
 }
@@ -83,20 +113,15 @@ float get_individual_multiplier_for_status(global const struct Params* params, D
   Utility functions
 */
 
-// get the corresponding 1D index for a 2D index 
-int get_1d_index(int person_id, int slot, int nslots) {
-  return person_id*nslots + slot;
-}
-
-uint sample_exposed_duration(global uint4* rng, global const Params* params){
+uint sample_exposed_duration(rng_t rng, global const Params* params){
   return (uint)rand_weibull(rng, params->exposed_scale, params->exposed_shape);
 }
 
-uint sample_presymptomatic_duration(global uint4* rng, global const Params* params){
+uint sample_presymptomatic_duration(rng_t rng, global const Params* params){
   return (uint)rand_weibull(rng, params->presymp_scale, params->presymp_shape);
 }
 
-uint sample_infection_duration(global uint4* rng, global const Params* params){
+uint sample_infection_duration(rng_t rng, global const Params* params){
   float mode = params->infection_mode;
   float sdlog = params->infection_log_scale;
   float meanlog = pow(sdlog, 2) + log(mode);
@@ -125,8 +150,109 @@ bool is_obese(ushort obesity){
   return obesity >= 2;
 }
 
+// The multiplier applied to the flows of a person to non-home places.
+// NB: lockdown is assumed not to change behaviour of symptomatic people, since it will already be reduced
+float non_home_flow_multiplier(DiseaseStatus status, global const Params* params){
+  return (status == Symptomatic) ? params->symptomatic_multiplier : params->lockdown_multiplier;
+}
+
+// In fused mode the flows of a person are computed on the fly from their baseline flows, instead of being stored in
+// people_flows by people_update_flows. This finds the slot of their home (the last home slot, as in
+// people_update_flows) and returns the new home flow, which is 1 minus the total of the reduced non-home flows.
+float fused_home_flow(uint first_flow_idx,
+                      uint last_flow_idx,
+                      float non_home_multiplier,
+                      global const flow_t* people_flows_baseline,
+                      global const uint* people_place_ids,
+                      global const uint* place_activities,
+                      uint* home_flow_idx){
+  float total_new_flow = 0.0;
+  *home_flow_idx = sentinel_value;
+
+  for(uint flow_idx = first_flow_idx; flow_idx < last_flow_idx; flow_idx++){
+    float baseline_flow = decode_flow(people_flows_baseline[flow_idx]);
+    uint place_id = people_place_ids[flow_idx];
+
+    if (place_id != sentinel_value){
+      if ((Activity)place_activities[place_id] == Home) {
+        *home_flow_idx = flow_idx;
+      } else {
+        // kept as a separate statement so the sum is rounded exactly as in people_update_flows
+        float new_flow = baseline_flow * non_home_multiplier;
+        total_new_flow += new_flow;
+      }
+    }
+  }
+
+  return 1.0 - total_new_flow;
+}
+
+// The flow of one slot in fused mode, rounded through flow_t exactly as if it had been stored in people_flows. Any
+// home slots other than the one updated by people_update_flows keep their baseline flow.
+float fused_flow(uint flow_idx,
+                 uint home_flow_idx,
+                 float home_flow,
+                 uint activity,
+                 float non_home_multiplier,
+                 global const flow_t* people_flows_baseline){
+  float baseline_flow = decode_flow(people_flows_baseline[flow_idx]);
+  if (flow_idx == home_flow_idx) return decode_flow(encode_flow(home_flow));
+  if ((Activity)activity == Home) return baseline_flow;
+  float new_flow = baseline_flow * non_home_multiplier;
+  return decode_flow(encode_flow(new_flow));
+}
+
+// The kernels which run over the active sets (see people_compact_active) are launched with a fixed number of work
+// items, since the lengths of the lists are only known on the device, so each work item loops over part of a list.
+// On GPUs neighbouring work items take neighbouring entries, so their reads are coalesced, while on CPUs (where the
+// program is built with CONTIGUOUS_ACTIVE_CHUNKS defined) each work item takes a contiguous chunk, which is much more
+// cache friendly.
+#ifdef CONTIGUOUS_ACTIVE_CHUNKS
+uint active_chunk(uint n) {
+  return (n + get_global_size(0) - 1) / get_global_size(0);
+}
+
+uint active_first(uint n) {
+  return get_global_id(0) * active_chunk(n);
+}
+
+uint active_last(uint n) {
+  return min(n, (uint)(get_global_id(0) + 1) * active_chunk(n));
+}
+
+uint active_stride() {
+  return 1;
+}
+#else
+uint active_first(uint n) {
+  return get_global_id(0);
+}
+
+uint active_last(uint n) {
+  return n;
+}
+
+uint active_stride() {
+  return get_global_size(0);
+}
+#endif
+
 /*
   Kernels
+
+  Every kernel is launched over a 2D range where the first dimension indexes people (or places) and the second
+  dimension indexes replicates. State which differs between replicates (statuses, transition times, flows, hazards,
+  prngs and place hazards/counts) is stored contiguously per replicate, so each kernel starts by offsetting those
+  buffers to the section owned by its replicate. Static data (ages, place ids, baseline flows etc.) is shared.
+
+  The slots (places visited) of each person are stored contiguously, with the slots of person i at indices
+  people_slot_offsets[i] to people_slot_offsets[i + 1] of people_place_ids and the flow buffers. Snapshots either
+  give everyone the same number of slots padded with sentinel_value, or pack only the used slots (a CSR layout), and
+  the kernels handle both in the same way. people_slot_offsets[npeople] is the total number of slots.
+
+  The params buffer holds a table of parameters with one row per day, so parameters which change over time (eg. the
+  lockdown multiplier) are uploaded once for the whole run. Kernels which use the parameters are given the row of
+  the current day as params_row, and start by offsetting params to it.
 */
 
 // Reset the hazard and count of each place to zero.
@@ -136,6 +262,10 @@ kernel void places_reset(uint nplaces,
   int place_id = get_global_id(0);
   if (place_id >= nplaces) return;
 
+  uint replicate = get_global_id(1);
+  place_hazards += replicate * nplaces;
+  place_counts += replicate * nplaces;
+
   place_hazards[place_id] = 0;
   place_counts[place_id] = 0;
 }
@@ -144,16 +274,22 @@ kernel void places_reset(uint nplaces,
 // given the person's baseline movement flows (pre-calculated from activity specific flows and durations) and disease status.
 // Includes lockdown logic.
 kernel void people_update_flows(uint npeople,
-                                uint nslots,
+                                global const uint* people_slot_offsets,
                                 global const uint* people_statuses,
-                                global const float* people_flows_baseline,
-                                global float* people_flows,
+                                global const flow_t* people_flows_baseline,
+                                global flow_t* people_flows,
                                 global const uint* people_place_ids,
                                 global const uint* place_activities,
-                                global const struct Params* params) {
+                                global const struct Params* params,
+                                uint params_row) {
   int person_id = get_global_id(0);
   if (person_id >= npeople) return;
 
+  uint replicate = get_global_id(1);
+  params += params_row;
+  people_statuses += replicate * npeople;
+  people_flows += replicate * people_slot_offsets[npeople];
+
   uint person_status = people_statuses[person_id];
 
   // choose flow multiplier based on whether person is symptomatic or not
@@ -161,12 +297,11 @@ kernel void people_update_flows(uint npeople,
   float non_home_multiplier = ((DiseaseStatus)person_status == Symptomatic) ? params->symptomatic_multiplier : params->lockdown_multiplier;
   
   float total_new_flow = 0.0;
-  uint home_flow_idx = 0;
+  uint home_flow_idx = sentinel_value;
   
   // adjust non-home activity flows by the chosen multiplier, while summing the new flows so we can calculate the new home flow
-  for(int slot = 0; slot < nslots; slot++){
-    uint flow_idx = get_1d_index(person_id, slot, nslots);
-    float baseline_flow = people_flows_baseline[flow_idx];
+  for(uint flow_idx = people_slot_offsets[person_id]; flow_idx < people_slot_offsets[person_id + 1]; flow_idx++){
+    float baseline_flow = decode_flow(people_flows_baseline[flow_idx]);
     uint place_id = people_place_ids[flow_idx];
 
     // check it is not an empty slot
@@ -178,88 +313,256 @@ kernel void people_update_flows(uint npeople,
       } else { 
         // for non-home activities - adjust flow by multiplier
         float new_flow = baseline_flow * non_home_multiplier;
-        people_flows[flow_idx] = new_flow;
+        people_flows[flow_idx] = encode_flow(new_flow);
         total_new_flow += new_flow;
       }
     }
   }
 
   // new home flow is 1 minus the total new flows for non-home activities, since all flows should sum to 1, 
-  people_flows[home_flow_idx] = 1.0 - total_new_flow;
+  // people without a home keep only their reduced non-home flows
+  if (home_flow_idx != sentinel_value) {
+    people_flows[home_flow_idx] = encode_flow(1.0 - total_new_flow);
+  }
+}
+
+// Accumulate the hazard from an infectious person into their candidate places. The per-replicate buffers must already
+// be offset to the person's replicate.
+void send_person_hazards(uint person_id,
+                         DiseaseStatus person_status,
+                         global const uint* people_slot_offsets,
+                         global const uint* people_place_ids,
+                         global const flow_t* people_flows,
+                         volatile global uint* place_hazards,
+                         volatile global uint* place_counts,
+                         global const uint* place_activities,
+                         global const Params* params) {
+  for (uint flow_idx = people_slot_offsets[person_id]; flow_idx < people_slot_offsets[person_id + 1]; flow_idx++) {
+    // Get the place and flow for this slot
+    uint place_id = people_place_ids[flow_idx];
+
+    //check it is not an empty slot
+    if (place_id == sentinel_value) continue;
+
+    float flow = decode_flow(people_flows[flow_idx]);
+    uint activity = place_activities[place_id];
+
+    //check it is a valid activity and select hazard multiplier
+    float place_multiplier = (0 <= activity && activity <= 4) ? params->place_hazard_multipliers[activity] : 1.0;
+    float individual_multiplier = get_individual_multiplier_for_status(params, person_status);
+
+    float hazard_increase = flow * place_multiplier * individual_multiplier;
+
+    // Convert the flow to fixed point
+    uint fixed_hazard_increase = (uint)(fixed_factor * hazard_increase);
+
+    // Atomically add hazard increase and increment counts for this place
+    atomic_add(&place_hazards[place_id], fixed_hazard_increase);
+    atomic_add(&place_counts[place_id], 1);
+  }
 }
 
 // Given their current status, accumulate hazard from each person into their candidate places.
 kernel void people_send_hazards(uint npeople,
-                                uint nslots,
+                                uint nplaces,
+                                global const uint* people_slot_offsets,
                                 global const uint* people_statuses,
                                 global const uint* people_place_ids,
-                                global const float* people_flows,
+                                global const flow_t* people_flows,
                                 global const float* people_hazards,
                                 volatile global uint* place_hazards,
                                 volatile global uint* place_counts,
                                 global const uint* place_activities,
-                                global const Params* params) {
+                                global const Params* params,
+                                uint params_row) {
   int person_id = get_global_id(0);
   if (person_id >= npeople) return;
 
+  uint replicate = get_global_id(1);
+  params += params_row;
+  people_statuses += replicate * npeople;
+  people_flows += replicate * people_slot_offsets[npeople];
+  place_hazards += replicate * nplaces;
+  place_counts += replicate * nplaces;
+
   // Early return for non infectious people
   DiseaseStatus person_status = (DiseaseStatus)people_statuses[person_id];
   if (!is_infectious(person_status)) return;
 
-  for (int slot=0; slot < nslots; slot++) {
-    // Get the place and flow for this slot
-    uint flow_idx = get_1d_index(person_id, slot, nslots);
-    uint place_id = people_place_ids[flow_idx];
+  send_person_hazards(person_id, person_status, people_slot_offsets, people_place_ids, people_flows, place_hazards,
+                      place_counts, place_activities, params);
+}
 
-    //check it is not an empty slot
+// Alternative to people_send_hazards which only runs over the infectious people listed by people_compact_active.
+// The list may be much shorter than the number of work items the kernel is launched with (which is fixed, since the
+// length is only known on the device), so each work item loops over the list with a stride of the global size.
+kernel void people_send_hazards_active(uint npeople,
+                                       uint nplaces,
+                                       global const uint* infectious_people_ids,
+                                       global const uint* active_counts,
+                                       global const uint* people_slot_offsets,
+                                       global const uint* people_statuses,
+                                       global const uint* people_place_ids,
+                                       global const flow_t* people_flows,
+                                       volatile global uint* place_hazards,
+                                       volatile global uint* place_counts,
+                                       global const uint* place_activities,
+                                       global const Params* params,
+                                       uint params_row) {
+  uint replicate = get_global_id(1);
+  params += params_row;
+  uint ninfectious = active_counts[replicate * 2];
+  infectious_people_ids += replicate * npeople;
+  people_statuses += replicate * npeople;
+  people_flows += replicate * people_slot_offsets[npeople];
+  place_hazards += replicate * nplaces;
+  place_counts += replicate * nplaces;
+
+  for (uint i = active_first(ninfectious); i < active_last(ninfectious); i += active_stride()) {
+    uint person_id = infectious_people_ids[i];
+    send_person_hazards(person_id, (DiseaseStatus)people_statuses[person_id], people_slot_offsets, people_place_ids,
+                        people_flows, place_hazards, place_counts, place_activities, params);
+  }
+}
+
+// Alternative to people_send_hazards which computes the hazard and count of each place by gathering the contributions
+// of its infectious visitors, so no atomics are needed. The visitors of each place are given by a transposed index of
+// people_place_ids: place_visitor_flow_ids[place_visitor_offsets[p]:place_visitor_offsets[p+1]] holds the slot index
+// of every visit to place p, and place_visitor_people_ids the person making each visit. The fixed point contribution of each visit is computed in
+// exactly the same way as in people_send_hazards, and integer addition is associative, so the results are identical.
+// This overwrites the hazards and counts of every place, so places_reset does not need to run first.
+kernel void places_gather_hazards(uint npeople,
+                                  uint nplaces,
+                                  global const uint* people_slot_offsets,
+                                  global const uint* people_statuses,
+                                  global const flow_t* people_flows,
+                                  global const uint* place_visitor_offsets,
+                                  global const uint* place_visitor_flow_ids,
+                                  global const uint* place_visitor_people_ids,
+                                  global uint* place_hazards,
+                                  global uint* place_counts,
+                                  global const uint* place_activities,
+                                  global const Params* params,
+                                  uint params_row) {
+  int place_id = get_global_id(0);
+  if (place_id >= nplaces) return;
+
+  uint replicate = get_global_id(1);
+  params += params_row;
+  people_statuses += replicate * npeople;
+  people_flows += replicate * people_slot_offsets[npeople];
+  place_hazards += replicate * nplaces;
+  place_counts += replicate * nplaces;
+
+  uint activity = place_activities[place_id];
+  float place_multiplier = (0 <= activity && activity <= 4) ? params->place_hazard_multipliers[activity] : 1.0;
+
+  uint hazard = 0;
+  uint count = 0;
+  for (uint i = place_visitor_offsets[place_id]; i < place_visitor_offsets[place_id + 1]; i++) {
+    DiseaseStatus person_status = (DiseaseStatus)people_statuses[place_visitor_people_ids[i]];
+    if (!is_infectious(person_status)) continue;
+
+    float individual_multiplier = get_individual_multiplier_for_status(params, person_status);
+    float flow = decode_flow(people_flows[place_visitor_flow_ids[i]]);
+    float hazard_increase = flow * place_multiplier * individual_multiplier;
+
+    hazard += (uint)(fixed_factor * hazard_increase);
+    count += 1;
+  }
+
+  place_hazards[place_id] = hazard;
+  place_counts[place_id] = count;
+}
+
+// Fused alternative to people_update_flows followed by people_send_hazards, which computes the flows of each
+// infectious person on the fly from their baseline flows, so the people_flows buffer is not needed. The hazard
+// increases are bitwise identical to those of the unfused kernels.
+kernel void people_send_hazards_fused(uint npeople,
+                                      uint nplaces,
+                                      global const uint* people_slot_offsets,
+                                      global const uint* people_statuses,
+                                      global const uint* people_place_ids,
+                                      global const flow_t* people_flows_baseline,
+                                      volatile global uint* place_hazards,
+                                      volatile global uint* place_counts,
+                                      global const uint* place_activities,
+                                      global const Params* params,
+                                      uint params_row) {
+  int person_id = get_global_id(0);
+  if (person_id >= npeople) return;
+
+  uint replicate = get_global_id(1);
+  params += params_row;
+  people_statuses += replicate * npeople;
+  place_hazards += replicate * nplaces;
+  place_counts += replicate * nplaces;
+
+  // Early return for non infectious people
+  DiseaseStatus person_status = (DiseaseStatus)people_statuses[person_id];
+  if (!is_infectious(person_status)) return;
+
+  float non_home_multiplier = non_home_flow_multiplier(person_status, params);
+  uint first_flow_idx = people_slot_offsets[person_id];
+  uint last_flow_idx = people_slot_offsets[person_id + 1];
+  uint home_flow_idx;
+  float home_flow = fused_home_flow(first_flow_idx, last_flow_idx, non_home_multiplier, people_flows_baseline,
+                                    people_place_ids, place_activities, &home_flow_idx);
+
+  for (uint flow_idx = first_flow_idx; flow_idx < last_flow_idx; flow_idx++) {
+    uint place_id = people_place_ids[flow_idx];
     if (place_id == sentinel_value) continue;
 
-    float flow = people_flows[flow_idx];
     uint activity = place_activities[place_id];
+    float flow = fused_flow(flow_idx, home_flow_idx, home_flow, activity, non_home_multiplier, people_flows_baseline);
 
-    //check it is a valid activity and select hazard multiplier
     float place_multiplier = (0 <= activity && activity <= 4) ? params->place_hazard_multipliers[activity] : 1.0;
     float individual_multiplier = get_individual_multiplier_for_status(params, person_status);
 
     float hazard_increase = flow * place_multiplier * individual_multiplier;
-
-    // Convert the flow to fixed point
     uint fixed_hazard_increase = (uint)(fixed_factor * hazard_increase);
 
-    // Atomically add hazard increase and increment counts for this place
     atomic_add(&place_hazards[place_id], fixed_hazard_increase);
     atomic_add(&place_counts[place_id], 1);
   }
 }
 
-//For each person accumulate hazard from all the places stored in their slots.
-kernel void people_recv_hazards(uint npeople,
-                                uint nslots,
-                                global const uint* people_statuses,
-                                global const uint* people_place_ids,
-                                global const float* people_flows,
-                                global float* people_hazards,
-                                global const uint* place_hazards,
-                                global const Params* params) {
-  int person_id = get_global_id(0);
-  if (person_id >= npeople) return;
+// Add the place hazards and counts accumulated by one partition of the people (see PartitionedSimulator) onto the
+// totals of all partitions. Partial hazards are fixed point, so the totals do not depend on how people are split.
+kernel void places_add_hazards(uint nplaces,
+                               global const uint* partial_hazards,
+                               global const uint* partial_counts,
+                               global uint* place_hazards,
+                               global uint* place_counts) {
+  int place_id = get_global_id(0);
+  if (place_id >= nplaces) return;
 
-  // Early return for non susceptible people
-  DiseaseStatus person_status = (DiseaseStatus)people_statuses[person_id];
-  if (person_status != Susceptible) return;
+  uint replicate = get_global_id(1);
+  uint idx = replicate * nplaces + place_id;
+
+  place_hazards[idx] += partial_hazards[idx];
+  place_counts[idx] += partial_counts[idx];
+}
 
+// Accumulate the hazard of a susceptible person from all the places stored in their slots. The per-replicate buffers
+// must already be offset to the person's replicate.
+void recv_person_hazards(uint person_id,
+                         global const uint* people_slot_offsets,
+                         global const uint* people_place_ids,
+                         global const flow_t* people_flows,
+                         global float* people_hazards,
+                         global const uint* place_hazards) {
   // Initialize hazard to accumulate into
   float hazard = 0.0;
 
-  for (int slot=0; slot < nslots; slot++) {
+  for (uint flow_idx = people_slot_offsets[person_id]; flow_idx < people_slot_offsets[person_id + 1]; flow_idx++) {
     // Get the place and flow for this slot
-    uint flow_idx = get_1d_index(person_id, slot, nslots);
     uint place_id = people_place_ids[flow_idx];
     
     //check it is not an empty slot
     if (place_id == sentinel_value) continue;
 
-    float flow = people_flows[flow_idx];
+    float flow = decode_flow(people_flows[flow_idx]);
 
     // Get the hazard and convert it to floating point
     uint fixed_hazard = place_hazards[place_id];
@@ -270,23 +573,82 @@ kernel void people_recv_hazards(uint npeople,
   people_hazards[person_id] = hazard;
 }
 
-// Disease model: given their current disease status and hazard, determine if a person is due to transition to the next
-// state, and if so apply that transition.
-kernel void people_update_statuses(uint npeople,
-                                   global const ushort* people_ages,
-                                   global const ushort* people_obesity,
-                                   global const uchar* people_cvd,
-                                   global const uchar* people_diabetes,
-                                   global const uchar* people_bloodpressure,
-                                   global const float* people_hazards,
-                                   global uint* people_statuses,
-                                   global uint* people_transition_times,
-                                   global uint4* people_prngs,
-                                   global const Params* params) {
+//For each person accumulate hazard from all the places stored in their slots.
+kernel void people_recv_hazards(uint npeople,
+                                uint nplaces,
+                                global const uint* people_slot_offsets,
+                                global const uint* people_statuses,
+                                global const uint* people_place_ids,
+                                global const flow_t* people_flows,
+                                global float* people_hazards,
+                                global const uint* place_hazards,
+                                global const Params* params,
+                                uint params_row) {
   int person_id = get_global_id(0);
   if (person_id >= npeople) return;
 
-  global uint4* rng = &people_prngs[person_id];
+  uint replicate = get_global_id(1);
+  params += params_row;
+  people_statuses += replicate * npeople;
+  people_flows += replicate * people_slot_offsets[npeople];
+  people_hazards += replicate * npeople;
+  place_hazards += replicate * nplaces;
+
+  // Early return for non susceptible people
+  DiseaseStatus person_status = (DiseaseStatus)people_statuses[person_id];
+  if (person_status != Susceptible) return;
+
+  recv_person_hazards(person_id, people_slot_offsets, people_place_ids, people_flows, people_hazards, place_hazards);
+}
+
+// Alternative to people_recv_hazards which only runs over the susceptible people listed by people_compact_active,
+// looping over the list in the same way as people_send_hazards_active.
+kernel void people_recv_hazards_active(uint npeople,
+                                       uint nplaces,
+                                       global const uint* susceptible_people_ids,
+                                       global const uint* active_counts,
+                                       global const uint* people_slot_offsets,
+                                       global const uint* people_place_ids,
+                                       global const flow_t* people_flows,
+                                       global float* people_hazards,
+                                       global const uint* place_hazards) {
+  uint replicate = get_global_id(1);
+  uint nsusceptible = active_counts[replicate * 2 + 1];
+  susceptible_people_ids += replicate * npeople;
+  people_flows += replicate * people_slot_offsets[npeople];
+  people_hazards += replicate * npeople;
+  place_hazards += replicate * nplaces;
+
+  for (uint i = active_first(nsusceptible); i < active_last(nsusceptible); i += active_stride()) {
+    recv_person_hazards(susceptible_people_ids[i], people_slot_offsets, people_place_ids, people_flows,
+                        people_hazards, place_hazards);
+  }
+}
+
+// The random number generator of a person in a replicate: their xoshiro128++ state in people_prngs (which must
+// already be offset to the replicate), or with COUNTER_PRNG a Philox generator keyed by the replicate's key and
+// counting from the person's id in the whole population (first_person + person_id) and the time.
+#ifdef COUNTER_PRNG
+#define PERSON_RNG(rng) \
+  CounterRng rng##_state = counter_rng(prng_keys[replicate], first_person + person_id, time); \
+  rng_t rng = &rng##_state
+#else
+#define PERSON_RNG(rng) rng_t rng = &people_prngs[person_id]
+#endif
+
+// Disease model: given their current disease status and hazard, determine if a person is due to transition to the next
+// state, and if so apply that transition. The per-replicate buffers must already be offset to the person's replicate.
+void update_person_status(uint person_id,
+                          global const ushort* people_ages,
+                          global const ushort* people_obesity,
+                          global const uchar* people_cvd,
+                          global const uchar* people_diabetes,
+                          global const uchar* people_bloodpressure,
+                          global const float* people_hazards,
+                          global uint* people_statuses,
+                          global uint* people_transition_times,
+                          rng_t rng,
+                          global const Params* params) {
 
   DiseaseStatus current_status = (DiseaseStatus)people_statuses[person_id];
   DiseaseStatus next_status = current_status;
@@ -391,3 +753,240 @@ kernel void people_update_statuses(uint npeople,
   people_statuses[person_id] = next_status;
   people_transition_times[person_id] = next_transition_time;
 }
+
+// Apply the disease model (update_person_status) to each person.
+kernel void people_update_statuses(uint npeople,
+                                   global const ushort* people_ages,
+                                   global const ushort* people_obesity,
+                                   global const uchar* people_cvd,
+                                   global const uchar* people_diabetes,
+                                   global const uchar* people_bloodpressure,
+                                   global const float* people_hazards,
+                                   global uint* people_statuses,
+                                   global uint* people_transition_times,
+                                   global uint4* people_prngs,
+                                   global const uint2* prng_keys,
+                                   uint first_person,
+                                   uint time,
+                                   global const Params* params,
+                                   uint params_row) {
+  int person_id = get_global_id(0);
+  if (person_id >= npeople) return;
+
+  uint replicate = get_global_id(1);
+  params += params_row;
+  people_hazards += replicate * npeople;
+  people_statuses += replicate * npeople;
+  people_transition_times += replicate * npeople;
+  people_prngs += replicate * npeople;
+
+  PERSON_RNG(rng);
+  update_person_status(person_id, people_ages, people_obesity, people_cvd, people_diabetes, people_bloodpressure,
+                       people_hazards, people_statuses, people_transition_times, rng, params);
+}
+
+// Fused alternative to people_update_flows, people_recv_hazards and people_update_statuses, which accumulates the
+// hazard of each susceptible person using flows computed on the fly from their baseline flows (see
+// people_send_hazards_fused) and then applies the disease model in the same pass. The hazards, statuses and random
+// states are bitwise identical to those of the unfused kernels.
+kernel void people_recv_hazards_update_statuses(uint npeople,
+                                                uint nplaces,
+                                                global const uint* people_slot_offsets,
+                                                global const uint* people_place_ids,
+                                                global const flow_t* people_flows_baseline,
+                                                global const uint* place_activities,
+                                                global const uint* place_hazards,
+                                                global const ushort* people_ages,
+                                                global const ushort* people_obesity,
+                                                global const uchar* people_cvd,
+                                                global const uchar* people_diabetes,
+                                                global const uchar* people_bloodpressure,
+                                                global float* people_hazards,
+                                                global uint* people_statuses,
+                                                global uint* people_transition_times,
+                                                global uint4* people_prngs,
+                                                global const uint2* prng_keys,
+                                                uint first_person,
+                                                uint time,
+                                                global const Params* params,
+                                                uint params_row) {
+  int person_id = get_global_id(0);
+  if (person_id >= npeople) return;
+
+  uint replicate = get_global_id(1);
+  params += params_row;
+  place_hazards += replicate * nplaces;
+  people_hazards += replicate * npeople;
+  people_statuses += replicate * npeople;
+  people_transition_times += replicate * npeople;
+  people_prngs += replicate * npeople;
+
+  DiseaseStatus person_status = (DiseaseStatus)people_statuses[person_id];
+  if (person_status == Susceptible) {
+    float non_home_multiplier = non_home_flow_multiplier(person_status, params);
+    uint first_flow_idx = people_slot_offsets[person_id];
+    uint last_flow_idx = people_slot_offsets[person_id + 1];
+    uint home_flow_idx;
+    float home_flow = fused_home_flow(first_flow_idx, last_flow_idx, non_home_multiplier, people_flows_baseline,
+                                      people_place_ids, place_activities, &home_flow_idx);
+
+    float hazard = 0.0;
+    for (uint flow_idx = first_flow_idx; flow_idx < last_flow_idx; flow_idx++) {
+      uint place_id = people_place_ids[flow_idx];
+      if (place_id == sentinel_value) continue;
+
+      float flow = fused_flow(flow_idx, home_flow_idx, home_flow, place_activities[place_id], non_home_multiplier,
+                              people_flows_baseline);
+
+      uint fixed_hazard = place_hazards[place_id];
+      hazard += flow * (float)fixed_hazard / fixed_factor;
+    }
+    people_hazards[person_id] = hazard;
+  }
+
+  PERSON_RNG(rng);
+  update_person_status(person_id, people_ages, people_obesity, people_cvd, people_diabetes, people_bloodpressure,
+                       people_hazards, people_statuses, people_transition_times, rng, params);
+}
+
+// Give every person in every replicate a fresh random state derived from a single seed, so replicates can be
+// reseeded without generating and uploading the states from the host. Each person's state comes from their own
+// stream, numbered from first_stream with streams_per_replicate streams for each replicate, so that a partition of a
+// population seeds its people exactly as the whole population would.
+kernel void people_seed_prngs(uint npeople,
+                              uint seed,
+                              uint first_stream,
+                              uint streams_per_replicate,
+                              global uint4* people_prngs) {
+  int person_id = get_global_id(0);
+  if (person_id >= npeople) return;
+
+  uint replicate = get_global_id(1);
+  ulong stream = (ulong)replicate * streams_per_replicate + first_stream + person_id;
+  people_prngs[replicate * npeople + person_id] = seed_xoshiro128pp(seed, stream);
+}
+
+// Seed initial cases by setting the hazard of each chosen person to the largest float, so updating their status
+// infects them with probability 1. Launched over (nseeds, nreplicates), the ids chosen for replicate r are
+// seed_people_ids[r * nseeds] to seed_people_ids[(r + 1) * nseeds - 1], padded with ids of npeople or more which are
+// skipped. The hazards of everyone else must be zeroed before this kernel runs.
+kernel void people_seed_cases(uint npeople,
+                              uint nseeds,
+                              global const uint* seed_people_ids,
+                              global float* people_hazards) {
+  int seed_id = get_global_id(0);
+  if (seed_id >= nseeds) return;
+
+  uint replicate = get_global_id(1);
+  uint person_id = seed_people_ids[replicate * nseeds + seed_id];
+  if (person_id >= npeople) return;
+
+  people_hazards[replicate * npeople + person_id] = FLT_MAX;
+}
+
+// Count the number of people with each disease status, and optionally the counts broken down by age bin and area,
+// so only these small histograms need to be transferred to the host each step. The detailed histograms are laid
+// out as [status][bin]. All count buffers must be zeroed before this kernel runs.
+// Total counts are first accumulated in local memory so each work group only does one global atomic per status,
+// which requires the work group not to span replicates (i.e. a local size of 1 in the second dimension).
+kernel void people_count_statuses(uint npeople,
+                                  uint nage_bins,
+                                  uint nareas,
+                                  uint count_detailed,
+                                  global const uint* people_statuses,
+                                  global const uchar* people_age_bins,
+                                  global const uint* people_area_ids,
+                                  global uint* status_counts,
+                                  global uint* age_status_counts,
+                                  global uint* area_status_counts) {
+  local uint local_counts[NUM_DISEASE_STATUSES];
+
+  int person_id = get_global_id(0);
+  uint local_id = get_local_id(0);
+  uint local_size = get_local_size(0);
+
+  uint replicate = get_global_id(1);
+  people_statuses += replicate * npeople;
+  status_counts += replicate * NUM_DISEASE_STATUSES;
+  age_status_counts += replicate * NUM_DISEASE_STATUSES * nage_bins;
+  area_status_counts += replicate * NUM_DISEASE_STATUSES * nareas;
+
+  for (uint i = local_id; i < NUM_DISEASE_STATUSES; i += local_size) {
+    local_counts[i] = 0;
+  }
+  barrier(CLK_LOCAL_MEM_FENCE);
+
+  // NB: no early return for padding work items since every work item must reach the barriers
+  if (person_id < npeople) {
+    uint status = people_statuses[person_id];
+    atomic_inc(&local_counts[status]);
+
+    if (count_detailed) {
+      atomic_inc(&age_status_counts[status * nage_bins + people_age_bins[person_id]]);
+      atomic_inc(&area_status_counts[status * nareas + people_area_ids[person_id]]);
+    }
+  }
+  barrier(CLK_LOCAL_MEM_FENCE);
+
+  for (uint i = local_id; i < NUM_DISEASE_STATUSES; i += local_size) {
+    if (local_counts[i] > 0) {
+      atomic_add(&status_counts[i], local_counts[i]);
+    }
+  }
+}
+
+// Build the active sets: the lists of infectious people (active_counts[0] of them) and susceptible people
+// (active_counts[1] of them) in each replicate, so people_send_hazards_active and people_recv_hazards_active only
+// run over the people who do any work. The order of each list is not deterministic, but hazards are summed in fixed
+// point so the results are. As in people_count_statuses, each work group reserves space for its people in local
+// memory, so only one global atomic per list is needed for each work group. active_counts must be zeroed first.
+kernel void people_compact_active(uint npeople,
+                                  global const uint* people_statuses,
+                                  global uint* infectious_people_ids,
+                                  global uint* susceptible_people_ids,
+                                  global uint* active_counts) {
+  local uint local_counts[2];
+  local uint local_offsets[2];
+
+  int person_id = get_global_id(0);
+  uint local_id = get_local_id(0);
+  uint local_size = get_local_size(0);
+
+  uint replicate = get_global_id(1);
+  people_statuses += replicate * npeople;
+  infectious_people_ids += replicate * npeople;
+  susceptible_people_ids += replicate * npeople;
+  active_counts += replicate * 2;
+
+  for (uint i = local_id; i < 2; i += local_size) {
+    local_counts[i] = 0;
+  }
+  barrier(CLK_LOCAL_MEM_FENCE);
+
+  // NB: no early return for padding work items since every work item must reach the barriers
+  int list = -1;
+  uint local_idx = 0;
+  if (person_id < npeople) {
+    DiseaseStatus status = (DiseaseStatus)people_statuses[person_id];
+    if (is_infectious(status)) {
+      list = 0;
+    } else if (status == Susceptible) {
+      list = 1;
+    }
+    if (list >= 0) {
+      local_idx = atomic_inc(&local_counts[list]);
+    }
+  }
+  barrier(CLK_LOCAL_MEM_FENCE);
+
+  for (uint i = local_id; i < 2; i += local_size) {
+    local_offsets[i] = local_counts[i] > 0 ? atomic_add(&active_counts[i], local_counts[i]) : 0;
+  }
+  barrier(CLK_LOCAL_MEM_FENCE);
+
+  if (list == 0) {
+    infectious_people_ids[local_offsets[0] + local_idx] = person_id;
+  } else if (list == 1) {
+    susceptible_people_ids[local_offsets[1] + local_idx] = person_id;
+  }
+}
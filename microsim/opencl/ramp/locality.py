@@ -0,0 +1,81 @@
+import numpy as np
+
+from microsim.opencl.ramp.activity import Activity
+from microsim.opencl.ramp.buffers import sentinel_value
+
+
+def hilbert_curve_index(x, y, order=16):
+    """
+    Compute the distance along a Hilbert curve of the integer grid coordinates x and y, which must lie in
+    [0, 2**order). Points which are close along the curve are close in space, so sorting by this index groups nearby
+    points together.
+    """
+    n = 1 << order
+    x = np.array(x, dtype=np.int64)
+    y = np.array(y, dtype=np.int64)
+    d = np.zeros(x.shape, dtype=np.int64)
+
+    s = n >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx.astype(np.int64)) ^ ry.astype(np.int64))
+
+        # rotate the quadrant so that the curve is continuous
+        flip = ~ry & rx
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        swap = ~ry
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+        s >>= 1
+
+    return d
+
+
+def coordinates_hilbert_index(place_coords, order=16):
+    """Hilbert curve index of each place, from the flat [lat, lon, lat, lon, ...] place coordinates."""
+    coords = np.asarray(place_coords, dtype=np.float64).reshape(-1, 2)
+    coords = np.where(np.isfinite(coords), coords, np.nan)
+
+    # scale the coordinates onto the integer grid, places without coordinates are put at the origin
+    lower = np.nanmin(coords, axis=0) if np.isfinite(coords).any() else np.zeros(2)
+    upper = np.nanmax(coords, axis=0) if np.isfinite(coords).any() else np.ones(2)
+    scale = ((1 << order) - 1) / np.maximum(upper - lower, np.finfo(np.float64).tiny)
+    grid = np.nan_to_num((coords - lower) * scale, nan=0.0)
+    grid = np.clip(np.rint(grid), 0, (1 << order) - 1).astype(np.int64)
+
+    return hilbert_curve_index(grid[:, 1], grid[:, 0], order)
+
+
+def home_place_ids(people_place_ids, place_activities, people_slot_offsets):
+    """The id of the home of each person, or sentinel_value for people without a home."""
+    place_ids = np.asarray(people_place_ids)
+    slot_counts = np.diff(np.asarray(people_slot_offsets, dtype=np.int64))
+    slot_people_ids = np.repeat(np.arange(slot_counts.shape[0]), slot_counts)
+
+    valid = place_ids != sentinel_value
+    is_home = np.zeros(place_ids.shape, dtype=bool)
+    is_home[valid] = place_activities[place_ids[valid]] == Activity.Home.value
+
+    # the first home slot of each person
+    home_people_ids, first_home_slots = np.unique(slot_people_ids[is_home], return_index=True)
+    homes = np.full(slot_counts.shape[0], sentinel_value, dtype=np.uint32)
+    homes[home_people_ids] = place_ids[is_home][first_home_slots]
+    return homes
+
+
+def locality_place_order(place_activities, place_coords, place_area_ids):
+    """
+    Order of places sorted by activity, then area (for places with one, eg. homes), then position along a Hilbert
+    curve over their coordinates. Returns the original id of the place at each position in the new order.
+    """
+    hilbert_index = coordinates_hilbert_index(place_coords)
+    return np.lexsort((hilbert_index, place_area_ids, place_activities)).astype(np.uint32)
+
+
+def locality_people_order(people_home_ids):
+    """
+    Order of people sorted by the id of their home (in the new place order), so that people sharing a home are
+    adjacent. Returns the original id of the person at each position in the new order.
+    """
+    return np.argsort(people_home_ids, kind="stable").astype(np.uint32)
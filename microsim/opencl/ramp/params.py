@@ -22,6 +22,29 @@ IndividualHazardMultipliers = namedtuple(
     ]
 )
 
+# Names and sizes of the fields packed into the params buffer by Params.asarray(), in order. Snapshots record the
+# layout their params buffer was packed with, so that snapshots created before fields were added can be migrated.
+# New fields should be appended to the end of the layout.
+params_layout = (
+    ("symptomatic_multiplier", 1),
+    ("exposed_scale", 1),
+    ("exposed_shape", 1),
+    ("presymptomatic_scale", 1),
+    ("presymptomatic_shape", 1),
+    ("infection_log_scale", 1),
+    ("infection_mode", 1),
+    ("lockdown_multiplier", 1),
+    ("place_hazard_multipliers", 5),
+    ("individual_hazard_multipliers", 3),
+    ("mortality_probs", 19),
+    ("obesity_multipliers", 4),
+    ("symptomatic_probs", 9),
+    ("cvd_multiplier", 1),
+    ("diabetes_multiplier", 1),
+    ("bloodpressure_multiplier", 1),
+    ("overweight_sympt_mplier", 1),
+)
+
 
 class Params:
     """Convenience class for setting simulator parameters. Also holds the hard-coded default values
@@ -158,3 +181,83 @@ class Params:
 
     def num_bytes(self):
         return 4 * self.asarray().size
+
+
+def params_schedule(params, lockdown_multipliers=None, overrides=None):
+    """
+    Pack the parameters of each day into a 2D array with one row of Params.asarray() per day, for
+    Simulator.upload_params_schedule(). Every row starts from params, with the lockdown multiplier of each day taken
+    from lockdown_multipliers and any other field of params_layout overridden by overrides, a dict from the field name
+    to an array of its value on each day (with shape (ndays,) or (ndays, field size)). The schedule is as long as the
+    longest of these, shorter ones keep their last value.
+    """
+    offsets = {}
+    offset = 0
+    for name, size in params_layout:
+        offsets[name] = (offset, size)
+        offset += size
+
+    overrides = dict(overrides) if overrides is not None else {}
+    if lockdown_multipliers is not None:
+        overrides["lockdown_multiplier"] = lockdown_multipliers
+    for name, values in overrides.items():
+        if name not in offsets:
+            raise ValueError(f"Unknown params field '{name}'")
+        if len(values) == 0:
+            raise ValueError(f"No values given for params field '{name}'")
+
+    ndays = max([len(values) for values in overrides.values()], default=1)
+    days = np.arange(ndays)
+    schedule = np.tile(params.asarray().astype(np.float32), (ndays, 1))
+    for name, values in overrides.items():
+        offset, size = offsets[name]
+        values = np.asarray(values, dtype=np.float32).reshape(len(values), size)
+        schedule[:, offset:offset + size] = values[np.minimum(days, values.shape[0] - 1)]
+    return schedule
+
+
+def infer_params_layout(num_params):
+    """
+    Infer the layout of a params array which was saved without one. Fields have only ever been appended to the
+    layout, so the layout is the prefix of the current params_layout with the same total size.
+    """
+    size = 0
+    for i, (name, field_size) in enumerate(params_layout):
+        if size == num_params:
+            return params_layout[:i]
+        size += field_size
+    if size == num_params:
+        return params_layout
+    raise ValueError(f"Could not infer the layout of a params array of size {num_params}, it does not match the "
+                     f"current params layout or any earlier version of it.")
+
+
+def migrate_params_array(params_array, layout):
+    """
+    Re-derive a params array in the current params_layout from one packed with the given (possibly older) layout.
+    Fields in both layouts are copied across, any other fields take the default values of the Params class.
+    """
+    layout = tuple((name, int(size)) for name, size in layout)
+    if layout == params_layout:
+        return params_array
+
+    old_offsets = {}
+    offset = 0
+    for name, size in layout:
+        old_offsets[name] = (offset, size)
+        offset += size
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        migrated_params_array = Params().asarray()
+
+    offset = 0
+    for name, size in params_layout:
+        if name in old_offsets and old_offsets[name][1] == size:
+            old_offset = old_offsets[name][0]
+            migrated_params_array[offset:offset + size] = params_array[old_offset:old_offset + size]
+        else:
+            warnings.warn(f"Params field '{name}' is not in the snapshot's params layout, using default values.")
+        offset += size
+
+    return migrated_params_array
@@ -0,0 +1,386 @@
+import copy
+import os
+
+import numpy as np
+import pyopencl as cl
+
+from microsim.opencl.ramp.buffers import Buffers, replicated_buffers, slot_buffers
+from microsim.opencl.ramp.initial_cases import InitialCases
+from microsim.opencl.ramp.simulator import Simulator, reseed_initial_cases
+
+
+def partition_devices(device, npartitions=None):
+    """
+    Split a device into sub-devices with device fission, so that each partition of a PartitionedSimulator gets its
+    own compute units. If npartitions is None the device is split by NUMA node where supported. If the device can not
+    be split into npartitions sub-devices, the partitions share the device instead.
+    """
+    properties = device.partition_properties
+    if npartitions is None:
+        if cl.device_partition_property.BY_AFFINITY_DOMAIN in properties:
+            return device.create_sub_devices([cl.device_partition_property.BY_AFFINITY_DOMAIN,
+                                              cl.device_affinity_domain.NUMA])
+        return [device]
+
+    if npartitions > 1 and device.partition_max_sub_devices >= npartitions and \
+            cl.device_partition_property.EQUALLY in properties:
+        compute_units = device.max_compute_units // npartitions
+        return device.create_sub_devices([cl.device_partition_property.EQUALLY, compute_units])[:npartitions]
+    return [device] * npartitions
+
+
+def partition_people(people_slot_offsets, npartitions):
+    """The boundaries of npartitions contiguous ranges of people, chosen so each range has a similar number of slots."""
+    people_slot_offsets = np.asarray(people_slot_offsets, dtype=np.int64)
+    npeople = people_slot_offsets.shape[0] - 1
+    targets = people_slot_offsets[-1] * np.arange(1, npartitions) / npartitions
+    bounds = np.concatenate([[0], np.searchsorted(people_slot_offsets, targets), [npeople]])
+    if np.any(np.diff(bounds) <= 0):
+        raise ValueError("Can not split {} people into {} non-empty partitions".format(npeople, npartitions))
+    return bounds
+
+
+class PartitionedSimulator:
+    """
+    Simulator which splits the people of a snapshot into contiguous partitions, each simulated by its own Simulator on
+    its own OpenCL device or sub-device, so one host can use several GPUs or every NUMA node of its CPUs.
+
+    Every partition holds all of the places. Each step, the partitions accumulate partial place hazards from their own
+    people, the partial hazards are summed on the device of the first partition and the totals are copied to every
+    partition before people receive hazards from places. Hazards are summed in fixed point and each person keeps their
+    own random state, so the results are identical to simulating the whole snapshot with a single Simulator.
+
+    The methods match those of Simulator, taking and returning arrays for the whole population, so a
+    PartitionedSimulator can be used in its place (eg. by run_headless).
+    """
+
+    def __init__(self, snapshot, devices=None, npartitions=None, gpu=True, opencl_dir="microsim/opencl/",
+                 num_seed_days=5, nreplicates=1, cache_programs=True, hazard_mode="auto", gather_threshold=None,
+                 fused=False, active_sets=False, profile=False, local_sizes=None, counter_prngs=False):
+        """Create a context for the devices and a Simulator for each partition of the people.
+
+        Args:
+            snapshot (Snapshot): snapshot containing data and number of places, people and slots
+            devices (list): OpenCL devices on the same platform to run the partitions on, one per partition. Defaults
+                to splitting the first device of the type chosen by gpu with partition_devices().
+            npartitions (int): Number of partitions when devices is not given.
+            gpu (bool): Whether to use a GPU or CPU when devices is not given.
+            The remaining arguments are passed to the Simulator of each partition.
+
+        Raises:
+            OSError: If devices are not given and none of the requested type is found.
+        """
+        if devices is None:
+            dev_type = cl.device_type.GPU if gpu else cl.device_type.CPU
+            platform_devices = [plat.get_devices(dev_type) for plat in cl.get_platforms()
+                                if len(plat.get_devices(dev_type)) > 0]
+            if len(platform_devices) == 0:
+                raise OSError("No compatible device found")
+            devices = partition_devices(platform_devices[0][0], npartitions)
+        if len(set(device.platform.int_ptr for device in devices)) != 1:
+            raise ValueError("All devices must be on the same platform")
+
+        # partitions may share a device, the context needs each device once
+        context_devices = []
+        for device in devices:
+            if device not in context_devices:
+                context_devices.append(device)
+        ctx = cl.Context(context_devices)
+
+        bounds = partition_people(snapshot.buffers.people_slot_offsets, len(devices))
+        partitions = []
+        for device, start, stop in zip(devices, bounds[:-1], bounds[1:]):
+            partition = Simulator(snapshot.select_people(start, stop), opencl_dir=opencl_dir,
+                                  num_seed_days=num_seed_days, nreplicates=nreplicates,
+                                  cache_programs=cache_programs, hazard_mode=hazard_mode,
+                                  gather_threshold=gather_threshold, context=ctx, device=device, fused=fused,
+                                  active_sets=active_sets, profile=profile, local_sizes=local_sizes,
+                                  counter_prngs=counter_prngs)
+            # seed each person from the same random stream as they would have in a single simulator
+            partition.set_first_person(start, snapshot.npeople)
+            partitions.append(partition)
+
+        self.nplaces = snapshot.nplaces
+        self.npeople = snapshot.npeople
+        self.nslots = snapshot.nslots
+        self.nreplicates = nreplicates
+        self.time = np.uint32(snapshot.time)
+
+        self.ctx = ctx
+        self.devices = devices
+        self.partitions = partitions
+        self.people_bounds = bounds
+        self.slot_bounds = snapshot.buffers.people_slot_offsets[bounds].astype(np.int64)
+        self.start_snapshot = snapshot
+
+        data_dir = os.path.join(opencl_dir, "data/")
+        self.start_initial_cases = InitialCases(snapshot.area_codes, snapshot.not_home_probs, data_dir,
+                                                snapshot.people_order)
+        self.initial_cases = self._copy_initial_cases()
+
+        self.num_seed_days = num_seed_days
+
+    @property
+    def npartitions(self):
+        return len(self.partitions)
+
+    def platform_name(self):
+        """The name of the OpenCL platform being used for simulation."""
+        return self.partitions[0].platform_name()
+
+    def device_name(self):
+        """The names of the OpenCL devices being used for simulation."""
+        return ", ".join(partition.device_name() for partition in self.partitions)
+
+    @property
+    def profilers(self):
+        """The Profiler of each partition, or an empty list when not profiling."""
+        return [partition.profiler for partition in self.partitions if partition.profiler is not None]
+
+    def _partition_arrays(self, name, host_buffer):
+        """Split an array for the whole population into the part belonging to each partition."""
+        if name not in Buffers._fields:
+            raise ValueError("No buffer with name {}".format(name))
+        people_bounds = zip(self.people_bounds[:-1], self.people_bounds[1:])
+        if name == "people_slot_offsets":
+            return [host_buffer[start:stop + 1] - host_buffer[start] for start, stop in people_bounds]
+        if name in slot_buffers:
+            return [host_buffer[start:stop] for start, stop in zip(self.slot_bounds[:-1], self.slot_bounds[1:])]
+        if name.startswith("people_"):
+            rows = host_buffer.reshape(self.npeople, -1)
+            return [rows[start:stop].reshape(-1) for start, stop in people_bounds]
+        return None
+
+    def upload(self, name, host_buffer, replicate=0):
+        """Transfers the contents of the provided numpy array for the whole population to the named buffer of every
+        partition. Place and params buffers are copied to every partition."""
+        arrays = self._partition_arrays(name, host_buffer)
+        for i, partition in enumerate(self.partitions):
+            partition.upload(name, host_buffer if arrays is None else arrays[i], replicate)
+
+    def download(self, name, host_buffer, replicate=0):
+        """Transfers the contents of the named buffer of every partition to the provided numpy array for the whole
+        population. Place and params buffers are read from the first partition, which holds the total hazards."""
+        arrays = self._partition_arrays(name, host_buffer)
+        if arrays is None:
+            self.partitions[0].download(name, host_buffer, replicate)
+            return
+        for partition, array, slot_start in zip(self.partitions, arrays, self.slot_bounds):
+            if name == "people_slot_offsets":
+                offsets = np.empty_like(array)
+                partition.download(name, offsets, replicate)
+                array[:] = offsets + slot_start
+            else:
+                partition.download(name, array, replicate)
+
+    def upload_all(self, host_buffers):
+        """Upload to every device buffer, errors if host_buffers is missing a field. Per-replicate state is
+        copied into every replicate."""
+        for name in Buffers._fields:
+            replicates = range(self.nreplicates) if name in replicated_buffers else [0]
+            for replicate in replicates:
+                self.upload(name, getattr(host_buffers, name), replicate)
+
+    def download_all(self, host_buffers, replicate=0):
+        """Downloads every device buffer, errors if host_buffers is missing a field."""
+        for name in Buffers._fields:
+            self.download(name, getattr(host_buffers, name), replicate if name in replicated_buffers else 0)
+
+    def allocate_state(self):
+        """Host arrays to hold the state of every replicate for the whole population, see
+        Simulator.allocate_state."""
+        state = {}
+        for name in self.partitions[0].pristine_buffers:
+            host_buffer = getattr(self.start_snapshot.buffers, name)
+            state[name] = np.zeros((self.nreplicates, host_buffer.size), dtype=host_buffer.dtype)
+        if self.partitions[0].counter_prngs:
+            state["prng_keys"] = np.zeros_like(self.partitions[0].start_prng_keys)
+        return state
+
+    def enqueue_download_state(self, state, wait_for=None):
+        """Download the state of every replicate into host arrays from allocate_state(). The state of the partitions
+        is gathered on the host, so this blocks and returns an empty list of events."""
+        for partition in self.partitions:
+            partition.queue.finish()
+        for name, host_array in state.items():
+            if name == "prng_keys":
+                # every partition holds the same keys
+                cl.enqueue_copy(self.partitions[0].queue, host_array, self.partitions[0].prng_keys)
+                continue
+            for replicate in range(self.nreplicates):
+                self.download(name, host_array[replicate], replicate)
+        return []
+
+    def upload_state(self, state):
+        """Upload the state of every replicate for the whole population to the partitions, see
+        Simulator.upload_state."""
+        for name, host_array in state.items():
+            if name == "prng_keys":
+                for partition in self.partitions:
+                    partition.upload_state({name: host_array})
+                continue
+            for replicate in range(self.nreplicates):
+                self.upload(name, np.ascontiguousarray(host_array[replicate]), replicate)
+
+    def save_fork_point(self, fork_point=None):
+        """Copy the state of every replicate on each partition's device, see Simulator.save_fork_point."""
+        partition_fork_points = [None] * self.npartitions if fork_point is None else fork_point["partitions"]
+        return {
+            "partitions": [partition.save_fork_point(partition_fork_point)
+                           for partition, partition_fork_point in zip(self.partitions, partition_fork_points)],
+            "time": self.time,
+            "initial_cases": [copy.copy(initial_cases) for initial_cases in self.initial_cases],
+            "numpy_random_state": np.random.get_state(),
+        }
+
+    def fork(self, fork_point, seed=None):
+        """Return every replicate to the state saved by save_fork_point(), see Simulator.fork."""
+        for partition, partition_fork_point in zip(self.partitions, fork_point["partitions"]):
+            partition.fork(partition_fork_point)
+        self.time = fork_point["time"]
+        self.initial_cases = [copy.copy(initial_cases) for initial_cases in fork_point["initial_cases"]]
+        if seed is not None:
+            self.seed_prngs_on_device(seed)
+            reseed_initial_cases(self.initial_cases, seed)
+            np.random.seed(seed)
+        else:
+            np.random.set_state(fork_point["numpy_random_state"])
+
+    def seed_prngs(self, seeds):
+        """Gives each replicate its own random states, generated on the host in the same way as Simulator.seed_prngs."""
+        if len(seeds) != self.nreplicates:
+            raise ValueError("Expected {} seeds but got {}".format(self.nreplicates, len(seeds)))
+        random_states = [np.random.RandomState(seed) for seed in seeds]
+        for initial_cases, random_state in zip(self.initial_cases, random_states):
+            initial_cases.random_state = random_state
+        if self.partitions[0].counter_prngs:
+            for partition in self.partitions:
+                partition.seed_prngs(seeds)
+            return
+        for replicate, random_state in enumerate(random_states):
+            prngs = random_state.randint(np.uint32((1 << 32) - 1), size=self.npeople * 4, dtype=np.uint32)
+            self.upload("people_prngs", prngs, replicate)
+
+    def seed_prngs_on_device(self, seed):
+        """Regenerate the random states of every person in every replicate on the devices from a single seed."""
+        for partition in self.partitions:
+            partition.seed_prngs_on_device(seed)
+
+    def reset(self, snapshot=None, seed=None):
+        """Return every replicate to the start of the simulation, see Simulator.reset."""
+        if snapshot is not None:
+            if not np.array_equal(snapshot.buffers.people_slot_offsets[self.people_bounds], self.slot_bounds):
+                raise ValueError("Snapshot can not be split into the same partitions as the simulator")
+            for partition, start, stop in zip(self.partitions, self.people_bounds[:-1], self.people_bounds[1:]):
+                partition.reset(snapshot.select_people(start, stop))
+            self.start_snapshot = snapshot
+        else:
+            for partition in self.partitions:
+                partition.reset()
+
+        if seed is not None:
+            self.seed_prngs_on_device(seed)
+            np.random.seed(seed)
+
+        self.time = np.uint32(self.start_snapshot.time)
+        self.initial_cases = self._copy_initial_cases()
+        for partition in self.partitions:
+            partition.queue.finish()
+
+    def upload_params_schedule(self, params_schedule):
+        """Upload the parameters of every day to every partition, see Simulator.upload_params_schedule."""
+        for partition in self.partitions:
+            partition.upload_params_schedule(params_schedule)
+
+    def rebind(self, params):
+        """Upload a new set of parameters to every partition."""
+        for partition in self.partitions:
+            partition.rebind(params)
+
+    def _copy_initial_cases(self):
+        """Each replicate draws its seed infections independently, so needs its own pool of candidates."""
+        return [copy.copy(self.start_initial_cases) for _ in range(self.nreplicates)]
+
+    def set_count_bins(self, people_age_bins, nage_bins, people_area_ids, nareas):
+        """Upload the age bin and area of every person, enabling the detailed counts in count_statuses()."""
+        for partition, start, stop in zip(self.partitions, self.people_bounds[:-1], self.people_bounds[1:]):
+            partition.set_count_bins(people_age_bins[start:stop], nage_bins, people_area_ids[start:stop], nareas)
+
+    def count_statuses(self, detailed=False):
+        """Count the people in each disease status, summing the counts of every partition. See
+        Simulator.count_statuses."""
+        counts = [partition.count_statuses(detailed) for partition in self.partitions]
+        total_counts = sum(partition_counts[0] for partition_counts in counts)
+        if not detailed:
+            return total_counts, None, None
+        age_counts = sum(partition_counts[1] for partition_counts in counts)
+        area_counts = sum(partition_counts[2] for partition_counts in counts)
+        return total_counts, age_counts, area_counts
+
+    def allocate_counts(self, detailed=False):
+        """Host arrays to hold the counts from enqueue_count_statuses(), see Simulator.count_statuses."""
+        return self.partitions[0].allocate_counts(detailed)
+
+    def enqueue_count_statuses(self, total_counts, age_counts=None, area_counts=None):
+        """Count the people in each disease status into host arrays from allocate_counts(). The counts of the
+        partitions are summed on the host, so this blocks and returns None, like a completed event."""
+        counts = self.count_statuses(detailed=age_counts is not None and area_counts is not None)
+        for host_array, partition_counts in zip([total_counts, age_counts, area_counts], counts):
+            if host_array is not None:
+                host_array[:] = partition_counts
+
+    def enqueue_step(self, params=None):
+        """Upload params (if given) and step every partition. The reduction between the partitions is synchronised
+        on the host, so this blocks and returns None, like a completed event."""
+        if params is not None:
+            self.upload("params", params)
+        self.step()
+
+    def step(self):
+        """Choose whether to run the normal step function or the one for initial case seeding"""
+        # the partitions are given the time for the random numbers and profiler records of their kernels
+        for partition in self.partitions:
+            partition.time = self.time
+        if self.time < self.num_seed_days:
+            self.step_with_seeding()
+        else:
+            self.step_all_kernels()
+
+    def step_all_kernels(self):
+        """Runs each kernel in order on every partition, summing the partial place hazards of the partitions between
+        sending and receiving hazards, and updates the time. Blocks until complete."""
+        send_events = [partition.enqueue_send_hazards() for partition in self.partitions]
+
+        # sum the partial hazards into the place buffers of the first partition
+        first = self.partitions[0]
+        add_hazards = first.kernels.places_add_hazards
+        places_dims = (self.nplaces, self.nreplicates)
+        reduce_event = send_events[0]
+        for partition, send_event in zip(self.partitions[1:], send_events[1:]):
+            add_hazards.set_args(self.nplaces, partition.buffers.place_hazards, partition.buffers.place_counts,
+                                 first.buffers.place_hazards, first.buffers.place_counts)
+            reduce_event = first._enqueue_kernel(add_hazards, places_dims, None, wait_for=[reduce_event, send_event])
+
+        # copy the total hazards back to the other partitions
+        recv_events = [first.enqueue_recv_hazards(wait_for=[reduce_event])]
+        for partition in self.partitions[1:]:
+            copy_event = partition._record("place_hazards", "copy", cl.enqueue_copy(
+                partition.queue, partition.buffers.place_hazards, first.buffers.place_hazards, wait_for=[reduce_event]))
+            recv_events.append(partition.enqueue_recv_hazards(wait_for=[copy_event]))
+
+        cl.wait_for_events(recv_events)
+        self.time += np.uint32(1)
+
+    def step_with_seeding(self):
+        """For initial case seeding: infects a number of people chosen from the initial cases data, then runs only
+        the kernel which updates people statuses. Each partition is given the ids of its own people. Blocks until
+        complete. See Simulator.step_with_seeding."""
+        seed_people_ids = [initial_cases.get_seed_people_ids_for_day(self.time)
+                           for initial_cases in self.initial_cases]
+
+        events = []
+        for partition, start, stop in zip(self.partitions, self.people_bounds[:-1], self.people_bounds[1:]):
+            partition_ids = [ids[(ids >= start) & (ids < stop)] - start for ids in seed_people_ids]
+            events.append(partition.enqueue_seed_cases(partition_ids))
+        cl.wait_for_events(events)
+        self.time += np.uint32(1)
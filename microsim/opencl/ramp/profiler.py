@@ -0,0 +1,146 @@
+import csv
+import json
+import os
+import sys
+
+import numpy as np
+
+# Fields of each record, in the order they are written to CSV files. Times are in nanoseconds on the device clock,
+# relative to when the first recorded command was queued.
+record_fields = ["name", "kind", "step", "queued_ns", "submit_ns", "start_ns", "end_ns", "duration_ms"]
+
+
+class Profiler:
+    """
+    Records the OpenCL events of each kernel and transfer enqueued by a Simulator created with profile=True, so their
+    queued, submitted, start and end times can be read back once they have completed. Reports a summary table of where
+    the time goes, and writes the records as JSON or CSV, or as a Chrome trace (which can be opened in chrome://tracing
+    or https://ui.perfetto.dev).
+    """
+
+    def __init__(self, device_name=""):
+        self.device_name = device_name
+        self.events = []
+
+    def record(self, name, kind, step, event):
+        """Record the event of a command enqueued during a step.
+
+        Args:
+            name: name of the kernel, or of the buffer which was transferred.
+            kind: kind of command, e.g. "kernel", "upload", "download", "copy" or "fill".
+            step: the time of the simulator when the command was enqueued.
+            event: the pyopencl Event of the command, from a queue with profiling enabled.
+        """
+        self.events.append((name, kind, int(step), event))
+
+    def clear(self):
+        """Forget every recorded event."""
+        self.events = []
+
+    def records(self):
+        """A list with a dict of the name, kind, step and times of each recorded command. Waits for the commands to
+        complete."""
+        if len(self.events) == 0:
+            return []
+        times = []
+        for _, _, _, event in self.events:
+            event.wait()
+            profile = event.profile
+            times.append((profile.queued, profile.submit, profile.start, profile.end))
+        origin = min(t[0] for t in times)
+
+        records = []
+        for (name, kind, step, _), (queued, submit, start, end) in zip(self.events, times):
+            records.append({
+                "name": name,
+                "kind": kind,
+                "step": step,
+                "queued_ns": queued - origin,
+                "submit_ns": submit - origin,
+                "start_ns": start - origin,
+                "end_ns": end - origin,
+                "duration_ms": (end - start) / 1e6,
+            })
+        return records
+
+    def summary(self, records=None):
+        """The number of calls and the total, mean and max time of each command, sorted by decreasing total time."""
+        records = self.records() if records is None else records
+        durations = {}
+        for record in records:
+            durations.setdefault((record["name"], record["kind"]), []).append(record["duration_ms"])
+        grand_total = sum(sum(d) for d in durations.values())
+
+        rows = []
+        for (name, kind), duration in durations.items():
+            total = float(np.sum(duration))
+            rows.append({
+                "name": name,
+                "kind": kind,
+                "calls": len(duration),
+                "total_ms": total,
+                "mean_ms": total / len(duration),
+                "max_ms": float(np.max(duration)),
+                "percent": 100.0 * total / grand_total if grand_total > 0 else 0.0,
+            })
+        return sorted(rows, key=lambda row: row["total_ms"], reverse=True)
+
+    def print_summary(self, file=sys.stdout):
+        """Print the summary table."""
+        rows = self.summary()
+        print(f"\nOpenCL profile {self.device_name}", file=file)
+        print(f"{'Command':40s} {'Kind':>8s} {'Calls':>7s} {'Total ms':>10s} {'Mean ms':>9s} {'Max ms':>9s} {'%':>6s}",
+              file=file)
+        for row in rows:
+            print(f"{row['name']:40s} {row['kind']:>8s} {row['calls']:7d} {row['total_ms']:10.2f} "
+                  f"{row['mean_ms']:9.3f} {row['max_ms']:9.3f} {row['percent']:6.1f}", file=file)
+
+    def write_json(self, path, records=None):
+        """Write the summary and every record to a JSON file."""
+        records = self.records() if records is None else records
+        with open(path, "w") as f:
+            json.dump({"device": self.device_name, "summary": self.summary(records), "records": records}, f, indent=1)
+
+    def write_csv(self, path, records=None):
+        """Write every record to a CSV file, one row per command."""
+        records = self.records() if records is None else records
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=record_fields)
+            writer.writeheader()
+            writer.writerows(records)
+
+    def write_chrome_trace(self, path, records=None):
+        """Write every record as a complete event in the Chrome trace event format, with one row per kind of
+        command."""
+        records = self.records() if records is None else records
+        kinds = []
+        trace_events = []
+        for record in records:
+            if record["kind"] not in kinds:
+                kinds.append(record["kind"])
+            trace_events.append({
+                "name": record["name"],
+                "cat": record["kind"],
+                "ph": "X",
+                "ts": record["start_ns"] / 1000,
+                "dur": (record["end_ns"] - record["start_ns"]) / 1000,
+                "pid": 0,
+                "tid": kinds.index(record["kind"]),
+                "args": {"step": record["step"], "queued_us": record["queued_ns"] / 1000},
+            })
+        metadata = [{"name": "process_name", "ph": "M", "pid": 0, "args": {"name": self.device_name}}]
+        metadata += [{"name": "thread_name", "ph": "M", "pid": 0, "tid": tid, "args": {"name": kind}}
+                     for tid, kind in enumerate(kinds)]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": metadata + trace_events, "displayTimeUnit": "ms"}, f)
+
+    def write(self, output_dir, name="profile", chrome_trace=True):
+        """Write name.json, name.csv and (if chrome_trace) name_trace.json to output_dir."""
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        # the records are only collected once, as collecting them waits for every event
+        records = self.records()
+        self.write_json(os.path.join(output_dir, name + ".json"), records)
+        self.write_csv(os.path.join(output_dir, name + ".csv"), records)
+        if chrome_trace:
+            self.write_chrome_trace(os.path.join(output_dir, name + "_trace.json"), records)
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import re
+
+import pyopencl as cl
+
+
+class ProgramCache:
+    """
+    On-disk cache of compiled OpenCL program binaries, so that repeatedly constructing simulators (e.g. in calibration
+    loops) does not pay for the OpenCL compiler every time.
+
+    Binaries are stored one file per device, keyed by a hash of the kernel source (including any files it includes),
+    the platform and device the binary was compiled for, the driver version and the build options. Changing any of
+    these produces a new key, so stale binaries are never loaded. Only file contents are hashed and include
+    directories are left out of the key, so the same kernels checked out somewhere else reuse the binary. The cache is bounded in size: when it grows beyond
+    max_bytes the least recently used binaries are evicted.
+    """
+
+    def __init__(self, cache_dir, max_bytes=256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def build(self, ctx, kernel_path, options=()):
+        """Build the program in kernel_path for every device in ctx, loading cached binaries when they are
+        available and storing newly compiled binaries otherwise.
+
+        Args:
+            ctx: the OpenCL context to build the program for.
+            kernel_path: path to the main .cl file, included files are resolved relative to its directory.
+            options: list of build options passed to the OpenCL compiler.
+
+        Returns:
+            A built pyopencl Program.
+        """
+        options = list(options)
+        with open(kernel_path) as f:
+            source = f.read()
+
+        devices = ctx.get_info(cl.context_info.DEVICES)
+        source_hash = self.source_hash(kernel_path)
+        paths = [self._binary_path(self.key(source_hash, device, options)) for device in devices]
+
+        if all(os.path.exists(path) for path in paths):
+            binaries = []
+            for path in paths:
+                with open(path, "rb") as f:
+                    binaries.append(f.read())
+                os.utime(path)  # mark as recently used
+            try:
+                return cl.Program(ctx, devices, binaries).build(options=options)
+            except cl.Error:
+                # binary rejected by the driver, fall through and recompile from source
+                pass
+
+        program = cl.Program(ctx, source).build(options=options)
+        self._store(paths, program.get_info(cl.program_info.BINARIES))
+        return program
+
+    @staticmethod
+    def source_hash(kernel_path):
+        """Hash the contents of the kernel file and, recursively, every file it #includes. Paths are not hashed, so
+        identical kernels in different directories have the same hash."""
+        digest = hashlib.sha256()
+        kernel_dir = os.path.dirname(kernel_path)
+        pending = [kernel_path]
+        seen = set()
+        while pending:
+            path = pending.pop(0)
+            if path in seen or not os.path.exists(path):
+                continue
+            seen.add(path)
+            with open(path, "rb") as f:
+                contents = f.read()
+            digest.update(contents)
+            for include in re.findall(rb'#include\s+"([^"]+)"', contents):
+                pending.append(os.path.join(kernel_dir, include.decode()))
+        return digest.hexdigest()
+
+    @staticmethod
+    def key(source_hash, device, options):
+        """Cache key for the given source hash compiled for a device with the given build options. Include
+        directories (-I) are ignored, the contents of the included files are already part of the source hash."""
+        digest = hashlib.sha256()
+        digest.update(source_hash.encode())
+        digest.update(device.platform.get_info(cl.platform_info.NAME).encode())
+        digest.update(device.platform.get_info(cl.platform_info.VERSION).encode())
+        digest.update(device.get_info(cl.device_info.NAME).encode())
+        digest.update(device.get_info(cl.device_info.DRIVER_VERSION).encode())
+        digest.update(" ".join(option for option in options if not option.startswith("-I")).encode())
+        return digest.hexdigest()
+
+    def clear(self):
+        """Invalidate the cache by removing every stored binary."""
+        for path in self._binary_paths():
+            os.remove(path)
+
+    def num_bytes(self):
+        """Total size in bytes of all the binaries in the cache."""
+        return sum(os.path.getsize(path) for path in self._binary_paths())
+
+    def _binary_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.bin")
+
+    def _binary_paths(self):
+        if not os.path.isdir(self.cache_dir):
+            return []
+        return [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith(".bin")]
+
+    def _store(self, paths, binaries):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for path, binary in zip(paths, binaries):
+            # write to a temporary file first so concurrent processes never read a partial binary
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(binary)
+            os.replace(tmp_path, path)
+        self._evict()
+
+    def _evict(self):
+        """Remove the least recently used binaries until the cache fits within max_bytes."""
+        paths = sorted(self._binary_paths(), key=os.path.getmtime)
+        total = sum(os.path.getsize(path) for path in paths)
+        for path in paths:
+            if total <= self.max_bytes:
+                break
+            total -= os.path.getsize(path)
+            os.remove(path)
@@ -1,26 +1,42 @@
+import copy
 import pickle
+from collections import deque, namedtuple
+import numpy as np
 from tqdm import tqdm
 import pandas as pd
 import os
 
+from microsim.opencl.ramp.buffers import Buffers, replicated_buffers
+from microsim.opencl.ramp.checkpoint import Checkpointer, clear_checkpoints, latest_checkpoint, load_checkpoint
 from microsim.opencl.ramp.inspector import Inspector
-from microsim.opencl.ramp.params import Params
+from microsim.opencl.ramp.params import Params, params_schedule
 from microsim.opencl.ramp.simulator import Simulator
 from microsim.opencl.ramp.summary import Summary
 from microsim.opencl.ramp.disease_statuses import DiseaseStatus
 
+# A scenario for run_headless_scenarios: a function which changes the scenario's copy of the snapshot in place, and the
+# names of the static buffers it changes. Only these buffers are copied for the scenario and uploaded to the device.
+Scenario = namedtuple("Scenario", ["change", "buffers"], defaults=[()])
 
-def run_opencl(snapshot, iterations=100, data_dir="./data", use_gui=True, use_gpu=False, num_seed_days=5, quiet=False):
+
+def run_opencl(snapshot, iterations=100, data_dir="./data", use_gui=True, use_gpu=False, num_seed_days=5, quiet=False,
+               observe_every=1, profile=False, checkpoint_every=0, resume=False):
     """
     Entry point for running the OpenCL simulation either with the UI or in headless mode.
-    NB: in order to write output data for the OpenCL dashboard you must run in headless mode.
+    NB: in order to write output data for the OpenCL dashboard you must run in headless mode. In headless mode the
+    status counts are only stored every observe_every days, the counts of the days in between are NaN. If profile is
+    set, the time spent in each kernel and transfer is printed and written to profile.json, profile.csv and
+    profile_trace.json in the output directory.
+    In headless mode a checkpoint is saved every checkpoint_every days (if not 0) in the checkpoints directory of the
+    output directory, and if resume is set the run continues from the latest checkpoint there (if any). Otherwise any
+    checkpoints of an earlier run there are deleted before the run starts.
     """
 
     if not quiet:
         print(f"\nSnapshot Size:\t{int(snapshot.num_bytes() / 1000000)} MB\n")
 
     # Create a simulator and upload the snapshot data to the OpenCL device
-    simulator = Simulator(snapshot, use_gpu, num_seed_days=num_seed_days)
+    simulator = Simulator(snapshot, use_gpu, num_seed_days=num_seed_days, profile=profile)
     simulator.upload_all(snapshot.buffers)
     if not quiet:
         print(f"Platform:\t{simulator.platform_name()}\nDevice:\t\t{simulator.device_name()}\n")
@@ -28,9 +44,29 @@ def run_opencl(snapshot, iterations=100, data_dir="./data", use_gui=True, use_gp
     if use_gui:
         run_with_gui(simulator, snapshot)
     else:
-        summary, final_state = run_headless(simulator, snapshot, iterations, quiet)
+        checkpoint_dir = data_dir + "/output/OpenCL/checkpoints/"
+        checkpointer = Checkpointer(simulator, snapshot, checkpoint_dir, checkpoint_every) if checkpoint_every > 0 \
+            else None
+        checkpoint_path = latest_checkpoint(checkpoint_dir) if resume else None
+        if checkpoint_path is not None:
+            if not quiet:
+                print(f"Resuming from checkpoint {checkpoint_path}\n")
+            summary, final_state = resume_headless(simulator, snapshot, checkpoint_path, iterations, quiet,
+                                                   observe_every=observe_every, checkpointer=checkpointer)
+        else:
+            if checkpointer is not None:
+                # checkpoints of an earlier run would otherwise be taken as later checkpoints of this one
+                clear_checkpoints(checkpoint_dir)
+            summary, final_state = run_headless(simulator, snapshot, iterations, quiet, observe_every=observe_every,
+                                                checkpointer=checkpointer)
+        if checkpointer is not None:
+            checkpointer.close()
         store_summary_data(summary, store_detailed_counts=True, data_dir=data_dir)
 
+    if profile:
+        simulator.profiler.print_summary()
+        simulator.profiler.write(data_dir + "/output/OpenCL/")
+
 
 def run_with_gui(simulator, snapshot):
     width = 2560  # Initial window width in pixels
@@ -45,46 +81,231 @@ def run_with_gui(simulator, snapshot):
         inspector.update()
 
 
-def run_headless(simulator, snapshot, iterations, quiet, store_detailed_counts=True):
+def run_headless(simulator, snapshot, iterations, quiet, store_detailed_counts=True, observe_every=1,
+                 pipeline_depth=2, checkpointer=None):
     """
     Run the simulation in headless mode and store summary data.
     NB: running in this mode is required in order to view output data in the dashboard. Also store_detailed_counts must
     be set to True to output the required data for the dashboard, however the model runs faster with this set to False.
+
+    Steps are pipelined (see run_pipelined), with the status counts only downloaded every observe_every days. The days
+    in between are NaN in the summary. If a Checkpointer is given, checkpoints are saved while running, and
+    the run can be continued from one of them with resume_headless. Returns the summary and the final state, as
+    Buffers of new host arrays, leaving the snapshot unchanged.
     """
-    params = Params.fromarray(snapshot.buffers.params)
     summary = Summary(snapshot, store_detailed_counts=store_detailed_counts, max_time=iterations)
+    return _run_headless(simulator, snapshot, summary, 0, iterations, quiet, store_detailed_counts, observe_every,
+                         pipeline_depth, checkpointer)
+
+
+def resume_headless(simulator, snapshot, checkpoint_path, iterations, quiet, store_detailed_counts=True,
+                    observe_every=1, pipeline_depth=2, checkpointer=None):
+    """
+    Continue a headless run from a checkpoint saved by run_headless, giving the same summary and final state as the
+    run would have if it had not stopped. The simulator must be created from the same snapshot with the same options
+    and have the snapshot uploaded, and iterations and store_detailed_counts must match the original run.
+    """
+    first_day, summaries = load_checkpoint(simulator, checkpoint_path)
+    return _run_headless(simulator, snapshot, summaries[0], first_day, iterations, quiet, store_detailed_counts,
+                         observe_every, pipeline_depth, checkpointer)
 
-    # only show progress bar in quiet mode
-    timestep_iterator = range(iterations) if quiet else tqdm(range(iterations), desc="Running simulation")
-    
-    for time in timestep_iterator:
-        # Update parameters based on lockdown
-        params.set_lockdown_multiplier(snapshot.lockdown_multipliers, time)
-        simulator.upload("params", params.asarray())
 
-        # Step the simulator
-        simulator.step()
+def _run_headless(simulator, snapshot, summary, first_day, iterations, quiet, store_detailed_counts, observe_every,
+                  pipeline_depth, checkpointer):
+    if store_detailed_counts:
+        set_count_bins(simulator, summary)
 
-        # Update the statuses
-        simulator.download("people_statuses", snapshot.buffers.people_statuses)
-        summary.update(time, snapshot.buffers.people_statuses)
+    # only show progress bar in quiet mode
+    observed_days = run_pipelined(simulator, snapshot, iterations, [summary], store_detailed_counts, observe_every,
+                                  pipeline_depth, show_progress=not quiet, first_day=first_day,
+                                  checkpointer=checkpointer)
+    if checkpointer is not None:
+        checkpointer.wait()
 
     if not quiet:
-        for i in range(iterations):
+        for i in observed_days:
             print(f"\nDay {i}")
             summary.print_counts(i)
 
     if not quiet:
         print("\nFinished")
 
-    # Download the snapshot from OpenCL to host memory
-    final_state = simulator.download_all(snapshot.buffers)
+    # Download the final state from OpenCL into new host buffers, so the snapshot still holds the start of the run
+    final_state = Buffers(**{name: np.empty_like(getattr(snapshot.buffers, name)) for name in Buffers._fields})
+    simulator.download_all(final_state)
 
     return summary, final_state
 
 
+def run_headless_replicates(simulator, snapshot, iterations, quiet, store_detailed_counts=True, observe_every=1,
+                            pipeline_depth=2):
+    """
+    Run every replicate of a batched simulator in headless mode, stepping all the replicates together with one kernel
+    launch per timestep. Returns a list with one Summary per replicate.
+    NB: the replicates are only independent if they have been given different random states with
+    Simulator.seed_prngs() after uploading the snapshot.
+    """
+    summaries = [Summary(snapshot, store_detailed_counts=store_detailed_counts, max_time=iterations)
+                 for _ in range(simulator.nreplicates)]
+    if store_detailed_counts:
+        set_count_bins(simulator, summaries[0])
+
+    run_pipelined(simulator, snapshot, iterations, summaries, store_detailed_counts, observe_every, pipeline_depth,
+                  show_progress=not quiet)
+
+    if not quiet:
+        print("\nFinished")
+
+    return summaries
+
+
+def run_headless_scenarios(simulator, snapshot, scenarios, warmup_days, iterations, quiet, store_detailed_counts=True,
+                           observe_every=1, pipeline_depth=2, seeds=None):
+    """
+    Run several scenarios which share their first warmup_days days in headless mode, simulating the shared days only
+    once. The state after the warm-up is kept on the device (see Simulator.save_fork_point), and each scenario forks
+    from it with device to device copies, then runs the remaining days with its own changes to the snapshot.
+
+    Args:
+        scenarios: A dict of scenario names to a Scenario, a function or None. The scenario's function changes a
+            copy of the snapshot in place, eg. its params (Snapshot.update_params), lockdown multipliers or population
+            (Snapshot.switch_to_healthier_population), and takes effect from the end of the warm-up. The copy has its
+            own params and lockdown multipliers, but only the static buffers listed in the Scenario are copied, the
+            others are read-only. A function on its own is a Scenario which changes no static buffers, and None leaves
+            the snapshot unchanged.
+        seeds: Optional dict of scenario names to integer seeds, giving those scenarios random numbers independent of
+            the other scenarios from the end of the warm-up. Scenarios without a seed continue with the random numbers
+            of the warm-up, so the differences between them are only due to the scenarios.
+
+    Returns:
+        A dict of scenario names to a Summary of the whole run, including the warm-up.
+    """
+    if not 0 <= warmup_days <= iterations:
+        raise ValueError(f"The warm-up of {warmup_days} days must be part of the {iterations} iterations")
+    seeds = {} if seeds is None else seeds
+    static_buffers = [name for name in Buffers._fields if name not in replicated_buffers and name != "params"]
+    scenarios = {name: scenario if scenario is None or isinstance(scenario, Scenario) else Scenario(scenario)
+                 for name, scenario in scenarios.items()}
+    for name, scenario in scenarios.items():
+        if scenario is not None and not set(scenario.buffers) <= set(static_buffers):
+            raise ValueError(f"Scenario '{name}' can only change the static buffers {static_buffers}, not "
+                             f"{sorted(set(scenario.buffers) - set(static_buffers))}")
+
+    summary = Summary(snapshot, store_detailed_counts=store_detailed_counts, max_time=iterations)
+    if store_detailed_counts:
+        set_count_bins(simulator, summary)
+    run_pipelined(simulator, snapshot, warmup_days, [summary], store_detailed_counts, observe_every, pipeline_depth,
+                  show_progress=not quiet)
+    fork_point = simulator.save_fork_point()
+
+    summaries = {}
+    for name, scenario in scenarios.items():
+        changed_buffers = () if scenario is None else scenario.buffers
+        scenario_snapshot = _scenario_snapshot(snapshot, changed_buffers)
+        if scenario is not None:
+            scenario.change(scenario_snapshot)
+        # only the static buffers the scenario changes are uploaded, and restored once it has run
+        for buffer_name in changed_buffers:
+            simulator.upload(buffer_name, getattr(scenario_snapshot.buffers, buffer_name))
+
+        simulator.fork(fork_point, seed=seeds.get(name))
+        summaries[name] = copy.deepcopy(summary)
+        if not quiet:
+            print(f"\nScenario {name}")
+        run_pipelined(simulator, scenario_snapshot, iterations, [summaries[name]], store_detailed_counts,
+                      observe_every, pipeline_depth, show_progress=not quiet, first_day=warmup_days)
+
+        for buffer_name in changed_buffers:
+            simulator.upload(buffer_name, getattr(snapshot.buffers, buffer_name))
+
+    if not quiet:
+        print("\nFinished")
+
+    return summaries
+
+
+def _scenario_snapshot(snapshot, changed_buffers):
+    """A shallow copy of the snapshot for a scenario, with its own params, lockdown multipliers and copies of the
+    changed_buffers. The other buffers are read-only views of the snapshot's, so they are not copied."""
+    buffers = {}
+    for name, array in snapshot.buffers._asdict().items():
+        if name in changed_buffers or name == "params":
+            buffers[name] = np.array(array)
+        else:
+            buffers[name] = array.view()
+            buffers[name].flags.writeable = False
+    scenario_snapshot = copy.copy(snapshot)
+    scenario_snapshot.buffers = Buffers(**buffers)
+    scenario_snapshot.lockdown_multipliers = np.array(snapshot.lockdown_multipliers)
+    return scenario_snapshot
+
+
+def run_pipelined(simulator, snapshot, iterations, summaries, store_detailed_counts, observe_every=1,
+                  pipeline_depth=2, show_progress=False, first_day=0, checkpointer=None):
+    """
+    Step the simulator for each timestep without waiting for the device, saving the status counts of each replicate
+    into its summary. The counts of a day are downloaded without blocking into one of pipeline_depth sets of host
+    arrays, and only summarised once the counts of the following days have been enqueued, so the device keeps working
+    while the host waits for and stores counts. Counts are only taken every observe_every days and on the last day,
+    so the days in between need no downloads at all, and are marked as NaN in the summaries. Returns the observed
+    days.
+
+    Runs resumed from a checkpoint start from first_day. If a Checkpointer is given, a checkpoint is saved whenever it
+    is due, after waiting for the counts of the days before it.
+    """
+    # The parameters of every day are uploaded once, each step uses the row of its day
+    simulator.upload_params_schedule(params_schedule(Params.fromarray(snapshot.buffers.params),
+                                                     snapshot.lockdown_multipliers))
+    count_arrays = [simulator.allocate_counts(store_detailed_counts) for _ in range(pipeline_depth)]
+    pending = deque()
+    observed_days = []
+    nobservations = 0
+
+    def summarise(time, event, counts):
+        if event is not None:
+            event.wait()
+        total_counts, age_counts, area_counts = counts
+        for replicate, summary in enumerate(summaries):
+            summary.update_from_counts(time, total_counts[replicate],
+                                       None if age_counts is None else age_counts[replicate],
+                                       None if area_counts is None else area_counts[replicate])
+        observed_days.append(time)
+
+    days = range(first_day, iterations)
+    timestep_iterator = tqdm(days, desc="Running simulation") if show_progress else days
+    for time in timestep_iterator:
+        simulator.enqueue_step()
+
+        if (time + 1) % observe_every == 0 or time == iterations - 1:
+            # Wait for the oldest counts before their host arrays are reused
+            if len(pending) == pipeline_depth:
+                summarise(*pending.popleft())
+            counts = count_arrays[nobservations % pipeline_depth]
+            pending.append((time, simulator.enqueue_count_statuses(*counts), counts))
+            nobservations += 1
+        else:
+            for summary in summaries:
+                summary.mark_unobserved(time)
+
+        if checkpointer is not None and checkpointer.due(time) and time < iterations - 1:
+            while len(pending) > 0:
+                summarise(*pending.popleft())
+            checkpointer.save(summaries)
+
+    while len(pending) > 0:
+        summarise(*pending.popleft())
+
+    return observed_days
+
+
+def set_count_bins(simulator, summary):
+    """Give the simulator the age bins and area ids used by the summary, so it can compute detailed counts."""
+    simulator.set_count_bins(summary.age_bins, len(summary.age_thresholds),
+                             summary.area_ids, len(summary.unique_area_codes))
+
+
 def store_summary_data(summary, store_detailed_counts, data_dir):
-    # convert total_counts to dict of pandas dataseries
+    # convert total_counts to dict of pandas dataseries, the counts of days which were not observed are NaN
     total_counts_dict = {}
     for status, timeseries in enumerate(summary.total_counts):
         total_counts_dict[DiseaseStatus(status).name.lower()] = pd.Series(timeseries)
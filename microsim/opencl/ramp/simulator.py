@@ -1,13 +1,53 @@
 import numpy as np
 import pyopencl as cl
+import copy
 import os
 
-from microsim.opencl.ramp.buffers import Buffers
+from microsim.opencl.ramp.autotune import LocalSizeCache, padded_size, usable_local_sizes
+from microsim.opencl.ramp.buffers import Buffers, replicated_buffers, sentinel_value
+from microsim.opencl.ramp.disease_statuses import DiseaseStatus
 from microsim.opencl.ramp.kernels import Kernels
-from microsim.opencl.ramp.params import Params
+from microsim.opencl.ramp.params import Params, params_layout
+from microsim.opencl.ramp.profiler import Profiler
+from microsim.opencl.ramp.program_cache import ProgramCache
 from microsim.opencl.ramp.snapshot import Snapshot
 from microsim.opencl.ramp.initial_cases import InitialCases
 
+# Ways of accumulating the hazards of places from their infectious visitors. "scatter" runs people_send_hazards, where
+# each infectious person atomically adds to the places they visit, "gather" runs places_gather_hazards, where each
+# place sums over its visitors without atomics, and "auto" chooses between them based on the infectious fraction.
+hazard_modes = ("auto", "scatter", "gather")
+# Default infectious fraction above which "auto" mode uses the gather kernel on GPUs, see
+# experiments/benchmarks/hazard_mode_benchmark.py to measure the crossover for a particular device
+gpu_gather_threshold = 0.05
+
+# Index of the time argument of the kernels which take the current time, set whenever they are enqueued
+time_args = {
+    "people_update_statuses": 12,
+    "people_recv_hazards_update_statuses": 18,
+}
+
+# Index of the params argument of the kernels which use the parameters. It is followed by the params_row argument,
+# the row of the params table for the current time, set whenever they are enqueued (see upload_params_schedule)
+params_args = {
+    "people_update_flows": 7,
+    "people_send_hazards": 10,
+    "people_send_hazards_active": 11,
+    "places_gather_hazards": 11,
+    "people_send_hazards_fused": 9,
+    "people_recv_hazards": 8,
+    "people_update_statuses": 13,
+    "people_recv_hazards_update_statuses": 19,
+}
+
+# Number of work items per compute unit that the kernels which run over the active sets are launched with
+active_work_items_per_compute_unit = 1024
+
+
+def counter_prng_keys(seed, nreplicates):
+    """The Philox key of each replicate for counter-based random numbers from a single seed."""
+    return np.column_stack([np.full(nreplicates, seed), np.arange(nreplicates)]).astype(np.uint32)
+
 
 class Simulator:
     """
@@ -15,107 +55,326 @@ class Simulator:
     and a step() method to execute the kernels to calculate one timestep of the model.
     """
 
-    def __init__(self, snapshot, gpu=True, opencl_dir="microsim/opencl/", num_seed_days=5):
+    def __init__(self, snapshot, gpu=True, opencl_dir="microsim/opencl/", num_seed_days=5, nreplicates=1,
+                 cache_programs=True, hazard_mode="auto", gather_threshold=None, context=None, device=None,
+                 fused=False, active_sets=False, profile=False, local_sizes=None, counter_prngs=False):
         """Initialise OpenCL context, kernels, and buffers for the simulator.
 
         Args:
             snapshot (Snapshot): snapshot containing data and number of places, people and slots
             gpu (bool): Whether to try to use a discrete GPU, set to false to use CPU.
+            nreplicates (int): Number of independent replicates to simulate in a batch. The static people and place
+                buffers are shared, while the buffers named in `replicated_buffers` get one section per replicate.
+            cache_programs (bool): Whether to store compiled kernel binaries in opencl_dir/kernel_cache and reuse them
+                on later runs instead of recompiling.
+            hazard_mode (str): One of `hazard_modes`, how place hazards are accumulated each step.
+            gather_threshold (float): In "auto" mode, the fraction of people who must be infectious (in the most
+                infectious replicate) for the gather kernel to be used instead of the scatter kernel. Defaults to
+                `gpu_gather_threshold` on GPUs, and to never gathering on CPUs, where atomics are rarely contended.
+            context (pyopencl.Context): Optional existing context to create the simulator in, instead of creating one
+                for the first platform with a device of the type chosen by gpu. Used to share a context between the
+                partitions of a PartitionedSimulator.
+            device (pyopencl.Device): The device in context to run on, defaults to the first device of the context.
+            fused (bool): Whether to run each step with the fused kernels, which compute flows on the fly from the
+                baseline flows instead of storing them in people_flows, and receive hazards and update statuses in one
+                pass. The results are identical, but no people_flows buffer is allocated on the device and place
+                hazards are always accumulated with the scatter kernel.
+            active_sets (bool): Whether to build lists of the infectious and susceptible people on the device each
+                step, and run the send and receive kernels over only those people rather than everyone. Can not be
+                combined with fused.
+            profile (bool): Whether to create the command queue with profiling enabled and record the times of every
+                kernel and transfer in `profiler`, see Profiler.
+            local_sizes (dict): The local (work-group) size to launch each kernel with, by kernel name, with global
+                sizes padded to a multiple of it. Kernels which are not given are launched with the driver's choice.
+                Defaults to the sizes found by autotune() for this device, if it has been tuned (see
+                microsim/opencl/ramp/autotune.py), pass an empty dict to always use the driver's choice.
+            counter_prngs (bool): Whether to derive every random draw from a counter-based (Philox) generator keyed by
+                a seed for each replicate, instead of storing a xoshiro128++ state for each person. No people_prngs
+                buffer is allocated on the device, and reseeding only uploads the key of each replicate.
 
         Raises:
             OSError: If a GPU was requested but none is found.
         """
+        if hazard_mode not in hazard_modes:
+            raise ValueError("Unknown hazard mode {}, expected one of {}".format(hazard_mode, hazard_modes))
+        if fused and hazard_mode == "gather":
+            raise ValueError("The gather hazard mode needs stored flows, so can not be used with fused kernels")
+        if fused and active_sets:
+            raise ValueError("Active sets can not be used with fused kernels")
+
         nplaces = snapshot.nplaces
         npeople = snapshot.npeople
         nslots = snapshot.nslots
+        nvisits = snapshot.nvisits
+        # flows are float32, or uint16 if the snapshot's flows are quantised
+        flow_bytes = snapshot.buffers.people_baseline_flows.itemsize
 
         # Create an OpenCL context
-        dev_type = cl.device_type.GPU if gpu else cl.device_type.CPU
-        platform = None
-        for plat in cl.get_platforms():
-            if len(plat.get_devices(dev_type)) > 0:
-                platform = plat
-                break
-        if platform is None:
-            raise OSError("No compatible device found")
-        ctx = cl.Context(dev_type=dev_type, properties=[(cl.context_properties.PLATFORM, platform)])
-        queue = cl.CommandQueue(ctx)
-
-        # Initialise the device buffers
+        if context is None:
+            dev_type = cl.device_type.GPU if gpu else cl.device_type.CPU
+            platform = None
+            for plat in cl.get_platforms():
+                if len(plat.get_devices(dev_type)) > 0:
+                    platform = plat
+                    break
+            if platform is None:
+                raise OSError("No compatible device found")
+            ctx = cl.Context(dev_type=dev_type, properties=[(cl.context_properties.PLATFORM, platform)])
+        else:
+            ctx = context
+        if device is None:
+            device = ctx.get_info(cl.context_info.DEVICES)[0]
+        if context is not None:
+            platform = device.platform
+            gpu = bool(device.type & cl.device_type.GPU)
+        queue = cl.CommandQueue(ctx, device,
+                                properties=cl.command_queue_properties.PROFILING_ENABLE if profile else 0)
+
+        # Initialise the device buffers, per-replicate state gets one section for each replicate
+        def replicated(nbytes):
+            return cl.Buffer(ctx, cl.mem_flags.READ_WRITE, nbytes * nreplicates)
+
         buffers = Buffers(
             place_activities=cl.Buffer(ctx, cl.mem_flags.READ_WRITE, nplaces * 4),
             place_coords=cl.Buffer(ctx, cl.mem_flags.READ_WRITE, nplaces * 8),
-            place_hazards=cl.Buffer(ctx, cl.mem_flags.READ_WRITE, nplaces * 4),
-            place_counts=cl.Buffer(ctx, cl.mem_flags.READ_WRITE, nplaces * 4),
+            place_hazards=replicated(nplaces * 4),
+            place_counts=replicated(nplaces * 4),
 
             people_ages=cl.Buffer(ctx, cl.mem_flags.READ_WRITE, npeople * 2),
             people_obesity=cl.Buffer(ctx, cl.mem_flags.READ_WRITE, npeople * 2),
             people_cvd=cl.Buffer(ctx, cl.mem_flags.READ_WRITE, npeople),
             people_diabetes=cl.Buffer(ctx, cl.mem_flags.READ_WRITE, npeople),
             people_blood_pressure=cl.Buffer(ctx, cl.mem_flags.READ_WRITE, npeople),
-            people_statuses=cl.Buffer(ctx, cl.mem_flags.READ_WRITE, npeople * 4),
-            people_transition_times=cl.Buffer(ctx, cl.mem_flags.READ_WRITE, npeople * 4),
-            people_place_ids=cl.Buffer(ctx, cl.mem_flags.READ_WRITE, npeople * nslots * 4),
-            people_baseline_flows=cl.Buffer(ctx, cl.mem_flags.READ_WRITE, npeople * nslots * 4),
-            people_flows=cl.Buffer(ctx, cl.mem_flags.READ_WRITE, npeople * nslots * 4),
-            people_hazards=cl.Buffer(ctx, cl.mem_flags.READ_WRITE, npeople * 4),
-            people_prngs=cl.Buffer(ctx, cl.mem_flags.READ_WRITE, npeople * 16),
+            people_statuses=replicated(npeople * 4),
+            people_transition_times=replicated(npeople * 4),
+            people_slot_offsets=cl.Buffer(ctx, cl.mem_flags.READ_WRITE, (npeople + 1) * 4),
+            people_place_ids=cl.Buffer(ctx, cl.mem_flags.READ_WRITE, max(nvisits, 1) * 4),
+            people_baseline_flows=cl.Buffer(ctx, cl.mem_flags.READ_WRITE, max(nvisits, 1) * flow_bytes),
+            # fused kernels compute flows on the fly, so only need a placeholder
+            people_flows=cl.Buffer(ctx, cl.mem_flags.READ_WRITE, flow_bytes) if fused else
+            replicated(max(nvisits, 1) * flow_bytes),
+            people_hazards=replicated(npeople * 4),
+            # counter-based random numbers are computed from the prng keys, so only need a placeholder
+            people_prngs=cl.Buffer(ctx, cl.mem_flags.READ_WRITE, 16) if counter_prngs else
+            replicated(npeople * 16),
 
             params=cl.Buffer(ctx, cl.mem_flags.READ_WRITE, Params().num_bytes()),
         )
 
         kernel_dir = os.path.join(opencl_dir, "ramp/kernels/")
 
-        # Load the OpenCL kernel programs
-        with open(os.path.join(kernel_dir, "ramp_ua.cl")) as f:
-            program = cl.Program(ctx, f.read())
-            program.build(options=[f"-I {kernel_dir}"])
+        # Load the OpenCL kernel programs, reusing a previously compiled binary if one is cached
+        kernel_path = os.path.join(kernel_dir, "ramp_ua.cl")
+        build_options = [f"-I {kernel_dir}"]
+        if not gpu:
+            # each work item running over the active sets takes a contiguous chunk of the list on CPUs
+            build_options += ["-D CONTIGUOUS_ACTIVE_CHUNKS"]
+        if counter_prngs:
+            build_options += ["-D COUNTER_PRNG"]
+        if snapshot.flow_scale is not None:
+            # the scale is passed as a hexadecimal float literal so the kernels use exactly the same value
+            build_options += ["-D QUANTISED_FLOWS", f"-D FLOW_SCALE={float(snapshot.flow_scale).hex()}f"]
+        source_hash = ProgramCache.source_hash(kernel_path)
+        if cache_programs:
+            program = ProgramCache(os.path.join(opencl_dir, "kernel_cache")).build(ctx, kernel_path, build_options)
+        else:
+            with open(kernel_path) as f:
+                program = cl.Program(ctx, f.read())
+                program.build(options=build_options)
 
         kernels = Kernels(
             places_reset=program.places_reset,
             people_update_flows=program.people_update_flows,
             people_send_hazards=program.people_send_hazards,
+            people_send_hazards_active=program.people_send_hazards_active,
+            places_gather_hazards=program.places_gather_hazards,
+            places_add_hazards=program.places_add_hazards,
+            people_send_hazards_fused=program.people_send_hazards_fused,
             people_recv_hazards=program.people_recv_hazards,
-            people_update_statuses=program.people_update_statuses)
+            people_recv_hazards_active=program.people_recv_hazards_active,
+            people_update_statuses=program.people_update_statuses,
+            people_recv_hazards_update_statuses=program.people_recv_hazards_update_statuses,
+            people_seed_prngs=program.people_seed_prngs,
+            people_seed_cases=program.people_seed_cases,
+            people_count_statuses=program.people_count_statuses,
+            people_compact_active=program.people_compact_active)
+
+        if local_sizes is None:
+            local_sizes = LocalSizeCache(os.path.join(opencl_dir, "kernel_cache")).load(device, source_hash,
+                                                                                       build_options, npeople)
+            local_sizes = usable_local_sizes(local_sizes, kernels, device)
 
         # Pass data buffers to the kernels using set_args
         kernels.places_reset.set_args(nplaces, buffers.place_hazards, buffers.place_counts)
 
         kernels.people_update_flows.set_args(
-            npeople, nslots, buffers.people_statuses, buffers.people_baseline_flows,
+            npeople, buffers.people_slot_offsets, buffers.people_statuses, buffers.people_baseline_flows,
             buffers.people_flows, buffers.people_place_ids, buffers.place_activities,
-            buffers.params)
+            buffers.params, np.uint32(0))
 
         kernels.people_send_hazards.set_args(
-            npeople, nslots, buffers.people_statuses, buffers.people_place_ids,
+            npeople, nplaces, buffers.people_slot_offsets, buffers.people_statuses, buffers.people_place_ids,
             buffers.people_flows, buffers.people_hazards, buffers.place_hazards,
-            buffers.place_counts, buffers.place_activities, buffers.params)
+            buffers.place_counts, buffers.place_activities, buffers.params, np.uint32(0))
+
+        # The gather kernel finds the visitors of each place from a transposed (place to visit) index of
+        # people_place_ids, which is rebuilt whenever people_place_ids is uploaded
+        visitor_buffers = {
+            "place_visitor_offsets": cl.Buffer(ctx, cl.mem_flags.READ_WRITE, (nplaces + 1) * 4),
+            "place_visitor_flow_ids": cl.Buffer(ctx, cl.mem_flags.READ_WRITE, max(nvisits, 1) * 4),
+            "place_visitor_people_ids": cl.Buffer(ctx, cl.mem_flags.READ_WRITE, max(nvisits, 1) * 4),
+        }
+        cl.enqueue_fill_buffer(queue, visitor_buffers["place_visitor_offsets"], np.uint32(0), 0, (nplaces + 1) * 4)
+        kernels.places_gather_hazards.set_args(
+            npeople, nplaces, buffers.people_slot_offsets, buffers.people_statuses, buffers.people_flows,
+            visitor_buffers["place_visitor_offsets"], visitor_buffers["place_visitor_flow_ids"],
+            visitor_buffers["place_visitor_people_ids"],
+            buffers.place_hazards, buffers.place_counts, buffers.place_activities, buffers.params, np.uint32(0))
 
         kernels.people_recv_hazards.set_args(
-            npeople, nslots, buffers.people_statuses, buffers.people_place_ids,
+            npeople, nplaces, buffers.people_slot_offsets, buffers.people_statuses, buffers.people_place_ids,
             buffers.people_flows, buffers.people_hazards, buffers.place_hazards,
-            buffers.params)
+            buffers.params, np.uint32(0))
+
+        # The key of each replicate's counter-based random numbers, see seed_prngs_on_device()
+        start_prng_keys = counter_prng_keys(0, nreplicates)
+        prng_keys = cl.Buffer(ctx, cl.mem_flags.READ_WRITE, start_prng_keys.nbytes)
+        cl.enqueue_copy(queue, prng_keys, start_prng_keys)
 
         kernels.people_update_statuses.set_args(
             npeople, buffers.people_ages, buffers.people_obesity, buffers.people_cvd, buffers.people_diabetes,
             buffers.people_blood_pressure, buffers.people_hazards, buffers.people_statuses,
-            buffers.people_transition_times, buffers.people_prngs, buffers.params)
+            buffers.people_transition_times, buffers.people_prngs, prng_keys, np.uint32(0), np.uint32(0),
+            buffers.params, np.uint32(0))
+
+        kernels.people_send_hazards_fused.set_args(
+            npeople, nplaces, buffers.people_slot_offsets, buffers.people_statuses, buffers.people_place_ids,
+            buffers.people_baseline_flows, buffers.place_hazards, buffers.place_counts, buffers.place_activities,
+            buffers.params, np.uint32(0))
+
+        kernels.people_recv_hazards_update_statuses.set_args(
+            npeople, nplaces, buffers.people_slot_offsets, buffers.people_place_ids, buffers.people_baseline_flows,
+            buffers.place_activities, buffers.place_hazards, buffers.people_ages, buffers.people_obesity,
+            buffers.people_cvd, buffers.people_diabetes, buffers.people_blood_pressure, buffers.people_hazards,
+            buffers.people_statuses, buffers.people_transition_times, buffers.people_prngs, prng_keys, np.uint32(0),
+            np.uint32(0), buffers.params, np.uint32(0))
+
+        kernels.people_seed_prngs.set_args(npeople, np.uint32(0), np.uint32(0), npeople, buffers.people_prngs)
+
+        # The ids of the people infected on a seeding day, grown to hold the most ids seeded so far
+        seed_people_ids = cl.Buffer(ctx, cl.mem_flags.READ_WRITE, 4)
+        kernels.people_seed_cases.set_args(npeople, np.uint32(0), seed_people_ids, buffers.people_hazards)
+
+        # Histograms of disease statuses are computed on the device, so each step only transfers the counts.
+        # The age and area histograms are only allocated once their bins are provided with set_count_bins()
+        nstatuses = len(DiseaseStatus)
+        count_buffers = {
+            "status_counts": cl.Buffer(ctx, cl.mem_flags.READ_WRITE, nreplicates * nstatuses * 4),
+            "age_status_counts": cl.Buffer(ctx, cl.mem_flags.READ_WRITE, 4),
+            "area_status_counts": cl.Buffer(ctx, cl.mem_flags.READ_WRITE, 4),
+        }
+        count_bin_buffers = {
+            "people_age_bins": cl.Buffer(ctx, cl.mem_flags.READ_WRITE, 1),
+            "people_area_ids": cl.Buffer(ctx, cl.mem_flags.READ_WRITE, 4),
+        }
+        kernels.people_count_statuses.set_args(
+            npeople, np.uint32(0), np.uint32(0), np.uint32(0), buffers.people_statuses,
+            count_bin_buffers["people_age_bins"], count_bin_buffers["people_area_ids"],
+            count_buffers["status_counts"], count_buffers["age_status_counts"], count_buffers["area_status_counts"])
+        count_local_size = min(256, kernels.people_count_statuses.get_work_group_info(
+            cl.kernel_work_group_info.WORK_GROUP_SIZE, device))
+
+        # The active sets list the infectious and susceptible people of each replicate, rebuilt at the start of each
+        # step. The kernels which run over them are launched with a fixed number of work items, since the lengths of
+        # the lists are only known on the device, and each work item loops over part of the list.
+        active_buffers = {}
+        active_global_size = 0
+        if active_sets:
+            active_buffers = {
+                "infectious_people_ids": replicated(npeople * 4),
+                "susceptible_people_ids": replicated(npeople * 4),
+                "active_counts": cl.Buffer(ctx, cl.mem_flags.READ_WRITE, nreplicates * 2 * 4),
+            }
+            kernels.people_compact_active.set_args(
+                npeople, buffers.people_statuses, active_buffers["infectious_people_ids"],
+                active_buffers["susceptible_people_ids"], active_buffers["active_counts"])
+            kernels.people_send_hazards_active.set_args(
+                npeople, nplaces, active_buffers["infectious_people_ids"], active_buffers["active_counts"],
+                buffers.people_slot_offsets, buffers.people_statuses, buffers.people_place_ids, buffers.people_flows,
+                buffers.place_hazards, buffers.place_counts, buffers.place_activities, buffers.params, np.uint32(0))
+            kernels.people_recv_hazards_active.set_args(
+                npeople, nplaces, active_buffers["susceptible_people_ids"], active_buffers["active_counts"],
+                buffers.people_slot_offsets, buffers.people_place_ids, buffers.people_flows, buffers.people_hazards,
+                buffers.place_hazards)
+            active_global_size = max(1, min(npeople, device.max_compute_units * active_work_items_per_compute_unit))
+        compact_local_size = min(256, kernels.people_compact_active.get_work_group_info(
+            cl.kernel_work_group_info.WORK_GROUP_SIZE, device))
+
+        # Keep a pristine device-resident copy of the snapshot's per-replicate state, so the simulator can be reset
+        # to the start of a run with device to device copies instead of new uploads
+        pristine_buffers = {}
+        for name in replicated_buffers:
+            if (fused and name == "people_flows") or (counter_prngs and name == "people_prngs"):
+                continue
+            host_buffer = getattr(snapshot.buffers, name)
+            pristine_buffers[name] = cl.Buffer(ctx, cl.mem_flags.READ_WRITE, host_buffer.nbytes)
+            cl.enqueue_copy(queue, pristine_buffers[name], host_buffer)
 
         self.nplaces = nplaces
         self.npeople = npeople
         self.nslots = nslots
-        self.time = snapshot.time
+        self.nvisits = nvisits
+        self.flow_scale = snapshot.flow_scale
+        self.nreplicates = nreplicates
+        # a copy, as snapshots loaded from files hold the time in an array which would be incremented in place
+        self.time = np.uint32(snapshot.time)
 
         self.platform = platform
         self.ctx = ctx
+        self.device = device
         self.queue = queue
+        self.profiler = Profiler(device.name) if profile else None
     
         self.start_snapshot = snapshot
         self.buffers = buffers
+        self.pristine_buffers = pristine_buffers
         self.kernels = kernels
+        self.visitor_buffers = visitor_buffers
+        # host copy of the slot offsets, needed to rebuild the place visitor index when people_place_ids is uploaded
+        self.people_slot_offsets = np.array(snapshot.buffers.people_slot_offsets, dtype=np.uint32)
+
+        self.hazard_mode = hazard_mode
+        self.fused = fused
+        self.active_sets = active_sets
+        self.active_buffers = active_buffers
+        self.active_global_size = active_global_size
+        self.compact_local_size = compact_local_size
+        if gather_threshold is None:
+            gather_threshold = gpu_gather_threshold if gpu else np.inf
+        self.gather_threshold = gather_threshold
+        self.infectious_fraction = self._snapshot_infectious_fraction(snapshot)
+        self.pending_counts = None
+
+        self.nstatuses = nstatuses
+        self.nage_bins = 0
+        self.nareas = 0
+        self.count_buffers = count_buffers
+        self.count_bin_buffers = count_bin_buffers
+        self.count_local_size = count_local_size
+        self.source_hash = source_hash
+        self.build_options = build_options
+        self.local_sizes = dict(local_sizes)
+        self.counter_prngs = counter_prngs
+        self.prng_keys = prng_keys
+        self.start_prng_keys = start_prng_keys
+        self.seed_people_ids = seed_people_ids
+        # number of rows (days) in the params table, see upload_params_schedule()
+        self.nparams_rows = 1
 
         data_dir = os.path.join(opencl_dir, "data/")
-        self.initial_cases = InitialCases(snapshot.area_codes, snapshot.not_home_probs, data_dir)
+        self.start_initial_cases = InitialCases(snapshot.area_codes, snapshot.not_home_probs, data_dir,
+                                                snapshot.people_order)
+        self.initial_cases = self._copy_initial_cases()
 
         self.num_seed_days = num_seed_days
 
@@ -125,89 +384,621 @@ class Simulator:
 
     def device_name(self):
         """The name of the OpenCL device being used for simulation."""
-        device = self.ctx.get_info(cl.context_info.DEVICES)[0]
-        return device.get_info(cl.device_info.NAME)
+        return self.device.get_info(cl.device_info.NAME)
 
-    def upload(self, name, host_buffer):
-        """Transfers the contents of the provided numpy array to the named OpenCL buffer."""
+    def upload(self, name, host_buffer, replicate=0):
+        """Transfers the contents of the provided numpy array to the named OpenCL buffer. For buffers holding
+        per-replicate state, the replicate argument selects the section which is written."""
         if hasattr(self.buffers, name):
-            cl.enqueue_copy(self.queue, getattr(self.buffers, name), host_buffer)
+            if self.fused and name == "people_flows":
+                # flows are computed from the baseline flows each step
+                return
+            if self.counter_prngs and name == "people_prngs":
+                # random numbers are computed from the prng keys, there are no states to upload
+                return
+            self._record(name, "upload", cl.enqueue_copy(
+                self.queue, getattr(self.buffers, name), host_buffer,
+                device_offset=self._device_offset(name, host_buffer, replicate)))
+            if name == "params":
+                # a single set of parameters is used on every day
+                self.nparams_rows = 1
+            elif name == "people_slot_offsets":
+                self.people_slot_offsets = np.array(host_buffer, dtype=np.uint32)
+            elif name == "people_place_ids":
+                self._upload_place_visitors(host_buffer)
         else:
             raise ValueError("No buffer with name {}".format(name))
 
-    def download(self, name, host_buffer):
-        """Transfers the contents of the named OpenCL buffer to the provided numpy array."""
+    def download(self, name, host_buffer, replicate=0):
+        """Transfers the contents of the named OpenCL buffer to the provided numpy array. For buffers holding
+        per-replicate state, the replicate argument selects the section which is read."""
         if hasattr(self.buffers, name):
-            cl.enqueue_copy(self.queue, host_buffer, getattr(self.buffers, name))
+            if self.fused and name == "people_flows":
+                self._download_fused_flows(host_buffer, replicate)
+                return
+            if self.counter_prngs and name == "people_prngs":
+                host_buffer[:] = 0
+                return
+            self._record(name, "download", cl.enqueue_copy(
+                self.queue, host_buffer, getattr(self.buffers, name),
+                device_offset=self._device_offset(name, host_buffer, replicate)))
         else:
             raise ValueError("No buffer with name {}".format(name))
 
+    def _download_fused_flows(self, host_buffer, replicate):
+        """Download the flows that the fused kernels will compute on the fly in the next step, from the current
+        statuses, by running people_update_flows into a temporary buffer holding the baseline flows (which the empty
+        and extra home slots keep)."""
+        flows = cl.Buffer(self.ctx, cl.mem_flags.READ_WRITE, host_buffer.nbytes * self.nreplicates)
+        for r in range(self.nreplicates):
+            self._record("people_baseline_flows", "copy", cl.enqueue_copy(
+                self.queue, flows, self.buffers.people_baseline_flows, byte_count=host_buffer.nbytes,
+                dest_offset=r * host_buffer.nbytes))
+        kernel = self.kernels.people_update_flows
+        kernel.set_arg(4, flows)
+        self._enqueue_kernel(kernel, (self.npeople, self.nreplicates), None)
+        kernel.set_arg(4, self.buffers.people_flows)
+        self._record("people_flows", "download", cl.enqueue_copy(
+            self.queue, host_buffer, flows, device_offset=replicate * host_buffer.nbytes))
+
+    def _upload_place_visitors(self, people_place_ids):
+        """Rebuild the transposed place to visit index used by the gather kernel from people_place_ids, using the
+        people_slot_offsets which were last uploaded (upload_all uploads the offsets first)."""
+        offsets, flow_ids, people_ids = place_visitor_index(people_place_ids, self.people_slot_offsets, self.nplaces)
+        uploads = [("place_visitor_offsets", offsets)]
+        if flow_ids.shape[0] > 0:
+            uploads += [("place_visitor_flow_ids", flow_ids), ("place_visitor_people_ids", people_ids)]
+        for name, host_buffer in uploads:
+            self._record(name, "upload", cl.enqueue_copy(self.queue, self.visitor_buffers[name], host_buffer))
+
+    def _device_offset(self, name, host_buffer, replicate):
+        """Byte offset of a replicate's section within the named buffer."""
+        if replicate == 0:
+            return 0
+        if name not in replicated_buffers:
+            raise ValueError("Buffer {} is shared between replicates".format(name))
+        if not 0 <= replicate < self.nreplicates:
+            raise ValueError("Replicate {} out of range for {} replicates".format(replicate, self.nreplicates))
+        return replicate * host_buffer.nbytes
+
     def upload_all(self, host_buffers):
-        """Upload to every device buffer, errors if host_buffers is missing a field.
+        """Upload to every device buffer, errors if host_buffers is missing a field. Per-replicate state is
+        copied into every replicate.
 
         Args:
             host_buffers: A Buffers namedtuple containing numpy arrays.
         """
         for name in Buffers._fields:
-            self.upload(name, getattr(host_buffers, name))
+            replicates = range(self.nreplicates) if name in replicated_buffers else [0]
+            for replicate in replicates:
+                self.upload(name, getattr(host_buffers, name), replicate)
 
-    def download_all(self, host_buffers):
+    def download_all(self, host_buffers, replicate=0):
         """Downloads every device buffer, errors if host_buffers is missing a field.
 
         Args:
             host_buffers: A dict of string names to numpy buffers.
+            replicate: The replicate to read per-replicate state from.
         """
         for name in Buffers._fields:
-            self.download(name, getattr(host_buffers, name))
+            self.download(name, getattr(host_buffers, name), replicate if name in replicated_buffers else 0)
+
+    def allocate_state(self):
+        """Host arrays in pinned (page-locked) memory to hold the state of every replicate, for
+        enqueue_download_state() and upload_state(). These are the per-replicate buffers, with one row for each
+        replicate, and the prng keys when using counter-based random numbers. Flows computed on the fly by the fused
+        kernels are not part of the state."""
+        state = {}
+        for name in self.pristine_buffers:
+            host_buffer = getattr(self.start_snapshot.buffers, name)
+            state[name] = self._pinned_array((self.nreplicates, host_buffer.size), host_buffer.dtype)
+        if self.counter_prngs:
+            state["prng_keys"] = self._pinned_array(self.start_prng_keys.shape, self.start_prng_keys.dtype)
+        return state
+
+    def _pinned_array(self, shape, dtype):
+        """A numpy array of host memory allocated by the OpenCL driver, which can be transferred to and from the
+        device without being copied into a staging buffer first. The memory stays mapped while the array is alive."""
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        buffer = cl.Buffer(self.ctx, cl.mem_flags.READ_WRITE | cl.mem_flags.ALLOC_HOST_PTR, nbytes)
+        array, _ = cl.enqueue_map_buffer(self.queue, buffer, cl.map_flags.READ | cl.map_flags.WRITE, 0, shape, dtype)
+        return array
+
+    def enqueue_download_state(self, state, wait_for=None):
+        """Download the state of every replicate into host arrays from allocate_state() without blocking. Returns
+        the events of the downloads, the arrays must not be read until they have completed."""
+        events = []
+        for name, host_array in state.items():
+            device_buffer = self.prng_keys if name == "prng_keys" else getattr(self.buffers, name)
+            events.append(self._record(name, "download", cl.enqueue_copy(
+                self.queue, host_array, device_buffer, is_blocking=False, wait_for=wait_for)))
+        return events
+
+    def upload_state(self, state):
+        """Upload the state of every replicate from host arrays like those from allocate_state(), eg. to resume from
+        a checkpoint."""
+        for name, host_array in state.items():
+            if name == "prng_keys":
+                self._record(name, "upload", cl.enqueue_copy(self.queue, self.prng_keys,
+                                                             np.ascontiguousarray(host_array, dtype=np.uint32)))
+                continue
+            for replicate in range(self.nreplicates):
+                self.upload(name, np.ascontiguousarray(host_array[replicate]), replicate)
+
+    def save_fork_point(self, fork_point=None):
+        """Copy the state of every replicate into device buffers with device to device copies, so that several
+        variants of a run (eg. scenarios) can each continue from this point with fork(), without simulating the days
+        before it again. Flows computed on the fly by the fused kernels are not part of the state.
+
+        Args:
+            fork_point: Optional fork point from an earlier call, whose device buffers are reused.
+
+        Returns:
+            The fork point, a dict of the device copies of the per-replicate buffers and the host state of the run.
+        """
+        fork_buffers = {} if fork_point is None else fork_point["buffers"]
+        device_buffers = {name: getattr(self.buffers, name) for name in self.pristine_buffers}
+        if self.counter_prngs:
+            device_buffers["prng_keys"] = self.prng_keys
+        for name, device_buffer in device_buffers.items():
+            if name not in fork_buffers:
+                fork_buffers[name] = cl.Buffer(self.ctx, cl.mem_flags.READ_WRITE, device_buffer.size)
+            self._record(name, "copy", cl.enqueue_copy(self.queue, fork_buffers[name], device_buffer))
+        return {
+            "buffers": fork_buffers,
+            "time": self.time,
+            "infectious_fraction": self.infectious_fraction,
+            "initial_cases": [copy.copy(initial_cases) for initial_cases in self.initial_cases],
+            "numpy_random_state": np.random.get_state(),
+        }
+
+    def fork(self, fork_point, seed=None):
+        """Return every replicate to the state saved by save_fork_point() with device to device copies. Static
+        buffers are left untouched, so a variant of the run can change them (or the params) before continuing.
+
+        Args:
+            fork_point: The fork point to continue from.
+            seed: Optional integer seed. If provided, every replicate is given fresh random states generated on the
+                device from this seed, and the initial cases still to be chosen are reshuffled with a numpy
+                RandomState seeded from it and the replicate (see InitialCases.reseed), so the run continues with
+                random numbers independent of those of other forks. numpy's global random state is seeded too.
+                Otherwise numpy's random state is restored, and the run continues with the random numbers it would
+                have had without forking.
+        """
+        for name, fork_buffer in fork_point["buffers"].items():
+            device_buffer = self.prng_keys if name == "prng_keys" else getattr(self.buffers, name)
+            self._record(name, "copy", cl.enqueue_copy(self.queue, device_buffer, fork_buffer))
+        self.time = fork_point["time"]
+        self.infectious_fraction = fork_point["infectious_fraction"]
+        self.pending_counts = None
+        self.initial_cases = [copy.copy(initial_cases) for initial_cases in fork_point["initial_cases"]]
+        if seed is not None:
+            self.seed_prngs_on_device(seed)
+            reseed_initial_cases(self.initial_cases, seed)
+            np.random.seed(seed)
+        else:
+            np.random.set_state(fork_point["numpy_random_state"])
+
+    def seed_prngs(self, seeds):
+        """Gives each replicate its own random states, generated on the host in the same way as
+        Snapshot.seed_prngs, and its own numpy RandomState to choose initial cases with, so a replicate seeded with
+        `seed` matches a single simulation seeded with `seed`. The RandomState continues from the random states, so
+        the initial cases are also those chosen after Snapshot.seed_prngs(seed) seeded numpy's global random state.
+
+        Args:
+            seeds: A sequence with one integer seed per replicate.
+        """
+        if len(seeds) != self.nreplicates:
+            raise ValueError("Expected {} seeds but got {}".format(self.nreplicates, len(seeds)))
+        random_states = [np.random.RandomState(seed) for seed in seeds]
+        for initial_cases, random_state in zip(self.initial_cases, random_states):
+            initial_cases.random_state = random_state
+        if self.counter_prngs:
+            keys = np.column_stack([seeds, np.zeros(self.nreplicates)]).astype(np.uint32)
+            self._record("prng_keys", "upload", cl.enqueue_copy(self.queue, self.prng_keys, keys))
+            return
+        for replicate, random_state in enumerate(random_states):
+            prngs = random_state.randint(np.uint32((1 << 32) - 1), size=self.npeople * 4, dtype=np.uint32)
+            self.upload("people_prngs", prngs, replicate)
+
+    def reset(self, snapshot=None, seed=None):
+        """Return every replicate to the start of the simulation, ready for another run without recreating the
+        OpenCL context, program or buffers.
+
+        Per-replicate state is restored with device to device copies from the pristine copy of the start snapshot
+        held on the device. Static buffers are left untouched (any changes to them must be uploaded explicitly).
+
+        Args:
+            snapshot: Optional new start snapshot with the same dimensions as the current one. If provided, all of
+                its buffers are uploaded and it becomes the state that later resets return to.
+            seed: Optional integer seed. If provided, every replicate is given fresh random states generated on the
+                device from this seed, and numpy's global random state (used to choose initial cases) is seeded.
+        """
+        if snapshot is not None:
+            if (snapshot.nplaces, snapshot.npeople, snapshot.nvisits) != (self.nplaces, self.npeople, self.nvisits):
+                raise ValueError("Snapshot dimensions do not match the simulator")
+            if snapshot.flow_scale != self.flow_scale:
+                raise ValueError("Snapshot flow quantisation does not match the simulator")
+            for name in Buffers._fields:
+                host_buffer = getattr(snapshot.buffers, name)
+                if name in self.pristine_buffers:
+                    self._record(name, "upload", cl.enqueue_copy(self.queue, self.pristine_buffers[name], host_buffer))
+                else:
+                    self.upload(name, host_buffer)
+            self.start_snapshot = snapshot
+
+        for name, pristine_buffer in self.pristine_buffers.items():
+            nbytes = pristine_buffer.size
+            for replicate in range(self.nreplicates):
+                self._record(name, "copy", cl.enqueue_copy(self.queue, getattr(self.buffers, name), pristine_buffer,
+                                                           byte_count=nbytes, dest_offset=replicate * nbytes))
+        if self.counter_prngs:
+            self._record("prng_keys", "upload", cl.enqueue_copy(self.queue, self.prng_keys, self.start_prng_keys))
+
+        if seed is not None:
+            self.seed_prngs_on_device(seed)
+            np.random.seed(seed)
+
+        self.time = np.uint32(self.start_snapshot.time)
+        self.infectious_fraction = self._snapshot_infectious_fraction(self.start_snapshot)
+        self.pending_counts = None
+        self.initial_cases = self._copy_initial_cases()
+        self.queue.finish()
+
+    def upload_params_schedule(self, params_schedule):
+        """Upload the parameters of every day at once, so parameters which change over time (eg. the lockdown
+        multiplier) need no uploads while running. Each step uses the row of the current time, and the last row once
+        the time is past the end of the schedule. Uploading "params" replaces the schedule with a single row.
+
+        Args:
+            params_schedule: 2D numpy array with the Params.asarray() of each day, see params.params_schedule().
+        """
+        params_schedule = np.ascontiguousarray(params_schedule, dtype=np.float32)
+        if params_schedule.ndim != 2 or params_schedule.shape[0] == 0 or \
+                params_schedule.shape[1] != sum(size for _, size in params_layout):
+            raise ValueError("Expected a 2D array with one row of parameters for each day")
+        if params_schedule.nbytes > self.buffers.params.size:
+            # the kernels read the table from a larger buffer, the old one is released once they are done with it
+            self.buffers = self.buffers._replace(
+                params=cl.Buffer(self.ctx, cl.mem_flags.READ_WRITE, params_schedule.nbytes))
+            for name, index in params_args.items():
+                getattr(self.kernels, name).set_arg(index, self.buffers.params)
+        self._record("params", "upload", cl.enqueue_copy(self.queue, self.buffers.params, params_schedule))
+        self.nparams_rows = params_schedule.shape[0]
+
+    def rebind(self, params):
+        """Upload a new set of parameters, e.g. between calibration runs.
+
+        Args:
+            params: A Params object.
+        """
+        self.upload("params", params.asarray())
+
+    def seed_prngs_on_device(self, seed):
+        """Regenerate the random states of every person in every replicate on the device from a single seed. With
+        counter-based random numbers only the key of each replicate is uploaded."""
+        if self.counter_prngs:
+            self._record("prng_keys", "upload", cl.enqueue_copy(
+                self.queue, self.prng_keys, counter_prng_keys(seed, self.nreplicates)))
+            return
+        self.kernels.people_seed_prngs.set_arg(1, np.uint32(seed))
+        self.step_kernel("people_seed_prngs")
+
+    def set_first_person(self, first_person, npeople_total):
+        """Draw the random numbers of the people in this simulator as if they were people first_person onwards of a
+        population of npeople_total, eg. for a partition of a PartitionedSimulator."""
+        self.kernels.people_seed_prngs.set_arg(2, np.uint32(first_person))
+        self.kernels.people_seed_prngs.set_arg(3, np.uint32(npeople_total))
+        self.kernels.people_update_statuses.set_arg(11, np.uint32(first_person))
+        self.kernels.people_recv_hazards_update_statuses.set_arg(17, np.uint32(first_person))
+
+    def _copy_initial_cases(self):
+        """Each replicate draws its seed infections independently, so needs its own pool of candidates."""
+        return [copy.copy(self.start_initial_cases) for _ in range(self.nreplicates)]
+
+    def set_count_bins(self, people_age_bins, nage_bins, people_area_ids, nareas):
+        """Upload the age bin and area of every person, enabling the detailed counts in count_statuses().
+
+        Args:
+            people_age_bins: numpy array with the age bin index of each person.
+            nage_bins: number of age bins.
+            people_area_ids: numpy array with the integer area id of each person.
+            nareas: number of areas.
+        """
+        people_age_bins = people_age_bins.astype(np.uint8)
+        people_area_ids = people_area_ids.astype(np.uint32)
+        self.count_bin_buffers = {
+            "people_age_bins": cl.Buffer(self.ctx, cl.mem_flags.READ_ONLY | cl.mem_flags.COPY_HOST_PTR,
+                                         hostbuf=people_age_bins),
+            "people_area_ids": cl.Buffer(self.ctx, cl.mem_flags.READ_ONLY | cl.mem_flags.COPY_HOST_PTR,
+                                         hostbuf=people_area_ids),
+        }
+        self.count_buffers["age_status_counts"] = cl.Buffer(
+            self.ctx, cl.mem_flags.READ_WRITE, self.nreplicates * self.nstatuses * nage_bins * 4)
+        self.count_buffers["area_status_counts"] = cl.Buffer(
+            self.ctx, cl.mem_flags.READ_WRITE, self.nreplicates * self.nstatuses * nareas * 4)
+        self.nage_bins = nage_bins
+        self.nareas = nareas
+
+        kernel = self.kernels.people_count_statuses
+        kernel.set_arg(1, np.uint32(nage_bins))
+        kernel.set_arg(2, np.uint32(nareas))
+        kernel.set_arg(5, self.count_bin_buffers["people_age_bins"])
+        kernel.set_arg(6, self.count_bin_buffers["people_area_ids"])
+        kernel.set_arg(8, self.count_buffers["age_status_counts"])
+        kernel.set_arg(9, self.count_buffers["area_status_counts"])
+
+    def count_statuses(self, detailed=False):
+        """Count the people in each disease status on the device and download only the counts.
+
+        Args:
+            detailed: whether to also count statuses by age bin and area, requires set_count_bins() to be called first.
+
+        Returns:
+            A tuple (total_counts, age_counts, area_counts) of uint32 numpy arrays of shape (nreplicates, nstatuses),
+            (nreplicates, nstatuses, nage_bins) and (nreplicates, nstatuses, nareas). The age and area counts are
+            None if detailed is False.
+        """
+        total_counts, age_counts, area_counts = self.allocate_counts(detailed)
+        self.enqueue_count_statuses(total_counts, age_counts, area_counts).wait()
+        self.infectious_fraction = self._infectious_fraction(total_counts)
+        self.pending_counts = None
+        return total_counts, age_counts, area_counts
+
+    def allocate_counts(self, detailed=False):
+        """Host arrays to hold the counts downloaded by enqueue_count_statuses(), see count_statuses()."""
+        total_counts = np.zeros((self.nreplicates, self.nstatuses), dtype=np.uint32)
+        if not detailed:
+            return total_counts, None, None
+        age_counts = np.zeros((self.nreplicates, self.nstatuses, self.nage_bins), dtype=np.uint32)
+        area_counts = np.zeros((self.nreplicates, self.nstatuses, self.nareas), dtype=np.uint32)
+        return total_counts, age_counts, area_counts
+
+    def enqueue_count_statuses(self, total_counts, age_counts=None, area_counts=None):
+        """Enqueue counting the people in each disease status on the device, and non-blocking downloads of the counts
+        into host arrays from allocate_counts(). The counts are detailed if age_counts and area_counts are given.
+
+        Returns:
+            The event of the last download, the host arrays must not be read or reused until it is complete.
+        """
+        detailed = age_counts is not None and area_counts is not None
+        if detailed and self.nage_bins == 0:
+            raise ValueError("Detailed counts require set_count_bins() to be called first")
+
+        names = ["status_counts", "age_status_counts", "area_status_counts"] if detailed else ["status_counts"]
+        for name in names:
+            buffer = self.count_buffers[name]
+            self._record(name, "fill", cl.enqueue_fill_buffer(self.queue, buffer, np.uint32(0), 0, buffer.size))
+
+        kernel = self.kernels.people_count_statuses
+        kernel.set_arg(3, np.uint32(detailed))
+        local_size = self.count_local_size
+        global_size = (local_size * ((self.npeople + local_size - 1) // local_size), self.nreplicates)
+        self._enqueue_kernel(kernel, global_size, (local_size, 1))
+
+        event = self._record("status_counts", "download", cl.enqueue_copy(
+            self.queue, total_counts, self.count_buffers["status_counts"], is_blocking=False))
+        self.pending_counts = (event, total_counts)
+        if detailed:
+            self._record("age_status_counts", "download", cl.enqueue_copy(
+                self.queue, age_counts, self.count_buffers["age_status_counts"], is_blocking=False))
+            event = self._record("area_status_counts", "download", cl.enqueue_copy(
+                self.queue, area_counts, self.count_buffers["area_status_counts"], is_blocking=False))
+        return event
+
+    def _infectious_fraction(self, total_counts):
+        """The largest fraction of people who are infectious in any replicate, from counts of each status."""
+        infectious = [DiseaseStatus.Presymptomatic.value, DiseaseStatus.Asymptomatic.value,
+                      DiseaseStatus.Symptomatic.value]
+        total_counts = np.atleast_2d(total_counts)
+        return float(total_counts[:, infectious].sum(axis=1).max()) / max(self.npeople, 1)
+
+    def _snapshot_infectious_fraction(self, snapshot):
+        counts = np.bincount(snapshot.buffers.people_statuses, minlength=len(DiseaseStatus))
+        return self._infectious_fraction(counts)
+
+    def _update_pending_infectious_fraction(self):
+        """Take the infectious fraction from the counts of the last enqueue_count_statuses() once they have been
+        downloaded, without waiting for them."""
+        if self.pending_counts is None:
+            return
+        event, total_counts = self.pending_counts
+        if event.command_execution_status == cl.command_execution_status.COMPLETE:
+            self.infectious_fraction = self._infectious_fraction(total_counts)
+            self.pending_counts = None
+
+    def uses_gather(self):
+        """Whether the next step will accumulate place hazards with the gather kernel rather than the scatter kernel.
+        In "auto" mode this is based on the infectious fraction from the last call to count_statuses() (or from the
+        start snapshot, before the first count), since the cost of the scatter kernel grows with the number of
+        infectious people while the cost of the gather kernel does not."""
+        if self.fused:
+            return False
+        if self.hazard_mode == "auto":
+            self._update_pending_infectious_fraction()
+            return self.infectious_fraction >= self.gather_threshold
+        return self.hazard_mode == "gather"
 
     def step(self):
         """Choose whether to run the normal step function or the one for initial case seeding"""
         if self.time < self.num_seed_days:
-            self.step_with_seeding()
+            self.step_with_seeding().wait()
         else:
             self.step_all_kernels()
 
     def step_all_kernels(self):
         """Runs each kernel in order and updates the time. Blocks until complete."""
-        reset_event = cl.enqueue_nd_range_kernel(
-            self.queue, self.kernels.places_reset, (self.nplaces,), None)
-        update_flows_event = cl.enqueue_nd_range_kernel(
-            self.queue, self.kernels.people_update_flows, (self.npeople,), None)
-        event = cl.enqueue_nd_range_kernel(
-            self.queue, self.kernels.people_send_hazards, (self.npeople,), None,
-            wait_for=[reset_event, update_flows_event])
-        event = cl.enqueue_nd_range_kernel(
-            self.queue, self.kernels.people_recv_hazards, (self.npeople,), None, wait_for=[event])
-        event = cl.enqueue_nd_range_kernel(
-            self.queue, self.kernels.people_update_statuses, (self.npeople,), None, wait_for=[event])
+        event = self.enqueue_send_hazards()
+        event = self.enqueue_recv_hazards(wait_for=[event])
         event.wait()
         self.time += np.uint32(1)
 
+    def enqueue_step(self, params=None):
+        """Enqueue a step without waiting for it to finish, for pipelined runs (see run_headless), and update the time.
+        Steps during initial case seeding choose the cases on the host and only upload their ids.
+
+        Args:
+            params: Optional numpy array from Params.asarray() which is uploaded before the step, without blocking.
+                It must not be modified until the step is complete.
+
+        Returns:
+            The event of the last kernel.
+        """
+        wait_for = None
+        if params is not None:
+            wait_for = [self._record("params", "upload", cl.enqueue_copy(
+                self.queue, self.buffers.params, params, is_blocking=False))]
+            self.nparams_rows = 1
+        if self.time < self.num_seed_days:
+            return self.step_with_seeding(wait_for=wait_for)
+        event = self.enqueue_send_hazards(wait_for=wait_for)
+        event = self.enqueue_recv_hazards(wait_for=[event])
+        self.time += np.uint32(1)
+        return event
+
+    def enqueue_send_hazards(self, wait_for=None):
+        """Enqueue the first half of a step, which updates the flows and accumulates the hazards of places. Returns
+        the event of the last kernel."""
+        places_dims = (self.nplaces, self.nreplicates)
+        people_dims = (self.npeople, self.nreplicates)
+        if self.fused:
+            reset_event = self._enqueue_kernel(self.kernels.places_reset, places_dims, None, wait_for=wait_for)
+            return self._enqueue_kernel(self.kernels.people_send_hazards_fused, people_dims, None,
+                                        wait_for=[reset_event])
+        update_flows_event = self._enqueue_kernel(self.kernels.people_update_flows, people_dims, None,
+                                                  wait_for=wait_for)
+        if self.active_sets:
+            update_flows_event = self._enqueue_compact_active(wait_for=[update_flows_event])
+        if self.uses_gather():
+            return self._enqueue_kernel(self.kernels.places_gather_hazards, places_dims, None,
+                                        wait_for=[update_flows_event])
+        reset_event = self._enqueue_kernel(self.kernels.places_reset, places_dims, None, wait_for=wait_for)
+        if self.active_sets:
+            return self._enqueue_kernel(self.kernels.people_send_hazards_active,
+                                        (self.active_global_size, self.nreplicates), None,
+                                        wait_for=[reset_event, update_flows_event])
+        return self._enqueue_kernel(self.kernels.people_send_hazards, people_dims, None,
+                                    wait_for=[reset_event, update_flows_event])
+
+    def _enqueue_compact_active(self, wait_for=None):
+        """Enqueue rebuilding the lists of infectious and susceptible people from the current statuses."""
+        active_counts = self.active_buffers["active_counts"]
+        fill_event = self._record("active_counts", "fill", cl.enqueue_fill_buffer(
+            self.queue, active_counts, np.uint32(0), 0, active_counts.size, wait_for=wait_for))
+        local_size = self.compact_local_size
+        global_size = (local_size * ((self.npeople + local_size - 1) // local_size), self.nreplicates)
+        return self._enqueue_kernel(self.kernels.people_compact_active, global_size, (local_size, 1),
+                                    wait_for=[fill_event])
+
+    def enqueue_recv_hazards(self, wait_for=None):
+        """Enqueue the second half of a step, where people receive hazards from places and update their statuses.
+        Returns the event of the last kernel."""
+        people_dims = (self.npeople, self.nreplicates)
+        if self.fused:
+            return self._enqueue_kernel(self.kernels.people_recv_hazards_update_statuses, people_dims, None,
+                                        wait_for=wait_for)
+        if self.active_sets:
+            event = self._enqueue_kernel(self.kernels.people_recv_hazards_active,
+                                         (self.active_global_size, self.nreplicates), None, wait_for=wait_for)
+        else:
+            event = self._enqueue_kernel(self.kernels.people_recv_hazards, people_dims, None, wait_for=wait_for)
+        return self._enqueue_kernel(self.kernels.people_update_statuses, people_dims, None, wait_for=[event])
+
+    def _enqueue_kernel(self, kernel, global_size, local_size, wait_for=None):
+        """Enqueue a kernel, recording it with the profiler if profiling. Kernels launched without a local size use
+        their size from local_sizes, if any, with the global size padded to a multiple of it. Kernels in time_args are
+        given the current time, and kernels in params_args the row of the params table for it. Returns the event."""
+        name = kernel.function_name
+        if name in time_args:
+            kernel.set_arg(time_args[name], np.uint32(self.time))
+        if name in params_args:
+            kernel.set_arg(params_args[name] + 1, np.uint32(min(self.time, self.nparams_rows - 1)))
+        if local_size is None and name in self.local_sizes:
+            local_size = (self.local_sizes[name], 1)
+            global_size = (padded_size(global_size[0], local_size[0]), global_size[1])
+        event = cl.enqueue_nd_range_kernel(self.queue, kernel, global_size, local_size, wait_for=wait_for)
+        return self._record(name, "kernel", event)
+
+    def _record(self, name, kind, event):
+        """Record the event of a command with the profiler if profiling. Returns the event."""
+        if self.profiler is not None:
+            self.profiler.record(name, kind, self.time, event)
+        return event
+
     def step_kernel(self, name):
         """Run a single kernel specified by name. NB: this is intended only to be used for testing."""
         if hasattr(self.kernels, name):
-            dims = (self.nplaces,) if name == "places_reset" else (self.npeople,)
-            event = cl.enqueue_nd_range_kernel(self.queue, getattr(self.kernels, name), dims, None)
+            dims = (self.nplaces if name.startswith("places_") else self.npeople, self.nreplicates)
+            event = self._enqueue_kernel(getattr(self.kernels, name), dims, None)
             event.wait()
         else:
             raise ValueError("No kernel with name {}".format(name))
 
-    def step_with_seeding(self):
-        """For initial case seeding: sets a number of people infected based on the initial cases data, then runs only
-        the kernel which updates people statuses."""
-        max_hazard_val = np.finfo(np.float32).max
-
-        people_hazards = np.zeros(self.npeople, dtype=np.float32)
-
-        initial_case_ids = self.initial_cases.get_seed_people_ids_for_day(self.time)
-
-        # set hazard to maximum float val, so these people will have infection_prob=1
-        # and will transition to exposed state
-        people_hazards[initial_case_ids] = max_hazard_val
+    def step_with_seeding(self, wait_for=None):
+        """For initial case seeding: infects a number of people chosen from the initial cases data, then runs only
+        the kernel which updates people statuses, and updates the time. Returns the event of the last kernel without
+        waiting for it."""
+        seed_people_ids = [initial_cases.get_seed_people_ids_for_day(self.time)
+                           for initial_cases in self.initial_cases]
+        event = self.enqueue_seed_cases(seed_people_ids, wait_for=wait_for)
+        self.time += np.uint32(1)
+        return event
 
-        self.upload("people_hazards", people_hazards)
+    def enqueue_seed_cases(self, seed_people_ids, wait_for=None):
+        """Enqueue infecting the given people of each replicate and then updating the statuses of everyone. The
+        hazards are zeroed on the device and only the ids are uploaded, so seeding costs about as much as a normal
+        step.
 
-        # run only the update statuses kernel so that people transition through disease states
-        self.step_kernel("people_update_statuses")
-        self.time += np.uint32(1)
+        Args:
+            seed_people_ids: a sequence with an array of the ids of the people to infect in each replicate.
+            wait_for: optional events to wait for before zeroing the hazards.
 
+        Returns:
+            The event of the last kernel.
+        """
+        people_hazards = self.buffers.people_hazards
+        event = self._record("people_hazards", "fill", cl.enqueue_fill_buffer(
+            self.queue, people_hazards, np.float32(0), 0, people_hazards.size, wait_for=wait_for))
+        nseeds = max(len(ids) for ids in seed_people_ids)
+        if nseeds > 0:
+            # the ids of every replicate are padded to the same length with npeople, which the kernel skips
+            host_ids = np.full((self.nreplicates, nseeds), self.npeople, dtype=np.uint32)
+            for replicate, ids in enumerate(seed_people_ids):
+                host_ids[replicate, :len(ids)] = ids
+            if self.seed_people_ids.size < host_ids.nbytes:
+                self.seed_people_ids = cl.Buffer(self.ctx, cl.mem_flags.READ_WRITE, host_ids.nbytes)
+                self.kernels.people_seed_cases.set_arg(2, self.seed_people_ids)
+            upload_event = self._record("seed_people_ids", "upload", cl.enqueue_copy(
+                self.queue, self.seed_people_ids, host_ids, is_blocking=False))
+            self.kernels.people_seed_cases.set_arg(1, np.uint32(nseeds))
+            event = self._enqueue_kernel(self.kernels.people_seed_cases, (nseeds, self.nreplicates), None,
+                                         wait_for=[event, upload_event])
+        return self._enqueue_kernel(self.kernels.people_update_statuses, (self.npeople, self.nreplicates), None,
+                                    wait_for=[event])
+
+
+def reseed_initial_cases(initial_cases, seed):
+    """Give the initial cases of each replicate a numpy RandomState seeded from the seed and the replicate, reshuffling
+    the people still to be chosen (see InitialCases.reseed)."""
+    for replicate, replicate_initial_cases in enumerate(initial_cases):
+        replicate_initial_cases.reseed(np.random.RandomState([seed, replicate]))
+
+
+def place_visitor_index(people_place_ids, people_slot_offsets, nplaces):
+    """
+    Transpose people_place_ids into a compressed sparse row index of the visits made to each place. Returns
+    (offsets, flow_ids, people_ids), where flow_ids[offsets[p]:offsets[p + 1]] are the slot indices of the visits to
+    place p, in order of person, and people_ids the person making each of those visits. Empty slots are skipped.
+    """
+    people_place_ids = np.asarray(people_place_ids)
+    slot_counts = np.diff(np.asarray(people_slot_offsets, dtype=np.int64))
+    slot_people_ids = np.repeat(np.arange(slot_counts.shape[0], dtype=np.uint32), slot_counts)
+
+    flow_ids = np.flatnonzero(people_place_ids != sentinel_value)
+    place_ids = people_place_ids[flow_ids].astype(np.int64)
+
+    order = np.argsort(place_ids, kind="stable")
+    offsets = np.zeros(nplaces + 1, dtype=np.uint32)
+    offsets[1:] = np.cumsum(np.bincount(place_ids, minlength=nplaces))
+    flow_ids = flow_ids[order]
+    return offsets, flow_ids.astype(np.uint32), slot_people_ids[flow_ids]
@@ -1,20 +1,40 @@
+import json
+import os
+
 import numpy as np
 
-from microsim.opencl.ramp.buffers import Buffers
-from microsim.opencl.ramp.params import Params
+from microsim.opencl.ramp import locality
+from microsim.opencl.ramp.buffers import Buffers, slot_buffers
+from microsim.opencl.ramp.params import Params, params_layout, infer_params_layout, migrate_params_array
+
+# Version of the snapshot file formats, increment when the layout of the files or manifest changes.
+# Version 1 introduced snapshot directories, version 2 added the params layout, version 3 added people_slot_offsets
+# (older snapshots all use the fixed slot layout), version 4 added quantised flows. Snapshots without a version are
+# treated as version 0.
+snapshot_format_version = 4
+snapshot_manifest_filename = "manifest.json"
 
 
 class Snapshot:
     """
-    Thin wrapper around the .npz file format for saving/loading snapshots.
+    Thin wrapper around the file formats for saving/loading snapshots.
     This enables loading existing snapshots from file, or generating new snapshots full of random data or zeros.
+    Snapshots are either stored as a single .npz file, or as a directory with one uncompressed .npy file per array and
+    a JSON manifest. The directory format is memory-mapped when loaded, so buffers are only read from disk when they
+    are used and many processes loading the same snapshot share the page-cached file contents.
+    The slots (places visited by each person) are either in a fixed layout, with nslots slots per person padded with
+    sentinel values, or packed into a CSR layout with only the used slots (see pack_slots()). In both cases the slots
+    of person i are entries people_slot_offsets[i] to people_slot_offsets[i + 1] of the slot buffers, and nslots is
+    the maximum number of slots per person.
+    Flows are stored as float32, or optionally quantised to 16 bit fixed point with a per-snapshot flow_scale (see
+    quantise_flows()).
     It also has a function for seeding initial infections in the population.
     Each snapshot consists of the data buffers used by OpenCL, as well as additional static data about the population
     which is not used in the runtime simulation but may be used for seeding infections at the snapshot stage.
     """
 
     def __init__(self, nplaces, npeople, nslots, time, area_codes, not_home_probs, lockdown_multipliers, buffers,
-                 name="cache"):
+                 name="cache", people_order=None, place_order=None, flow_scale=None):
         self.name = name
         self.nplaces = nplaces
         self.npeople = npeople
@@ -24,6 +44,11 @@ class Snapshot:
         self.not_home_probs = not_home_probs
         self.lockdown_multipliers = lockdown_multipliers
         self.buffers = buffers
+        # If the people or places have been reordered (see reorder()), the original id of each person or place
+        self.people_order = people_order
+        self.place_order = place_order
+        # If the flows are quantised, the flow represented by each unit of the stored uint16 values
+        self.flow_scale = flow_scale
 
     @classmethod
     def zeros(cls, nplaces, npeople, nslots):
@@ -50,6 +75,7 @@ class Snapshot:
             people_blood_pressure=np.zeros(npeople, dtype=np.uint8),
             people_statuses=np.zeros(npeople, dtype=np.uint32),
             people_transition_times=np.zeros(npeople, dtype=np.uint32),
+            people_slot_offsets=fixed_slot_offsets(npeople, nslots),
             people_place_ids=np.zeros(npeople * nslots, dtype=np.uint32),
             people_baseline_flows=np.zeros(npeople * nslots, dtype=np.float32),
             people_flows=np.zeros(npeople * nslots, dtype=np.float32),
@@ -62,8 +88,9 @@ class Snapshot:
         return cls(nplaces, npeople, nslots, time, area_codes, not_home_probs, lockdown_multipliers, buffers)
 
     @classmethod
-    def random(cls, nplaces, npeople, nslots, lat=50.7, lon=-3.5):
-        """Generates a random snapshot for testing in a 1 degree square around lat/lon."""
+    def random(cls, nplaces, npeople, nslots, lat=50.7, lon=-3.5, sparse=False):
+        """Generates a random snapshot for testing in a 1 degree square around lat/lon. If sparse is set, each person
+        visits a random number (at least one) of random places, with the rest of their slots empty."""
         nplaces = np.uint32(nplaces)
         npeople = np.uint32(npeople)
         nslots = np.uint32(nslots)
@@ -86,6 +113,7 @@ class Snapshot:
             people_blood_pressure=np.zeros(npeople, dtype=np.uint8),
             people_statuses=np.random.binomial(1, 0.001, npeople).astype(np.uint32),
             people_transition_times=np.ones(npeople, dtype=np.uint32),
+            people_slot_offsets=fixed_slot_offsets(npeople, nslots),
             people_place_ids=np.random.randint(nplaces, size=npeople * nslots, dtype=np.uint32),
             people_baseline_flows=np.random.rand(npeople * nslots).astype(np.float32),
             people_flows=np.zeros(npeople * nslots, dtype=np.float32),
@@ -97,7 +125,7 @@ class Snapshot:
 
         ids = np.reshape(np.tile(np.arange(nslots), npeople), (npeople, nslots))
         ids += np.reshape(np.arange(npeople), (npeople, 1))
-        buffers.people_place_ids[:] = np.clip(ids, 0, nplaces).flatten().astype(np.uint32)
+        buffers.people_place_ids[:] = np.clip(ids, 0, nplaces - 1).flatten().astype(np.uint32)
 
         buffers.place_coords[0::2] = np.mod(np.arange(nplaces), np.sqrt(nplaces)) / np.sqrt(nplaces)
         buffers.place_coords[1::2] = np.arange(nplaces) / nplaces
@@ -105,6 +133,12 @@ class Snapshot:
         buffers.place_coords[1::2] += lon - 0.5
         buffers.place_coords[:] += np.random.randn(2 * nplaces) / 100.0
 
+        if sparse:
+            place_ids = np.random.randint(nplaces, size=(npeople, nslots)).astype(np.uint32)
+            place_ids[np.arange(nslots) >= np.random.randint(1, nslots + 1, size=(npeople, 1))] = \
+                locality.sentinel_value
+            buffers.people_place_ids[:] = place_ids.flatten()
+
         return cls(nplaces, npeople, nslots, time, area_codes, not_home_probs, lockdown_multipliers, buffers)
 
     @classmethod
@@ -138,6 +172,7 @@ class Snapshot:
             people_blood_pressure=people_blood_pressure,
             people_statuses=np.zeros(npeople, dtype=np.uint32),
             people_transition_times=np.zeros(npeople, dtype=np.uint32),
+            people_slot_offsets=fixed_slot_offsets(npeople, nslots),
             people_place_ids=people_place_ids,
             people_baseline_flows=people_baseline_flows,
             people_flows=people_baseline_flows,
@@ -154,8 +189,9 @@ class Snapshot:
             self.buffers.params[:] = new_params.asarray()
         except ValueError as e:
             print(f"Snapshot.py caused an exception '{str(e)}'. This can happen if the parameters in the model "
-                  f"have changed after a snapshot has been created. Try deleting the snapshot file "
-                  f"'microsim/opencl/snapshots/{self.name}.npz' and re-running the model.")
+                  f"have changed after a snapshot has been created. Snapshots are migrated to the current params "
+                  f"layout when loaded, so try reloading the snapshot with Snapshot.load_full_snapshot or "
+                  f"upgrading it with Snapshot.upgrade.")
             raise e
 
     def seed_prngs(self, seed):
@@ -168,6 +204,176 @@ class Snapshot:
         self.buffers.people_prngs[:] = np.random.randint(
             np.uint32((1 << 32) - 1), size=self.npeople * 4, dtype=np.uint32)
 
+    @property
+    def nvisits(self):
+        """The total number of slots, ie. the length of the slot buffers."""
+        return int(self.buffers.people_slot_offsets[-1])
+
+    def has_fixed_slots(self):
+        """Whether every person has nslots slots (the fixed layout), rather than the slots being packed."""
+        return np.array_equal(self.buffers.people_slot_offsets, fixed_slot_offsets(self.npeople, self.nslots))
+
+    def slot_people_ids(self):
+        """The id of the person owning each slot."""
+        return np.repeat(np.arange(self.npeople, dtype=np.uint32), np.diff(self.buffers.people_slot_offsets))
+
+    def pack_slots(self):
+        """
+        Converts the slots to the packed (CSR) layout, removing the empty slots which pad the fixed layout, so the
+        slot buffers are smaller and the kernels do not loop over empty slots. The simulation results are unchanged.
+        """
+        used = self.buffers.people_place_ids != locality.sentinel_value
+        slot_counts = np.bincount(self.slot_people_ids()[used], minlength=self.npeople)
+
+        people_slot_offsets = np.zeros(self.npeople + 1, dtype=np.uint32)
+        people_slot_offsets[1:] = np.cumsum(slot_counts)
+        replacements = {name: getattr(self.buffers, name)[used] for name in slot_buffers}
+        self.buffers = self.buffers._replace(people_slot_offsets=people_slot_offsets, **replacements)
+
+    def quantise_flows(self):
+        """
+        Converts the baseline flows and flows to 16 bit fixed point, where each flow is stored as a uint16 multiple of
+        flow_scale. This halves the size of the largest buffers on the device, and the memory traffic of the kernels
+        which read them, in exchange for rounding each flow by up to flow_scale / 2 (about 8e-6 for flows up to 1).
+        """
+        if self.flow_scale is not None:
+            return
+        max_flow = max(1.0, float(np.max(self.buffers.people_baseline_flows, initial=0.0)))
+        flow_scale = np.float32(max_flow / np.iinfo(np.uint16).max)
+
+        replacements = {}
+        for name in ["people_baseline_flows", "people_flows"]:
+            flows = getattr(self.buffers, name) / flow_scale
+            replacements[name] = np.clip(np.rint(flows), 0, np.iinfo(np.uint16).max).astype(np.uint16)
+        self.buffers = self.buffers._replace(**replacements)
+        self.flow_scale = flow_scale
+
+    def decode_flows(self, flows):
+        """Converts flows in this snapshot's storage format (eg. downloaded from the simulator) to float32."""
+        if self.flow_scale is None:
+            return np.asarray(flows, dtype=np.float32)
+        return np.asarray(flows).astype(np.float32) * self.flow_scale
+
+    def to_padded_slots(self, values, fill_value=locality.sentinel_value):
+        """Converts an array with one entry per slot into an (npeople, nslots) array, padding with fill_value."""
+        offsets = self.buffers.people_slot_offsets
+        padded = np.full((self.npeople, self.nslots), fill_value, dtype=np.asarray(values).dtype)
+        people_ids = self.slot_people_ids()
+        padded[people_ids, np.arange(people_ids.shape[0]) - offsets[people_ids]] = values
+        return padded
+
+    def select_people(self, start, stop):
+        """
+        A snapshot containing only people start to stop (exclusive) of this snapshot, and all of the places. Used to
+        split the people between the partitions of a PartitionedSimulator. The arrays are views where possible.
+        """
+        people_slot_offsets = self.buffers.people_slot_offsets
+        slot_start, slot_stop = people_slot_offsets[start], people_slot_offsets[stop]
+
+        replacements = {"people_slot_offsets": people_slot_offsets[start:stop + 1] - slot_start}
+        for name in self.buffers._fields:
+            if name in slot_buffers:
+                replacements[name] = getattr(self.buffers, name)[slot_start:slot_stop]
+            elif name.startswith("people_") and name != "people_slot_offsets":
+                replacements[name] = getattr(self.buffers, name).reshape(self.npeople, -1)[start:stop].reshape(-1)
+
+        return Snapshot(self.nplaces, np.uint32(stop - start), self.nslots, self.time,
+                        np.asarray(self.area_codes)[start:stop], self.not_home_probs[start:stop],
+                        self.lockdown_multipliers, self.buffers._replace(**replacements), name=self.name,
+                        flow_scale=self.flow_scale)
+
+    def reorder(self, place_order=None, people_order=None):
+        """
+        Reorders the places and/or people in this snapshot, remapping the place ids of each person to match.
+        Each order gives the current id of the place or person to move to each position. The resulting order relative
+        to the original snapshot is kept in place_order and people_order, so per-place and per-person outputs can be
+        reported in the original order with to_original_place_order() and to_original_people_order().
+        The random states of the people are reordered with them, and simulators choose initial cases in the original
+        order of the people, so a simulation gives the same results once its outputs are put back in the original
+        order. That is not the case if the random states are seeded by the simulator (eg. with Simulator.seed_prngs or
+        counter-based random numbers), as those are drawn for each position rather than each person.
+        """
+        replacements = {}
+        if place_order is not None:
+            place_order = np.asarray(place_order, dtype=np.uint32)
+            new_place_ids = np.empty(self.nplaces, dtype=np.uint32)
+            new_place_ids[place_order] = np.arange(self.nplaces, dtype=np.uint32)
+
+            for name in ["place_activities", "place_hazards", "place_counts"]:
+                replacements[name] = getattr(self.buffers, name)[place_order]
+            replacements["place_coords"] = self.buffers.place_coords.reshape(-1, 2)[place_order].flatten()
+
+            people_place_ids = np.array(self.buffers.people_place_ids)
+            valid = people_place_ids != locality.sentinel_value
+            people_place_ids[valid] = new_place_ids[people_place_ids[valid]]
+            replacements["people_place_ids"] = people_place_ids
+
+            self.place_order = place_order if self.place_order is None else self.place_order[place_order]
+
+        if people_order is not None:
+            people_order = np.asarray(people_order, dtype=np.uint32)
+            slot_order, people_slot_offsets = reordered_slots(self.buffers.people_slot_offsets, people_order)
+            for name in self.buffers._fields:
+                if not name.startswith("people_") or name == "people_slot_offsets":
+                    continue
+                array = replacements.get(name, getattr(self.buffers, name))
+                if name in slot_buffers:
+                    replacements[name] = array[slot_order]
+                else:
+                    replacements[name] = array.reshape(self.npeople, -1)[people_order].flatten()
+            replacements["people_slot_offsets"] = people_slot_offsets
+            self.area_codes = np.asarray(self.area_codes)[people_order]
+            self.not_home_probs = self.not_home_probs[people_order]
+
+            self.people_order = people_order if self.people_order is None else self.people_order[people_order]
+
+        self.buffers = self.buffers._replace(**replacements)
+
+    def reorder_for_locality(self):
+        """
+        Reorders places by activity, area and then position along a Hilbert curve, and people by their home, so that
+        people and the places they visit are close together in memory. This improves cache usage when the kernels
+        scatter hazards to and gather hazards from places.
+        """
+        homes = locality.home_place_ids(self.buffers.people_place_ids, self.buffers.place_activities,
+                                        self.buffers.people_slot_offsets)
+        has_home = homes != locality.sentinel_value
+
+        # homes are assigned the area of one of their residents
+        _, area_ids = np.unique(np.asarray(self.area_codes, dtype=str), return_inverse=True)
+        place_area_ids = np.full(self.nplaces, -1, dtype=np.int64)
+        place_area_ids[homes[has_home]] = area_ids[has_home]
+
+        place_order = locality.locality_place_order(self.buffers.place_activities, self.buffers.place_coords,
+                                                    place_area_ids)
+        self.reorder(place_order=place_order)
+
+        homes = locality.home_place_ids(self.buffers.people_place_ids, self.buffers.place_activities,
+                                        self.buffers.people_slot_offsets)
+        self.reorder(people_order=locality.locality_people_order(homes))
+
+    def to_original_people_order(self, values):
+        """Reorders an array with one row per person (or, with packed slots, one entry per slot) in this snapshot into
+        the original order of the people."""
+        if self.people_order is None:
+            return values
+        values = np.asarray(values)
+        if values.shape[0] == self.nvisits and not self.has_fixed_slots():
+            slot_order, _ = reordered_slots(self.buffers.people_slot_offsets, np.argsort(self.people_order))
+            return values[slot_order]
+        original = np.empty_like(values)
+        original.reshape(self.npeople, -1)[self.people_order] = values.reshape(self.npeople, -1)
+        return original
+
+    def to_original_place_order(self, values):
+        """Reorders an array with one row per place in this snapshot into the original order of the places."""
+        if self.place_order is None:
+            return values
+        values = np.asarray(values)
+        original = np.empty_like(values)
+        original.reshape(self.nplaces, -1)[self.place_order] = values.reshape(self.nplaces, -1)
+        return original
+
     def switch_to_healthier_population(self):
         """
         Updates to a healthier population by reducing obesity. Any individuals that are overweight or obese are moved
@@ -180,8 +386,22 @@ class Snapshot:
 
     @classmethod
     def load_full_snapshot(cls, path):
-        """Creates a snapshot by reading the .npz file from the provided path."""
+        """
+        Creates a snapshot by reading the snapshot at the provided path. This can either be a snapshot directory or a
+        .npz file. If a .npz path is given which does not exist but a snapshot directory of the same name does, then
+        the directory is loaded instead.
+        """
+        if os.path.isdir(path):
+            return cls.load_snapshot_directory(path)
+        if path.endswith(".npz") and not os.path.exists(path) and os.path.isdir(path[:-len(".npz")]):
+            return cls.load_snapshot_directory(path[:-len(".npz")])
+
         with np.load(path, allow_pickle=True) as file_data:
+            version = int(file_data["version"]) if "version" in file_data.files else 0
+            if version > snapshot_format_version:
+                raise ValueError(f"Snapshot '{path}' has format version {version}, but only versions up to "
+                                 f"{snapshot_format_version} are supported.")
+
             nplaces = file_data["nplaces"]
             npeople = file_data["npeople"]
             nslots = file_data["nslots"]
@@ -190,14 +410,128 @@ class Snapshot:
             not_home_probs = file_data["not_home_probs"]
             lockdown_multipliers = file_data["lockdown_multipliers"]
 
-            buffers = Buffers(**{name: file_data[name] for name in Buffers._fields})
-            return cls(nplaces, npeople, nslots, time, area_codes, not_home_probs, lockdown_multipliers, buffers)
+            arrays = {name: file_data[name] for name in Buffers._fields if name in file_data.files}
+            buffers = _buffers_with_slot_offsets(arrays, npeople, nslots)
+            if "params_layout" in file_data.files:
+                layout = json.loads(str(file_data["params_layout"]))
+            else:
+                layout = infer_params_layout(buffers.params.size)
+            buffers = buffers._replace(params=migrate_params_array(buffers.params, layout))
+
+            people_order = file_data["people_order"] if "people_order" in file_data.files else None
+            place_order = file_data["place_order"] if "place_order" in file_data.files else None
+            flow_scale = np.float32(file_data["flow_scale"]) if "flow_scale" in file_data.files else None
+
+            return cls(nplaces, npeople, nslots, time, area_codes, not_home_probs, lockdown_multipliers, buffers,
+                       people_order=people_order, place_order=place_order, flow_scale=flow_scale)
+
+    @classmethod
+    def load_snapshot_directory(cls, path):
+        """
+        Creates a snapshot from a snapshot directory written by save(). Arrays are memory-mapped copy-on-write, so they
+        are paged in lazily and can be modified in memory (eg. by update_params) without changing the files on disk.
+        """
+        with open(os.path.join(path, snapshot_manifest_filename)) as f:
+            manifest = json.load(f)
+
+        if manifest["version"] > snapshot_format_version:
+            raise ValueError(f"Snapshot '{path}' has format version {manifest['version']}, but only versions up to "
+                             f"{snapshot_format_version} are supported.")
+
+        arrays = {name: load_array(path, name, array_info) for name, array_info in manifest["arrays"].items()}
+
+        nplaces = np.uint32(manifest["nplaces"])
+        npeople = np.uint32(manifest["npeople"])
+        nslots = np.uint32(manifest["nslots"])
+        time = np.uint32(manifest["time"])
+
+        # area codes are stored as indices into a lookup table of the distinct codes
+        area_code_lookup = np.array(manifest["area_code_lookup"], dtype=object)
+        area_codes = area_code_lookup[arrays["area_codes"]]
+
+        buffers = _buffers_with_slot_offsets(arrays, npeople, nslots)
+        if "params_layout" in manifest:
+            layout = manifest["params_layout"]
+        else:
+            layout = infer_params_layout(buffers.params.size)
+        buffers = buffers._replace(params=migrate_params_array(buffers.params, layout))
+
+        flow_scale = np.float32(manifest["flow_scale"]) if manifest.get("flow_scale") is not None else None
+
+        return cls(nplaces, npeople, nslots, time, area_codes, arrays["not_home_probs"],
+                   arrays["lockdown_multipliers"], buffers, name=os.path.basename(os.path.normpath(path)),
+                   people_order=arrays.get("people_order"), place_order=arrays.get("place_order"),
+                   flow_scale=flow_scale)
 
     def save(self, path):
-        """Saves this snapshot to the provided path as a .npz file."""
-        np.savez(path, nplaces=self.nplaces, npeople=self.npeople, nslots=self.nslots,
-                 time=self.time, area_codes=self.area_codes, not_home_probs=self.not_home_probs,
-                 lockdown_multipliers=self.lockdown_multipliers, **self.buffers._asdict())
+        """
+        Saves this snapshot to the provided path. Paths ending in .npz are saved as a single .npz file, any other path
+        is saved as a snapshot directory.
+        """
+        if path.endswith(".npz"):
+            np.savez(path, nplaces=self.nplaces, npeople=self.npeople, nslots=self.nslots,
+                     time=self.time, area_codes=self.area_codes, not_home_probs=self.not_home_probs,
+                     lockdown_multipliers=self.lockdown_multipliers, version=snapshot_format_version,
+                     params_layout=json.dumps(params_layout), **self._orders(), **self._flow_scale(),
+                     **self.buffers._asdict())
+        else:
+            self.save_snapshot_directory(path)
+
+    @classmethod
+    def upgrade(cls, path):
+        """
+        Upgrades the snapshot at the provided path in place to the current snapshot format and params layout, keeping
+        the same file format, so that older snapshots do not have to be regenerated from the population data.
+        """
+        snapshot = cls.load_full_snapshot(path)
+        if not os.path.exists(path):
+            path = path[:-len(".npz")]  # load_full_snapshot fell back to the snapshot directory
+        snapshot.save(path)
+        return snapshot
+
+    def save_snapshot_directory(self, path):
+        """
+        Saves this snapshot as a directory containing an uncompressed .npy file for each array and a JSON manifest
+        describing them. The manifest is written last, so a directory without one is an incomplete snapshot.
+        """
+        os.makedirs(path, exist_ok=True)
+        manifest_path = os.path.join(path, snapshot_manifest_filename)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+
+        area_code_lookup, area_code_ids = np.unique(np.asarray(self.area_codes, dtype=str), return_inverse=True)
+
+        arrays = dict(self.buffers._asdict())
+        arrays["area_codes"] = area_code_ids.astype(np.uint32)
+        arrays["not_home_probs"] = self.not_home_probs
+        arrays["lockdown_multipliers"] = self.lockdown_multipliers
+        arrays.update(self._orders())
+
+        manifest = {
+            "version": snapshot_format_version,
+            "nplaces": int(self.nplaces),
+            "npeople": int(self.npeople),
+            "nslots": int(self.nslots),
+            "time": int(self.time),
+            "area_code_lookup": area_code_lookup.tolist(),
+            "params_layout": params_layout,
+            "flow_scale": None if self.flow_scale is None else float(self.flow_scale),
+            "arrays": {},
+        }
+        for name, array in arrays.items():
+            manifest["arrays"][name] = save_array(path, name, array)
+
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    def _orders(self):
+        """The people and place orders which are set, to be saved with the snapshot."""
+        orders = {"people_order": self.people_order, "place_order": self.place_order}
+        return {name: order for name, order in orders.items() if order is not None}
+
+    def _flow_scale(self):
+        """The flow scale if the flows are quantised, to be saved with the snapshot."""
+        return {} if self.flow_scale is None else {"flow_scale": self.flow_scale}
 
     def num_bytes(self):
         """Returns size in bytes of this snapshot."""
@@ -209,3 +543,76 @@ class Snapshot:
     def sanitize_coords(self):
         """Sets all zero coordinate to nan so they can be discarded by the renderer."""
         self.buffers.place_coords[:] = np.where(self.buffers.place_coords == 0.0, np.nan, self.buffers.place_coords)
+
+
+def save_array(path, name, array):
+    """
+    Saves an array as an uncompressed .npy file in a snapshot directory, and returns its entry in the manifest.
+    """
+    array = np.ascontiguousarray(array)
+    # write to a temporary file and rename it, as the existing file may be memory-mapped by a snapshot
+    array_path = os.path.join(path, f"{name}.npy")
+    with open(f"{array_path}.tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(f"{array_path}.tmp", array_path)
+    return {"dtype": array.dtype.str, "shape": list(array.shape)}
+
+
+def load_array(path, name, array_info):
+    """
+    Memory-maps (copy-on-write) an array saved by save_array(), checking it matches its entry in the manifest.
+    """
+    array = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="c")
+    if array.dtype != np.dtype(array_info["dtype"]) or list(array.shape) != array_info["shape"]:
+        raise ValueError(f"Array '{name}' in snapshot '{path}' has dtype {array.dtype} and shape "
+                         f"{array.shape}, but the manifest expects {array_info['dtype']} and "
+                         f"{tuple(array_info['shape'])}.")
+    return array
+
+
+def list_snapshots(snapshot_dir):
+    """The names of the snapshots in a directory, both .npz files and complete snapshot directories, sorted."""
+    names = []
+    for name in sorted(os.listdir(snapshot_dir)):
+        path = os.path.join(snapshot_dir, name)
+        if (name.endswith(".npz") and os.path.isfile(path)) or \
+                os.path.isfile(os.path.join(path, snapshot_manifest_filename)):
+            names.append(name)
+    return names
+
+
+def snapshot_index(snapshots, name):
+    """The index of the snapshot called name in a list from list_snapshots(), which is either a snapshot directory or
+    a .npz file, preferring the directory if there are both."""
+    for snapshot in [name, f"{name}.npz"]:
+        if snapshot in snapshots:
+            return snapshots.index(snapshot)
+    raise ValueError(f"No snapshot called '{name}' in {snapshots}")
+
+
+def fixed_slot_offsets(npeople, nslots):
+    """The people_slot_offsets of the fixed slot layout, where every person has nslots slots."""
+    return (np.arange(npeople + 1, dtype=np.uint32) * np.uint32(nslots)).astype(np.uint32)
+
+
+def reordered_slots(people_slot_offsets, people_order):
+    """
+    The slots of each person, reordered to follow people_order. Returns (slot_order, new_slot_offsets), where
+    slot_order gives the current index of the slot to move to each position.
+    """
+    people_slot_offsets = np.asarray(people_slot_offsets, dtype=np.int64)
+    slot_counts = np.diff(people_slot_offsets)[people_order]
+    new_slot_offsets = np.zeros(slot_counts.shape[0] + 1, dtype=np.int64)
+    new_slot_offsets[1:] = np.cumsum(slot_counts)
+
+    # each person's slots are a contiguous run starting from their old offset
+    run_starts = np.repeat(people_slot_offsets[:-1][people_order] - new_slot_offsets[:-1], slot_counts)
+    slot_order = run_starts + np.arange(new_slot_offsets[-1])
+    return slot_order, new_slot_offsets.astype(np.uint32)
+
+
+def _buffers_with_slot_offsets(arrays, npeople, nslots):
+    """Buffers from loaded arrays, adding the fixed layout slot offsets to snapshots saved before they existed."""
+    if "people_slot_offsets" not in arrays:
+        arrays = dict(arrays, people_slot_offsets=fixed_slot_offsets(npeople, nslots))
+    return Buffers(**{name: arrays[name] for name in Buffers._fields})
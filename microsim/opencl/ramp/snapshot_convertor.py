@@ -1,22 +1,23 @@
+import itertools
 import numpy as np
-import random
+import pandas as pd
 import os
 import json
 from tqdm import tqdm
 from convertbng.util import convert_lonlat
 
+from microsim.opencl.ramp.buffers import sentinel_value
 from microsim.opencl.ramp.snapshot import Snapshot
 
-sentinel_value = (1 << 31) - 1
-
 
 class SnapshotConvertor:
     """
     Convert dataframe of individuals and activity locations into a Snapshot object that can be used by the OpenCL model
     """
 
-    def __init__(self, individuals, activity_locations, time_activity_multiplier, data_dir):
+    def __init__(self, individuals, activity_locations, time_activity_multiplier, data_dir, random_seed=None):
         self.data_dir = data_dir
+        self.rng = np.random.default_rng(random_seed)
 
         self.individuals = individuals
         self.activity_names = list(activity_locations.keys())
@@ -34,7 +35,14 @@ class SnapshotConvertor:
         self.num_people = self.individuals['ID'].count()
         self.global_place_id_lookup, self.num_places = self.create_global_place_ids()
 
-    def generate_snapshot(self):
+    def generate_snapshot(self, reorder_for_locality=False, pack_slots=False, quantise_flows=False):
+        """
+        Generate the snapshot. If reorder_for_locality is set the people and places are reordered to improve memory
+        locality in the kernels (see Snapshot.reorder_for_locality), otherwise they are in the order of the input data.
+        If pack_slots is set the slots are stored in the packed (CSR) layout without empty slots (see
+        Snapshot.pack_slots), otherwise every person has the same number of slots. If quantise_flows is set the flows
+        are stored as 16 bit fixed point (see Snapshot.quantise_flows), otherwise as float32.
+        """
         people_ages = self.get_people_ages()
         people_obesity = self.get_people_obesity()
         people_cvd = self.get_people_cvd()
@@ -46,9 +54,16 @@ class SnapshotConvertor:
 
         place_activities = self.get_place_data()
         place_coordinates = self.get_place_coordinates()
-        return Snapshot.from_arrays(people_ages, people_obesity, people_cvd, people_diabetes, people_blood_pressure,
-                                    people_place_ids, people_flows, area_codes, not_home_probs, place_activities,
-                                    place_coordinates, self.lockdown_multipliers)
+        snapshot = Snapshot.from_arrays(people_ages, people_obesity, people_cvd, people_diabetes,
+                                        people_blood_pressure, people_place_ids, people_flows, area_codes,
+                                        not_home_probs, place_activities, place_coordinates, self.lockdown_multipliers)
+        if pack_slots:
+            snapshot.pack_slots()
+        if reorder_for_locality:
+            snapshot.reorder_for_locality()
+        if quantise_flows:
+            snapshot.quantise_flows()
+        return snapshot
 
     def create_global_place_ids(self):
         max_id = 0
@@ -78,6 +93,11 @@ class SnapshotConvertor:
         global_id_location = local_place_id - ids_for_activity["id_offset"]
         return ids_for_activity["ids"][global_id_location]
 
+    def get_global_place_ids(self, activity_name, local_place_ids):
+        """Vectorised version of get_global_place_id for an array of local place ids."""
+        ids_for_activity = self.global_place_id_lookup[activity_name]
+        return ids_for_activity["ids"][local_place_ids - ids_for_activity["id_offset"]]
+
     def get_people_ages(self):
         return self.individuals['age'].to_numpy(dtype=np.uint16)
 
@@ -95,7 +115,7 @@ class SnapshotConvertor:
         return self.individuals['bloodpressure'].to_numpy(dtype=np.uint8)
 
     def get_people_area_codes(self):
-        return self.individuals['area'].to_numpy(dtype=np.object)
+        return self.individuals['area'].to_numpy(dtype=object)
 
     def get_not_home_probs(self):
         return self.individuals['pnothome'].to_numpy(dtype=np.float32)
@@ -106,50 +126,62 @@ class SnapshotConvertor:
         these flows and taking the top n so they can fit in a fixed size array. Locations from all activities are contained
         in the same array so the activity specific location ids are mapped to global location ids.
 
-        :param max_places_per_person: upper limit of places per person so we can use a fixed size array
-        :param places_to_keep_per_person:
+        The ragged venue and flow lists are flattened once per activity into flat arrays tagged with the person they
+        belong to, so the conversion is columnar and never materialises a (num_people, max_places_per_person) array.
+
+        :param max_places_per_person: upper limit of places per person, kept as a sanity check on the input data
+        :param places_to_keep_per_person: number of places with the highest flows to keep for each person
         :return: Numpy arrays of place ids and baseline flows indexed by person id
         """
-
-        people_place_ids = np.full((self.num_people, max_places_per_person), sentinel_value, dtype=np.uint32)
-        people_place_flows = np.zeros((self.num_people, max_places_per_person), dtype=np.float32)
-
-        num_places_added = np.zeros(self.num_people, dtype=np.uint32)
+        people_ids = []
+        place_ids = []
+        place_flows = []
+        num_places_per_person = np.zeros(self.num_people, dtype=np.uint32)
 
         for activity_name in self.activity_names:
             activity_venues = self.individuals.loc[:, activity_name + "_Venues"]
             activity_flows = self.individuals.loc[:, activity_name + "_Flows"]
-            activity_durations = self.individuals.loc[:, activity_name + "_Duration"]
+            activity_durations = self.individuals.loc[:, activity_name + "_Duration"].to_numpy(dtype=np.float64)
 
-            for people_id, (local_place_ids, flows, duration) in tqdm(
-                    enumerate(zip(activity_venues, activity_flows, activity_durations)),
-                    total=self.num_people,
-                    desc=f"Converting {activity_name} flows for all people"):
-                flows = np.array(flows) * duration
+            num_venues = activity_venues.map(len).to_numpy(dtype=np.uint32)
+            num_flows = activity_flows.map(len).to_numpy(dtype=np.uint32)
 
-                # check dimensions match
-                assert len(local_place_ids) == flows.shape[0]
+            # check dimensions match
+            assert np.array_equal(num_venues, num_flows)
 
-                num_places_to_add = len(local_place_ids)
+            total_venues = int(num_venues.sum())
+            local_place_ids = np.fromiter(itertools.chain.from_iterable(activity_venues), dtype=np.int64,
+                                          count=total_venues)
+            flows = np.fromiter(itertools.chain.from_iterable(activity_flows), dtype=np.float64, count=total_venues)
 
-                start_idx = num_places_added[people_id]
-                end_idx = start_idx + num_places_to_add
-                people_place_ids[people_id, start_idx:end_idx] = np.array(
-                    [self.get_global_place_id(activity_name, local_place_id)
-                     for local_place_id in local_place_ids])
+            people_ids.append(np.repeat(np.arange(self.num_people, dtype=np.uint32), num_venues))
+            place_ids.append(self.get_global_place_ids(activity_name, local_place_ids))
+            place_flows.append((flows * np.repeat(activity_durations, num_venues)).astype(np.float32))
+            num_places_per_person += num_venues
 
-                people_place_flows[people_id, start_idx:end_idx] = flows
+        assert num_places_per_person.max(initial=0) <= max_places_per_person
 
-                num_places_added[people_id] += num_places_to_add
+        people_ids = np.concatenate(people_ids)
+        place_ids = np.concatenate(place_ids)
+        place_flows = np.concatenate(place_flows)
 
-        # Sort by magnitude of flow (reversed)
-        sorted_indices = people_place_flows.argsort()[:, ::-1]
-        people_place_ids = np.take_along_axis(people_place_ids, sorted_indices, axis=1)
-        people_place_flows = np.take_along_axis(people_place_flows, sorted_indices, axis=1)
+        # Sort by person, then by magnitude of flow (reversed)
+        sorted_indices = np.lexsort((-place_flows, people_ids))
+        people_ids = people_ids[sorted_indices]
 
-        # truncate to maximum places per person
-        people_place_ids = people_place_ids[:, 0:places_to_keep_per_person]
-        people_place_flows = people_place_flows[:, 0:places_to_keep_per_person]
+        # rank of each place within its person's sorted segment, only the top places_to_keep_per_person are kept
+        segment_starts = np.zeros(self.num_people, dtype=np.int64)
+        segment_starts[1:] = np.cumsum(num_places_per_person, dtype=np.int64)[:-1]
+        ranks = np.arange(people_ids.shape[0], dtype=np.int64) - segment_starts[people_ids]
+        keep = ranks < places_to_keep_per_person
+        people_ids = people_ids[keep]
+        ranks = ranks[keep]
+        sorted_indices = sorted_indices[keep]
+
+        people_place_ids = np.full((self.num_people, places_to_keep_per_person), sentinel_value, dtype=np.uint32)
+        people_place_flows = np.zeros((self.num_people, places_to_keep_per_person), dtype=np.float32)
+        people_place_ids[people_ids, ranks] = place_ids[sorted_indices]
+        people_place_flows[people_ids, ranks] = place_flows[sorted_indices]
 
         return people_place_ids, people_place_flows
 
@@ -181,52 +213,64 @@ class SnapshotConvertor:
 
             # Convert OS grid coordinates (eastings and northings) to latitude and longitude
             if 'Easting' in activity_locations_df.columns and 'Northing' in activity_locations_df.columns:
-                local_ids = activity_locations_df.loc[:, "ID"]
-                eastings = activity_locations_df.loc[:, "Easting"]
-                northings = activity_locations_df.loc[:, "Northing"]
+                local_ids = activity_locations_df.loc[:, "ID"].to_numpy(dtype=np.int64)
+                eastings = activity_locations_df.loc[:, "Easting"].to_numpy(dtype=np.float64)
+                northings = activity_locations_df.loc[:, "Northing"].to_numpy(dtype=np.float64)
 
-                for local_place_id, easting, northing in tqdm(zip(local_ids, eastings, northings),
-                                                              desc=f"Processing coordinate data for {activity_name}"):
-                    global_place_id = self.get_global_place_id(activity_name, local_place_id)
+                # convert all the coordinates for this activity in one call
+                longs, lats = convert_lonlat(eastings, northings)
 
-                    long_lat = convert_lonlat([easting], [northing])
-                    long = long_lat[0][0]
-                    lat = long_lat[1][0]
-                    place_coordinates[global_place_id] = np.array([lat, long])
+                global_place_ids = self.get_global_place_ids(activity_name, local_ids)
+                place_coordinates[global_place_ids, 0] = lats
+                place_coordinates[global_place_ids, 1] = longs
 
         # for homes: assign coordinates of random building inside MSOA area
         home_locations_df = self.locations["Home"]
         lats, lons = self.get_coordinates_from_buildings(home_locations_df)
-        local_ids = home_locations_df.loc[:, "ID"]
+        local_ids = home_locations_df.loc[:, "ID"].to_numpy(dtype=np.int64)
 
-        for local_place_id, lat, lon in tqdm(zip(local_ids, lats, lons), desc=f"Storing coordinates for homes"):
-            global_place_id = self.get_global_place_id("Home", local_place_id)
-            place_coordinates[global_place_id] = np.array([lat, lon])
+        global_place_ids = self.get_global_place_ids("Home", local_ids)
+        place_coordinates[global_place_ids, 0] = lats
+        place_coordinates[global_place_ids, 1] = lons
 
         return place_coordinates
 
     def get_coordinates_from_buildings(self, home_locations_df):
-        # load msoa building lookup from JSON file
-        msoa_building_filepath = os.path.join(self.data_dir, "msoa_building_coordinates.json")
-        with open(msoa_building_filepath) as f:
-            msoa_buildings = json.load(f)
+        """Assign each home the coordinates of a building chosen uniformly at random from within its MSOA area."""
+        msoa_codes, building_offsets, building_coordinates = self.load_msoa_buildings()
 
         areas = home_locations_df.loc[:, "area"]
+        msoa_indices = pd.Index(msoa_codes).get_indexer(areas)
+        if (msoa_indices < 0).any():
+            raise KeyError(f"No buildings found for areas {sorted(set(areas[msoa_indices < 0]))}")
 
-        num_locations = len(home_locations_df.index)
+        # select a random building from within each area using the offset table
+        num_buildings = building_offsets[msoa_indices + 1] - building_offsets[msoa_indices]
+        building_indices = building_offsets[msoa_indices] + self.rng.integers(num_buildings)
 
-        lats = np.zeros(num_locations)
-        lons = np.zeros(num_locations)
+        lats = building_coordinates[building_indices, 0]
+        lons = building_coordinates[building_indices, 1]
+        return lats, lons
+
+    def load_msoa_buildings(self):
+        """
+        Load the MSOA building lookup from the JSON file into a flat table of building coordinates, where the buildings
+        in the MSOA msoa_codes[i] are the rows building_offsets[i]:building_offsets[i + 1] of building_coordinates.
+        """
+        msoa_building_filepath = os.path.join(self.data_dir, "msoa_building_coordinates.json")
+        with open(msoa_building_filepath) as f:
+            msoa_buildings = json.load(f)
 
-        for i, area in enumerate(areas):
-            # select random building from within area and assign easting and northing
-            area_buildings = msoa_buildings[area]
-            building = random.choice(area_buildings)
+        msoa_codes = list(msoa_buildings.keys())
+        building_counts = np.array([len(msoa_buildings[msoa]) for msoa in msoa_codes], dtype=np.int64)
+        building_offsets = np.zeros(len(msoa_codes) + 1, dtype=np.int64)
+        np.cumsum(building_counts, out=building_offsets[1:])
 
-            lats[i] = building[0]
-            lons[i] = building[1]
+        building_coordinates = np.fromiter(
+            itertools.chain.from_iterable(itertools.chain.from_iterable(msoa_buildings.values())),
+            dtype=np.float64, count=2 * building_offsets[-1]).reshape(-1, 2)
 
-        return lats, lons
+        return msoa_codes, building_offsets, building_coordinates
 
 
 def get_obesity_value(bmi_vg6_str):
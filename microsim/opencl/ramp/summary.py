@@ -19,17 +19,18 @@ class Summary:
             snapshot: Snapshot
                 snapshot data for the simulation, required for ages and area codes
             store_detailed_counts : bool
-                whether to store aggregate counts for ages and area codes. **WARNING**: this causes a significant
-                reduction in performance.
+                whether to store aggregate counts for ages and area codes.
             max_time : int
                 number of timesteps
         """
 
         self.max_time = max_time
         self.store_detailed_counts = store_detailed_counts
+        nstatuses = len(DiseaseStatus)
+        self.nstatuses = nstatuses
 
         # create empty arrays to hold total counts
-        self.total_counts = [np.zeros(max_time, np.float32) for _ in range(len(DiseaseStatus))]
+        self.total_counts = [np.zeros(max_time, np.float32) for _ in range(nstatuses)]
 
         if store_detailed_counts:
             # process age data into buckets
@@ -39,22 +40,25 @@ class Summary:
             self.age_thresholds = age_thresholds
 
             # get integer ids for area code strings
-            self.unique_area_codes = np.unique(snapshot.area_codes)
+            self.unique_area_codes, area_ids = np.unique(snapshot.area_codes, return_inverse=True)
+            area_ids = area_ids.astype(np.uint32)
 
-            self.area_code_id_lookup = {area_code: i for (i, area_code) in enumerate(self.unique_area_codes)}
-            area_ids = np.array([self.area_code_id_lookup[area_code] for area_code in snapshot.area_codes],
-                                dtype=np.uint32)
+            self.age_bins = age_bins
+            self.area_ids = area_ids
 
-            self.individuals_df = pd.DataFrame({'status': np.zeros(snapshot.npeople),
-                                                'age_bin': age_bins,
-                                                'area_id': area_ids,
-                                                })
+            # precompute the offset of each person's bin in the flattened [bin][status] histograms, so each update
+            # only needs to add the status and count with np.bincount
+            self.age_bin_offsets = (age_bins * nstatuses).astype(np.int64)
+            self.area_id_offsets = (area_ids * nstatuses).astype(np.int64)
 
-            # create empty dicts to hold age and area counts
-            # (use the string representation of the disease, e.g. DiseaseStatus.Exposed = 'exposed')
+            # preallocate the counts for every status, bin and timestep
+            self.age_status_counts = np.zeros((nstatuses, len(age_thresholds), max_time))
+            self.area_status_counts = np.zeros((nstatuses, len(self.unique_area_codes), max_time))
 
-            self.age_counts = {str(d): np.zeros((len(age_thresholds), max_time)) for d in DiseaseStatus}
-            self.area_counts = {str(d): np.zeros((len(self.unique_area_codes), max_time)) for d in DiseaseStatus}
+            # dicts of views into the arrays above, keyed by the string representation of the disease,
+            # e.g. DiseaseStatus.Exposed = 'exposed'
+            self.age_counts = {str(d): self.age_status_counts[d.value] for d in DiseaseStatus}
+            self.area_counts = {str(d): self.area_status_counts[d.value] for d in DiseaseStatus}
 
         # fill arrays up to current time with constant values
         for i in range(snapshot.time):
@@ -83,21 +87,53 @@ class Summary:
         current_time = np.minimum(time, self.max_time-1)
 
         # store total counts by status
-        unique_statuses, counts = np.unique(statuses, return_counts=True)
-        for status, count in zip(unique_statuses, counts):
+        counts = np.bincount(statuses, minlength=self.nstatuses)
+        for status, count in enumerate(counts):
             self.total_counts[status][current_time] = np.float32(count)
 
         if self.store_detailed_counts:
-            # update dataframe with new statuses
-            self.individuals_df['status'] = statuses
+            # store age and area counts, by counting the combined (bin, status) codes of every person
+            nage_bins = self.age_status_counts.shape[1]
+            age_counts = np.bincount(self.age_bin_offsets + statuses, minlength=nage_bins * self.nstatuses)
+            self.age_status_counts[:, :, current_time] = age_counts.reshape(nage_bins, self.nstatuses).T
 
-            # store age counts
-            for (age_bin, status), count in self.individuals_df.groupby(["age_bin", "status"]).size().iteritems():
-                self.age_counts[DiseaseStatus(status).name.lower()][age_bin][current_time] = np.float32(count)
+            nareas = self.area_status_counts.shape[1]
+            area_counts = np.bincount(self.area_id_offsets + statuses, minlength=nareas * self.nstatuses)
+            self.area_status_counts[:, :, current_time] = area_counts.reshape(nareas, self.nstatuses).T
 
-            # store area counts
-            for (area_id, status), count in self.individuals_df.groupby(["area_id", "status"]).size().iteritems():
-                self.area_counts[DiseaseStatus(status).name.lower()][area_id][current_time] = np.float32(count)
+    def update_from_counts(self, time, total_counts, age_counts=None, area_counts=None):
+        """Save counts which have already been computed, e.g. on the OpenCL device.
+
+        Parameters
+        ----------
+            time : int
+                the timestep the counts are for
+            total_counts : array_like
+                number of people with each status, indexed by status
+            age_counts : array_like
+                optional counts indexed by [status][age_bin], only saved if storing detailed counts
+            area_counts : array_like
+                optional counts indexed by [status][area_id], only saved if storing detailed counts
+        """
+        current_time = np.minimum(time, self.max_time-1)
+
+        for status, count in enumerate(total_counts):
+            self.total_counts[status][current_time] = np.float32(count)
+
+        if self.store_detailed_counts and age_counts is not None and area_counts is not None:
+            self.age_status_counts[:, :, current_time] = age_counts
+            self.area_status_counts[:, :, current_time] = area_counts
+
+    def mark_unobserved(self, time):
+        """Mark the counts of a timestep which was not observed as NaN, so they can't be mistaken for counts of zero."""
+        current_time = np.minimum(time, self.max_time-1)
+
+        for status in range(self.nstatuses):
+            self.total_counts[status][current_time] = np.nan
+
+        if self.store_detailed_counts:
+            self.age_status_counts[:, :, current_time] = np.nan
+            self.area_status_counts[:, :, current_time] = np.nan
 
     def draw_plots(self, time, size):
         """Given current time and graph size, draw the imgui plots."""
@@ -0,0 +1,75 @@
+import copy
+
+import numpy as np
+import pyopencl as cl
+import pytest
+
+from microsim.opencl.ramp.disease_statuses import DiseaseStatus
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot
+
+nplaces = 50
+npeople = 700
+nslots = 5
+
+
+def random_snapshot():
+    snapshot = Snapshot.random(nplaces, npeople, nslots, sparse=True)
+    snapshot.buffers.people_statuses[:] = np.random.choice([0, 0, 0, 0, 1, 2, 3, 4, 5], size=npeople)
+    return snapshot
+
+
+def test_compact_active():
+    snapshot = random_snapshot()
+    simulator = Simulator(snapshot, gpu=False, nreplicates=2, active_sets=True)
+    simulator.upload_all(snapshot.buffers)
+    statuses = np.random.randint(len(DiseaseStatus), size=npeople).astype(np.uint32)
+    simulator.upload("people_statuses", statuses, replicate=1)
+
+    simulator._enqueue_compact_active().wait()
+
+    active_counts = np.zeros(4, dtype=np.uint32)
+    infectious_ids = np.zeros(npeople * 2, dtype=np.uint32)
+    susceptible_ids = np.zeros(npeople * 2, dtype=np.uint32)
+    cl.enqueue_copy(simulator.queue, active_counts, simulator.active_buffers["active_counts"])
+    cl.enqueue_copy(simulator.queue, infectious_ids, simulator.active_buffers["infectious_people_ids"])
+    cl.enqueue_copy(simulator.queue, susceptible_ids, simulator.active_buffers["susceptible_people_ids"])
+
+    infectious = [DiseaseStatus.Presymptomatic.value, DiseaseStatus.Asymptomatic.value,
+                  DiseaseStatus.Symptomatic.value]
+    for replicate, replicate_statuses in enumerate([snapshot.buffers.people_statuses, statuses]):
+        ninfectious, nsusceptible = active_counts[replicate * 2:replicate * 2 + 2]
+        ids = infectious_ids[replicate * npeople:][:ninfectious]
+        assert np.array_equal(np.sort(ids), np.flatnonzero(np.isin(replicate_statuses, infectious)))
+        ids = susceptible_ids[replicate * npeople:][:nsusceptible]
+        assert np.array_equal(np.sort(ids), np.flatnonzero(replicate_statuses == DiseaseStatus.Susceptible.value))
+
+
+@pytest.mark.parametrize("hazard_mode", ["scatter", "gather"])
+def test_active_sets_give_identical_simulations(hazard_mode):
+    snapshot = random_snapshot()
+
+    results = []
+    for active_sets in [False, True]:
+        simulator = Simulator(snapshot, gpu=False, num_seed_days=0, nreplicates=2, hazard_mode=hazard_mode,
+                              active_sets=active_sets)
+        simulator.upload_all(snapshot.buffers)
+        simulator.reset(seed=4)
+        for _ in range(8):
+            simulator.step()
+        replicates = []
+        for replicate in range(2):
+            buffers = copy.deepcopy(snapshot.buffers)
+            simulator.download_all(buffers, replicate)
+            replicates.append(buffers)
+        results.append(replicates)
+
+    assert np.any(results[0][0].people_statuses != snapshot.buffers.people_statuses)
+    for expected, actual in zip(*results):
+        for name in expected._fields:
+            assert np.array_equal(getattr(expected, name), getattr(actual, name)), name
+
+
+def test_active_sets_can_not_be_fused():
+    with pytest.raises(ValueError):
+        Simulator(random_snapshot(), gpu=False, fused=True, active_sets=True)
@@ -0,0 +1,92 @@
+import copy
+
+import numpy as np
+import pyopencl as cl
+
+from microsim.opencl.ramp.autotune import LocalSizeCache, autotune, candidate_local_sizes, padded_size, \
+    tunable_kernels, usable_local_sizes
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot
+
+nplaces = 53
+npeople = 701
+nslots = 5
+
+
+def random_snapshot():
+    snapshot = Snapshot.random(nplaces, npeople, nslots, sparse=True)
+    snapshot.buffers.people_statuses[:] = np.random.choice([0, 0, 0, 0, 1, 2, 3, 4, 5], size=npeople)
+    return snapshot
+
+
+def run(snapshot, hazard_mode, local_sizes, steps=5):
+    simulator = Simulator(snapshot, gpu=False, num_seed_days=0, nreplicates=2, hazard_mode=hazard_mode,
+                          local_sizes=local_sizes)
+    simulator.upload_all(copy.deepcopy(snapshot.buffers))
+    for _ in range(steps):
+        simulator.step()
+    statuses = np.zeros(npeople * 2, dtype=np.uint32)
+    hazards = np.zeros(nplaces * 2, dtype=np.uint32)
+    cl.enqueue_copy(simulator.queue, statuses, simulator.buffers.people_statuses)
+    cl.enqueue_copy(simulator.queue, hazards, simulator.buffers.place_hazards)
+    return statuses, hazards
+
+
+def test_padded_size():
+    assert padded_size(701, 64) == 704
+    assert padded_size(704, 64) == 704
+    assert padded_size(1, 32) == 32
+
+
+def test_padded_launches_match_driver_choice():
+    snapshot = random_snapshot()
+    for hazard_mode in ["scatter", "gather"]:
+        statuses, hazards = run(snapshot, hazard_mode, {})
+        # a local size which does not divide the number of people or places, so every launch is padded
+        padded_statuses, padded_hazards = run(snapshot, hazard_mode, {name: 64 for name in tunable_kernels})
+        assert np.array_equal(statuses, padded_statuses)
+        assert np.array_equal(hazards, padded_hazards)
+
+
+def test_local_size_cache(tmp_path):
+    simulator = Simulator(random_snapshot(), gpu=False, local_sizes={})
+    cache = LocalSizeCache(str(tmp_path))
+    assert cache.load(simulator.device, simulator.source_hash, simulator.build_options, npeople) == {}
+
+    cache.store(simulator.device, simulator.source_hash, simulator.build_options, 1000, 100, {"places_reset": 32})
+    cache.store(simulator.device, simulator.source_hash, simulator.build_options, 1000000, 100000,
+                {"places_reset": 256})
+    assert cache.load(simulator.device, simulator.source_hash, simulator.build_options, 2000) == {"places_reset": 32}
+    assert cache.load(simulator.device, simulator.source_hash, simulator.build_options, 500000) == {"places_reset": 256}
+    # tuning again for the same population replaces the previous result
+    cache.store(simulator.device, simulator.source_hash, simulator.build_options, 1000, 100, {"places_reset": 64})
+    assert cache.load(simulator.device, simulator.source_hash, simulator.build_options, 1000) == {"places_reset": 64}
+    # local sizes tuned for other kernel sources are not used
+    assert cache.load(simulator.device, "another source", simulator.build_options, 1000) == {}
+    # nor those tuned for a build of the kernels with other options
+    assert cache.load(simulator.device, simulator.source_hash, simulator.build_options + ["-D COUNTER_PRNG"],
+                      1000) == {}
+
+
+def test_usable_local_sizes():
+    simulator = Simulator(random_snapshot(), gpu=False, local_sizes={})
+    max_size = simulator.kernels.places_reset.get_work_group_info(cl.kernel_work_group_info.WORK_GROUP_SIZE,
+                                                                  simulator.device)
+    # sizes the kernel can't be launched with are left to the driver
+    local_sizes = {"places_reset": max_size * 2, "people_update_flows": None, "people_update_statuses": 1}
+    assert usable_local_sizes(local_sizes, simulator.kernels, simulator.device) == {"people_update_statuses": 1}
+
+
+def test_autotune(tmp_path):
+    snapshot = random_snapshot()
+    simulator = Simulator(snapshot, gpu=False, local_sizes={})
+    simulator.upload_all(copy.deepcopy(snapshot.buffers))
+    local_sizes = autotune(simulator, repeats=1, cache_dir=str(tmp_path))
+
+    assert set(local_sizes.keys()) == set(tunable_kernels)
+    for name, local_size in local_sizes.items():
+        assert local_size in candidate_local_sizes(getattr(simulator.kernels, name), simulator.device)
+    assert simulator.local_sizes == {name: size for name, size in local_sizes.items() if size is not None}
+    cached = LocalSizeCache(str(tmp_path)).load(simulator.device, simulator.source_hash, simulator.build_options,
+                                                npeople)
+    assert cached == local_sizes
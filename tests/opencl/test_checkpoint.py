@@ -0,0 +1,170 @@
+import copy
+import json
+import os
+
+import numpy as np
+import pytest
+
+from microsim.opencl.ramp.checkpoint import Checkpointer, checkpoint_name, clear_checkpoints, latest_checkpoint, \
+    list_checkpoints, load_checkpoint
+from microsim.opencl.ramp.partitioned_simulator import PartitionedSimulator
+from microsim.opencl.ramp.run import resume_headless, run_headless
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot, snapshot_manifest_filename
+
+nplaces = 40
+npeople = 600
+nslots = 5
+iterations = 16
+num_seed_days = 6
+
+
+def random_snapshot():
+    snapshot = Snapshot.random(nplaces, npeople, nslots, sparse=True)
+    snapshot.buffers.people_statuses[:] = np.random.choice([0, 0, 0, 0, 0, 2, 3], size=npeople)
+    # some high risk people to seed initial cases from
+    snapshot.area_codes = np.random.choice(["E02004143", "E02004129", "E02004130"], npeople)
+    snapshot.not_home_probs = np.random.rand(npeople)
+    snapshot.lockdown_multipliers = np.linspace(1.0, 0.4, iterations).astype(np.float32)
+    return snapshot
+
+
+def create_simulator(snapshot, options):
+    simulator_class = PartitionedSimulator if "npartitions" in options else Simulator
+    simulator = simulator_class(snapshot, gpu=False, num_seed_days=num_seed_days, **options)
+    simulator.upload_all(copy.deepcopy(snapshot.buffers))
+    return simulator
+
+
+def final_state(simulator, snapshot, summary):
+    buffers = copy.deepcopy(snapshot.buffers)
+    simulator.download_all(buffers)
+    return summary, buffers.people_statuses, buffers.people_transition_times
+
+
+def run(snapshot, options, checkpointer_dir=None, every=5, keep=3):
+    np.random.seed(1)  # initial cases are chosen with numpy's random numbers
+    simulator = create_simulator(snapshot, options)
+    checkpointer = None
+    if checkpointer_dir is not None:
+        checkpointer = Checkpointer(simulator, snapshot, checkpointer_dir, every, keep=keep)
+    summary, _ = run_headless(simulator, snapshot, iterations, quiet=True, checkpointer=checkpointer)
+    if checkpointer is not None:
+        checkpointer.close()
+    return final_state(simulator, snapshot, summary)
+
+
+def resume(snapshot, options, checkpoint_path):
+    np.random.seed(2)  # the checkpoint must not depend on numpy's random state when resuming
+    simulator = create_simulator(snapshot, options)
+    summary, _ = resume_headless(simulator, snapshot, checkpoint_path, iterations, quiet=True)
+    return final_state(simulator, snapshot, summary)
+
+
+def assert_same_run(run_a, run_b):
+    summary_a, statuses_a, transition_times_a = run_a
+    summary_b, statuses_b, transition_times_b = run_b
+    assert np.array_equal(summary_a.total_counts, summary_b.total_counts)
+    assert np.array_equal(summary_a.age_status_counts, summary_b.age_status_counts)
+    assert np.array_equal(summary_a.area_status_counts, summary_b.area_status_counts)
+    assert np.array_equal(statuses_a, statuses_b)
+    assert np.array_equal(transition_times_a, transition_times_b)
+
+
+@pytest.mark.parametrize("options", [{}, {"counter_prngs": True}, {"fused": True},
+                                     {"npartitions": 2, "hazard_mode": "scatter"}])
+def test_resume_matches_uninterrupted_run(tmp_path, options):
+    snapshot = random_snapshot()
+    expected = run(snapshot, options)
+    checkpoint_dir = str(tmp_path / "checkpoints")
+
+    # checkpointing does not change the run
+    assert_same_run(expected, run(snapshot, options, checkpoint_dir))
+    checkpoints = list_checkpoints(checkpoint_dir)
+    assert [os.path.basename(path) for path in checkpoints] == [checkpoint_name(day) for day in [5, 10, 15]]
+
+    # resuming from any checkpoint, including one during seeding, continues exactly where the run was
+    for checkpoint_path in checkpoints:
+        assert_same_run(expected, resume(snapshot, options, checkpoint_path))
+
+
+def test_checkpoints_hold_only_replicated_buffers(tmp_path):
+    snapshot = random_snapshot()
+    checkpoint_dir = str(tmp_path / "checkpoints")
+    options = {"nreplicates": 2}
+    np.random.seed(1)
+    simulator = create_simulator(snapshot, options)
+    simulator.seed_prngs([3, 4])
+    checkpointer = Checkpointer(simulator, snapshot, checkpoint_dir, every=4, keep=2)
+    for _ in range(4):
+        simulator.step()
+    checkpointer.save([])
+    checkpointer.close()
+
+    path = latest_checkpoint(checkpoint_dir)
+    assert os.path.basename(path) == checkpoint_name(4)
+    for replicate in range(2):
+        replicate_path = os.path.join(path, f"replicate_{replicate}")
+        with open(os.path.join(replicate_path, snapshot_manifest_filename)) as f:
+            manifest = json.load(f)
+        assert manifest["time"] == 4
+        assert manifest["snapshot"] == snapshot.name
+        # the static buffers are not saved, they come from the snapshot the run started from
+        assert sorted(manifest["arrays"]) == sorted(simulator.pristine_buffers)
+        assert not os.path.exists(os.path.join(replicate_path, "people_ages.npy"))
+        statuses = np.zeros(npeople, dtype=np.uint32)
+        simulator.download("people_statuses", statuses, replicate)
+        assert np.array_equal(np.load(os.path.join(replicate_path, "people_statuses.npy")), statuses)
+
+    # the checkpoint can only be loaded into a simulator with the same number of replicates
+    with pytest.raises(ValueError):
+        load_checkpoint(create_simulator(snapshot, {}), path)
+
+    # or created from a snapshot of the same size
+    other_snapshot = Snapshot.random(nplaces, npeople + 1, nslots)
+    with pytest.raises(ValueError):
+        load_checkpoint(create_simulator(other_snapshot, options), path)
+
+
+def test_only_latest_checkpoints_are_kept(tmp_path):
+    snapshot = random_snapshot()
+    checkpoint_dir = str(tmp_path / "checkpoints")
+    assert latest_checkpoint(checkpoint_dir) is None
+    run(snapshot, {}, checkpoint_dir, every=3, keep=2)
+
+    # incomplete checkpoints are ignored
+    os.makedirs(os.path.join(checkpoint_dir, checkpoint_name(99) + ".tmp"))
+    checkpoints = list_checkpoints(checkpoint_dir)
+    assert [os.path.basename(path) for path in checkpoints] == [checkpoint_name(day) for day in [12, 15]]
+    assert latest_checkpoint(checkpoint_dir) == checkpoints[-1]
+
+
+def test_checkpoints_of_another_run_are_rejected(tmp_path):
+    snapshot = random_snapshot()
+    checkpoint_dir = str(tmp_path / "checkpoints")
+    run(snapshot, {}, checkpoint_dir, every=5)
+    path = latest_checkpoint(checkpoint_dir)
+
+    # a snapshot of the same size with different contents
+    with pytest.raises(ValueError):
+        load_checkpoint(create_simulator(random_snapshot(), {}), path)
+    # or different options
+    with pytest.raises(ValueError):
+        load_checkpoint(create_simulator(snapshot, {"fused": True}), path)
+    load_checkpoint(create_simulator(copy.deepcopy(snapshot), {}), path)
+
+
+def test_clear_checkpoints_of_earlier_run(tmp_path):
+    checkpoint_dir = str(tmp_path / "checkpoints")
+    clear_checkpoints(checkpoint_dir)
+    run(random_snapshot(), {}, checkpoint_dir, every=15)
+    # checkpoints of an earlier run which got further than the new one will
+    os.replace(os.path.join(checkpoint_dir, checkpoint_name(15)), os.path.join(checkpoint_dir, checkpoint_name(99)))
+    os.makedirs(os.path.join(checkpoint_dir, checkpoint_name(100) + ".tmp"))
+
+    # otherwise the earlier run's checkpoint would be kept as the latest, and the new run's deleted
+    clear_checkpoints(checkpoint_dir)
+    assert os.listdir(checkpoint_dir) == []
+    snapshot = random_snapshot()
+    run(snapshot, {}, checkpoint_dir, every=5, keep=1)
+    assert latest_checkpoint(checkpoint_dir) == os.path.join(checkpoint_dir, checkpoint_name(15))
@@ -0,0 +1,55 @@
+import numpy as np
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot
+from microsim.opencl.ramp.summary import Summary
+
+nplaces = 20
+npeople = 1003
+nslots = 4
+nstatuses = 7
+
+
+def test_total_counts_match_host_counts():
+    snapshot = Snapshot.random(nplaces, npeople, nslots)
+    statuses = np.random.randint(nstatuses, size=(2, npeople)).astype(np.uint32)
+
+    simulator = Simulator(snapshot, gpu=False, nreplicates=2)
+    simulator.upload_all(snapshot.buffers)
+    simulator.upload("people_statuses", statuses[0], 0)
+    simulator.upload("people_statuses", statuses[1], 1)
+
+    total_counts, age_counts, area_counts = simulator.count_statuses()
+
+    assert age_counts is None and area_counts is None
+    for replicate in range(2):
+        expected = np.bincount(statuses[replicate], minlength=nstatuses)
+        assert np.array_equal(expected, total_counts[replicate])
+
+    # counts are reset between calls rather than accumulating
+    total_counts, _, _ = simulator.count_statuses()
+    assert total_counts[0].sum() == npeople
+
+
+def test_detailed_counts_match_summary():
+    snapshot = Snapshot.random(nplaces, npeople, nslots)
+    snapshot.area_codes = np.random.choice(["E02004129", "E02004130", "E02004131"], npeople)
+    statuses = np.random.randint(nstatuses, size=npeople).astype(np.uint32)
+
+    host_summary = Summary(snapshot, store_detailed_counts=True, max_time=3)
+    host_summary.update(1, statuses)
+
+    simulator = Simulator(snapshot, gpu=False)
+    simulator.upload_all(snapshot.buffers)
+    simulator.upload("people_statuses", statuses)
+    simulator.set_count_bins(host_summary.age_bins, len(host_summary.age_thresholds),
+                             host_summary.area_ids, len(host_summary.unique_area_codes))
+
+    total_counts, age_counts, area_counts = simulator.count_statuses(detailed=True)
+    device_summary = Summary(snapshot, store_detailed_counts=True, max_time=3)
+    device_summary.update_from_counts(1, total_counts[0], age_counts[0], area_counts[0])
+
+    for status in range(nstatuses):
+        assert np.array_equal(host_summary.total_counts[status], device_summary.total_counts[status])
+    for status in host_summary.age_counts.keys():
+        assert np.array_equal(host_summary.age_counts[status], device_summary.age_counts[status])
+        assert np.array_equal(host_summary.area_counts[status], device_summary.area_counts[status])
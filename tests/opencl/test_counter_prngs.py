@@ -0,0 +1,141 @@
+import copy
+import os
+
+import numpy as np
+import pyopencl as cl
+
+from microsim.opencl.ramp.disease_statuses import DiseaseStatus
+from microsim.opencl.ramp.partitioned_simulator import PartitionedSimulator
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot
+
+nplaces = 40
+npeople = 500
+nslots = 6
+steps = 10
+
+
+def random_snapshot():
+    snapshot = Snapshot.random(nplaces, npeople, nslots, sparse=True)
+    flows = np.random.rand(npeople, nslots).astype(np.float32)
+    snapshot.buffers.people_baseline_flows[:] = (flows / flows.sum(axis=1, keepdims=True)).flatten()
+    snapshot.buffers.people_flows[:] = snapshot.buffers.people_baseline_flows
+    snapshot.buffers.people_statuses[:] = np.random.choice([0, 0, 0, 2, 3, 4], size=npeople)
+    snapshot.area_codes = np.random.choice(["E02004129", "E02004130"], npeople)
+    return snapshot
+
+
+def run(simulator, snapshot, seeds=None, seed=None):
+    """Run a simulator with counter-based random numbers and download the statuses of every replicate."""
+    simulator.upload_all(copy.deepcopy(snapshot.buffers))
+    simulator.reset()
+    if seeds is not None:
+        simulator.seed_prngs(seeds)
+    if seed is not None:
+        simulator.seed_prngs_on_device(seed)
+    for _ in range(steps):
+        simulator.step()
+    statuses = np.zeros((simulator.nreplicates, npeople), dtype=np.uint32)
+    for replicate in range(simulator.nreplicates):
+        simulator.download("people_statuses", statuses[replicate], replicate)
+    return statuses
+
+
+def test_philox_known_answers():
+    # known answer tests of Philox4x32-10 from the Random123 library
+    ctx = cl.create_some_context(interactive=False)
+    queue = cl.CommandQueue(ctx)
+    source = """
+        #include "prng.cl"
+        kernel void philox(global const uint4* counters, global const uint2* keys, global uint4* out) {
+          out[get_global_id(0)] = philox4x32_10(counters[get_global_id(0)], keys[get_global_id(0)]);
+        }
+    """
+    kernel_dir = os.path.join("microsim/opencl/", "ramp/kernels/")
+    program = cl.Program(ctx, source).build(options=[f"-I {kernel_dir}"])
+
+    counters = np.array([[0, 0, 0, 0], [0xffffffff] * 4, [0x243f6a88, 0x85a308d3, 0x13198a2e, 0x03707344]],
+                        dtype=np.uint32)
+    keys = np.array([[0, 0], [0xffffffff] * 2, [0xa4093822, 0x299f31d0]], dtype=np.uint32)
+    expected = np.array([[0x6627e8d5, 0xe169c58d, 0xbc57ac4c, 0x9b00dbd8],
+                         [0x408f276d, 0x41c83b0e, 0xa20bc7c6, 0x6d5451fd],
+                         [0xd16cfe09, 0x94fdcceb, 0x5001e420, 0x24126ea1]], dtype=np.uint32)
+    out = np.zeros_like(expected)
+    mf = cl.mem_flags
+    counters_buffer = cl.Buffer(ctx, mf.READ_ONLY | mf.COPY_HOST_PTR, hostbuf=counters)
+    keys_buffer = cl.Buffer(ctx, mf.READ_ONLY | mf.COPY_HOST_PTR, hostbuf=keys)
+    out_buffer = cl.Buffer(ctx, mf.WRITE_ONLY, out.nbytes)
+    program.philox(queue, (3,), None, counters_buffer, keys_buffer, out_buffer)
+    cl.enqueue_copy(queue, out, out_buffer)
+
+    assert np.array_equal(out, expected)
+
+
+def test_susceptible_become_infected():
+    test_hazard = 0.4
+    n = 50000
+    snapshot = Snapshot.random(8, n, 8)
+    snapshot.buffers.people_hazards[:] = test_hazard
+    snapshot.buffers.people_statuses[:] = DiseaseStatus.Susceptible.value
+    snapshot.buffers.people_transition_times[:] = 0
+
+    simulator = Simulator(snapshot, gpu=False, counter_prngs=True)
+    simulator.upload_all(snapshot.buffers)
+    simulator.step_kernel("people_update_statuses")
+
+    statuses = np.zeros(n, dtype=np.uint32)
+    simulator.download("people_statuses", statuses)
+    proportion_exposed = np.count_nonzero(statuses == DiseaseStatus.Exposed.value) / n
+    assert np.isclose(1.0 - np.exp(-test_hazard), proportion_exposed, atol=0.01)
+
+    # the draws of the next step are independent of the first, so about the same fraction of the rest are infected
+    simulator.upload("people_statuses", np.full(n, DiseaseStatus.Susceptible.value, dtype=np.uint32))
+    simulator.time += np.uint32(1)
+    simulator.step_kernel("people_update_statuses")
+    next_statuses = np.zeros(n, dtype=np.uint32)
+    simulator.download("people_statuses", next_statuses)
+    both_exposed = np.count_nonzero((statuses == DiseaseStatus.Exposed.value) &
+                                    (next_statuses == DiseaseStatus.Exposed.value)) / n
+    assert np.isclose(proportion_exposed ** 2, both_exposed, atol=0.01)
+
+
+def test_no_prng_states_on_device():
+    simulator = Simulator(random_snapshot(), gpu=False, counter_prngs=True)
+    assert simulator.buffers.people_prngs.size == 16
+    assert "people_prngs" not in simulator.pristine_buffers
+
+
+def test_seeds():
+    snapshot = random_snapshot()
+    simulator = Simulator(snapshot, gpu=False, num_seed_days=0, nreplicates=2, counter_prngs=True)
+
+    statuses = run(simulator, snapshot, seeds=[7, 8])
+    assert np.array_equal(statuses, run(simulator, snapshot, seeds=[7, 8]))
+    assert not np.array_equal(statuses[0], statuses[1])
+
+    # a replicate seeded with a seed matches a single simulation seeded with it
+    single = Simulator(snapshot, gpu=False, num_seed_days=0, counter_prngs=True)
+    assert np.array_equal(statuses[1], run(single, snapshot, seeds=[8])[0])
+
+    # seeding on the device gives each replicate its own stream, the first matching a single simulation
+    statuses = run(simulator, snapshot, seed=3)
+    assert not np.array_equal(statuses[0], statuses[1])
+    assert np.array_equal(statuses[0], run(single, snapshot, seed=3)[0])
+
+    # resetting returns to the keys the simulator started with
+    assert np.array_equal(run(simulator, snapshot), run(simulator, snapshot, seed=0))
+
+
+def test_fused_and_partitioned_match_simulator():
+    snapshot = random_snapshot()
+    simulator = Simulator(snapshot, gpu=False, num_seed_days=0, nreplicates=2, hazard_mode="scatter",
+                          counter_prngs=True)
+    statuses = run(simulator, snapshot, seed=11)
+
+    fused = Simulator(snapshot, gpu=False, num_seed_days=0, nreplicates=2, fused=True, counter_prngs=True)
+    assert np.array_equal(statuses, run(fused, snapshot, seed=11))
+
+    partitioned = PartitionedSimulator(snapshot, npartitions=3, gpu=False, num_seed_days=0, nreplicates=2,
+                                       hazard_mode="scatter", counter_prngs=True)
+    assert np.array_equal(statuses, run(partitioned, snapshot, seed=11))
+    assert np.array_equal(run(simulator, snapshot, seeds=[5, 6]), run(partitioned, snapshot, seeds=[5, 6]))
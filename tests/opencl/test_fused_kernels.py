@@ -0,0 +1,72 @@
+import copy
+
+import numpy as np
+import pytest
+
+from microsim.opencl.ramp.activity import Activity
+from microsim.opencl.ramp.params import Params
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot
+
+nplaces = 60
+npeople = 500
+nslots = 6
+
+
+def reference_snapshot():
+    """A random snapshot with empty slots, people with no home or several homes, and a lockdown."""
+    snapshot = Snapshot.random(nplaces, npeople, nslots, sparse=True)
+    snapshot.buffers.place_activities[:] = np.random.randint(len(Activity), size=nplaces)
+    flows = np.random.rand(npeople, nslots).astype(np.float32)
+    snapshot.buffers.people_baseline_flows[:] = (flows / flows.sum(axis=1, keepdims=True)).flatten()
+    snapshot.buffers.people_flows[:] = snapshot.buffers.people_baseline_flows
+    snapshot.buffers.people_statuses[:] = np.random.choice([0, 0, 0, 2, 3, 4], size=npeople)
+    params = Params()
+    params.lockdown_multiplier = 0.6
+    params.place_hazard_multipliers = np.array([0.2, 0.3, 0.4, 0.5, 0.6], dtype=np.float32)
+    snapshot.update_params(params)
+    return snapshot
+
+
+def run(snapshot, fused, steps=8):
+    simulator = Simulator(snapshot, gpu=False, num_seed_days=0, nreplicates=2, hazard_mode="scatter", fused=fused)
+    simulator.upload_all(snapshot.buffers)
+    simulator.reset(seed=11)
+    for _ in range(steps):
+        simulator.step()
+    if not fused:
+        # downloaded fused flows are computed from the current statuses, ie. they are the flows of the next step
+        simulator.step_kernel("people_update_flows")
+    results = []
+    for replicate in range(2):
+        buffers = copy.deepcopy(snapshot.buffers)
+        simulator.download_all(buffers, replicate)
+        results.append(buffers)
+    return results
+
+
+@pytest.mark.parametrize("quantised,packed", [(False, False), (False, True), (True, False)])
+def test_fused_kernels_match_unfused_kernels(quantised, packed):
+    snapshot = reference_snapshot()
+    if packed:
+        snapshot.pack_slots()
+    if quantised:
+        snapshot.quantise_flows()
+
+    expected = run(snapshot, fused=False)
+    actual = run(snapshot, fused=True)
+
+    assert np.any(expected[0].people_statuses != snapshot.buffers.people_statuses)
+    for expected_buffers, actual_buffers in zip(expected, actual):
+        for name in expected_buffers._fields:
+            assert np.array_equal(getattr(expected_buffers, name), getattr(actual_buffers, name)), name
+
+
+def test_fused_simulator_has_no_flows_buffer():
+    snapshot = reference_snapshot()
+    simulator = Simulator(snapshot, gpu=False, fused=True)
+    assert simulator.buffers.people_flows.size == 4
+    assert not simulator.uses_gather()
+
+    with pytest.raises(ValueError):
+        Simulator(snapshot, gpu=False, fused=True, hazard_mode="gather")
@@ -0,0 +1,103 @@
+import numpy as np
+
+from microsim.opencl.ramp.disease_statuses import DiseaseStatus
+from microsim.opencl.ramp.params import Params
+from microsim.opencl.ramp.simulator import Simulator, place_visitor_index
+from microsim.opencl.ramp.snapshot import Snapshot
+
+sentinel_value = (1 << 31) - 1
+
+
+def random_hazard_snapshot(nplaces, npeople, nslots):
+    snapshot = Snapshot.random(nplaces, npeople, nslots)
+    snapshot.buffers.people_place_ids[:] = np.random.randint(nplaces, size=npeople * nslots)
+    snapshot.buffers.people_place_ids[np.random.rand(npeople * nslots) < 0.2] = sentinel_value
+    snapshot.buffers.people_statuses[:] = np.random.randint(len(DiseaseStatus), size=npeople)
+    snapshot.buffers.place_activities[:] = np.random.randint(5, size=nplaces)
+    params = Params()
+    params.place_hazard_multipliers = np.random.rand(5).astype(np.float32)
+    snapshot.update_params(params)
+    return snapshot
+
+
+def test_place_visitor_index():
+    people_place_ids = np.array([[2, 0, sentinel_value],
+                                 [0, 3, 2]], dtype=np.uint32).flatten()
+    people_slot_offsets = np.array([0, 3, 6], dtype=np.uint32)
+
+    offsets, flow_ids, people_ids = place_visitor_index(people_place_ids, people_slot_offsets, nplaces=4)
+
+    assert np.array_equal(offsets, [0, 2, 2, 4, 5])
+    assert np.array_equal(flow_ids, [1, 3, 0, 5, 4])
+    assert np.array_equal(people_ids, [0, 1, 0, 1, 1])
+
+
+def test_gather_hazards_matches_send_hazards():
+    nplaces = 50
+    npeople = 1000
+    nslots = 8
+    snapshot = random_hazard_snapshot(nplaces, npeople, nslots)
+
+    results = []
+    for kernel in ["people_send_hazards", "places_gather_hazards"]:
+        simulator = Simulator(snapshot, gpu=False)
+        simulator.upload_all(snapshot.buffers)
+        simulator.step_kernel("people_update_flows")
+        # fill the place buffers with garbage to check the gather kernel overwrites them
+        simulator.upload("place_hazards", np.full(nplaces, 12345, dtype=np.uint32))
+        simulator.upload("place_counts", np.full(nplaces, 12345, dtype=np.uint32))
+        if kernel == "people_send_hazards":
+            simulator.step_kernel("places_reset")
+        simulator.step_kernel(kernel)
+
+        place_hazards = np.zeros(nplaces, dtype=np.uint32)
+        place_counts = np.zeros(nplaces, dtype=np.uint32)
+        simulator.download("place_hazards", place_hazards)
+        simulator.download("place_counts", place_counts)
+        results.append((place_hazards, place_counts))
+
+    # hazards are summed in fixed point, so the order of accumulation makes no difference
+    assert np.any(results[0][0] > 0)
+    assert np.array_equal(results[0][0], results[1][0])
+    assert np.array_equal(results[0][1], results[1][1])
+
+
+def test_hazard_modes_give_identical_simulations():
+    nplaces = 30
+    npeople = 500
+    nslots = 6
+    snapshot = random_hazard_snapshot(nplaces, npeople, nslots)
+
+    statuses = {}
+    for hazard_mode in ["scatter", "gather", "auto"]:
+        simulator = Simulator(snapshot, gpu=False, num_seed_days=0, nreplicates=2, hazard_mode=hazard_mode)
+        simulator.upload_all(snapshot.buffers)
+        simulator.seed_prngs([1, 2])
+        for _ in range(10):
+            simulator.step()
+            simulator.count_statuses()
+        statuses[hazard_mode] = [np.zeros(npeople, dtype=np.uint32) for _ in range(2)]
+        for replicate in range(2):
+            simulator.download("people_statuses", statuses[hazard_mode][replicate], replicate)
+
+    for replicate in range(2):
+        assert np.array_equal(statuses["scatter"][replicate], statuses["gather"][replicate])
+        assert np.array_equal(statuses["scatter"][replicate], statuses["auto"][replicate])
+
+
+def test_auto_hazard_mode_uses_infectious_fraction():
+    snapshot = Snapshot.random(nplaces=10, npeople=100, nslots=4)
+    snapshot.buffers.people_statuses[:] = DiseaseStatus.Susceptible.value
+    simulator = Simulator(snapshot, gpu=False, gather_threshold=0.1)
+    simulator.upload_all(snapshot.buffers)
+    assert not simulator.uses_gather()
+
+    statuses = snapshot.buffers.people_statuses.copy()
+    statuses[:20] = DiseaseStatus.Symptomatic.value
+    simulator.upload("people_statuses", statuses)
+    simulator.count_statuses()
+    assert simulator.infectious_fraction == 0.2
+    assert simulator.uses_gather()
+
+    simulator.reset()
+    assert not simulator.uses_gather()
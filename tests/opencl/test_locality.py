@@ -0,0 +1,97 @@
+import copy
+import os
+
+import numpy as np
+
+from microsim.opencl.ramp.buffers import sentinel_value
+from microsim.opencl.ramp.locality import hilbert_curve_index
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot
+
+
+def test_hilbert_curve_index():
+    order = 3
+    x, y = np.meshgrid(np.arange(1 << order), np.arange(1 << order))
+    x = x.flatten()
+    y = y.flatten()
+
+    d = hilbert_curve_index(x, y, order)
+
+    # every cell is visited exactly once, and consecutive cells along the curve are adjacent on the grid
+    assert np.array_equal(np.sort(d), np.arange(1 << (2 * order)))
+    path = np.argsort(d)
+    steps = np.abs(np.diff(x[path])) + np.abs(np.diff(y[path]))
+    assert np.all(steps == 1)
+
+
+def random_reorderable_snapshot(nplaces, npeople, nslots):
+    snapshot = Snapshot.random(nplaces, npeople, nslots)
+    snapshot.buffers.people_place_ids[:] = np.random.randint(nplaces, size=npeople * nslots)
+    snapshot.buffers.people_place_ids[nslots - 1::nslots] = sentinel_value  # leave the last slot empty
+    snapshot.buffers.people_statuses[:] = np.random.choice([0, 2, 3, 4], size=npeople)
+    # E02004143 is a high risk area, so there are people to seed initial cases from
+    snapshot.area_codes = np.random.choice(["E02004129", "E02004130", "E02004143"], npeople)
+    return snapshot
+
+
+def test_reorder_for_locality_preserves_results():
+    nplaces = 64
+    npeople = 500
+    nslots = 8
+    snapshot = random_reorderable_snapshot(nplaces, npeople, nslots)
+    reordered_snapshot = copy.deepcopy(snapshot)
+    reordered_snapshot.reorder_for_locality()
+
+    # people who share a home are now adjacent, and places are grouped by activity
+    assert np.all(np.diff(reordered_snapshot.buffers.place_activities.astype(int)) >= 0)
+    assert not np.array_equal(reordered_snapshot.people_order, np.arange(npeople))
+
+    # the static data is the same once put back into the original order
+    assert np.array_equal(reordered_snapshot.to_original_people_order(reordered_snapshot.buffers.people_ages),
+                          snapshot.buffers.people_ages)
+    assert np.array_equal(reordered_snapshot.to_original_place_order(reordered_snapshot.buffers.place_coords),
+                          snapshot.buffers.place_coords)
+    assert np.array_equal(reordered_snapshot.to_original_people_order(reordered_snapshot.area_codes),
+                          snapshot.area_codes)
+
+    # every person visits the same places (by original id) with the same flows
+    place_ids = reordered_snapshot.to_original_people_order(reordered_snapshot.buffers.people_place_ids)
+    valid = place_ids != sentinel_value
+    place_ids[valid] = reordered_snapshot.place_order[place_ids[valid]]
+    assert np.array_equal(place_ids, snapshot.buffers.people_place_ids)
+
+    # each person has their own PRNG state from the snapshot, initial cases are chosen in the original order of the
+    # people and hazards are accumulated in fixed point, so running the model on the reordered snapshot gives exactly
+    # the same results
+    results = []
+    for s in [snapshot, reordered_snapshot]:
+        np.random.seed(0)  # initial cases are chosen with numpy's random numbers
+        simulator = Simulator(s, gpu=False, num_seed_days=5)
+        high_risk_ids = simulator.initial_cases[0].high_risk_ids
+        assert len(high_risk_ids) > 0
+        assert np.all(np.asarray(s.area_codes)[high_risk_ids] == "E02004143")
+        assert np.all(s.not_home_probs[high_risk_ids] > 0.3)
+        simulator.upload_all(s.buffers)
+        for _ in range(5):
+            simulator.step()
+        statuses = np.zeros(npeople, dtype=np.uint32)
+        hazards = np.zeros(nplaces, dtype=np.uint32)
+        simulator.download("people_statuses", statuses)
+        simulator.download("place_hazards", hazards)
+        results.append((s.to_original_people_order(statuses), s.to_original_place_order(hazards)))
+
+    assert np.array_equal(results[0][0], results[1][0])
+    assert np.array_equal(results[0][1], results[1][1])
+
+
+def test_save_and_load_reordered_snapshot():
+    snapshot = random_reorderable_snapshot(nplaces=20, npeople=50, nslots=4)
+    snapshot.reorder_for_locality()
+
+    snapshot_path = "tests/opencl/reordered.npz"
+    snapshot.save(snapshot_path)
+    loaded_snapshot = Snapshot.load_full_snapshot(snapshot_path)
+    os.remove(snapshot_path)
+
+    assert np.array_equal(snapshot.people_order, loaded_snapshot.people_order)
+    assert np.array_equal(snapshot.place_order, loaded_snapshot.place_order)
@@ -0,0 +1,92 @@
+import copy
+import os
+import shutil
+
+import numpy as np
+
+from microsim.opencl.ramp.buffers import sentinel_value
+from microsim.opencl.ramp.disease_statuses import DiseaseStatus
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot
+
+
+def random_sparse_snapshot(nplaces, npeople, nslots):
+    """A random snapshot where each person uses a random number of their slots, with the rest empty."""
+    snapshot = Snapshot.random(nplaces, npeople, nslots, sparse=True)
+    snapshot.buffers.people_statuses[:] = np.random.choice([0, 0, 0, 2, 3, 4], size=npeople)
+    snapshot.area_codes = np.random.choice(["E02004129", "E02004130"], npeople)
+    return snapshot
+
+
+def test_pack_slots():
+    snapshot = Snapshot.zeros(nplaces=4, npeople=3, nslots=3)
+    snapshot.buffers.people_place_ids[:] = [2, sentinel_value, sentinel_value,
+                                            sentinel_value, sentinel_value, sentinel_value,
+                                            0, 1, 3]
+    snapshot.buffers.people_baseline_flows[:] = np.arange(9)
+    assert snapshot.has_fixed_slots()
+
+    padded_place_ids = snapshot.to_padded_slots(snapshot.buffers.people_place_ids)
+    snapshot.pack_slots()
+
+    assert not snapshot.has_fixed_slots()
+    assert snapshot.nvisits == 4
+    assert np.array_equal(snapshot.buffers.people_slot_offsets, [0, 1, 1, 4])
+    assert np.array_equal(snapshot.buffers.people_place_ids, [2, 0, 1, 3])
+    assert np.array_equal(snapshot.buffers.people_baseline_flows, [0, 6, 7, 8])
+    assert np.array_equal(snapshot.to_padded_slots(snapshot.buffers.people_place_ids), padded_place_ids)
+
+
+def test_packed_slots_give_identical_simulations():
+    nplaces = 40
+    npeople = 300
+    nslots = 8
+    snapshot = random_sparse_snapshot(nplaces, npeople, nslots)
+    packed_snapshot = copy.deepcopy(snapshot)
+    packed_snapshot.pack_slots()
+    reordered_packed_snapshot = copy.deepcopy(packed_snapshot)
+    reordered_packed_snapshot.reorder_for_locality()
+    assert packed_snapshot.nvisits < npeople * nslots
+
+    for hazard_mode in ["scatter", "gather"]:
+        results = []
+        for s in [snapshot, packed_snapshot, reordered_packed_snapshot]:
+            simulator = Simulator(s, gpu=False, num_seed_days=0, hazard_mode=hazard_mode)
+            simulator.upload_all(s.buffers)
+            for _ in range(5):
+                simulator.step()
+            statuses = np.zeros(npeople, dtype=np.uint32)
+            people_hazards = np.zeros(npeople, dtype=np.float32)
+            place_hazards = np.zeros(nplaces, dtype=np.uint32)
+            flows = np.zeros(s.nvisits, dtype=np.float32)
+            simulator.download("people_statuses", statuses)
+            simulator.download("people_hazards", people_hazards)
+            simulator.download("place_hazards", place_hazards)
+            simulator.download("people_flows", flows)
+            results.append((s.to_original_people_order(statuses), s.to_original_people_order(people_hazards),
+                            s.to_original_place_order(place_hazards), s.to_original_people_order(flows)))
+
+        assert np.any(results[0][0] != DiseaseStatus.Susceptible.value)
+        for result in results[1:]:
+            for expected, actual in zip(results[0][:3], result[:3]):
+                assert np.array_equal(expected, actual)
+            # the flows of the used slots are the same
+            used = snapshot.buffers.people_place_ids != sentinel_value
+            assert np.array_equal(results[0][3][used], result[3])
+
+
+def test_save_and_load_packed_snapshot():
+    snapshot = random_sparse_snapshot(nplaces=20, npeople=50, nslots=4)
+    snapshot.pack_slots()
+
+    for snapshot_path in ["tests/opencl/packed.npz", "tests/opencl/packed"]:
+        snapshot.save(snapshot_path)
+        loaded_snapshot = Snapshot.load_full_snapshot(snapshot_path)
+        if os.path.isdir(snapshot_path):
+            shutil.rmtree(snapshot_path)
+        else:
+            os.remove(snapshot_path)
+
+        assert loaded_snapshot.nvisits == snapshot.nvisits
+        for name in ["people_slot_offsets", "people_place_ids", "people_baseline_flows"]:
+            assert np.array_equal(getattr(snapshot.buffers, name), getattr(loaded_snapshot.buffers, name))
@@ -1,6 +1,9 @@
 import numpy as np
 
-from microsim.opencl.ramp.params import Params
+import pytest
+
+from microsim.opencl.ramp.params import Params, params_layout, params_schedule, infer_params_layout, \
+    migrate_params_array
 
 
 def test_params_to_from_array():
@@ -11,3 +14,46 @@ def test_params_to_from_array():
     params_from_array_array = params_from_array.asarray()
 
     assert np.all(params_array == params_from_array_array)
+
+
+def test_migrate_params_array():
+    params_array = Params().asarray()
+
+    # a params array from before the health multipliers were appended to the layout
+    old_layout = infer_params_layout(params_array.size - 4)
+    assert old_layout == params_layout[:-4]
+    old_params_array = params_array[:-4] * 2
+
+    migrated_params_array = migrate_params_array(old_params_array, old_layout)
+
+    assert migrated_params_array.size == params_array.size
+    assert np.all(migrated_params_array[:-4] == old_params_array)
+    assert np.all(migrated_params_array[-4:] == params_array[-4:])
+
+    # arrays already in the current layout are unchanged
+    assert migrate_params_array(params_array, params_layout) is params_array
+
+
+def test_params_schedule():
+    params = Params()
+    params_array = params.asarray()
+
+    # without any schedules there is a single row
+    assert np.array_equal(params_schedule(params), params_array[np.newaxis])
+
+    lockdown_multipliers = np.array([1.0, 0.8, 0.6])
+    place_hazard_multipliers = np.array([[0.01] * 5, [0.02] * 5, [0.03] * 5, [0.04] * 5, [0.05] * 5])
+    schedule = params_schedule(params, lockdown_multipliers,
+                               overrides={"place_hazard_multipliers": place_hazard_multipliers})
+    assert schedule.shape == (5, params_array.size)
+    assert schedule.dtype == np.float32
+
+    for day, row in enumerate(schedule):
+        day_params = Params.fromarray(row)
+        # the shorter lockdown schedule keeps its last value
+        assert day_params.lockdown_multiplier == np.float32(lockdown_multipliers[min(day, 2)])
+        assert np.array_equal(day_params.place_hazard_multipliers, place_hazard_multipliers[day].astype(np.float32))
+        assert day_params.symptomatic_multiplier == np.float32(params.symptomatic_multiplier)
+
+    with pytest.raises(ValueError):
+        params_schedule(params, overrides={"not_a_field": [1.0]})
@@ -0,0 +1,83 @@
+import copy
+
+import numpy as np
+import pytest
+
+from microsim.opencl.ramp.params import Params, params_schedule
+from microsim.opencl.ramp.partitioned_simulator import PartitionedSimulator
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot
+
+nplaces = 30
+npeople = 500
+nslots = 5
+iterations = 12
+
+
+def random_snapshot():
+    snapshot = Snapshot.random(nplaces, npeople, nslots, sparse=True)
+    snapshot.buffers.people_statuses[:] = np.random.choice([0, 0, 0, 2, 3, 4], size=npeople)
+    snapshot.area_codes = np.random.choice(["E02004129", "E02004130"], npeople)
+    return snapshot
+
+
+def day_schedule():
+    """A schedule where the lockdown tightens and the place hazards drop part way through the run."""
+    params = Params()
+    lockdown_multipliers = np.linspace(1.0, 0.3, iterations // 2)
+    place_hazard_multipliers = np.repeat([params.place_hazard_multipliers * 20,
+                                          params.place_hazard_multipliers * 5], [4, 3], axis=0)
+    return params_schedule(params, lockdown_multipliers,
+                           overrides={"place_hazard_multipliers": place_hazard_multipliers})
+
+
+def run(simulator, snapshot, schedule, upload_each_day):
+    simulator.upload_all(copy.deepcopy(snapshot.buffers))
+    simulator.reset(seed=2)
+    if not upload_each_day:
+        simulator.upload_params_schedule(schedule)
+    for time in range(iterations):
+        if upload_each_day:
+            simulator.upload("params", schedule[min(time, schedule.shape[0] - 1)])
+        simulator.step()
+    statuses = np.zeros((simulator.nreplicates, npeople), dtype=np.uint32)
+    for replicate in range(simulator.nreplicates):
+        simulator.download("people_statuses", statuses[replicate], replicate)
+    return statuses
+
+
+@pytest.mark.parametrize("options", [{"hazard_mode": "scatter"}, {"hazard_mode": "gather"}, {"fused": True},
+                                     {"active_sets": True, "hazard_mode": "scatter"}])
+def test_schedule_matches_uploading_each_day(options):
+    snapshot = random_snapshot()
+    schedule = day_schedule()
+    simulator = Simulator(snapshot, gpu=False, num_seed_days=2, nreplicates=2, **options)
+
+    expected = run(simulator, snapshot, schedule, upload_each_day=True)
+    assert np.array_equal(expected, run(simulator, snapshot, schedule, upload_each_day=False))
+
+    # the schedule changes the results
+    constant = np.tile(schedule[0], (iterations, 1))
+    assert not np.array_equal(expected, run(simulator, snapshot, constant, upload_each_day=False))
+
+    # uploading params replaces the schedule with a single row
+    simulator.upload("params", schedule[0])
+    assert simulator.nparams_rows == 1
+
+
+def test_partitioned_schedule_matches_simulator():
+    snapshot = random_snapshot()
+    schedule = day_schedule()
+    simulator = Simulator(snapshot, gpu=False, num_seed_days=2, nreplicates=2, hazard_mode="scatter")
+    partitioned = PartitionedSimulator(snapshot, npartitions=3, gpu=False, num_seed_days=2, nreplicates=2,
+                                       hazard_mode="scatter")
+    assert np.array_equal(run(simulator, snapshot, schedule, upload_each_day=False),
+                          run(partitioned, snapshot, schedule, upload_each_day=False))
+
+
+def test_schedule_shape_is_checked():
+    simulator = Simulator(random_snapshot(), gpu=False)
+    with pytest.raises(ValueError):
+        simulator.upload_params_schedule(Params().asarray())
+    with pytest.raises(ValueError):
+        simulator.upload_params_schedule(np.zeros((3, 7), dtype=np.float32))
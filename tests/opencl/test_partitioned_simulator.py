@@ -0,0 +1,91 @@
+import copy
+
+import numpy as np
+import pyopencl as cl
+import pytest
+
+from microsim.opencl.ramp.disease_statuses import DiseaseStatus
+from microsim.opencl.ramp.partitioned_simulator import PartitionedSimulator, partition_devices, partition_people
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot
+
+nplaces = 40
+npeople = 300
+nslots = 6
+
+
+def random_snapshot():
+    snapshot = Snapshot.random(nplaces, npeople, nslots, sparse=True)
+    snapshot.buffers.people_statuses[:] = np.random.choice([0, 0, 0, 2, 3, 4], size=npeople)
+    snapshot.area_codes = np.random.choice(["E02004129", "E02004130"], npeople)
+    return snapshot
+
+
+def run(simulator, snapshot, seed, steps):
+    """Reset the simulator with a seed, run it and download the state of every replicate."""
+    simulator.upload_all(snapshot.buffers)
+    simulator.reset(seed=seed)
+    for _ in range(steps):
+        simulator.step()
+    results = []
+    for replicate in range(simulator.nreplicates):
+        buffers = copy.deepcopy(snapshot.buffers)
+        simulator.download_all(buffers, replicate)
+        results.append(buffers)
+    return results, simulator.count_statuses()[0]
+
+
+def test_partition_people():
+    people_slot_offsets = np.array([0, 4, 4, 5, 6, 10, 12], dtype=np.uint32)
+    bounds = partition_people(people_slot_offsets, 2)
+    assert np.array_equal(bounds, [0, 4, 6])
+
+    with pytest.raises(ValueError):
+        partition_people(people_slot_offsets, 7)
+
+
+def test_partition_devices_shares_a_device_that_can_not_be_split():
+    device = cl.get_platforms()[0].get_devices()[0]
+    npartitions = device.partition_max_sub_devices + 1
+    assert partition_devices(device, npartitions) == [device] * npartitions
+
+
+@pytest.mark.parametrize("npartitions,hazard_mode", [(2, "scatter"), (3, "scatter"), (3, "gather")])
+def test_partitioned_simulator_matches_simulator(npartitions, hazard_mode):
+    snapshot = random_snapshot()
+    snapshot.pack_slots()
+
+    simulator = Simulator(snapshot, gpu=False, num_seed_days=2, nreplicates=2, hazard_mode=hazard_mode)
+    expected, expected_counts = run(simulator, snapshot, seed=7, steps=6)
+
+    partitioned = PartitionedSimulator(snapshot, npartitions=npartitions, gpu=False, num_seed_days=2, nreplicates=2,
+                                       hazard_mode=hazard_mode)
+    assert partitioned.npartitions == npartitions
+    actual, actual_counts = run(partitioned, snapshot, seed=7, steps=6)
+
+    assert np.any(expected[0].people_statuses != snapshot.buffers.people_statuses)
+    assert np.array_equal(expected_counts, actual_counts)
+    for expected_buffers, actual_buffers in zip(expected, actual):
+        for name in expected_buffers._fields:
+            assert np.array_equal(getattr(expected_buffers, name), getattr(actual_buffers, name)), name
+    assert not np.array_equal(actual[0].people_statuses, actual[1].people_statuses)
+
+
+def test_partitioned_simulator_detailed_counts():
+    snapshot = random_snapshot()
+    people_age_bins = np.random.randint(3, size=npeople)
+    people_area_ids = np.random.randint(4, size=npeople)
+
+    simulator = Simulator(snapshot, gpu=False, num_seed_days=0)
+    partitioned = PartitionedSimulator(snapshot, npartitions=2, gpu=False, num_seed_days=0)
+    counts = []
+    for s in [simulator, partitioned]:
+        s.upload_all(snapshot.buffers)
+        s.set_count_bins(people_age_bins, 3, people_area_ids, 4)
+        s.step()
+        counts.append(s.count_statuses(detailed=True))
+
+    for expected, actual in zip(*counts):
+        assert np.array_equal(expected, actual)
+    assert counts[1][0][0].sum() == npeople
+    assert counts[1][0][0][DiseaseStatus.Susceptible.value] < npeople
@@ -0,0 +1,109 @@
+import copy
+import csv
+import json
+import os
+
+import numpy as np
+
+from microsim.opencl.ramp.profiler import Profiler, record_fields
+from microsim.opencl.ramp.run import run_headless
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot
+
+nplaces = 50
+npeople = 700
+nslots = 5
+iterations = 8
+
+
+def random_snapshot():
+    snapshot = Snapshot.random(nplaces, npeople, nslots, sparse=True)
+    snapshot.buffers.people_statuses[:] = np.random.choice([0, 0, 0, 0, 1, 2, 3, 4, 5], size=npeople)
+    snapshot.area_codes = np.random.choice(["E02004129", "E02004130", "E02004131"], npeople)
+    snapshot.lockdown_multipliers = np.ones(iterations, dtype=np.float32)
+    return snapshot
+
+
+def run(snapshot, profile):
+    simulator = Simulator(snapshot, gpu=False, num_seed_days=0, hazard_mode="scatter", profile=profile)
+    simulator.upload_all(copy.deepcopy(snapshot.buffers))
+    summary, _ = run_headless(simulator, snapshot, iterations, quiet=True)
+    statuses = np.zeros(npeople, dtype=np.uint32)
+    simulator.download("people_statuses", statuses)
+    return simulator, summary, statuses
+
+
+def test_profiled_run_matches_unprofiled():
+    snapshot = random_snapshot()
+    _, summary, statuses = run(copy.deepcopy(snapshot), profile=False)
+    _, profiled_summary, profiled_statuses = run(snapshot, profile=True)
+
+    assert np.array_equal(summary.total_counts, profiled_summary.total_counts)
+    assert np.array_equal(statuses, profiled_statuses)
+    assert Simulator(snapshot, gpu=False).profiler is None
+
+
+def test_profiler_records():
+    simulator, _, _ = run(random_snapshot(), profile=True)
+    records = simulator.profiler.records()
+
+    kernels = {record["name"] for record in records if record["kind"] == "kernel"}
+    assert {"people_update_flows", "places_reset", "people_send_hazards", "people_recv_hazards",
+            "people_update_statuses", "people_count_statuses"} <= kernels
+    uploads = {record["name"] for record in records if record["kind"] == "upload"}
+    assert {"people_statuses", "place_hazards", "params"} <= uploads
+    assert "status_counts" in {record["name"] for record in records if record["kind"] == "download"}
+
+    steps = [record["step"] for record in records if record["name"] == "people_update_statuses"]
+    assert steps == list(range(iterations))
+    for record in records:
+        assert 0 <= record["queued_ns"] <= record["submit_ns"] <= record["start_ns"] <= record["end_ns"]
+        assert record["duration_ms"] >= 0
+
+    summary = simulator.profiler.summary(records)
+    assert sum(row["calls"] for row in summary) == len(records)
+    assert [row["total_ms"] for row in summary] == sorted((row["total_ms"] for row in summary), reverse=True)
+    update_statuses = next(row for row in summary if row["name"] == "people_update_statuses")
+    assert update_statuses["calls"] == iterations
+
+    simulator.profiler.clear()
+    assert simulator.profiler.records() == []
+
+
+def test_profiler_write(tmp_path):
+    simulator, _, _ = run(random_snapshot(), profile=True)
+    profiler = simulator.profiler
+    records = profiler.records
+    calls = []
+    # collecting the records waits for every event, so writing every file only does it once
+    profiler.records = lambda: calls.append(1) or records()
+    profiler.write(str(tmp_path / "output"))
+    assert len(calls) == 1
+    nrecords = len(records())
+
+    with open(tmp_path / "output" / "profile.json") as f:
+        profile = json.load(f)
+    assert profile["device"] == simulator.device_name()
+    assert len(profile["records"]) == nrecords
+    assert {row["name"] for row in profile["summary"]} == {record["name"] for record in profile["records"]}
+
+    with open(tmp_path / "output" / "profile.csv", newline="") as f:
+        reader = csv.DictReader(f)
+        assert reader.fieldnames == record_fields
+        assert len(list(reader)) == nrecords
+
+    with open(tmp_path / "output" / "profile_trace.json") as f:
+        trace = json.load(f)
+    complete_events = [event for event in trace["traceEvents"] if event["ph"] == "X"]
+    assert len(complete_events) == nrecords
+    thread_names = {event["args"]["name"] for event in trace["traceEvents"] if event["name"] == "thread_name"}
+    assert {"kernel", "upload", "download"} <= thread_names
+
+
+def test_empty_profiler(tmp_path):
+    profiler = Profiler()
+    assert profiler.records() == []
+    assert profiler.summary() == []
+    profiler.write(str(tmp_path), chrome_trace=False)
+    assert os.path.exists(tmp_path / "profile.json")
+    assert not os.path.exists(tmp_path / "profile_trace.json")
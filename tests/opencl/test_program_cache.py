@@ -0,0 +1,95 @@
+import os
+import pyopencl as cl
+
+from microsim.opencl.ramp.program_cache import ProgramCache
+
+kernel_source = """
+#include "helper.cl"
+
+kernel void double_values(global float* values) {
+  int i = get_global_id(0);
+  values[i] = twice(values[i]);
+}
+"""
+
+
+def create_context():
+    for platform in cl.get_platforms():
+        if len(platform.get_devices(cl.device_type.CPU)) > 0:
+            return cl.Context(dev_type=cl.device_type.CPU, properties=[(cl.context_properties.PLATFORM, platform)])
+    raise OSError("No compatible device found")
+
+
+def write_kernels(kernel_dir, factor=2.0):
+    with open(os.path.join(kernel_dir, "main.cl"), "w") as f:
+        f.write(kernel_source)
+    with open(os.path.join(kernel_dir, "helper.cl"), "w") as f:
+        f.write(f"float twice(float x) {{ return {factor}f * x; }}\n")
+    return os.path.join(kernel_dir, "main.cl")
+
+
+def test_binaries_are_cached_and_reused(tmp_path):
+    ctx = create_context()
+    kernel_path = write_kernels(str(tmp_path))
+    options = [f"-I {tmp_path}"]
+    cache = ProgramCache(str(tmp_path / "cache"))
+
+    program = cache.build(ctx, kernel_path, options)
+    assert hasattr(program, "double_values")
+    cached_files = os.listdir(tmp_path / "cache")
+    assert len(cached_files) == 1
+
+    # a second build is served from the existing binary rather than adding another one
+    program = cache.build(ctx, kernel_path, options)
+    assert hasattr(program, "double_values")
+    assert os.listdir(tmp_path / "cache") == cached_files
+
+
+def test_key_changes_with_included_source_and_options(tmp_path):
+    ctx = create_context()
+    kernel_path = write_kernels(str(tmp_path))
+    cache = ProgramCache(str(tmp_path / "cache"))
+
+    cache.build(ctx, kernel_path, [f"-I {tmp_path}"])
+    cache.build(ctx, kernel_path, [f"-I {tmp_path}", "-D UNUSED_FLAG"])
+    assert len(os.listdir(tmp_path / "cache")) == 2
+
+    # editing only the included file must invalidate the cached binary
+    before = ProgramCache.source_hash(kernel_path)
+    write_kernels(str(tmp_path), factor=3.0)
+    assert ProgramCache.source_hash(kernel_path) != before
+
+
+def test_eviction_and_clear(tmp_path):
+    ctx = create_context()
+    kernel_path = write_kernels(str(tmp_path))
+    cache = ProgramCache(str(tmp_path / "cache"))
+
+    cache.build(ctx, kernel_path, [f"-I {tmp_path}"])
+    binary_size = cache.num_bytes()
+
+    # only room for one binary, so building with new options evicts the older one
+    cache.max_bytes = int(1.5 * binary_size)
+    cache.build(ctx, kernel_path, [f"-I {tmp_path}", "-D UNUSED_FLAG"])
+    assert len(os.listdir(tmp_path / "cache")) == 1
+
+    cache.clear()
+    assert cache.num_bytes() == 0
+
+
+def test_key_does_not_depend_on_kernel_location(tmp_path):
+    ctx = create_context()
+    first_dir = tmp_path / "first"
+    second_dir = tmp_path / "second"
+    first_dir.mkdir()
+    second_dir.mkdir()
+    first_path = write_kernels(str(first_dir))
+    second_path = write_kernels(str(second_dir))
+    cache = ProgramCache(str(tmp_path / "cache"))
+
+    # identical kernels in another directory are served from the binary built for the first copy
+    assert ProgramCache.source_hash(first_path) == ProgramCache.source_hash(second_path)
+    cache.build(ctx, first_path, [f"-I {first_dir}"])
+    program = cache.build(ctx, second_path, [f"-I {second_dir}"])
+    assert hasattr(program, "double_values")
+    assert len(os.listdir(tmp_path / "cache")) == 1
@@ -0,0 +1,79 @@
+import copy
+import os
+import shutil
+
+import numpy as np
+
+from microsim.opencl.ramp.params import Params
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot
+
+nplaces = 50
+npeople = 500
+nslots = 8
+
+
+def random_flows_snapshot():
+    snapshot = Snapshot.random(nplaces, npeople, nslots)
+    snapshot.buffers.people_place_ids[:] = np.random.randint(nplaces, size=npeople * nslots)
+    flows = np.random.rand(npeople, nslots).astype(np.float32)
+    flows /= flows.sum(axis=1, keepdims=True)
+    snapshot.buffers.people_baseline_flows[:] = flows.flatten()
+    snapshot.buffers.people_statuses[:] = np.random.choice([0, 0, 2, 3, 4], size=npeople)
+    params = Params()
+    params.lockdown_multiplier = 0.7
+    snapshot.update_params(params)
+    return snapshot
+
+
+def test_quantise_flows():
+    snapshot = random_flows_snapshot()
+    baseline_flows = snapshot.buffers.people_baseline_flows.copy()
+
+    snapshot.quantise_flows()
+
+    assert snapshot.buffers.people_baseline_flows.dtype == np.uint16
+    assert snapshot.flow_scale == np.float32(1 / 65535)
+    decoded_flows = snapshot.decode_flows(snapshot.buffers.people_baseline_flows)
+    assert np.max(np.abs(decoded_flows - baseline_flows)) <= snapshot.flow_scale / 2
+
+
+def test_quantised_flows_give_close_hazards():
+    snapshot = random_flows_snapshot()
+    quantised_snapshot = copy.deepcopy(snapshot)
+    quantised_snapshot.quantise_flows()
+
+    results = []
+    for s in [snapshot, quantised_snapshot]:
+        simulator = Simulator(s, gpu=False)
+        simulator.upload_all(s.buffers)
+        for kernel in ["people_update_flows", "places_reset", "people_send_hazards", "people_recv_hazards"]:
+            simulator.step_kernel(kernel)
+
+        flows = np.zeros(npeople * nslots, dtype=s.buffers.people_flows.dtype)
+        people_hazards = np.zeros(npeople, dtype=np.float32)
+        simulator.download("people_flows", flows)
+        simulator.download("people_hazards", people_hazards)
+        results.append((s.decode_flows(flows), people_hazards))
+
+    # each flow is rounded when quantised and again when updated, and the home flow also accumulates the rounding
+    # of the non-home flows
+    assert np.max(np.abs(results[0][0] - results[1][0])) <= quantised_snapshot.flow_scale * nslots
+    assert np.any(results[0][1] > 0)
+    assert np.allclose(results[0][1], results[1][1], rtol=1e-3, atol=1e-4)
+
+
+def test_save_and_load_quantised_snapshot():
+    snapshot = random_flows_snapshot()
+    snapshot.quantise_flows()
+
+    for snapshot_path in ["tests/opencl/quantised.npz", "tests/opencl/quantised"]:
+        snapshot.save(snapshot_path)
+        loaded_snapshot = Snapshot.load_full_snapshot(snapshot_path)
+        if os.path.isdir(snapshot_path):
+            shutil.rmtree(snapshot_path)
+        else:
+            os.remove(snapshot_path)
+
+        assert loaded_snapshot.flow_scale == snapshot.flow_scale
+        assert np.array_equal(loaded_snapshot.buffers.people_baseline_flows, snapshot.buffers.people_baseline_flows)
@@ -0,0 +1,104 @@
+import copy
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from microsim.opencl.ramp.params import Params
+from microsim.opencl.ramp.partitioned_simulator import PartitionedSimulator
+from microsim.opencl.ramp.run import run_headless, run_headless_replicates, store_summary_data
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot
+
+nplaces = 30
+npeople = 400
+nslots = 4
+iterations = 10
+
+
+def random_snapshot():
+    snapshot = Snapshot.random(nplaces, npeople, nslots)
+    snapshot.buffers.people_place_ids[:] = np.random.randint(nplaces, size=npeople * nslots)
+    snapshot.buffers.people_statuses[:] = np.random.choice([0, 0, 0, 2, 3, 4], size=npeople)
+    snapshot.area_codes = np.random.choice(["E02004129", "E02004130"], npeople)
+    snapshot.lockdown_multipliers = np.linspace(1.0, 0.5, iterations).astype(np.float32)
+    return snapshot
+
+
+def synchronous_counts(snapshot, seed):
+    """The total counts of each day from stepping and counting one day at a time."""
+    simulator = Simulator(snapshot, gpu=False, num_seed_days=2)
+    simulator.upload_all(snapshot.buffers)
+    simulator.reset(seed=seed)
+    params = Params.fromarray(snapshot.buffers.params)
+    counts = []
+    for time in range(iterations):
+        params.set_lockdown_multiplier(snapshot.lockdown_multipliers, time)
+        simulator.upload("params", params.asarray())
+        simulator.step()
+        counts.append(simulator.count_statuses()[0][0])
+    return np.array(counts).T
+
+
+@pytest.mark.parametrize("observe_every,pipeline_depth", [(1, 1), (1, 2), (3, 2), (4, 3)])
+def test_pipelined_run_matches_synchronous_run(observe_every, pipeline_depth):
+    snapshot = random_snapshot()
+    expected = synchronous_counts(snapshot, seed=3)
+
+    simulator = Simulator(snapshot, gpu=False, num_seed_days=2)
+    simulator.upload_all(copy.deepcopy(snapshot.buffers))
+    simulator.reset(seed=3)
+    summary, _ = run_headless(simulator, snapshot, iterations, quiet=True, store_detailed_counts=False,
+                              observe_every=observe_every, pipeline_depth=pipeline_depth)
+
+    observed = [day for day in range(iterations) if (day + 1) % observe_every == 0 or day == iterations - 1]
+    total_counts = np.array(summary.total_counts)
+    assert np.array_equal(total_counts[:, observed], expected[:, observed])
+    unobserved = np.setdiff1d(np.arange(iterations), observed)
+    assert np.all(np.isnan(total_counts[:, unobserved]))
+    assert simulator.time == iterations
+
+
+def test_pipelined_run_of_replicates_and_partitions():
+    snapshot = random_snapshot()
+    simulator = Simulator(snapshot, gpu=False, num_seed_days=2, nreplicates=2)
+    simulator.upload_all(snapshot.buffers)
+    simulator.seed_prngs([5, 6])
+    summaries = run_headless_replicates(simulator, snapshot, iterations, quiet=True, observe_every=2)
+
+    partitioned = PartitionedSimulator(snapshot, npartitions=2, gpu=False, num_seed_days=2, nreplicates=2)
+    partitioned.upload_all(snapshot.buffers)
+    partitioned.seed_prngs([5, 6])
+    partitioned_summaries = run_headless_replicates(partitioned, snapshot, iterations, quiet=True, observe_every=2)
+
+    for summary, partitioned_summary in zip(summaries, partitioned_summaries):
+        assert np.array_equal(summary.total_counts, partitioned_summary.total_counts, equal_nan=True)
+        assert np.array_equal(summary.age_status_counts, partitioned_summary.age_status_counts, equal_nan=True)
+        assert np.array_equal(summary.area_status_counts, partitioned_summary.area_status_counts, equal_nan=True)
+    assert np.all(np.array(summaries[0].total_counts).sum(axis=0)[1::2] == npeople)
+
+
+def test_unobserved_days_are_marked_in_stored_summary(tmp_path):
+    snapshot = random_snapshot()
+    simulator = Simulator(snapshot, gpu=False, num_seed_days=2)
+    simulator.upload_all(copy.deepcopy(snapshot.buffers))
+    summary, _ = run_headless(simulator, snapshot, iterations, quiet=True, observe_every=4)
+
+    # days 3, 7 and the last day are observed, the others are NaN rather than counts of zero
+    observed = [3, 7, iterations - 1]
+    unobserved = np.setdiff1d(np.arange(iterations), observed)
+    assert np.all(np.isnan(summary.age_status_counts[:, :, unobserved]))
+    assert np.all(np.isnan(summary.area_status_counts[:, :, unobserved]))
+    assert np.all(summary.age_status_counts[:, :, observed].sum(axis=(0, 1)) == npeople)
+
+    store_summary_data(summary, store_detailed_counts=True, data_dir=str(tmp_path))
+    with open(os.path.join(str(tmp_path), "output", "OpenCL", "total_counts.pkl"), "rb") as f:
+        total_counts = pd.DataFrame(pickle.load(f))
+    assert total_counts.iloc[unobserved].isna().all(axis=None)
+    assert np.all(total_counts.iloc[observed].sum(axis=1) == npeople)
+    with open(os.path.join(str(tmp_path), "output", "OpenCL", "area_counts.pkl"), "rb") as f:
+        area_counts = pickle.load(f)
+    for counts in area_counts.values():
+        assert counts.iloc[:, unobserved].isna().all(axis=None)
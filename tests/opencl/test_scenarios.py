@@ -0,0 +1,169 @@
+import copy
+
+import numpy as np
+import pytest
+
+from microsim.opencl.ramp.buffers import Buffers
+from microsim.opencl.ramp.params import Params
+from microsim.opencl.ramp.partitioned_simulator import PartitionedSimulator
+from microsim.opencl.ramp.run import Scenario, run_headless, run_headless_scenarios
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot
+
+nplaces = 40
+npeople = 600
+nslots = 5
+iterations = 16
+num_seed_days = 6
+
+
+def random_snapshot():
+    snapshot = Snapshot.random(nplaces, npeople, nslots, sparse=True)
+    snapshot.buffers.people_statuses[:] = np.random.choice([0, 0, 0, 0, 0, 2, 3], size=npeople)
+    snapshot.buffers.people_obesity[:] = np.random.randint(5, size=npeople)
+    # some high risk people to seed initial cases from
+    snapshot.area_codes = np.random.choice(["E02004143", "E02004129", "E02004130"], npeople)
+    snapshot.not_home_probs = np.random.rand(npeople)
+    snapshot.lockdown_multipliers = np.linspace(1.0, 0.4, iterations).astype(np.float32)
+    return snapshot
+
+
+def healthier(snapshot):
+    snapshot.switch_to_healthier_population()
+
+
+def stricter_lockdown(snapshot):
+    snapshot.lockdown_multipliers *= 0.5
+
+
+def riskier(snapshot):
+    params = Params.fromarray(snapshot.buffers.params)
+    params.place_hazard_multipliers *= 2
+    snapshot.update_params(params)
+
+
+def create_simulator(snapshot, options):
+    simulator_class = PartitionedSimulator if "npartitions" in options else Simulator
+    simulator = simulator_class(snapshot, gpu=False, num_seed_days=num_seed_days, **options)
+    simulator.upload_all(copy.deepcopy(snapshot.buffers))
+    return simulator
+
+
+def run(snapshot, options):
+    snapshot = copy.deepcopy(snapshot)
+    np.random.seed(1)  # initial cases are chosen with numpy's random numbers
+    summary, _ = run_headless(create_simulator(snapshot, options), snapshot, iterations, quiet=True)
+    return summary
+
+
+def run_scenarios(snapshot, options, scenarios, warmup_days, seeds=None):
+    np.random.seed(1)
+    simulator = create_simulator(snapshot, options)
+    return run_headless_scenarios(simulator, snapshot, scenarios, warmup_days, iterations, quiet=True, seeds=seeds)
+
+
+def assert_same_summary(summary_a, summary_b):
+    assert np.array_equal(summary_a.total_counts, summary_b.total_counts)
+    assert np.array_equal(summary_a.age_status_counts, summary_b.age_status_counts)
+    assert np.array_equal(summary_a.area_status_counts, summary_b.area_status_counts)
+
+
+@pytest.mark.parametrize("options", [{}, {"counter_prngs": True}, {"fused": True},
+                                     {"npartitions": 2, "hazard_mode": "scatter"}])
+def test_forks_match_separate_runs(options):
+    snapshot = random_snapshot()
+    scenarios = {"baseline": None, "healthier": Scenario(healthier, ["people_obesity"]), "lockdown": stricter_lockdown,
+                 "riskier": riskier}
+
+    # forking from the start of the run is the same as running each scenario separately
+    summaries = run_scenarios(snapshot, options, scenarios, 0)
+    for name, scenario in scenarios.items():
+        scenario_snapshot = copy.deepcopy(snapshot)
+        if isinstance(scenario, Scenario):
+            scenario.change(scenario_snapshot)
+        elif scenario is not None:
+            scenario(scenario_snapshot)
+        assert_same_summary(run(scenario_snapshot, options), summaries[name])
+
+    # an unchanged fork continues exactly as if it had not been forked, from a warm-up during or after seeding
+    expected = run(snapshot, options)
+    for warmup_days in [4, 10]:
+        summaries = run_scenarios(snapshot, options, scenarios, warmup_days)
+        assert_same_summary(expected, summaries["baseline"])
+        for name in ["healthier", "lockdown", "riskier"]:
+            assert np.array_equal(np.array(expected.total_counts)[:, :warmup_days],
+                                  np.array(summaries[name].total_counts)[:, :warmup_days])
+
+        # each scenario is forked from the same state, whatever ran before it
+        reordered = run_scenarios(snapshot, options, dict(reversed(list(scenarios.items()))), warmup_days)
+        for name in scenarios:
+            assert_same_summary(summaries[name], reordered[name])
+
+
+def test_seeded_forks_are_independent():
+    snapshot = random_snapshot()
+    warmup_days = 8
+    scenarios = {"baseline": None, "seeded": None, "seeded_again": None, "other_seed": None}
+    seeds = {"seeded": 5, "seeded_again": 5, "other_seed": 6}
+    summaries = run_scenarios(snapshot, {}, scenarios, warmup_days, seeds)
+
+    assert_same_summary(summaries["seeded"], summaries["seeded_again"])
+    assert not np.array_equal(summaries["baseline"].total_counts, summaries["seeded"].total_counts)
+    assert not np.array_equal(summaries["seeded"].total_counts, summaries["other_seed"].total_counts)
+    for name in scenarios:
+        assert np.array_equal(np.array(summaries["baseline"].total_counts)[:, :warmup_days],
+                              np.array(summaries[name].total_counts)[:, :warmup_days])
+
+
+@pytest.mark.parametrize("options", [{"nreplicates": 2}, {"nreplicates": 2, "npartitions": 2}])
+def test_seeded_forks_during_seeding_choose_independent_initial_cases(options):
+    np.random.seed(1)
+    simulator = create_simulator(random_snapshot(), options)
+    simulator.seed_prngs([3, 4])
+    for _ in range(2):
+        simulator.step()
+    fork_point = simulator.save_fork_point()
+    num_chosen = fork_point["initial_cases"][0].num_chosen
+    assert 0 < num_chosen < len(fork_point["initial_cases"][0].high_risk_ids)
+
+    def fork_order(seed):
+        simulator.fork(fork_point, seed=seed)
+        return [initial_cases.shuffled_ids for initial_cases in simulator.initial_cases]
+
+    unseeded, seeded, seeded_again, other_seed = fork_order(None), fork_order(5), fork_order(5), fork_order(6)
+    for replicate in range(2):
+        # the people already chosen are kept, the rest are chosen in an order which only depends on the seed
+        assert np.array_equal(unseeded[replicate][:num_chosen], seeded[replicate][:num_chosen])
+        assert np.array_equal(np.sort(unseeded[replicate]), np.sort(seeded[replicate]))
+        assert np.array_equal(seeded[replicate], seeded_again[replicate])
+        assert not np.array_equal(seeded[replicate], other_seed[replicate])
+        assert not np.array_equal(seeded[replicate], unseeded[replicate])
+    assert not np.array_equal(seeded[0][num_chosen:], seeded[1][num_chosen:])
+    assert np.array_equal(fork_order(None)[0], unseeded[0])
+
+
+def test_scenarios_only_change_the_buffers_they_list():
+    snapshot = random_snapshot()
+    original = copy.deepcopy(snapshot)
+    summaries = run_scenarios(snapshot, {}, {"healthier": Scenario(healthier, ["people_obesity"]),
+                                             "lockdown": stricter_lockdown, "riskier": riskier}, 4)
+    assert len(summaries) == 3
+
+    # the scenarios change their own copies of the buffers they list, params and lockdown multipliers
+    for name in Buffers._fields:
+        assert np.array_equal(getattr(original.buffers, name), getattr(snapshot.buffers, name))
+    assert np.array_equal(original.lockdown_multipliers, snapshot.lockdown_multipliers)
+
+    # other static buffers can't be changed, nor listed with the per-replicate buffers
+    with pytest.raises(ValueError):
+        run_scenarios(snapshot, {}, {"healthier": healthier}, 4)
+    with pytest.raises(ValueError):
+        run_scenarios(snapshot, {}, {"statuses": Scenario(healthier, ["people_obesity", "people_statuses"])}, 4)
+    assert np.array_equal(original.buffers.people_obesity, snapshot.buffers.people_obesity)
+
+
+def test_warmup_must_be_part_of_the_run():
+    snapshot = random_snapshot()
+    simulator = create_simulator(snapshot, {})
+    with pytest.raises(ValueError):
+        run_headless_scenarios(simulator, snapshot, {"baseline": None}, iterations + 1, iterations, quiet=True)
@@ -0,0 +1,96 @@
+import copy
+
+import numpy as np
+
+from microsim.opencl.ramp.disease_statuses import DiseaseStatus
+from microsim.opencl.ramp.initial_cases import InitialCases
+from microsim.opencl.ramp.partitioned_simulator import PartitionedSimulator
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot
+
+nplaces = 30
+npeople = 400
+nslots = 5
+high_risk_area = "E02004143"
+low_risk_area = "E02004187"
+
+
+def seeding_snapshot():
+    snapshot = Snapshot.random(nplaces, npeople, nslots, sparse=True)
+    snapshot.buffers.people_statuses[:] = DiseaseStatus.Susceptible.value
+    snapshot.buffers.people_transition_times[:] = 0
+    snapshot.area_codes = np.random.choice([high_risk_area, low_risk_area], npeople)
+    snapshot.not_home_probs = np.random.rand(npeople)
+    return snapshot
+
+
+def download_state(simulator):
+    statuses = np.zeros((simulator.nreplicates, simulator.npeople), dtype=np.uint32)
+    transition_times = np.zeros((simulator.nreplicates, simulator.npeople), dtype=np.uint32)
+    for replicate in range(simulator.nreplicates):
+        simulator.download("people_statuses", statuses[replicate], replicate)
+        simulator.download("people_transition_times", transition_times[replicate], replicate)
+    return statuses, transition_times
+
+
+def test_initial_cases_never_repeat():
+    snapshot = seeding_snapshot()
+    initial_cases = InitialCases(snapshot.area_codes, snapshot.not_home_probs)
+    high_risk_ids = set(initial_cases.high_risk_ids)
+
+    chosen = [initial_cases.get_seed_people_ids_for_day(day) for day in range(6)]
+    num_cases = initial_cases.initial_cases["num_cases"].to_numpy()
+    remaining = len(high_risk_ids)
+    for day, ids in enumerate(chosen):
+        assert len(ids) == min(num_cases[day], remaining)
+        remaining -= len(ids)
+    all_chosen = np.concatenate(chosen)
+    assert len(set(all_chosen)) == len(all_chosen)
+    assert set(all_chosen) <= high_risk_ids
+
+    # once the pool is used up there is no one left to choose
+    assert remaining == 0
+    assert len(initial_cases.get_seed_people_ids_for_day(6)) == 0
+
+
+def test_seed_kernel_matches_hazard_upload():
+    snapshot = seeding_snapshot()
+    simulator = Simulator(snapshot, gpu=False, nreplicates=2)
+    simulator.upload_all(copy.deepcopy(snapshot.buffers))
+    simulator.reset(seed=4)
+    simulator.step_with_seeding().wait()
+    statuses, transition_times = download_state(simulator)
+
+    # the same cases, infected by uploading a hazard for every person
+    simulator.reset(seed=4)
+    people_hazards = np.zeros(npeople, dtype=np.float32)
+    for replicate, initial_cases in enumerate(simulator.initial_cases):
+        people_hazards[:] = 0
+        people_hazards[initial_cases.get_seed_people_ids_for_day(0)] = np.finfo(np.float32).max
+        simulator.upload("people_hazards", people_hazards, replicate)
+    simulator.step_kernel("people_update_statuses")
+    expected_statuses, expected_transition_times = download_state(simulator)
+
+    assert np.array_equal(statuses, expected_statuses)
+    assert np.array_equal(transition_times, expected_transition_times)
+    assert np.count_nonzero(statuses[0] == DiseaseStatus.Exposed.value) == \
+        min(37, len(simulator.initial_cases[0].high_risk_ids))
+
+
+def test_partitioned_seeding_matches_simulator():
+    snapshot = seeding_snapshot()
+    simulator = Simulator(snapshot, gpu=False, num_seed_days=3, nreplicates=2, hazard_mode="scatter")
+    partitioned = PartitionedSimulator(snapshot, npartitions=3, gpu=False, num_seed_days=3, nreplicates=2,
+                                       hazard_mode="scatter")
+
+    results = []
+    for sim in [simulator, partitioned]:
+        sim.upload_all(copy.deepcopy(snapshot.buffers))
+        sim.reset(seed=9)
+        for _ in range(5):
+            sim.step()
+        results.append(download_state(sim))
+
+    assert np.array_equal(results[0][0], results[1][0])
+    assert np.array_equal(results[0][1], results[1][1])
+    assert np.count_nonzero(results[0][0] != DiseaseStatus.Susceptible.value) > 0
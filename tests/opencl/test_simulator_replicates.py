@@ -0,0 +1,86 @@
+import numpy as np
+from microsim.opencl.ramp.params import Params
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot
+from microsim.opencl.ramp.disease_statuses import DiseaseStatus
+
+nplaces = 50
+npeople = 200
+nslots = 6
+iterations = 20
+
+
+def create_snapshot():
+    np.random.seed(1)
+    snapshot = Snapshot.random(nplaces, npeople, nslots)
+    snapshot.buffers.people_statuses[:] = DiseaseStatus.Susceptible.value
+    snapshot.buffers.people_statuses[:20] = DiseaseStatus.Symptomatic.value
+    snapshot.buffers.people_transition_times[:] = 5
+
+    params = Params()
+    params.place_hazard_multipliers = np.full(5, 0.5, dtype=np.float32)
+    snapshot.update_params(params)
+    return snapshot
+
+
+def run_single(snapshot, seed, num_seed_days=0):
+    simulator = Simulator(snapshot, gpu=False, num_seed_days=num_seed_days)
+    simulator.upload_all(snapshot.buffers)
+    simulator.seed_prngs([seed])
+    for _ in range(iterations):
+        simulator.step()
+    statuses = np.zeros(npeople, dtype=np.uint32)
+    simulator.download("people_statuses", statuses)
+    return statuses
+
+
+def test_replicates_match_single_simulations():
+    snapshot = create_snapshot()
+    seeds = [3, 7, 11]
+
+    simulator = Simulator(snapshot, gpu=False, num_seed_days=0, nreplicates=len(seeds))
+    simulator.upload_all(snapshot.buffers)
+    simulator.seed_prngs(seeds)
+    for _ in range(iterations):
+        simulator.step()
+
+    replicate_statuses = []
+    for replicate, seed in enumerate(seeds):
+        statuses = np.zeros(npeople, dtype=np.uint32)
+        simulator.download("people_statuses", statuses, replicate)
+        replicate_statuses.append(statuses)
+
+        assert np.array_equal(statuses, run_single(snapshot, seed))
+
+    # different seeds should give different epidemics
+    assert not np.array_equal(replicate_statuses[0], replicate_statuses[1])
+
+
+def test_replicates_choose_initial_cases_like_single_simulations():
+    snapshot = create_snapshot()
+    snapshot.buffers.people_statuses[:] = DiseaseStatus.Susceptible.value
+    # everyone is high risk, so there are more people to seed initial cases from than are chosen
+    snapshot.area_codes = np.full(npeople, "E02004143")
+    snapshot.not_home_probs = np.ones(npeople)
+    seeds = [3, 7, 11]
+
+    simulator = Simulator(snapshot, gpu=False, num_seed_days=5, nreplicates=len(seeds))
+    simulator.upload_all(snapshot.buffers)
+    simulator.seed_prngs(seeds)
+    np.random.seed(0)  # the initial cases must not depend on numpy's global random state
+    for _ in range(iterations):
+        simulator.step()
+
+    for replicate, seed in enumerate(seeds):
+        statuses = np.zeros(npeople, dtype=np.uint32)
+        simulator.download("people_statuses", statuses, replicate)
+        assert np.array_equal(statuses, run_single(snapshot, seed, num_seed_days=5))
+
+
+def test_replicates_share_static_buffers():
+    snapshot = create_snapshot()
+    simulator = Simulator(snapshot, gpu=False, nreplicates=4)
+
+    assert simulator.buffers.people_ages.size == npeople * 2
+    assert simulator.buffers.people_statuses.size == npeople * 4 * 4
+    assert simulator.buffers.place_hazards.size == nplaces * 4 * 4
@@ -0,0 +1,161 @@
+import os
+
+import numpy as np
+
+from experiments.opencl_runner import OpenCLRunner
+from microsim.opencl.ramp.params import Params
+from microsim.opencl.ramp.run import run_headless
+from microsim.opencl.ramp.simulator import Simulator
+from microsim.opencl.ramp.snapshot import Snapshot
+from microsim.opencl.ramp.disease_statuses import DiseaseStatus
+
+nplaces = 50
+npeople = 200
+nslots = 6
+iterations = 15
+
+
+def create_snapshot():
+    np.random.seed(1)
+    snapshot = Snapshot.random(nplaces, npeople, nslots)
+    snapshot.buffers.people_statuses[:] = DiseaseStatus.Susceptible.value
+    snapshot.buffers.people_statuses[:20] = DiseaseStatus.Symptomatic.value
+    snapshot.buffers.people_transition_times[:] = 5
+
+    params = Params()
+    params.place_hazard_multipliers = np.full(5, 0.5, dtype=np.float32)
+    snapshot.update_params(params)
+    return snapshot
+
+
+def run(simulator, replicate=0):
+    for _ in range(iterations):
+        simulator.step()
+    statuses = np.zeros(npeople, dtype=np.uint32)
+    simulator.download("people_statuses", statuses, replicate)
+    return statuses
+
+
+def test_reset_restores_start_state():
+    snapshot = create_snapshot()
+    start_statuses = snapshot.buffers.people_statuses.copy()
+
+    simulator = Simulator(snapshot, gpu=False, num_seed_days=0)
+    simulator.upload_all(snapshot.buffers)
+    first_run = run(simulator)
+    assert not np.array_equal(first_run, start_statuses)
+
+    simulator.reset()
+    assert simulator.time == snapshot.time
+
+    statuses = np.zeros(npeople, dtype=np.uint32)
+    simulator.download("people_statuses", statuses)
+    assert np.array_equal(statuses, start_statuses)
+
+    prngs = np.zeros(npeople * 4, dtype=np.uint32)
+    simulator.download("people_prngs", prngs)
+    assert np.array_equal(prngs, snapshot.buffers.people_prngs)
+
+    # without reseeding, the run is repeated exactly
+    assert np.array_equal(run(simulator), first_run)
+
+
+def test_reset_with_seed_is_deterministic():
+    snapshot = create_snapshot()
+    simulator = Simulator(snapshot, gpu=False, num_seed_days=0, nreplicates=2)
+    simulator.upload_all(snapshot.buffers)
+
+    simulator.reset(seed=5)
+    first_run = run(simulator)
+    simulator.reset(seed=5)
+    second_run = run(simulator)
+    simulator.reset(seed=6)
+    other_seed_run = run(simulator)
+
+    assert np.array_equal(first_run, second_run)
+    assert not np.array_equal(first_run, other_seed_run)
+
+    # replicates are given different random states from the same seed
+    prngs = np.zeros((2, npeople * 4), dtype=np.uint32)
+    simulator.download("people_prngs", prngs[0], 0)
+    simulator.download("people_prngs", prngs[1], 1)
+    assert np.all(prngs[0] != prngs[1])
+
+
+def test_rebind_params():
+    snapshot = create_snapshot()
+    simulator = Simulator(snapshot, gpu=False, num_seed_days=0)
+    simulator.upload_all(snapshot.buffers)
+
+    # with no hazard at any place nobody new is infected
+    params = Params()
+    params.place_hazard_multipliers = np.zeros(5, dtype=np.float32)
+    simulator.rebind(params)
+    simulator.reset(seed=1)
+    statuses = run(simulator)
+
+    assert np.count_nonzero(statuses == DiseaseStatus.Susceptible.value) == npeople - 20
+
+
+def test_runner_reuses_simulator_without_changing_snapshot(tmp_path):
+    snapshot_filepath = str(tmp_path / "snapshot.npz")
+    create_snapshot().save(snapshot_filepath)
+    start_statuses = Snapshot.load_full_snapshot(snapshot_filepath).buffers.people_statuses
+    OpenCLRunner.clear_simulators()
+
+    params = Params()
+    params.place_hazard_multipliers = np.full(5, 0.5, dtype=np.float32)
+    first_summary, final_state = OpenCLRunner.run_opencl_model(
+        1, iterations, snapshot_filepath, params, "microsim/opencl/", False, quiet=True)
+    cached_snapshot, simulator = OpenCLRunner.get_simulator(snapshot_filepath, "microsim/opencl/", False)
+
+    # the final state is returned separately, the cached snapshot still holds the start of the run
+    assert not np.array_equal(final_state.people_statuses, start_statuses)
+    assert np.array_equal(cached_snapshot.buffers.people_statuses, start_statuses)
+
+    other_params = Params()
+    other_params.place_hazard_multipliers = np.zeros(5, dtype=np.float32)
+    OpenCLRunner.run_opencl_model(1, iterations, snapshot_filepath, other_params, "microsim/opencl/", False,
+                                  quiet=True)
+    second_summary, _ = OpenCLRunner.run_opencl_model(
+        1, iterations, snapshot_filepath, params, "microsim/opencl/", False, quiet=True)
+    assert OpenCLRunner.get_simulator(snapshot_filepath, "microsim/opencl/", False)[1] is simulator
+    assert np.array_equal(first_summary.total_counts, second_summary.total_counts)
+
+    # a regenerated snapshot file is loaded into a new simulator
+    regenerated = create_snapshot()
+    regenerated.buffers.people_statuses[:] = DiseaseStatus.Susceptible.value
+    regenerated.save(snapshot_filepath)
+    os.utime(snapshot_filepath, ns=(0, 0))
+    regenerated_snapshot, regenerated_simulator = OpenCLRunner.get_simulator(snapshot_filepath, "microsim/opencl/",
+                                                                             False)
+    assert regenerated_simulator is not simulator
+    assert np.array_equal(regenerated_snapshot.buffers.people_statuses, regenerated.buffers.people_statuses)
+    OpenCLRunner.clear_simulators()
+
+
+def test_runner_batched_runs_match_single_runs(tmp_path):
+    snapshot_filepath = str(tmp_path / "snapshot.npz")
+    create_snapshot().save(snapshot_filepath)
+    OpenCLRunner.clear_simulators()
+    params = Params()
+    params.place_hazard_multipliers = np.full(5, 0.5, dtype=np.float32)
+
+    seeds = [3, 7]
+    batched = OpenCLRunner.run_opencl_model_batched(seeds, iterations, snapshot_filepath, params, "microsim/opencl/",
+                                                    False)
+    assert not np.array_equal(batched[0][0].total_counts, batched[1][0].total_counts)
+    for (batched_summary, _), seed in zip(batched, seeds):
+        summary, _ = OpenCLRunner.run_opencl_model(seed, iterations, snapshot_filepath, params, "microsim/opencl/",
+                                                   False, quiet=True)
+        assert np.array_equal(batched_summary.total_counts, summary.total_counts)
+
+        # which is the same as seeding the snapshot for each run
+        snapshot = Snapshot.load_full_snapshot(snapshot_filepath)
+        snapshot.update_params(params)
+        snapshot.seed_prngs(seed)
+        simulator = Simulator(snapshot, gpu=False)
+        simulator.upload_all(snapshot.buffers)
+        snapshot_summary, _ = run_headless(simulator, snapshot, iterations, quiet=True)
+        assert np.array_equal(snapshot_summary.total_counts, summary.total_counts)
+    OpenCLRunner.clear_simulators()
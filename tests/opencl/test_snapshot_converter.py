@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 import os
+import json
 from microsim.opencl.ramp.snapshot_convertor import SnapshotConvertor
 
 sentinel_value = (1 << 31) - 1
@@ -26,7 +27,7 @@ individuals_df = pd.DataFrame({'ID': [0, 1, 3],
                                'cvd': [0, 0, 0],
                                'diabetes': [0, 0, 0],
                                'bloodpressure': [0, 0, 0],
-                               'area': np.array(["E02004143", "E02004144", "E02004145"]).astype(np.object)
+                               'area': np.array(["E02004143", "E02004144", "E02004145"]).astype(object)
                                })
 
 home_df = pd.DataFrame({'ID': [0, 1, 2], 'area': ['E02004129', 'E02004130', 'E02004131']})
@@ -83,6 +84,16 @@ def test_processes_people_flows():
     assert np.all(np.isclose(expected_people_flows, people_flows))
 
 
+def test_processes_people_flows_keeps_highest_flows():
+    expected_people_place_ids = np.array([[0, 5], [1, 5], [2, 3]])
+    expected_people_flows = np.array([[0.8, 0.1], [0.7, 0.18], [0.6, 0.2]])
+
+    people_place_ids, people_flows = snapshot_converter.get_people_place_data(places_to_keep_per_person=2)
+
+    assert np.array_equal(expected_people_place_ids, people_place_ids)
+    assert np.all(np.isclose(expected_people_flows, people_flows))
+
+
 def test_get_place_data():
     expected_place_activities = np.array([0, 0, 0, 1, 1, 1, 1, 1])
     place_activities = snapshot_converter.get_place_data()
@@ -105,3 +116,20 @@ def test_get_coordinates():
 
     assert np.all(np.isclose(expected_non_home_place_coordinates, non_home_place_coordinates, atol=0.0001,
                              equal_nan=True))
+
+
+def test_get_coordinates_from_buildings():
+    with open(os.path.join(data_dir, "msoa_building_coordinates.json")) as f:
+        msoa_buildings = json.load(f)
+
+    # homes are assigned a building from their own area, and the same seed gives the same buildings
+    lats, lons = SnapshotConvertor(individuals_df, activity_locations, time_activity_multiplier=None,
+                                   data_dir=data_dir, random_seed=42).get_coordinates_from_buildings(home_df)
+    for area, lat, lon in zip(home_df["area"], lats, lons):
+        assert [lat, lon] in msoa_buildings[area]
+
+    seeded_lats, seeded_lons = SnapshotConvertor(individuals_df, activity_locations, time_activity_multiplier=None,
+                                                 data_dir=data_dir, random_seed=42).get_coordinates_from_buildings(
+        home_df)
+    assert np.array_equal(lats, seeded_lats)
+    assert np.array_equal(lons, seeded_lons)
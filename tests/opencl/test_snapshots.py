@@ -1,7 +1,10 @@
-from microsim.opencl.ramp.snapshot import Snapshot
+from microsim.opencl.ramp.snapshot import Snapshot, list_snapshots, snapshot_format_version, snapshot_index
+from microsim.opencl.ramp.params import Params
 import numpy as np
+import pytest
 import os
 import copy
+import shutil
 
 sentinel_value = (1 << 31) - 1
 
@@ -46,6 +49,47 @@ def test_save_and_load_full_snapshot():
     assert loaded_snapshot.nslots == nslots
 
 
+def test_save_and_load_snapshot_directory():
+    generated_snapshot = Snapshot.random(nplaces=10, npeople=100, nslots=16)
+    generated_snapshot.area_codes = np.random.choice(["E02004129", "E02004130", "E02004131"], 100)
+
+    snapshot_path = "tests/opencl/random_snapshot"
+
+    generated_snapshot.save(snapshot_path)
+    loaded_snapshot = Snapshot.load_full_snapshot(snapshot_path)
+
+    # a .npz path falls back to the snapshot directory of the same name
+    loaded_npz_path_snapshot = Snapshot.load_full_snapshot(snapshot_path + ".npz")
+
+    try:
+        for name in generated_snapshot.buffers._fields:
+            generated_buffer = getattr(generated_snapshot.buffers, name)
+            loaded_buffer = getattr(loaded_snapshot.buffers, name)
+            assert generated_buffer.dtype == loaded_buffer.dtype
+            assert np.array_equal(generated_buffer, loaded_buffer)
+            assert isinstance(loaded_buffer, np.memmap)
+
+        assert np.array_equal(generated_snapshot.area_codes, loaded_snapshot.area_codes)
+        assert np.array_equal(generated_snapshot.not_home_probs, loaded_snapshot.not_home_probs)
+        assert np.array_equal(generated_snapshot.area_codes, loaded_npz_path_snapshot.area_codes)
+        assert loaded_snapshot.nplaces == 10
+        assert loaded_snapshot.npeople == 100
+        assert loaded_snapshot.nslots == 16
+
+        # memory-mapped buffers can be modified without changing the files on disk
+        loaded_snapshot.seed_prngs(12)
+        reloaded_snapshot = Snapshot.load_full_snapshot(snapshot_path)
+        assert np.array_equal(generated_snapshot.buffers.people_prngs, reloaded_snapshot.buffers.people_prngs)
+
+        # a memory-mapped snapshot can be saved over the directory it was loaded from
+        loaded_snapshot.save(snapshot_path)
+        reloaded_snapshot = Snapshot.load_full_snapshot(snapshot_path)
+        assert np.array_equal(loaded_snapshot.buffers.people_prngs, reloaded_snapshot.buffers.people_prngs)
+        assert np.array_equal(generated_snapshot.area_codes, reloaded_snapshot.area_codes)
+    finally:
+        shutil.rmtree(snapshot_path)
+
+
 def test_load_existing_snapshot():
     # Load initial snapshot generated from the SnapshotConverter test
     loaded_snapshot = Snapshot.load_full_snapshot("tests/opencl/test_snapshot.npz")
@@ -113,3 +157,52 @@ def test_copy_snapshot():
     # mutate original snapshot and check that the copy is no longer equal
     snapshot.buffers.people_baseline_flows[:] = snapshot.buffers.people_baseline_flows * 2.5
     assert not np.array_equal(snapshot.buffers.people_baseline_flows, snapshot_copy.buffers.people_baseline_flows)
+
+
+def test_load_and_upgrade_snapshot_with_old_params_layout():
+    snapshot = Snapshot.random(nplaces=10, npeople=100, nslots=16)
+    params_array = snapshot.buffers.params.copy()
+
+    # write an unversioned .npz snapshot from before the health multipliers were appended to the params layout, and
+    # before the slot offsets were stored
+    snapshot_path = "tests/opencl/old_params.npz"
+    old_buffers = snapshot.buffers._replace(params=params_array[:-4])._asdict()
+    del old_buffers["people_slot_offsets"]
+    np.savez(snapshot_path, nplaces=snapshot.nplaces, npeople=snapshot.npeople, nslots=snapshot.nslots,
+             time=snapshot.time, area_codes=snapshot.area_codes, not_home_probs=snapshot.not_home_probs,
+             lockdown_multipliers=snapshot.lockdown_multipliers, **old_buffers)
+
+    try:
+        # the params buffer is migrated to the current layout on load, and the slots are in the fixed layout
+        loaded_snapshot = Snapshot.load_full_snapshot(snapshot_path)
+        assert np.array_equal(params_array, loaded_snapshot.buffers.params)
+        assert np.array_equal(snapshot.buffers.people_slot_offsets, loaded_snapshot.buffers.people_slot_offsets)
+        loaded_snapshot.update_params(Params())
+
+        # upgrading the snapshot in place stores the current version and params layout
+        Snapshot.upgrade(snapshot_path)
+        with np.load(snapshot_path) as file_data:
+            assert int(file_data["version"]) == snapshot_format_version
+            assert file_data["params"].size == params_array.size
+    finally:
+        os.remove(snapshot_path)
+
+
+def test_list_snapshots(tmp_path):
+    snapshot_dir = str(tmp_path)
+    snapshot = Snapshot.random(nplaces=10, npeople=20, nslots=4)
+    snapshot.save(os.path.join(snapshot_dir, "cache"))
+    snapshot.save(os.path.join(snapshot_dir, "legacy.npz"))
+    # neither an incomplete snapshot directory nor other files are snapshots
+    os.makedirs(os.path.join(snapshot_dir, "incomplete"))
+    open(os.path.join(snapshot_dir, "notes.txt"), "w").close()
+
+    snapshots = list_snapshots(snapshot_dir)
+    assert snapshots == ["cache", "legacy.npz"]
+
+    # a loaded snapshot directory is found by its name, as the inspector does on startup
+    loaded = Snapshot.load_full_snapshot(os.path.join(snapshot_dir, "cache"))
+    assert snapshots[snapshot_index(snapshots, loaded.name)] == "cache"
+    assert snapshots[snapshot_index(snapshots, "legacy")] == "legacy.npz"
+    with pytest.raises(ValueError):
+        snapshot_index(snapshots, "missing")
@@ -1,7 +1,9 @@
 import numpy as np
+import pandas as pd
 
 from microsim.opencl.ramp.summary import Summary
 from microsim.opencl.ramp.snapshot import Snapshot
+from microsim.opencl.ramp.disease_statuses import DiseaseStatus
 
 
 def test_summary_update():
@@ -27,3 +29,30 @@ def test_summary_update():
     assert summary.total_counts[4][time] == 101
     assert summary.total_counts[5][time] == 0
     assert summary.total_counts[6][time] == 551
+
+
+def test_summary_update_detailed_counts():
+    npeople = 500
+    max_time = 5
+    snapshot = Snapshot.random(nplaces=10, npeople=npeople, nslots=10)
+    snapshot.area_codes = np.random.choice(["E02004129", "E02004130", "E02004131"], npeople)
+    summary = Summary(snapshot, store_detailed_counts=True, max_time=max_time)
+
+    time = 3
+    statuses = np.random.randint(len(DiseaseStatus), size=npeople).astype(np.uint32)
+    summary.update(time, statuses)
+
+    # compare with counts grouped by pandas
+    individuals_df = pd.DataFrame({"status": statuses, "age_bin": summary.age_bins, "area_id": summary.area_ids})
+    for (age_bin, status), count in individuals_df.groupby(["age_bin", "status"]).size().items():
+        assert summary.age_counts[str(DiseaseStatus(status))][age_bin][time] == count
+    for (area_id, status), count in individuals_df.groupby(["area_id", "status"]).size().items():
+        assert summary.area_counts[str(DiseaseStatus(status))][area_id][time] == count
+
+    assert summary.age_status_counts[:, :, time].sum() == npeople
+    assert summary.area_status_counts[:, :, time].sum() == npeople
+    assert not summary.age_status_counts[:, :, time - 1].any()
+
+    # the dataframes used by the dashboard have one row per area code
+    area_dataframes = summary.get_area_dataframes()
+    assert list(area_dataframes["exposed"].index) == ["E02004129", "E02004130", "E02004131"]
@@ -211,6 +211,7 @@ def test_hazard_multipliers(test_microsim):
     # All school flows need to be 1 (don't want the people to go to more than 1 school
     m.individuals[f"{ColumnNames.Activities.PRIMARY}{ColumnNames.ACTIVITY_FLOWS}"] = \
         m.individuals.loc[:, f"{ColumnNames.Activities.PRIMARY}{ColumnNames.ACTIVITY_VENUES}"].apply(lambda x: [1.0])
+    m.update_venue_flows()  # The venues and flows have changed so need to be re-indexed
 
     for p in [p1, p2]:  # Set their activity durations to 0.5 for home and school
         for name, activity in m.activity_locations.items():
@@ -253,6 +254,75 @@ def test_hazard_multipliers(test_microsim):
     print("End of test hazard multipliers")
 
 
+def test_venue_danger_and_risks_match_reference_loop(test_microsim):
+    """Check that the vectorised dangers and risks are identical to looping over each individual's venues"""
+    m = copy.deepcopy(test_microsim)
+    statuses = [ColumnNames.DiseaseStatuses.PRESYMPTOMATIC, ColumnNames.DiseaseStatuses.SYMPTOMATIC,
+                ColumnNames.DiseaseStatuses.ASYMPTOMATIC]
+    for p in range(0, len(m.individuals), 3):
+        m.individuals.loc[p, ColumnNames.DISEASE_STATUS] = statuses[p % len(statuses)]
+    m.hazard_individual_multipliers = {"presymptomatic": 0.7, "symptomatic": 1.3, "asymptomatic": 0.4}
+    m.hazard_location_multipliers = {name: 1.0 + 0.25 * i for i, name in enumerate(m.activity_locations)}
+    m.risk_multiplier = 1.7
+
+    # Edit some venues and flows, which requires the venues and flows to be re-indexed
+    venues_col = f"{ColumnNames.Activities.PRIMARY}{ColumnNames.ACTIVITY_VENUES}"
+    flows_col = f"{ColumnNames.Activities.PRIMARY}{ColumnNames.ACTIVITY_FLOWS}"
+    m.individuals[venues_col] = m.individuals.loc[:, venues_col].apply(lambda x: list(x) + [0])
+    m.individuals[flows_col] = m.individuals.loc[:, flows_col].apply(lambda x: list(x) + [0.3])
+    m.update_venue_flows()
+
+    for decimals in [8, None]:
+        expected_risk, expected_activity_risks, expected_dangers = _reference_venue_danger_and_risks(m, decimals)
+        m.update_venue_danger_and_risks(decimals=decimals)
+
+        assert list(m.individuals[ColumnNames.CURRENT_RISK]) == expected_risk
+        for name, activity_location in m.activity_locations.items():
+            assert list(m.individuals[f"{name}{ColumnNames.ACTIVITY_RISK}"]) == expected_activity_risks[name]
+            assert activity_location.get_dangers() == expected_dangers[name]
+
+
+def _reference_venue_danger_and_risks(m, decimals):
+    """The dangers and risks calculated by looping over each individual and each of their venues in turn, as
+    Microsim.update_venue_danger_and_risks did before it was vectorised"""
+    infectious_statuses = {ColumnNames.DiseaseStatuses.PRESYMPTOMATIC: "presymptomatic",
+                           ColumnNames.DiseaseStatuses.SYMPTOMATIC: "symptomatic",
+                           ColumnNames.DiseaseStatuses.ASYMPTOMATIC: "asymptomatic"}
+    current_risk = [0] * len(m.individuals)
+    activity_risks = {}
+    dangers = {}
+    for name, activity_location in m.activity_locations.items():
+        loc_dangers = [0] * len(activity_location.get_dangers())
+        venues = m.individuals.loc[:, f"{name}{ColumnNames.ACTIVITY_VENUES}"]
+        flows = m.individuals.loc[:, f"{name}{ColumnNames.ACTIVITY_FLOWS}"]
+        durations = m.individuals.loc[:, f"{name}{ColumnNames.ACTIVITY_DURATION}"]
+        statuses = m.individuals[ColumnNames.DISEASE_STATUS]
+        for v, f, s, duration in zip(venues, flows, statuses, durations):
+            if s in infectious_statuses:
+                individual_hazard_multiplier = m.hazard_individual_multipliers[infectious_statuses[s]]
+                location_hazard_multiplier = m.hazard_location_multipliers[name]
+                for venue_idx, flow in zip(v, f):
+                    loc_dangers[venue_idx] += flow * duration * individual_hazard_multiplier * \
+                        location_hazard_multiplier
+
+        activity_specific_risk = [0] * len(m.individuals)
+        for i, (v, f, duration) in enumerate(zip(venues, flows, durations)):
+            for venue_idx, flow in zip(v, f):
+                risk_increase = flow * loc_dangers[venue_idx] * duration * m.risk_multiplier
+                current_risk[i] += risk_increase
+                activity_specific_risk[i] += risk_increase
+
+        if decimals is not None:
+            activity_specific_risk = [round(x, decimals) for x in activity_specific_risk]
+            loc_dangers = [round(x, decimals) for x in loc_dangers]
+        activity_risks[name] = [float(x) for x in activity_specific_risk]
+        dangers[name] = [float(x) for x in loc_dangers]
+
+    if decimals is not None:
+        current_risk = [round(x, decimals) for x in current_risk]
+    return [float(x) for x in current_risk], activity_risks, dangers
+
+
 def _check_hazard_spread(p1, p2, individuals, households, risk):
     """Checks how the disease is spreading. To save code repetition in test_hazard_multipliers"""
     for p in [p1, p2]: